@@ -4,24 +4,44 @@ import numpy as np
 from scipy.signal import welch
 
 
-def generate_frequency_hopping_signal(frequencies, hop_duration, sample_rate, total_duration):
+def generate_frequency_hopping_signal(frequencies, hop_duration, sample_rate, total_duration, iq=False, rng=None):
+    """
+    Tone hopping between `frequencies` every `hop_duration` seconds.
+
+    :param iq: return a complex baseband tone (negative frequencies allowed) instead of a real sine.
+    :param rng: np.random.Generator picking the hops, the global numpy random state by default.
+    :return: (t, signal).
+    """
+    rng = np.random if rng is None else rng
     t = np.arange(0, total_duration, 1 / sample_rate)
-    signal = np.zeros_like(t)
+    signal = np.zeros_like(t, dtype=np.complex64 if iq else t.dtype)
 
     num_hops = int(total_duration / hop_duration)
     for i in range(num_hops):
         start_idx = int(i * hop_duration * sample_rate)
         end_idx = int((i + 1) * hop_duration * sample_rate)
-        freq = np.random.choice(frequencies)
-        signal[start_idx:end_idx] = np.sin(2 * np.pi * freq * t[start_idx:end_idx])
+        freq = rng.choice(frequencies)
+        phase = 2 * np.pi * freq * t[start_idx:end_idx]
+        signal[start_idx:end_idx] = np.exp(1j * phase) if iq else np.sin(phase)
 
     return t, signal
 
 
-def add_awgn_noise(signal, snr):
+def add_awgn_noise(signal, snr, rng=None):
+    """
+    Add white Gaussian noise at `snr` dB below the mean power of `signal`.
+
+    Complex (IQ) signals get circular noise, half of its power on I and half on Q, and keep their dtype.
+
+    :param rng: np.random.Generator drawing the noise, the global numpy random state by default.
+    """
+    rng = np.random if rng is None else rng
     signal_power = np.mean(np.abs(signal) ** 2)
     noise_power = signal_power / (10 ** (snr / 10))
-    noise = np.sqrt(noise_power) * np.random.normal(size=signal.shape)
+    if np.iscomplexobj(signal):
+        noise = np.sqrt(noise_power / 2) * (rng.normal(size=signal.shape) + 1j * rng.normal(size=signal.shape))
+        return (signal + noise).astype(signal.dtype)
+    noise = np.sqrt(noise_power) * rng.normal(size=signal.shape)
     noisy_signal = signal + noise
     return noisy_signal
 
@@ -38,6 +58,196 @@ def psd_snr(datapack, noise, fs, nperseg=1024):
     return snr
 
 
+def window_psd(data, slice_point, nperseg=1024, max_segments=64, step=None, block_size=None):
+    """
+    Averaged periodogram of every window of a complex IQ stream.
+
+    The stream is framed with a strided view (no copy), each window is split into `nperseg`-point segments and up to
+    `max_segments` evenly spaced segments per window go through one batched FFT per block of windows.
+
+    :param data: 1-D complex IQ samples, a np.memmap works without loading the file.
+    :param slice_point: number of samples per window, i.e. fs * duration_time.
+    :param nperseg: FFT length of each segment.
+    :param max_segments: maximum number of segments averaged per window, None to use every segment.
+    :param step: hop between two window starts, default is `slice_point` (non-overlapping windows).
+    :param block_size: number of windows transformed per FFT call, chosen from the frame size if None.
+    :return: psd array of shape (n_windows, nperseg), frequency axis fftshifted.
+    """
+    step = int(step or slice_point)
+    slice_point = int(slice_point)
+    if len(data) < slice_point:
+        return np.zeros((0, nperseg))
+
+    n_windows = (len(data) - slice_point) // step + 1
+    n_seg = slice_point // nperseg
+    if n_seg == 0:
+        raise ValueError(f'slice_point ({slice_point}) is shorter than nperseg ({nperseg})')
+    if max_segments and n_seg > max_segments:
+        seg_idx = np.unique(np.linspace(0, n_seg - 1, max_segments).astype(int))
+    else:
+        seg_idx = np.arange(n_seg)
+
+    stride = data.strides[0]
+    frames = np.lib.stride_tricks.as_strided(data,
+                                             shape=(n_windows, n_seg, nperseg),
+                                             strides=(step * stride, nperseg * stride, stride),
+                                             writeable=False)
+    window = np.hanning(nperseg).astype(np.float32)
+    scale = 1.0 / np.sum(window ** 2)
+    if block_size is None:
+        block_size = max(1, (1 << 22) // (len(seg_idx) * nperseg))
+
+    psd = np.empty((n_windows, nperseg))
+    for start in range(0, n_windows, block_size):
+        block = frames[start:start + block_size][:, seg_idx, :] * window
+        spec = np.fft.fft(block, axis=-1)
+        psd[start:start + block_size] = np.mean(np.abs(spec) ** 2, axis=1) * scale
+
+    return np.fft.fftshift(psd, axes=-1)
+
+
+def noise_floor(psd, quantile=0.1):
+    """
+    Estimate the per-bin noise floor from a set of window PSDs, no background recording needed.
+
+    Each bin takes a low quantile over time, then bins that are occupied for most of the capture (e.g. a continuous
+    video link) are capped at the median floor of the band so they cannot hide their own signal.
+
+    :param psd: (n_windows, nfft) window PSDs as returned by `window_psd`.
+    :param quantile: quantile over time used as the noise level of each bin.
+    :return: (nfft,) noise floor.
+    """
+    floor = np.quantile(psd, quantile, axis=0)
+    return np.minimum(floor, np.median(floor))
+
+
+def window_snr(psd, floor):
+    """
+    SNR of every window against a noise floor, with the same convention as `psd_snr`:
+    10 * log10(window power / noise power), so a noise-only window is close to 0 dB.
+
+    :param psd: (n_windows, nfft) window PSDs.
+    :param floor: (nfft,) or scalar noise floor.
+    :return: (n_windows,) SNR in dB.
+    """
+    noise_power = np.sum(np.broadcast_to(floor, psd.shape[-1:]))
+    signal_power = np.sum(psd, axis=-1)
+    return 10 * np.log10(np.maximum(signal_power, 1e-30) / max(noise_power, 1e-30))
+
+
+class EnergyGate:
+    """
+    Per-window energy detector computed on the raw IQ slices before any STFT rendering.
+
+    Windows whose SNR against the noise floor is below `threshold_db` are reported as empty so the caller can label them
+    "no signal" without running the classifier. Counters accumulate over every call and are exposed by `stats`.
+
+    Args:
+        threshold_db (float): minimum window SNR (dB) to be considered as containing a signal.
+        nperseg (int): FFT length of the PSD segments.
+        max_segments (int): maximum number of segments averaged per window.
+        noise_quantile (float): quantile used by `noise_floor`.
+        floor (np.ndarray, optional): fixed noise floor, e.g. for streaming inputs that are too short to estimate one.
+    """
+
+    def __init__(self, threshold_db=3.0, nperseg=1024, max_segments=64, noise_quantile=0.1, floor=None):
+        self.threshold_db = threshold_db
+        self.nperseg = nperseg
+        self.max_segments = max_segments
+        self.noise_quantile = noise_quantile
+        self.floor = floor
+        self.total = 0
+        self.gated = 0
+
+    def __call__(self, data, slice_point, step=None):
+        """
+        :return: (active, snr) - boolean mask of windows holding a signal and their SNR in dB.
+        """
+        psd = window_psd(data, slice_point, nperseg=self.nperseg, max_segments=self.max_segments, step=step)
+        floor = self.floor if self.floor is not None else noise_floor(psd, self.noise_quantile)
+        snr = window_snr(psd, floor)
+        active = snr >= self.threshold_db
+
+        self.total += len(active)
+        self.gated += int(np.count_nonzero(~active))
+        return active, snr
+
+    @property
+    def stats(self):
+        return {
+            "windows": self.total,
+            "gated": self.gated,
+            "classified": self.total - self.gated,
+            "hit_rate": round(self.gated / self.total, 4) if self.total else 0.0,
+            "threshold_db": self.threshold_db
+        }
+
+    def reset(self):
+        self.total = 0
+        self.gated = 0
+
+
+def load_iq(datapack, file_type=np.float32):
+    """
+    Memory-map an interleaved I/Q capture as a complex array without reading it into RAM.
+
+    :param datapack: path of the raw capture.
+    :param file_type: sample type of the file, float32 / float64 captures are viewed as complex directly.
+    :return: 1-D complex array (a np.memmap view for float captures).
+    """
+    raw = np.memmap(datapack, dtype=file_type, mode='r')
+    raw = raw[:len(raw) - len(raw) % 2]
+    if raw.dtype == np.float32:
+        return raw.view(np.complex64)
+    if raw.dtype == np.float64:
+        return raw.view(np.complex128)
+    return raw[::2].astype(np.float32) + 1j * raw[1::2].astype(np.float32)
+
+
+def snr_timeline(datapack, fs=100e6, duration_time=0.1, step_time=None, nperseg=1024, max_segments=64,
+                 noise_quantile=0.1, file_type=np.float32):
+    """
+    Per-window SNR timeline of a whole capture, the noise floor is estimated from the capture itself.
+
+    :param datapack: path of the raw capture.
+    :param fs: sample rate.
+    :param duration_time: window length in seconds, use the same value as the spectrogram generation.
+    :param step_time: hop between two windows in seconds, default is `duration_time`.
+    :param nperseg: FFT length of the PSD segments.
+    :param max_segments: maximum number of segments averaged per window.
+    :param noise_quantile: quantile used by `noise_floor`.
+    :param file_type: sample type of the file.
+    :return: dict with the window start times (s), the window SNRs (dB) and the noise floor power (dB).
+    """
+    data = load_iq(datapack, file_type)
+    slice_point = int(fs * duration_time)
+    step = int(fs * step_time) if step_time else slice_point
+
+    psd = window_psd(data, slice_point, nperseg=nperseg, max_segments=max_segments, step=step)
+    if not len(psd):
+        return {"time": np.zeros(0), "snr": np.zeros(0), "noise_floor_db": None}
+
+    floor = noise_floor(psd, noise_quantile)
+    return {
+        "time": np.arange(len(psd)) * step / fs,
+        "snr": window_snr(psd, floor),
+        "noise_floor_db": float(10 * np.log10(max(np.sum(floor), 1e-30)))
+    }
+
+
+def snr_buckets(snr, edges=(-20, -10, -5, 0, 5, 10, 15, 20)):
+    """
+    Assign every SNR value to a bucket named after its lower edge, e.g. "5dB" holds [5, 10) dB.
+    Values below the first edge go to "<{edges[0]}dB".
+
+    :param snr: array of SNRs in dB.
+    :param edges: sorted bucket edges in dB.
+    :return: list of bucket names, one per value.
+    """
+    names = [f'<{edges[0]}dB'] + [f'{e}dB' for e in edges]
+    return [names[i] for i in np.digitize(snr, edges)]
+
+
 # Usage-----------------------------------------------------------------------------------------------------------------
 def main():
     signal = ''
@@ -50,6 +260,10 @@ def main():
     snr_value = psd_snr(signal_data, noise_data, fs)
     print("SNR:", snr_value, "dB")
 
+    timeline = snr_timeline(signal, fs=fs, duration_time=0.1)
+    for t, snr, bucket in zip(timeline['time'], timeline['snr'], snr_buckets(timeline['snr'])):
+        print(f'{t:.2f}s: {snr:.2f} dB ({bucket})')
+
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,140 @@
+from fastapi import APIRouter, HTTPException, BackgroundTasks, Query
+from typing import Optional
+import logging
+
+from models.schemas import BenchmarkRequest, TaskResponse, TaskActionResponse
+from services import get_benchmark_service
+
+logger = logging.getLogger(__name__)
+router = APIRouter()
+benchmark_service = get_benchmark_service()
+
+DEFAULT_STORE = "results/benchmarks.db"
+
+
+@router.post("/start", response_model=TaskResponse, summary="启动benchmark")
+async def start_benchmark(
+    request: BenchmarkRequest,
+    background_tasks: BackgroundTasks
+):
+    """
+    在 SNR 分组的 benchmark 数据上评估分类模型，并将结果记录到结果库
+
+    - **cfg_path** / **weight_path**: 模型配置与权重（剪枝等导出的完整模型同样支持）
+    - **data_path**: `SNR/分组/类别` 目录或分片目录
+    - **precision**: 推理精度 fp32 / fp16 / bf16
+    - **store_path**: 结果库，记录模型、权重哈希、精度、设备、代码版本、各SNR准确率/F1/mAP、吞吐与延迟分位数
+    - **name**: 本次运行名称
+
+    所有子集通过同一个多进程 DataLoader 批量推理，完成后 stats 中包含记录ID (run_id)，
+    可通过 `/compare` 与其他记录对比
+    """
+    try:
+        task_id = await benchmark_service.start_benchmark(request, background_tasks)
+        return benchmark_service.get_task(task_id)
+    except Exception as e:
+        logger.error(f"启动benchmark失败: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.get("/runs", summary="列出benchmark记录")
+async def list_runs(
+    store_path: str = DEFAULT_STORE,
+    model: Optional[str] = None,
+    weight_hash: Optional[str] = None,
+    name: Optional[str] = None,
+    limit: int = Query(100, ge=1, le=1000),
+    offset: int = Query(0, ge=0)
+):
+    """
+    按模型、权重哈希或名称筛选 benchmark 记录，最新的在前
+    """
+    try:
+        return {"runs": benchmark_service.list_runs(store_path, model=model, weight_hash=weight_hash, name=name,
+                                                    limit=limit, offset=offset)}
+    except FileNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except Exception as e:
+        logger.error(f"查询benchmark记录失败: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.get("/compare", summary="对比两次benchmark")
+async def compare_runs(
+    baseline: int,
+    candidate: int,
+    store_path: str = DEFAULT_STORE,
+    max_acc_drop: Optional[float] = Query(None, ge=0, description="准确率最大下降（百分点），默认 1.0"),
+    max_f1_drop: Optional[float] = Query(None, ge=0, description="macro F1 最大下降，默认 0.01"),
+    max_map_drop: Optional[float] = Query(None, ge=0, description="mAP 最大下降，默认 0.01"),
+    max_throughput_drop: Optional[float] = Query(None, ge=0, description="吞吐最大相对下降，默认 0.1"),
+    max_latency_increase: Optional[float] = Query(None, ge=0, description="延迟(p50/p99)最大相对增长，默认 0.1")
+):
+    """
+    对比候选记录 (candidate) 与基线记录 (baseline)，例如量化/剪枝/导出模型与原模型
+
+    在整体与每个 SNR 子集上检查准确率、F1、mAP 下降，在整体上检查吞吐下降与延迟增长，
+    超出阈值的项列在 regressions 中，passed 为 false；数据路径、设备、批次大小不一致时给出 warnings
+    """
+    try:
+        return benchmark_service.compare_runs(store_path, baseline, candidate, max_acc_drop=max_acc_drop,
+                                              max_f1_drop=max_f1_drop, max_map_drop=max_map_drop,
+                                              max_throughput_drop=max_throughput_drop,
+                                              max_latency_increase=max_latency_increase)
+    except (FileNotFoundError, KeyError) as e:
+        raise HTTPException(status_code=404, detail=str(e.args[0]) if e.args else str(e))
+    except Exception as e:
+        logger.error(f"对比benchmark记录失败: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.get("/runs/{run_id}", summary="获取benchmark记录")
+async def get_run(run_id: int, store_path: str = DEFAULT_STORE):
+    """
+    获取单条 benchmark 记录，含各子集指标与完整报告
+    """
+    try:
+        return benchmark_service.get_run(store_path, run_id)
+    except (FileNotFoundError, KeyError) as e:
+        raise HTTPException(status_code=404, detail=str(e.args[0]) if e.args else str(e))
+
+
+@router.delete("/runs/{run_id}", response_model=TaskActionResponse, summary="删除benchmark记录")
+async def delete_run(run_id: int, store_path: str = DEFAULT_STORE):
+    """
+    删除一条 benchmark 记录
+    """
+    try:
+        deleted = benchmark_service.delete_run(store_path, run_id)
+    except FileNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    if not deleted:
+        raise HTTPException(status_code=404, detail=f"benchmark 记录不存在: {run_id}")
+    return TaskActionResponse(
+        status="success",
+        message="benchmark记录已删除",
+        task_id=str(run_id)
+    )
+
+
+@router.get("/{task_id}", response_model=TaskResponse, summary="获取benchmark任务状态")
+async def get_benchmark_status(task_id: str):
+    """
+    获取benchmark任务状态，完成后 stats 中包含记录ID、准确率、吞吐与延迟分位数
+    """
+    task = benchmark_service.get_task(task_id)
+    if not task:
+        raise HTTPException(status_code=404, detail=f"任务 {task_id} 不存在")
+    return task
+
+
+@router.get("/{task_id}/logs", summary="获取benchmark日志流")
+async def get_benchmark_logs(task_id: str):
+    """
+    获取benchmark任务的实时日志流 (Server-Sent Events)
+    """
+    task = benchmark_service.get_task(task_id)
+    if not task:
+        raise HTTPException(status_code=404, detail=f"任务 {task_id} 不存在")
+
+    return benchmark_service.stream_logs(task_id)
@@ -4,6 +4,7 @@ import logging
 from models.schemas import (
     InferenceRequest, 
     BatchInferenceRequest, 
+    TwoStageInferenceRequest,
     TaskResponse,
     BatchInferenceResponse
 )
@@ -63,6 +64,43 @@ async def batch_inference(
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@router.post("/two_stage", response_model=TaskResponse, summary="两阶段推理（检测+分类）")
+async def two_stage_inference(
+    request: TwoStageInferenceRequest,
+    background_tasks: BackgroundTasks
+):
+    """
+    检测后分类的两阶段推理，中间不落盘
+    
+    - **detector**: 检测模型 {model_name, weight_path}
+    - **classifier**: 分类模型 {weight_path, cfg}
+    - **target_dir**: 待推理图像文件或目录
+    - **save_dir**: 可选，保存标注图像与 results.json
+    
+    批量检测后在张量内裁剪检测区域，同一批次的所有目标一次前向完成分类，
+    完成后通过 `/{task_id}/results` 获取逐框结果
+    """
+    try:
+        task_id = await inference_service.start_two_stage(request, background_tasks)
+        return inference_service.get_task(task_id)
+    except Exception as e:
+        logger.error(f"启动两阶段推理任务失败: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.get("/{task_id}/results", summary="获取两阶段推理结果")
+async def get_two_stage_results(task_id: str):
+    """
+    获取两阶段推理的逐框结果：{图像路径: [{box, det_conf, det_class, class, probability}]}
+    """
+    task = inference_service.get_task(task_id)
+    if not task:
+        raise HTTPException(status_code=404, detail=f"任务 {task_id} 不存在")
+    if task.get("status") != "completed":
+        raise HTTPException(status_code=400, detail=f"任务 {task_id} 尚未完成")
+    return {"task_id": task_id, "results": task.get("results", {})}
+
+
 @router.get("/{task_id}", response_model=TaskResponse, summary="获取推理任务状态")
 async def get_inference_status(task_id: str):
     """
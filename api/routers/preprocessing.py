@@ -1,10 +1,16 @@
-from fastapi import APIRouter, HTTPException, BackgroundTasks
+from fastapi import APIRouter, HTTPException, BackgroundTasks, Query
+from typing import List, Optional
 import logging
 
 from models.schemas import (
     DatasetSplitRequest,
     DataAugmentationRequest,
     ImageCropRequest,
+    SNREstimationRequest,
+    ShardPackRequest,
+    CatalogScanRequest,
+    CatalogExportRequest,
+    SignalMixingRequest,
     PreprocessingResponse,
     TaskActionResponse
 )
@@ -27,6 +33,10 @@ async def split_dataset(
     - **output_path**: 输出路径
     - **train_ratio**: 训练集比例（0.1-0.9）
     - **val_ratio**: 验证集比例（可选，用于三分割）
+    - **mode**: 分割方式，copy（默认）/ hardlink / reflink / symlink 生成与复制相同的目录结构但不复制图像数据；
+      manifest 只写出 train.json / valid.json（以及供YOLO使用的 train.txt / valid.txt 图像列表），
+      训练时直接将清单文件作为 train_path / val_path
+    - **seed**: 随机种子
     
     数据集结构示例：
     ```
@@ -49,6 +59,13 @@ async def split_dataset(
             ├── class1/
             └── class2/
     ```
+
+    manifest 模式输出：
+    ```
+    output_path/
+        ├── train.json / train.txt
+        └── valid.json / valid.txt
+    ```
     """
     try:
         task_id = await preprocessing_service.split_dataset(request, background_tasks)
@@ -70,6 +87,9 @@ async def augment_dataset(
     - **dataset_path**: 数据集路径（应包含train和valid文件夹）
     - **output_path**: 输出路径（默认为dataset_aug）
     - **methods**: 增强方法列表（可选）
+    - **num_workers**: 并行进程数（默认为CPU核数），**chunk_size**: 每个工作单元的图像数
+    
+    每张图像只解码一次并依次应用全部方法，原图只复制一次；完成后 stats 中包含各进程的吞吐量。
     
     支持的增强方法：
     - **AdvancedBlur**: 高级模糊
@@ -115,6 +135,10 @@ async def crop_images(
     - **y**: 裁剪区域左上角Y坐标
     - **width**: 裁剪宽度
     - **height**: 裁剪高度
+    - **mode**: write（默认）多进程并行裁剪并写出新图像；virtual 仅写出 crop.json 清单，
+      训练时将其作为 train_path / val_path，图像在加载时裁剪
+    - **lossless**: 起点对齐到16像素的JPEG使用 jpegtran 无损裁剪，无需解码与重新编码
+    - **num_workers**: 并行进程数
     
     如果input_path是目录，将递归处理所有图像并保持目录结构。
     """
@@ -127,6 +151,155 @@ async def crop_images(
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@router.post("/shards", response_model=PreprocessingResponse, summary="数据集分片打包")
+async def pack_shards(
+    request: ShardPackRequest,
+    background_tasks: BackgroundTasks
+):
+    """
+    将大量小图像打包为少量大的 tar 分片，训练与测试时顺序读取分片，代替逐个文件的随机小读取
+    
+    - **input_path**: 分类数据集（类别文件夹或分割清单 train.json）或检测数据集（images 目录或图像列表txt）
+    - **output_path**: 分片目录，包含 shard-*.tar 与索引 shards.json
+      （每个样本的分片、偏移、长度、标签、SNR、来源数据包与切片序号）
+    - **task**: classify（默认）/ detect，检测数据集的标注与图像尺寸一并写入索引
+    - **shard_size_mb**: 单个分片大小
+    - **shuffle** / **seed**: 打包前打乱样本顺序
+    
+    完成后分片目录可直接作为 train_path / val_path、benchmark 数据路径或 YOLO 数据集路径。
+    """
+    try:
+        task_id = await preprocessing_service.pack_shards(request, background_tasks)
+        task = preprocessing_service.get_task(task_id)
+        return PreprocessingResponse(**task)
+    except Exception as e:
+        logger.error(f"启动分片打包任务失败: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.post("/catalog/scan", response_model=PreprocessingResponse, summary="原始数据建立索引")
+async def scan_catalog(
+    request: CatalogScanRequest,
+    background_tasks: BackgroundTasks
+):
+    """
+    扫描原始IQ数据目录，将每个数据包与每个切片的元数据写入 SQLite 索引
+    
+    - **data_path**: 原始数据根目录，第一级文件夹名为类别
+    - **db_path**: 索引路径（默认 data_path/catalog.db）
+    - **sample_rate** / **duration_time** / **step_time**: 切片参数
+    - **buckets**: SNR分桶边界（dB）
+    - **rescan**: 是否重新扫描未变化的数据包（默认按大小与修改时间跳过）
+    
+    每个数据包记录数据类型、采样点数与切片参数，每个切片记录采样点/字节偏移、能量、SNR与分桶。
+    """
+    try:
+        task_id = await preprocessing_service.scan_catalog(request, background_tasks)
+        task = preprocessing_service.get_task(task_id)
+        return PreprocessingResponse(**task)
+    except Exception as e:
+        logger.error(f"启动数据索引任务失败: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.get("/catalog/query", summary="查询原始数据索引")
+async def query_catalog(
+    db_path: str,
+    label: Optional[List[str]] = Query(None),
+    min_snr: Optional[float] = None,
+    max_snr: Optional[float] = None,
+    bucket: Optional[List[str]] = Query(None),
+    min_energy: Optional[float] = None,
+    limit: int = Query(100, ge=1, le=10000),
+    offset: int = Query(0, ge=0)
+):
+    """
+    按类别、SNR、分桶、能量筛选切片，仅查询索引而不读取原始数据，
+    例如 `?db_path=...&label=DJI&min_snr=10` 返回所有 SNR 不低于 10 dB 的 DJI 切片
+    
+    返回各类别/分桶的切片数量（counts）与分页的切片列表（slices）
+    """
+    try:
+        return preprocessing_service.query_catalog(db_path, limit=limit, offset=offset, label=label,
+                                                   min_snr=min_snr, max_snr=max_snr, bucket=bucket,
+                                                   min_energy=min_energy)
+    except FileNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except Exception as e:
+        logger.error(f"查询数据索引失败: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.post("/catalog/export", response_model=PreprocessingResponse, summary="从索引生成数据集")
+async def export_catalog(
+    request: CatalogExportRequest,
+    background_tasks: BackgroundTasks
+):
+    """
+    按筛选条件从索引中选取切片，多进程渲染时频图，生成训练数据集或 benchmark 数据集
+    
+    - **labels** / **min_snr** / **max_snr** / **buckets** / **min_energy**: 筛选条件，与查询接口一致
+    - **layout**: class 生成 `类别/数据包 (切片序号).jpg`，可继续进行数据集分割；
+      benchmark 生成 `SNR分桶/group/类别/...`，可直接作为 benchmark 数据路径
+    - **stft_point** / **image_width** / **image_height**: 时频图参数
+    - **num_workers**: 并行进程数
+    """
+    try:
+        task_id = await preprocessing_service.export_catalog(request, background_tasks)
+        task = preprocessing_service.get_task(task_id)
+        return PreprocessingResponse(**task)
+    except Exception as e:
+        logger.error(f"启动索引数据集生成任务失败: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.post("/mix", response_model=PreprocessingResponse, summary="多无人机信号混合")
+async def mix_signals(
+    request: SignalMixingRequest,
+    background_tasks: BackgroundTasks
+):
+    """
+    将多个原始IQ数据包逐切片叠加（内存映射读取），生成多机干扰场景的时频图数据集
+    
+    - **sources**: 信号源列表，每个信号源可设置 gain_db 或相对第一个信号源的 snr_db、
+      起始时间偏移 offset（秒）与频移 freq_shift（Hz）
+    - **awgn_snr_db**: 叠加高斯白噪声（相对参考源功率）
+    - **duration_time** / **step_time**: 切片时长与步进
+    - **stft_point** / **image_width** / **image_height**: 时频图参数
+    - **num_workers**: 并行渲染的进程数
+    """
+    try:
+        task_id = await preprocessing_service.mix_signals(request, background_tasks)
+        task = preprocessing_service.get_task(task_id)
+        return PreprocessingResponse(**task)
+    except Exception as e:
+        logger.error(f"启动信号混合任务失败: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.post("/snr", response_model=PreprocessingResponse, summary="SNR估计")
+async def estimate_snr(
+    request: SNREstimationRequest,
+    background_tasks: BackgroundTasks
+):
+    """
+    估计原始IQ数据的逐窗口SNR时间线（噪底由数据自身分位数估计，无需背景噪声文件）
+    
+    - **input_path**: 输入路径（数据包文件或目录）
+    - **output_path**: 输出路径，每个数据包生成一个 `*_snr.csv`，并汇总到 `snr_summary.json`
+    - **sample_rate**: 采样率
+    - **duration_time**: 窗口时长（秒）
+    - **buckets**: SNR分桶边界（dB），用于构建benchmark的SNR目录
+    """
+    try:
+        task_id = await preprocessing_service.estimate_snr(request, background_tasks)
+        task = preprocessing_service.get_task(task_id)
+        return PreprocessingResponse(**task)
+    except Exception as e:
+        logger.error(f"启动SNR估计任务失败: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
 @router.get("/{task_id}", response_model=PreprocessingResponse, summary="获取预处理任务状态")
 async def get_preprocessing_status(task_id: str):
     """
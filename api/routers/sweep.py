@@ -0,0 +1,86 @@
+from fastapi import APIRouter, HTTPException, BackgroundTasks
+import logging
+
+from models.schemas import SweepRequest, TaskResponse, TaskActionResponse
+from services import get_sweep_service
+
+logger = logging.getLogger(__name__)
+router = APIRouter()
+sweep_service = get_sweep_service()
+
+
+@router.post("/start", response_model=TaskResponse, summary="启动超参数搜索")
+async def start_sweep(
+    request: SweepRequest,
+    background_tasks: BackgroundTasks
+):
+    """
+    在 TrainingRequest 字段上进行超参数搜索（ASHA 异步逐次减半）
+
+    - **base**: 基础训练配置，num_epochs 为单个试验的完整预算
+    - **search_space**: 字段 -> 候选值列表，或连续区间 {low, high, log}
+    - **num_trials**: 试验数量（为空时遍历全部网格）
+    - **metric**: 调度依据的验证指标 (val_acc/val_loss/macro_f1)
+    - **min_epochs** / **reduction_factor**: 档位为 min_epochs * reduction_factor^k，
+      每个档位只保留前 1/reduction_factor 的试验继续训练
+    - **max_concurrent_trials**: 最大并行试验数（仍受资源管理器限制）
+
+    完成后 stats 中包含最佳试验与节省的计算量，详情见 `/{task_id}/trials`
+    """
+    try:
+        task_id = await sweep_service.start_sweep(request, background_tasks)
+        return sweep_service.get_task(task_id)
+    except Exception as e:
+        logger.error(f"启动超参数搜索失败: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.get("/{task_id}", response_model=TaskResponse, summary="获取超参数搜索状态")
+async def get_sweep_status(task_id: str):
+    """
+    获取超参数搜索状态，stats 中包含各档位记录数、最佳试验和计算量统计
+    """
+    task = sweep_service.get_task(task_id)
+    if not task:
+        raise HTTPException(status_code=404, detail=f"任务 {task_id} 不存在")
+    return task
+
+
+@router.get("/{task_id}/trials", summary="获取超参数搜索的试验列表")
+async def get_sweep_trials(task_id: str):
+    """
+    获取每个试验的参数、状态（pending/running/completed/stopped/early_stopped/failed/cancelled）、
+    已训练epoch数、每个epoch的指标历史与最佳指标
+    """
+    task = sweep_service.get_task(task_id)
+    if not task:
+        raise HTTPException(status_code=404, detail=f"任务 {task_id} 不存在")
+    return {"task_id": task_id, "trials": task.get("trials", [])}
+
+
+@router.get("/{task_id}/logs", summary="获取超参数搜索日志流")
+async def get_sweep_logs(task_id: str):
+    """
+    获取超参数搜索的实时日志流 (Server-Sent Events)
+    """
+    task = sweep_service.get_task(task_id)
+    if not task:
+        raise HTTPException(status_code=404, detail=f"任务 {task_id} 不存在")
+
+    return sweep_service.stream_logs(task_id)
+
+
+@router.post("/{task_id}/stop", response_model=TaskActionResponse, summary="停止超参数搜索")
+async def stop_sweep(task_id: str):
+    """
+    停止超参数搜索，正在运行的试验会在下一次取消检查时结束
+    """
+    result = sweep_service.stop_task(task_id)
+    if not result:
+        raise HTTPException(status_code=404, detail=f"任务 {task_id} 不存在")
+
+    return TaskActionResponse(
+        status="success",
+        message="超参数搜索已停止",
+        task_id=task_id
+    )
@@ -1,7 +1,7 @@
 from fastapi import APIRouter, HTTPException, BackgroundTasks
 import logging
 
-from models.schemas import TrainingRequest, TaskResponse, TaskActionResponse
+from models.schemas import TrainingRequest, PruningRequest, TaskResponse, TaskActionResponse
 from services import get_training_service
 
 logger = logging.getLogger(__name__)
@@ -21,6 +21,8 @@ async def start_training(
     - **train_path**: 训练集路径
     - **val_path**: 验证集路径  
     - **device**: 设备选择 (cuda/cpu)
+    - **augmentation**: 在线数据增强，训练时在 DataLoader 工作进程(num_workers)中随机应用
+      augmentation_methods 之一（概率 augmentation_p），无需离线增强生成副本
     - **priority**: 优先级 (1-10, 数字越小优先级越高)
     
     返回任务信息，可通过task_id查询状态和日志
@@ -33,6 +35,31 @@ async def start_training(
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@router.post("/prune", response_model=TaskResponse, summary="启动模型剪枝任务")
+async def start_pruning(
+    request: PruningRequest,
+    background_tasks: BackgroundTasks
+):
+    """
+    对已训练的分类模型进行结构化剪枝并微调
+
+    - **cfg_path** / **weight_path**: 已训练模型的配置与权重
+    - **latency_budget_ms**: 目标延迟，自动搜索满足预算的保留比例（或直接指定 **keep_ratio**）
+    - **finetune_epochs**: 剪枝后在原训练集上的微调轮数
+    - **latency_device**: 测量延迟的设备，默认 cpu
+
+    ResNet 剪枝残差块内部通道，MobileNetV3 剪枝倒残差块的扩展通道，ViT/Swin 剪枝 Transformer MLP 隐藏层神经元。
+    完成后 stats.pruning 中包含剪枝前后的延迟、参数量、FLOPs 与准确率，
+    剪枝模型导出为 pruned_model.pth（完整模块），可配合生成的 config.yaml 用于推理
+    """
+    try:
+        task_id = await training_service.start_pruning(request, background_tasks)
+        return training_service.get_task(task_id)
+    except Exception as e:
+        logger.error(f"启动剪枝任务失败: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
 @router.get("/{task_id}", response_model=TaskResponse, summary="获取训练任务状态（含详细指标）")
 async def get_training_status(task_id: str):
     """
@@ -113,3 +140,37 @@ async def stop_training(task_id: str):
         task_id=task_id
     )
 
+
+@router.post("/{task_id}/suspend", response_model=TaskActionResponse, summary="挂起训练任务")
+async def suspend_training(task_id: str):
+    """
+    挂起正在运行的训练任务并释放设备（例如为紧急推理让出GPU）
+
+    每个epoch结束时会保存完整训练状态（模型、优化器、学习率调度、最佳指标、随机数状态），
+    挂起时当前未完成的epoch会被丢弃，恢复后从最近一次完成的epoch继续
+
+    任务先进入 suspending 状态，训练进程停止并释放设备后变为 suspended，此后才能恢复
+    """
+    result = training_service.suspend_task(task_id)
+    if not result:
+        raise HTTPException(status_code=404, detail=f"任务 {task_id} 不存在或不在运行中")
+
+    return TaskActionResponse(
+        status="success",
+        message="训练任务挂起中，训练进程停止后状态变为 suspended",
+        task_id=task_id
+    )
+
+
+@router.post("/{task_id}/resume", response_model=TaskResponse, summary="恢复训练任务")
+async def resume_training(task_id: str, background_tasks: BackgroundTasks):
+    """
+    从最新检查点恢复被挂起、取消或失败的训练任务，沿用原任务ID，
+    训练从下一个epoch开始，优化器动量与随机数状态与中断前一致
+    """
+    try:
+        await training_service.resume_training(task_id, background_tasks)
+        return training_service.get_task(task_id)
+    except Exception as e:
+        logger.error(f"恢复训练任务失败: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
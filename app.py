@@ -3,7 +3,7 @@ from fastapi.middleware.cors import CORSMiddleware
 from contextlib import asynccontextmanager
 import logging
 
-from api.routers import training, inference, tasks, resources, health, preprocessing
+from api.routers import training, inference, tasks, resources, health, preprocessing, sweep, benchmark
 from core.config import settings
 from core.resource_manager import resource_manager
 
@@ -67,17 +67,41 @@ async def root():
                 "启动训练": "POST /api/v2/training/start",
                 "训练状态（含详细指标）": "GET /api/v2/training/{task_id}",
                 "训练日志流（含指标）": "GET /api/v2/training/{task_id}/logs",
-                "停止训练": "POST /api/v2/training/{task_id}/stop"
+                "停止训练": "POST /api/v2/training/{task_id}/stop",
+                "挂起训练": "POST /api/v2/training/{task_id}/suspend",
+                "恢复训练": "POST /api/v2/training/{task_id}/resume",
+                "模型剪枝": "POST /api/v2/training/prune"
+            },
+            "超参数搜索接口": {
+                "启动搜索": "POST /api/v2/sweep/start",
+                "搜索状态（含节省计算量）": "GET /api/v2/sweep/{task_id}",
+                "试验列表": "GET /api/v2/sweep/{task_id}/trials",
+                "搜索日志流": "GET /api/v2/sweep/{task_id}/logs",
+                "停止搜索": "POST /api/v2/sweep/{task_id}/stop"
             },
             "推理接口": {
                 "启动推理": "POST /api/v2/inference/start",
                 "推理状态": "GET /api/v2/inference/{task_id}",
                 "批量推理": "POST /api/v2/inference/batch"
             },
+            "Benchmark接口": {
+                "启动benchmark": "POST /api/v2/benchmark/start",
+                "benchmark状态": "GET /api/v2/benchmark/{task_id}",
+                "benchmark日志流": "GET /api/v2/benchmark/{task_id}/logs",
+                "历史记录": "GET /api/v2/benchmark/runs",
+                "记录详情": "GET /api/v2/benchmark/runs/{run_id}",
+                "删除记录": "DELETE /api/v2/benchmark/runs/{run_id}",
+                "对比两次运行（退化检测）": "GET /api/v2/benchmark/compare"
+            },
             "数据预处理接口": {
                 "数据集分割": "POST /api/v2/preprocessing/split",
                 "数据增强": "POST /api/v2/preprocessing/augment",
                 "图像裁剪": "POST /api/v2/preprocessing/crop",
+                "分片打包": "POST /api/v2/preprocessing/shards",
+                "原始数据索引": "POST /api/v2/preprocessing/catalog/scan",
+                "索引查询": "GET /api/v2/preprocessing/catalog/query",
+                "索引生成数据集": "POST /api/v2/preprocessing/catalog/export",
+                "信号混合": "POST /api/v2/preprocessing/mix",
                 "任务状态": "GET /api/v2/preprocessing/{task_id}",
                 "任务日志": "GET /api/v2/preprocessing/{task_id}/logs"
             },
@@ -110,12 +134,24 @@ app.include_router(
     tags=["Training"]
 )
 
+app.include_router(
+    sweep.router,
+    prefix="/api/v2/sweep",
+    tags=["Sweep"]
+)
+
 app.include_router(
     inference.router,
     prefix="/api/v2/inference",
     tags=["Inference"]
 )
 
+app.include_router(
+    benchmark.router,
+    prefix="/api/v2/benchmark",
+    tags=["Benchmark"]
+)
+
 app.include_router(
     tasks.router,
     prefix="/api/v2/tasks",
@@ -161,6 +161,81 @@ class ResourceManager:
                 f"当前: {self.device_usage[device][task_type]}/{max_allowed}"
             )
     
+    def _slots(self, dev: str, task_type: str) -> int:
+        """设备的并发名额上限"""
+        limits = self.max_concurrent.get(dev, self.max_concurrent["cuda" if dev.startswith("cuda") else dev])
+        return limits[task_type]
+
+    def check_gang(self, device: str, count: int, task_type: str) -> List[str]:
+        """
+        校验设备组请求，设备不存在或名额上限永远无法满足时抛出 ValueError，避免任务无限等待
+        返回候选设备列表（CPU 为 ["cpu"]）
+        """
+        if device == "cpu":
+            # CPU上的多个进程各占用一个CPU名额
+            if self._slots("cpu", task_type) < count:
+                raise ValueError(f"CPU {task_type} 名额不足: 需要 {count} 个进程，上限 {self._slots('cpu', task_type)}")
+            return ["cpu"]
+
+        # device_usage 是 defaultdict，未知设备名会被静默创建并永远等待，这里先按检测到的GPU校验
+        known = [f"cuda:{i}" for i in range(self.gpu_count)]
+        if "," in device:
+            candidates = [d.strip() for d in device.split(",")]
+            if len(set(candidates)) != len(candidates):
+                raise ValueError(f"设备列表中存在重复设备: {device}")
+            unknown = [d for d in candidates if d not in known]
+            if unknown:
+                raise ValueError(f"未知设备: {', '.join(unknown)}，可用设备: {', '.join(known) or '无'}")
+            if len(candidates) < count:
+                raise ValueError(f"设备列表数量不足: 需要 {count}，实际 {len(candidates)}")
+        else:
+            if not self.gpu_available or self.gpu_count < count:
+                raise ValueError(f"可用GPU数量不足: 需要 {count}，实际 {self.gpu_count}")
+            candidates = known
+        usable = [d for d in candidates if self._slots(d, task_type) > 0]
+        if len(usable) < count:
+            raise ValueError(f"允许 {task_type} 任务的GPU数量不足: 需要 {count}，实际 {len(usable)}")
+        return candidates
+
+    def allocate_gang(self, device: str, count: int, task_type: str, task_id: str) -> Optional[List[str]]:
+        """
+        一次性分配多个设备（用于分布式训练），要么全部分配成功，要么不分配
+        device: cpu / cuda（自动选择负载最小的GPU）/ 逗号分隔的设备列表（如 cuda:0,cuda:1）
+        返回分配到的设备列表，资源暂时不足时返回None，请求永远无法满足时抛出 ValueError（见 check_gang）
+        """
+        candidates = self.check_gang(device, count, task_type)
+        with self.lock:
+            def free_slots(dev: str) -> int:
+                return self._slots(dev, task_type) - self.device_usage[dev][task_type]
+
+            if device == "cpu":
+                if free_slots("cpu") < count:
+                    return None
+                devices = ["cpu"] * count
+            else:
+                if "," not in device:
+                    candidates = sorted(candidates, key=lambda d: self.device_usage[d][task_type])
+                devices = [d for d in candidates if free_slots(d) > 0][:count]
+                if len(devices) < count:
+                    return None
+
+            for dev in devices:
+                self.device_usage[dev][task_type] += 1
+                self.active_tasks[dev].append({"id": task_id, "type": task_type})
+
+            logger.info(f"资源组分配: {', '.join(devices)} {task_type} (任务: {task_id[:8]})")
+            return devices
+
+    def release_gang(self, devices: List[str], task_type: str, task_id: str):
+        """释放 allocate_gang 分配的全部设备"""
+        with self.lock:
+            for dev in devices:
+                self.device_usage[dev][task_type] = max(0, self.device_usage[dev][task_type] - 1)
+            for dev in set(devices):
+                self.active_tasks[dev] = [t for t in self.active_tasks[dev] if t["id"] != task_id]
+
+            logger.info(f"资源组释放: {', '.join(devices)} {task_type} (任务: {task_id[:8]})")
+
     def get_status(self) -> Dict:
         """获取资源使用状态"""
         with self.lock:
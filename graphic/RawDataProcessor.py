@@ -3,11 +3,18 @@ import matplotlib.pyplot as plt
 from scipy.signal import stft, windows
 import numpy as np
 import os
-from io import BytesIO
 import imageio
 from PIL import Image
 from typing import Union
-from scipy.fft import fft
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+import threading
+import queue
+
+try:
+    from graphic.waterfull import waterfall_frames, plot_waterfall_spectrogram, colorize
+except ImportError:
+    from waterfull import waterfall_frames, plot_waterfall_spectrogram, colorize
 
 
 class RawDataProcessor:
@@ -93,10 +100,12 @@ def generate_images(datapack: str = None,
                     duration_time: float = 0.1,
                     ratio: int = 1,  # 控制产生图片时间间隔的倍率，默认为1生成视频的倍率
                     location: str = 'buffer',
-                    file_type=np.float32
+                    file_type=np.float32,
+                    gate=None
                     ):
     """
     Generates images from the given data using Short-Time Fourier Transform (STFT).
+    Use `iter_images` instead to process long packs without keeping every image in memory.
 
     Parameters:
     - datapack (str): Path to the data file.
@@ -107,18 +116,72 @@ def generate_images(datapack: str = None,
     - duration_time (float): Duration time for each segment, default is 0.1 seconds.
     - ratio (int): Controls the time interval ratio for generating images, default is 1.
     - location (str): Location to save the images, default is 'buffer'.
+    - gate (EnergyGate): Optional energy detector run on the raw IQ windows first, windows it rejects are not rendered.
 
     Returns:
-    - list: List of images if `location` is 'buffer'.
+    - list: List of images if `location` is 'buffer', a gated window is returned as None so indices match the windows.
+    """
+    images = iter_images(datapack=datapack, fs=fs, stft_point=stft_point, duration_time=duration_time,
+                         ratio=ratio, file_type=file_type, gate=gate)
+    if location == 'buffer':
+        return list(images)
+
+    for k, image in enumerate(images):
+        if image is None:
+            continue
+        i = k * 2 ** (-ratio) if k else 0
+        image.convert('RGB').save(location + (file + '/' if file else '') + (pack + '/' if pack else '') + file + ' (' + str(i) + ').jpg')
+
+
+def iter_images(datapack: str = None,
+                fs: int = 100e6,
+                stft_point: int = 1024,
+                duration_time: float = 0.1,
+                ratio: int = 1,
+                file_type=np.float32,
+                gate=None,
+                dpi: int = 300
+                ):
+    """
+    Generator version of `generate_images`, yields one PIL image per window as soon as it is rendered.
+
+    A single off-screen Agg figure is reused and its RGBA canvas is read back directly, so no PNG encode/decode is done
+    per frame and memory does not depend on the pack length.
+
+    Parameters:
+    - datapack (str): Path to the data file.
+    - fs (int): Sampling frequency, default is 100 MHz.
+    - stft_point (int): Number of points for STFT, default is 1024.
+    - duration_time (float): Duration time for each segment, default is 0.1 seconds.
+    - ratio (int): Controls the time interval ratio for generating images, default is 1.
+    - gate (EnergyGate): Optional energy detector, gated windows are yielded as None.
+    - dpi (int): Resolution of the rendered figure, default is 300.
+
+    Yields:
+    - PIL.Image: RGBA spectrogram image, or None for a gated window.
     """
     slice_point = int(fs * duration_time)
     data = np.fromfile(datapack, dtype=file_type)
     data = data[::2] + data[1::2] * 1j
-    if location == 'buffer': images = []
+
+    active = None
+    if gate is not None:
+        active, _ = gate(data, slice_point, step=int(slice_point * 2 ** (-ratio)))
+
+    fig = Figure(dpi=dpi)
+    canvas = FigureCanvasAgg(fig)
+    ax = fig.add_axes([0, 0, 1, 1])
 
     i = 0
+    window = 0
     while (i + 1) * slice_point <= len(data):
 
+        if active is not None and window < len(active) and not active[window]:
+            yield None
+            i += 2 ** (-ratio)
+            window += 1
+            continue
+
         f, t, Zxx = STFT(data[int(i * slice_point): int((i + 1) * slice_point)],
                          stft_point=stft_point, fs=fs, duration_time=duration_time, onside=False)
         f = np.fft.fftshift(f)
@@ -126,27 +189,75 @@ def generate_images(datapack: str = None,
         aug = 10 * np.log10(np.abs(Zxx))
         extent = [t.min(), t.max(), f.min(), f.max()]
 
-        plt.figure()
-        plt.imshow(aug, extent=extent, aspect='auto', origin='lower', cmap='jet')
-        plt.axis('off')
-        plt.subplots_adjust(left=0, right=1, bottom=0, top=1, wspace=None, hspace=None)
+        ax.clear()
+        ax.imshow(aug, extent=extent, aspect='auto', origin='lower', cmap='jet')
+        ax.axis('off')
+        canvas.draw()
+        yield Image.fromarray(np.asarray(canvas.buffer_rgba()).copy())
 
-        if location == 'buffer':
-            buffer = BytesIO()
-            plt.savefig(buffer, format='png', dpi=300)
-            plt.close()
+        i += 2 ** (-ratio)
+        window += 1
 
-            buffer.seek(0)
-            images.append(Image.open(buffer))
 
-        else:
-            plt.savefig(location + (file + '/' if file else '') + (pack + '/' if pack else '') + file + ' (' + str(i) + ').jpg', dpi=300)
-            plt.close()
+class VideoStreamWriter:
+    """
+    Encode video frames on a background thread as soon as they are produced.
 
-        i += 2 ** (-ratio)
+    Frames go through a bounded queue to an imageio (ffmpeg) writer, so encoding overlaps with the producer (STFT,
+    inference) and memory stays constant whatever the number of frames. Use as a context manager, `close` waits for
+    the queue to drain and re-raises any encoding error.
 
-    if location == 'buffer':
-        return images
+    Args:
+        path (str): output video path.
+        fps (int): frame rate of the video.
+        queue_size (int): maximum number of frames waiting to be encoded.
+    """
+
+    def __init__(self, path: str, fps: int = 5, queue_size: int = 8, **writer_kwargs):
+        self.path = path
+        self.frames = 0
+        self.error = None
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._writer = imageio.get_writer(path, fps=fps, **writer_kwargs)
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def write(self, frame):
+        """Queue a frame (PIL image or HxWx3/4 array), blocks when the encoder is `queue_size` frames behind."""
+        if self.error is not None:
+            raise self.error
+        if isinstance(frame, Image.Image):
+            frame = frame.convert('RGB')
+        frame = np.asarray(frame)
+        if frame.ndim == 3 and frame.shape[2] == 4:
+            frame = frame[..., :3]
+        self._queue.put(frame)
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
+        self._writer.close()
+        if self.error is not None:
+            raise self.error
+
+    def _run(self):
+        while True:
+            frame = self._queue.get()
+            if frame is None:
+                break
+            if self.error is not None:
+                continue
+            try:
+                self._writer.append_data(frame)
+                self.frames += 1
+            except Exception as e:
+                self.error = e
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
 
 
 def save_as_video(datapack: str,
@@ -158,7 +269,7 @@ def save_as_video(datapack: str,
                   file_type=np.float32
                   ):
     """
-    Saves the generated images as a video.
+    Saves the generated images as a video, frames are encoded while the next ones are being generated.
 
     Parameters:
     - datapack (str): Path to the data file.
@@ -174,8 +285,10 @@ def save_as_video(datapack: str,
     if not os.path.exists(datapack):
         raise ValueError('File not found!')
 
-    images = generate_images(datapack=datapack, fs=fs, stft_point=stft_point, duration_time=duration_time, file_type=file_type)
-    imageio.mimsave(save_path+'video.mp4', images, fps=fps)
+    with VideoStreamWriter(os.path.join(save_path, 'video.mp4'), fps=fps) as writer:
+        for image in iter_images(datapack=datapack, fs=fs, stft_point=stft_point, duration_time=duration_time,
+                                 file_type=file_type):
+            writer.write(image)
 
 
 def show_spectrum(datapack: str = '',
@@ -380,6 +493,35 @@ def STFT(data,
     return f, t, Zxx
 
 
+def spectrogram_image(data,
+                      stft_point: int = 1024,
+                      fs: int = 100e6,
+                      size=(1920, 1440),
+                      lut=None
+                      ):
+
+    """
+    Render the spectrogram of one IQ slice by colormap lookup, without matplotlib.
+
+    Same picture as a frame of `iter_images` (two-sided STFT, fftshifted, dB scale, 'jet', low frequencies at the
+    bottom) at a fraction of the cost, meant for bulk dataset generation from a catalog or a mixer.
+
+    Parameters:
+    - data (array-like): Complex IQ samples of the slice.
+    - stft_point (int): Number of points for STFT, default is 1024.
+    - fs (int): Sampling frequency, default is 100 MHz.
+    - size (tuple): Output (width, height), default is the size of the `iter_images` frames. None keeps the
+      (frequency bins, time frames) resolution.
+    - lut (np.ndarray): (256, 3) colormap lookup table, default is jet.
+
+    Returns:
+    - np.ndarray: (H, W, 3) uint8 RGB image.
+    """
+    f, t, Zxx = stft(data, fs, return_onesided=False, window=windows.hamming(stft_point), nperseg=stft_point)
+    aug = 10 * np.log10(np.maximum(np.abs(np.fft.fftshift(Zxx, axes=0)), 1e-12))
+    return colorize(aug[::-1], lut, size)
+
+
 def waterfall_spectrogram(datapack, fft_size, fs, location, time_scale):
     """
     Generate and save waterfall spectrograms.
@@ -387,88 +529,27 @@ def waterfall_spectrogram(datapack, fft_size, fs, location, time_scale):
     This function reads a data pack, performs Fourier Transform to generate spectrograms,
     and saves the results as images based on the specified parameters.
     If location is set to 'buffer', images are saved in memory; otherwise, they are saved to the specified folder.
+    Rendering is done by `WaterfallEngine` (batched FFTs, ring-buffer history, colormap lookup).
 
     Parameters:
     - datapack: Path to the data pack.
     - fft_size: Window size for Fast Fourier Transform.
     - fs: Sampling rate.
-    - location: Image save location, can be 'buffer' (in memory) or a file system path.
+    - location: Image save location, can be 'buffer' (in memory), 'stream' (generator of RGB arrays) or a file system path.
     - time_scale: Time scale to control when to start scrolling the spectrogram.
 
     Returns:
-    - images: A list of saved images when location is 'buffer'; otherwise, returns None.
+    - images: A list of saved images when location is 'buffer', a generator when location is 'stream'; otherwise, returns None.
     """
     if isinstance(datapack, str):
-        data = np.fromfile(datapack, dtype=np.float32)
-        data = data[::2] + data[1::2] * 1j
+        data = np.fromfile(datapack, dtype=np.float32).view(np.complex64)
     if isinstance(datapack, np.ndarray):
         data = datapack
-    pack_gap = 0
-    j = 0
-    gap = 150
-    window = np.hanning(fft_size)
-    spectrogram = []
-    num_frames = len(data) // fft_size
 
-    if location == 'buffer':
-        images = []
-    else:
-        if not os.path.exists(location):
-            os.makedirs(location)
-
-    for i in range(num_frames):
-        frame_data = data[i * fft_size: (i+1)*fft_size] * window
-        magnitude = np.abs(np.fft.fftshift(fft(frame_data)))
+    if location == 'stream':
+        return waterfall_frames(data, frame_size=fft_size, plot_size=time_scale)
 
-        if i > time_scale:
-            spectrogram = spectrogram[1:]
-            spectrogram = np.concatenate((spectrogram, magnitude.reshape(1, fft_size)), axis=0)
-
-        else:
-            spectrogram.append(magnitude)
-
-        pack_gap += 1
-        if i == time_scale:
-            spectrogram = np.array(spectrogram)
-            plt.figure()
-            plt.imshow(np.log10(spectrogram.T), aspect='auto', cmap='jet', origin='lower',
-                       extent=[0, num_frames * (fft_size) / fs, -fs / 2, fs / 2])
-            plt.subplots_adjust(left=0, right=1, bottom=0, top=1, wspace=None, hspace=None)
-            plt.axis('off')
-
-            if location != 'buffer':
-                # 保存瀑布图
-                plt.savefig(os.path.join(location, str(j) + 'waterfall_spectrogram.jpg'), dpi=300)
-                plt.close()
-            else:
-                buffer = BytesIO()
-                plt.savefig(buffer, format='png', dpi=300)
-                plt.close()
-                buffer.seek(0)
-                images.append(BytesIO(buffer.getvalue()))
-
-            j += 1
-            pack_gap = 0
-
-        if i > time_scale and pack_gap == gap:
-            plt.figure()
-            plt.imshow(np.log10(spectrogram.T), aspect='auto', cmap='jet', origin='lower',
-                       extent=[0, num_frames * (fft_size) / fs, -fs / 2, fs / 2])
-            plt.axis('off')
-            plt.subplots_adjust(left=0, right=1, bottom=0, top=1, wspace=None, hspace=None)
-
-            if location != 'buffer':
-                plt.savefig(os.path.join(location, str(j) + 'waterfall_spectrogram.jpg'), dpi=300)
-                plt.close()
-            else:
-                plt.savefig(buffer, format='png', dpi=300)
-                plt.close()
-                buffer.seek(0)
-                images.append(BytesIO(buffer.getvalue()))
-            j += 1
-            pack_gap = 0
-
-    return images
+    return plot_waterfall_spectrogram(data, fs=fs, output_dir=location, frame_size=fft_size, plot_size=time_scale)
 
 
 # Usage-----------------------------------------------------------------------------------------------------------------
@@ -6,6 +6,136 @@ import cv2
 from io import BytesIO
 
 
+def jet_lut():
+    """256-entry RGB lookup table of the 'jet' colormap, same colors as plt.imshow(cmap='jet')."""
+    return (plt.get_cmap('jet')(np.linspace(0, 1, 256))[:, :3] * 255).astype(np.uint8)
+
+
+def colorize(values, lut=None, size=None):
+    """
+    Map a 2-D array to an RGB image by direct colormap lookup, min/max normalized like plt.imshow.
+
+    :param values: 2-D array, row 0 is drawn at the top.
+    :param lut: (256, 3) uint8 lookup table, default is `jet_lut()`.
+    :param size: optional output (width, height).
+    :return: (H, W, 3) uint8 RGB image.
+    """
+    lut = jet_lut() if lut is None else lut
+    vmin, vmax = float(np.min(values)), float(np.max(values))
+    scale = 255.0 / (vmax - vmin) if vmax > vmin else 0.0
+    if size is not None:
+        values = cv2.resize(values.astype(np.float32), size, interpolation=cv2.INTER_AREA)
+    index = np.clip((values - vmin) * scale, 0, 255).astype(np.uint8)
+    return lut[index]
+
+
+class WaterfallEngine:
+    """
+    Scrolling waterfall spectrogram renderer.
+
+    Frame FFTs are computed in blocks with one batched FFT over a reshaped view of the IQ data, the scrolling history
+    lives in a circular buffer of `plot_size + 1` rows and images are produced by colormap lookup instead of matplotlib.
+    The first image covers frames [0, plot_size], then one image is emitted every `gap` frames, like the former
+    matplotlib implementation.
+
+    Args:
+        fft_size (int): samples per frame.
+        plot_size (int): index of the frame that completes the first image, the history holds plot_size + 1 frames.
+        gap (int): number of frames between two emitted images once the history is full.
+        image_size (tuple): (width, height) of the output images, 1920x1440 matches the former 300 dpi figures.
+        block_frames (int): number of frames transformed per FFT call.
+    """
+
+    def __init__(self, fft_size=256, plot_size=39062, gap=150, image_size=(1920, 1440), block_frames=8192):
+        self.fft_size = fft_size
+        self.plot_size = plot_size
+        self.gap = gap
+        self.image_size = image_size
+        self.block_frames = block_frames
+        self.window = np.hanning(fft_size).astype(np.float32)
+        self.lut = jet_lut()
+        self.history = np.empty((plot_size + 1, fft_size), dtype=np.float32)
+        self.head = 0
+        self.count = 0
+        self._remainder = np.zeros(0, dtype=np.complex64)
+
+    def reset(self):
+        self.head = 0
+        self.count = 0
+        self._remainder = np.zeros(0, dtype=np.complex64)
+
+    def spectra(self, iq_data):
+        """Yield blocks of log10 magnitude spectra, shape (frames, fft_size), for complete frames of `iq_data`."""
+        num_frames = len(iq_data) // self.fft_size
+        frames = iq_data[:num_frames * self.fft_size].reshape(num_frames, self.fft_size)
+        for start in range(0, num_frames, self.block_frames):
+            spec = fft(frames[start:start + self.block_frames] * self.window, axis=-1, workers=-1)
+            magnitude = np.abs(np.fft.fftshift(spec, axes=-1))
+            yield np.log10(np.maximum(magnitude, 1e-12)).astype(np.float32)
+
+    def process(self, iq_data):
+        """
+        Feed IQ samples, chunks of any length can be streamed in, and yield every image completed by them.
+
+        :param iq_data: 1-D complex IQ samples.
+        :return: generator of (H, W, 3) uint8 RGB images.
+        """
+        if len(self._remainder):
+            iq_data = np.concatenate((self._remainder, iq_data))
+        used = len(iq_data) // self.fft_size * self.fft_size
+        self._remainder = np.array(iq_data[used:])
+
+        for rows in self.spectra(iq_data[:used]):
+            pos = 0
+            while pos < len(rows):
+                emit_at = self._next_emit(self.count)
+                take = min(len(rows) - pos, emit_at - self.count + 1)
+                self._write(rows[pos:pos + take])
+                pos += take
+                if self.count - 1 == emit_at:
+                    yield self.render()
+
+    def render(self):
+        """Render the current history as an RGB image, time along x and frequency upwards along y."""
+        ordered = np.concatenate((self.history[self.head:], self.history[:self.head]))
+        return colorize(ordered.T[::-1], self.lut, self.image_size)
+
+    def _next_emit(self, i):
+        if i <= self.plot_size:
+            return self.plot_size
+        return self.plot_size + -(-(i - self.plot_size) // self.gap) * self.gap
+
+    def _write(self, rows):
+        capacity = len(self.history)
+        n = len(rows)
+        if n >= capacity:
+            self.history[:] = rows[-capacity:]
+            self.head = 0
+        else:
+            end = self.head + n
+            if end <= capacity:
+                self.history[self.head:end] = rows
+            else:
+                first = capacity - self.head
+                self.history[self.head:] = rows[:first]
+                self.history[:n - first] = rows[first:]
+            self.head = end % capacity
+        self.count += n
+
+
+def waterfall_frames(iq_data,
+                     frame_size: int = 256,
+                     plot_size: int = 39062,
+                     gap: int = 150,
+                     image_size=(1920, 1440)
+                     ):
+    """
+    Streaming generator of waterfall images (RGB uint8 arrays) for a complex IQ array, see `WaterfallEngine`.
+    """
+    engine = WaterfallEngine(fft_size=frame_size, plot_size=plot_size, gap=gap, image_size=image_size)
+    yield from engine.process(iq_data)
+
+
 def plot_waterfall_spectrogram(iq_data,
                                fs: int,
                                output_dir: str,
@@ -19,8 +149,9 @@ def plot_waterfall_spectrogram(iq_data,
     :param iq_data: IQ signal data (complex form)
     :param frame_size: Size of each frame
     :param fs: Sampling frequency
-    :param output_dir: Directory to save images
+    :param output_dir: Directory to save images, or 'buffer' to return the images as in-memory PNGs
     :param plot_size: Number of frames to include in the initial plot
+    :return: list of BytesIO PNG images when output_dir is 'buffer'
     """
 
     if output_dir != 'buffer':
@@ -29,63 +160,15 @@ def plot_waterfall_spectrogram(iq_data,
     else:
         images = []
 
-    num_frames = len(iq_data) // frame_size
-    window = np.hanning(frame_size)
-    spectrogram = []
-    pack_gap = 0
-    j = 0
-    gap = 150
-
-    for i in range(num_frames):
-        start_idx = i * (frame_size)
-        magnitude = np.abs(np.fft.fftshift(fft(iq_data[start_idx:start_idx + frame_size] * window)))
-        if i > plot_size:
-            spectrogram = spectrogram[1:]
-            spectrogram = np.concatenate((spectrogram, magnitude.reshape(1, frame_size)), axis=0)
-
+    for j, image in enumerate(waterfall_frames(iq_data, frame_size=frame_size, plot_size=plot_size)):
+        image = cv2.cvtColor(image, cv2.COLOR_RGB2BGR)
+        if output_dir != 'buffer':
+            cv2.imwrite(os.path.join(output_dir, str(j) + 'waterfall_spectrogram.jpg'), image)
         else:
-            spectrogram.append(magnitude)
+            images.append(BytesIO(cv2.imencode('.png', image)[1].tobytes()))
 
-        pack_gap += 1
-
-        if i == plot_size:
-            spectrogram = np.array(spectrogram)
-            plt.figure()
-            plt.imshow(np.log10(spectrogram.T), aspect='auto', cmap='jet', origin='lower',
-                       extent=[0, num_frames * (frame_size) / fs, -fs / 2, fs / 2])
-            plt.subplots_adjust(left=0, right=1, bottom=0, top=1, wspace=None, hspace=None)
-            plt.axis('off')
-
-            if output_dir != 'buffer':
-                plt.savefig(os.path.join(output_dir, str(j) + 'waterfall_spectrogram.jpg'), dpi=300)
-                plt.close()
-
-            else:
-                buffer = BytesIO()
-                plt.savefig(buffer, format='png', dpi=300)
-                plt.close()
-                buffer.seek(0)
-                images.append(BytesIO(buffer.getvalue()))
-
-            j += 1
-            pack_gap = 0
-
-        if i > plot_size and pack_gap == gap:
-            plt.figure()
-            plt.imshow(np.log10(spectrogram.T), aspect='auto', cmap='jet', origin='lower',
-                       extent=[0, num_frames * (frame_size) / fs, -fs / 2, fs / 2])
-            plt.axis('off')
-            plt.subplots_adjust(left=0, right=1, bottom=0, top=1, wspace=None, hspace=None)
-            if output_dir != 'buffer':
-                plt.savefig(os.path.join(output_dir, str(j) + 'waterfall_spectrogram.jpg'), dpi=300)
-                plt.close()
-            else:
-                plt.savefig(buffer, format='png', dpi=300)
-                plt.close()
-                buffer.seek(0)
-                images.append(BytesIO(buffer.getvalue()))
-            j += 1
-            pack_gap = 0
+    if output_dir == 'buffer':
+        return images
 
 
 def video_maker(image_folder: str = '',
@@ -135,7 +218,7 @@ def main():
     data = data_I + data_Q * 1j
     """
 
-    plot_waterfall_spectrogram(iq_data=data, output_dir=save_path)
+    plot_waterfall_spectrogram(iq_data=data, fs=100e6, output_dir=save_path)
 
 
 if __name__ == "__main__":
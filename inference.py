@@ -8,6 +8,7 @@ def main():
                           weight_path='')
     # test.inference(source=source, save_path='./res/')
     test.benchmark(data_path=source)
+    test.close()
 
 
 if __name__ == '__main__':
@@ -8,6 +8,29 @@ from datetime import datetime
 
 # ==================== 请求模型 ====================
 
+class SyntheticIQConfig(BaseModel):
+    """在线合成训练数据配置（见 utils.synthetic.SyntheticIQDataset）"""
+    fs: float = Field(default=100e6, description="采样率 (Hz)", gt=0)
+    duration_time: float = Field(default=0.1, description="切片时长 (秒)，与生成时频图时一致", gt=0)
+    file_type: str = Field(default="float32", description="原始数据类型 (float32/float64/int16)")
+    snr_range: List[float] = Field(default=[-10, 20], description="叠加高斯白噪声的信噪比范围 [下限, 上限] (dB)，均匀采样",
+                                   min_length=2, max_length=2)
+    noise_p: float = Field(default=1.0, description="每个样本叠加白噪声的概率", ge=0, le=1)
+    interference_p: float = Field(default=0.0, description="每个样本混入另一类无人机切片作为干扰的概率", ge=0, le=1)
+    hopping_p: float = Field(default=0.0, description="每个样本叠加跳频干扰信号的概率", ge=0, le=1)
+    sir_range: List[float] = Field(default=[0, 20], description="信干比范围 [下限, 上限] (dB)", min_length=2,
+                                   max_length=2)
+    max_freq_shift: float = Field(default=0.0, description="干扰信号随机频移的最大值 (Hz)", ge=0)
+    stft_point: int = Field(default=1024, description="STFT点数", ge=16)
+    size: List[int] = Field(default=[640, 480], description="渲染时频图尺寸 [宽, 高]（随后缩放到 image_size）",
+                            min_length=2, max_length=2)
+    samples_per_epoch: Optional[int] = Field(None, description="每个epoch的样本数（默认为全部切片数）", ge=1)
+    balance: bool = Field(default=False, description="是否按类别均衡采样")
+    catalog: Optional[str] = Field(None, description="原始数据目录数据库 (catalog.db)，设置后仅从其中已登记的切片采样")
+    min_snr: Optional[float] = Field(None, description="配合 catalog 使用：采样切片的最小信噪比 (dB)")
+    seed: int = Field(default=0, description="随机种子")
+
+
 class TrainingRequest(BaseModel):
     """训练请求"""
     # 模型配置
@@ -35,6 +58,46 @@ class TrainingRequest(BaseModel):
     weight_path: Optional[str] = Field(default="", description="预训练权重路径")
     pretrained: bool = Field(default=True, description="是否使用预训练")
     shuffle: bool = Field(default=True, description="是否打乱数据")
+    num_workers: int = Field(default=0, description="DataLoader 工作进程数（解码与在线增强在其中并行执行）", ge=0)
+    num_devices: int = Field(
+        default=1,
+        description="分布式数据并行(DDP)进程数，大于1时按设备组一次性分配（GPU使用nccl，CPU使用gloo），batch_size为单进程批次",
+        ge=1
+    )
+
+    # 早停与学习率调度
+    patience: int = Field(default=0, description="早停耐心值：监控指标连续多少个epoch无提升后停止（0为关闭）", ge=0)
+    min_delta: float = Field(default=0.0, description="被视为提升的最小变化量", ge=0)
+    monitor: str = Field(default="val_acc", description="早停与plateau调度监控的验证指标 (val_acc/val_loss/macro_f1)")
+    lr_scheduler: Optional[str] = Field(
+        default=None,
+        description="学习率调度 (plateau: 指标停滞时降低学习率 / cosine: 按总epoch余弦退火 / 为空不调度)"
+    )
+
+    # 在线数据增强（训练时在DataLoader工作进程中随机增强，不生成离线副本）
+    augmentation: bool = Field(default=False, description="是否启用在线数据增强")
+    augmentation_methods: Optional[List[str]] = Field(
+        None,
+        description="在线增强方法（默认全部）：AdvancedBlur, CLAHE, ColorJitter, GaussNoise, ISONoise, Sharpen，"
+                    "每张训练图像随机选择其中一种"
+    )
+    augmentation_p: float = Field(default=0.5, description="每张训练图像被增强的概率", ge=0, le=1)
+
+    # 在线合成数据（train_path/val_path 为原始IQ数据目录时，在DataLoader工作进程中实时加噪、混入干扰并生成时频图）
+    synthetic: Optional[SyntheticIQConfig] = Field(
+        None, description="在线合成训练数据配置，设置后原始IQ数据目录可直接作为训练集/验证集，无需预先生成图像"
+    )
+
+    # 知识蒸馏（设置 teacher_weight 后以蒸馏模式训练 model 指定的学生模型）
+    teacher_weight: Optional[str] = Field(None, description="教师模型权重 (best_model.pth)")
+    teacher_cfg: Optional[str] = Field(None, description="教师模型配置文件 (config.yaml)")
+    distill_temperature: float = Field(default=4.0, description="蒸馏温度", gt=0)
+    distill_alpha: float = Field(default=0.5, description="蒸馏损失(KL)权重，其余为交叉熵", ge=0, le=1)
+    latency_device: str = Field(default="cpu", description="蒸馏完成后测量学生/教师推理延迟的设备")
+
+    # 断点续训
+    resume_from: Optional[str] = Field(None, description="从训练检查点恢复（last_checkpoint.pth 或其所在目录）")
+    resume_task_id: Optional[str] = Field(None, description="从已有训练任务的最新检查点恢复")
     
     # 任务配置
     task_id: Optional[str] = Field(None, description="任务ID")
@@ -42,6 +105,48 @@ class TrainingRequest(BaseModel):
     description: Optional[str] = Field(None, description="任务描述")
 
 
+class SweepRequest(BaseModel):
+    """超参数搜索请求"""
+    base: TrainingRequest = Field(..., description="基础训练配置，num_epochs 为单个试验的完整训练预算")
+    search_space: Dict[str, Any] = Field(
+        ...,
+        description="搜索空间：TrainingRequest 字段 -> 候选值列表，或连续区间 {low, high, log, int}",
+        example={"model": ["resnet18", "resnet50", "vit_b_16"],
+                 "learning_rate": {"low": 1e-5, "high": 1e-3, "log": True}}
+    )
+    num_trials: Optional[int] = Field(None, description="试验数量（为空时遍历全部网格）", ge=1)
+    metric: str = Field(default="val_acc", description="调度依据的验证指标 (val_acc/val_loss/macro_f1)")
+    min_epochs: int = Field(default=1, description="第一个评估档位(rung)的epoch数", ge=1)
+    reduction_factor: int = Field(default=3, description="每个档位仅保留前 1/reduction_factor 的试验", ge=2)
+    max_concurrent_trials: int = Field(default=1, description="最大并行试验数（仍受资源管理器限制）", ge=1)
+    seed: Optional[int] = Field(None, description="随机种子")
+    task_id: Optional[str] = Field(None, description="任务ID")
+
+
+class PruningRequest(BaseModel):
+    """模型剪枝请求"""
+    cfg_path: str = Field(..., description="已训练模型的配置文件 (config.yaml)")
+    weight_path: str = Field(..., description="已训练模型的权重 (best_model.pth)")
+    train_path: str = Field(..., description="微调使用的训练集路径")
+    val_path: str = Field(..., description="评估精度使用的验证集路径")
+    save_path: str = Field(..., description="剪枝模型保存路径")
+    name: Optional[str] = Field(None, description="自定义保存名称（会作为子目录名附加到保存路径）")
+
+    latency_budget_ms: Optional[float] = Field(
+        None, description="目标推理延迟(ms，batch=1)，自动搜索满足预算的最大保留比例", gt=0
+    )
+    keep_ratio: Optional[float] = Field(None, description="固定的通道/神经元保留比例（与延迟预算二选一）", gt=0, le=1)
+    finetune_epochs: int = Field(default=3, description="剪枝后微调轮数（0为不微调）", ge=0)
+    learning_rate: float = Field(default=0.0001, description="微调学习率", gt=0)
+    batch_size: Optional[int] = Field(None, description="批次大小（为空时沿用配置文件）", ge=1)
+    device: str = Field(default="cuda", description="微调设备", example="cuda:0")
+    latency_device: str = Field(default="cpu", description="测量推理延迟的设备")
+    torchscript: bool = Field(default=False, description="是否同时导出 TorchScript 模型")
+
+    task_id: Optional[str] = Field(None, description="任务ID")
+    priority: int = Field(default=5, description="优先级", ge=1, le=10)
+
+
 class InferenceRequest(BaseModel):
     """推理请求"""
     cfg_path: str = Field(..., description="配置文件路径")
@@ -56,6 +161,12 @@ class InferenceRequest(BaseModel):
     )
     task_id: Optional[str] = Field(None, description="任务ID")
     priority: int = Field(default=3, description="优先级", ge=1, le=10)
+    energy_gate: bool = Field(default=False, description="启用能量预检测，跳过无信号窗口的分类推理（仅原始IQ数据）")
+    gate_threshold_db: float = Field(default=3.0, description="能量门限，窗口相对噪底的SNR低于该值(dB)判定为无信号")
+    annotation: str = Field(
+        default="burn",
+        description="结果标注方式: burn(绘制到图像/视频上) / sidecar(不绘制，输出同名JSON结果文件)"
+    )
 
 
 class BatchInferenceRequest(BaseModel):
@@ -66,6 +177,51 @@ class BatchInferenceRequest(BaseModel):
     save_base_path: Optional[str] = Field(None, description="结果保存基础路径")
     device: str = Field(default="cuda", description="推理设备")
     priority: int = Field(default=3, description="优先级")
+    energy_gate: bool = Field(default=False, description="启用能量预检测")
+    gate_threshold_db: float = Field(default=3.0, description="能量门限(dB)")
+
+
+class DetectorConfig(BaseModel):
+    """两阶段推理 - 检测模型配置"""
+    model_name: str = Field(default="yolov5", description="检测模型名称")
+    weight_path: str = Field(..., description="检测模型权重路径")
+
+
+class ClassifierConfig(BaseModel):
+    """两阶段推理 - 分类模型配置"""
+    weight_path: str = Field(..., description="分类模型权重路径")
+    cfg: str = Field(..., description="分类模型配置文件路径")
+
+
+class TwoStageInferenceRequest(BaseModel):
+    """两阶段（检测+分类）推理请求，字段与 example/two_stage/sample.json 一致"""
+    detector: DetectorConfig = Field(..., description="检测模型配置")
+    classifier: ClassifierConfig = Field(..., description="分类模型配置")
+    target_dir: str = Field(..., description="待推理图像文件或目录")
+    save_dir: Optional[str] = Field(None, description="结果保存目录（标注图像与results.json），为空则不保存")
+    device: str = Field(default="cuda", description="推理设备 (cpu/cuda/cuda:0/...)")
+    imgsz: int = Field(default=640, description="检测输入尺寸", gt=0)
+    conf_thres: float = Field(default=0.6, description="检测置信度阈值", ge=0, le=1)
+    iou_thres: float = Field(default=0.45, description="NMS IoU阈值", ge=0, le=1)
+    batch_size: int = Field(default=8, description="每批图像数", ge=1)
+    task_id: Optional[str] = Field(None, description="任务ID")
+    priority: int = Field(default=3, description="优先级", ge=1, le=10)
+
+
+class BenchmarkRequest(BaseModel):
+    """分类模型 benchmark 请求"""
+    cfg_path: str = Field(..., description="配置文件路径")
+    weight_path: str = Field(..., description="模型权重路径（state_dict 或导出的完整模型，如剪枝模型）")
+    data_path: str = Field(..., description="benchmark 数据路径（SNR/分组/类别 目录或分片目录）")
+    save_path: Optional[str] = Field(None, description="结果保存路径（默认为 data_path/benchmark result）")
+    store_path: str = Field(default="results/benchmarks.db", description="benchmark 结果库路径")
+    name: Optional[str] = Field(None, description="本次运行名称，如 resnet18-pruned-0.5")
+    device: str = Field(default="cuda", description="推理设备 (cpu/cuda/cuda:0/...)", example="cuda:0")
+    precision: str = Field(default="fp32", description="推理精度 (fp32 / fp16 / bf16，后两者使用autocast)")
+    num_workers: Optional[int] = Field(None, description="DataLoader 工作进程数（默认 min(8, CPU核数)）", ge=0)
+    plot: bool = Field(default=True, description="是否绘制各子集的混淆矩阵")
+    task_id: Optional[str] = Field(None, description="任务ID")
+    priority: int = Field(default=3, description="优先级", ge=1, le=10)
 
 
 class ResourceConfigUpdate(BaseModel):
@@ -92,6 +248,9 @@ class TaskResponse(BaseModel):
     total_epochs: Optional[int] = None
     latest_metrics: Optional['TrainingMetrics'] = None
 
+    # 任务统计信息（如推理任务的能量门限命中率）
+    stats: Optional[Dict[str, Any]] = None
+
 
 class TaskListResponse(BaseModel):
     """任务列表响应"""
@@ -206,6 +365,11 @@ class TrainingMetrics(BaseModel):
     learning_rate: Optional[float] = Field(None, description="当前学习率")
     best_acc: Optional[float] = Field(None, description="最佳准确率")
 
+    # 提前停止
+    stop_reason: Optional[str] = Field(None, description="提前停止原因 (early_stopping/callback)")
+    epochs_saved: Optional[int] = Field(None, description="提前停止节省的epoch数")
+    best_epoch: Optional[int] = Field(None, description="早停时监控指标最佳的epoch")
+
 
 class DetailedLogEntry(BaseModel):
     """详细日志条目"""
@@ -238,6 +402,12 @@ class DatasetSplitRequest(BaseModel):
     output_path: str = Field(..., description="输出数据集路径")
     train_ratio: float = Field(default=0.8, description="训练集比例", ge=0.1, le=0.9)
     val_ratio: Optional[float] = Field(None, description="验证集比例（可选，用于三分割）", ge=0.05, le=0.5)
+    mode: str = Field(
+        default="copy",
+        description="分割方式 (copy: 复制文件 / hardlink: 硬链接 / reflink: 写时复制克隆 / symlink: 符号链接 / "
+                    "manifest: 仅写出 train.json、valid.json 等清单，可直接作为训练集/验证集路径)"
+    )
+    seed: Optional[int] = Field(None, description="随机种子，相同种子得到相同的分割")
     task_id: Optional[str] = Field(None, description="任务ID")
     description: Optional[str] = Field(None, description="任务描述")
 
@@ -250,6 +420,8 @@ class DataAugmentationRequest(BaseModel):
         default=None,
         description="增强方法列表（可选）：AdvancedBlur, CLAHE, ColorJitter, GaussNoise, ISONoise, Sharpen"
     )
+    num_workers: Optional[int] = Field(None, description="并行增强的进程数（默认为CPU核数）", ge=1)
+    chunk_size: int = Field(default=32, description="每个工作单元包含的图像数", ge=1)
     task_id: Optional[str] = Field(None, description="任务ID")
     description: Optional[str] = Field(None, description="任务描述")
 
@@ -262,6 +434,114 @@ class ImageCropRequest(BaseModel):
     y: int = Field(..., description="裁剪区域左上角Y坐标", ge=0)
     width: int = Field(..., description="裁剪宽度", gt=0)
     height: int = Field(..., description="裁剪高度", gt=0)
+    mode: str = Field(
+        default="write",
+        description="裁剪方式 (write: 并行裁剪并写出新图像 / virtual: 仅写出带裁剪框的 crop.json 清单，训练加载时裁剪)"
+    )
+    lossless: bool = Field(
+        default=True,
+        description="裁剪起点为16的倍数的JPEG图像使用 jpegtran 在DCT域无损裁剪（需安装jpegtran，否则解码后裁剪）"
+    )
+    num_workers: Optional[int] = Field(None, description="并行裁剪的进程数（默认为CPU核数）", ge=1)
+    task_id: Optional[str] = Field(None, description="任务ID")
+    description: Optional[str] = Field(None, description="任务描述")
+
+
+class SNREstimationRequest(BaseModel):
+    """SNR估计请求"""
+    input_path: str = Field(..., description="原始IQ数据文件或目录路径")
+    output_path: str = Field(..., description="SNR时间线输出目录")
+    sample_rate: float = Field(default=100e6, description="采样率(Hz)", gt=0)
+    duration_time: float = Field(default=0.1, description="窗口时长(秒)，与生成时频图的时长一致", gt=0)
+    step_time: Optional[float] = Field(None, description="窗口步进(秒)，默认等于窗口时长", gt=0)
+    nperseg: int = Field(default=1024, description="PSD分段FFT点数", gt=0)
+    noise_quantile: float = Field(default=0.1, description="噪底估计分位数", gt=0, lt=1)
+    file_type: str = Field(default="float32", description="原始数据类型 (float32/float64/int16)")
+    buckets: List[float] = Field(
+        default=[-20, -10, -5, 0, 5, 10, 15, 20],
+        description="SNR分桶边界(dB)，按下边界命名，如 5dB 表示 [5, 10)"
+    )
+    task_id: Optional[str] = Field(None, description="任务ID")
+    description: Optional[str] = Field(None, description="任务描述")
+
+
+class ShardPackRequest(BaseModel):
+    """数据集分片打包请求"""
+    input_path: str = Field(..., description="输入数据集路径（分类: 类别文件夹或 train.json 清单；检测: images 目录或图像列表txt）")
+    output_path: str = Field(..., description="分片输出目录，生成 shard-00000.tar ... 与索引 shards.json")
+    task: str = Field(default="classify", description="数据集类型 (classify: 分类 / detect: YOLO检测，标注与图像尺寸写入索引)")
+    shard_size_mb: int = Field(default=256, description="单个分片的大小(MB)", ge=1)
+    shuffle: bool = Field(default=True, description="打包前打乱样本顺序，使每个分片混合各类别与SNR（仅分类）")
+    seed: int = Field(default=0, description="打乱顺序的随机种子")
+    task_id: Optional[str] = Field(None, description="任务ID")
+    description: Optional[str] = Field(None, description="任务描述")
+
+
+class CatalogScanRequest(BaseModel):
+    """原始IQ数据目录建立索引请求"""
+    data_path: str = Field(..., description="原始数据根目录，其下第一级文件夹为无人机类别")
+    db_path: Optional[str] = Field(None, description="索引数据库路径（默认为 data_path/catalog.db）")
+    sample_rate: float = Field(default=100e6, description="采样率(Hz)", gt=0)
+    duration_time: float = Field(default=0.1, description="切片时长(秒)，与生成时频图的时长一致", gt=0)
+    step_time: Optional[float] = Field(None, description="切片步进(秒)，默认等于切片时长", gt=0)
+    file_type: str = Field(default="float32", description="原始数据类型 (float32/float64/int16)")
+    nperseg: int = Field(default=1024, description="PSD分段FFT点数", gt=0)
+    noise_quantile: float = Field(default=0.1, description="噪底估计分位数", gt=0, lt=1)
+    buckets: List[float] = Field(
+        default=[-20, -10, -5, 0, 5, 10, 15, 20],
+        description="SNR分桶边界(dB)，按下边界命名，如 5dB 表示 [5, 10)"
+    )
+    rescan: bool = Field(default=False, description="重新扫描已建立索引且未变化的数据包")
+    task_id: Optional[str] = Field(None, description="任务ID")
+    description: Optional[str] = Field(None, description="任务描述")
+
+
+class CatalogExportRequest(BaseModel):
+    """从索引中选取切片生成数据集请求"""
+    db_path: str = Field(..., description="索引数据库路径")
+    output_path: str = Field(..., description="输出路径")
+    layout: str = Field(
+        default="class",
+        description="目录结构 (class: 类别/图像，可继续分割为训练集 / benchmark: SNR分桶/分组/类别/图像，用于benchmark)"
+    )
+    group: str = Field(default="catalog", description="benchmark 结构中的分组目录名")
+    labels: Optional[List[str]] = Field(None, description="选取的类别（默认全部）")
+    min_snr: Optional[float] = Field(None, description="最小SNR(dB)")
+    max_snr: Optional[float] = Field(None, description="最大SNR(dB)，不含")
+    buckets: Optional[List[str]] = Field(None, description="选取的SNR分桶，如 5dB、10dB（默认全部）")
+    min_energy: Optional[float] = Field(None, description="最小切片能量(dB)")
+    stft_point: int = Field(default=1024, description="STFT点数", gt=0)
+    image_width: int = Field(default=1920, description="图像宽度", gt=0)
+    image_height: int = Field(default=1440, description="图像高度", gt=0)
+    num_workers: Optional[int] = Field(None, description="并行渲染的进程数（默认为CPU核数）", ge=1)
+    task_id: Optional[str] = Field(None, description="任务ID")
+    description: Optional[str] = Field(None, description="任务描述")
+
+
+class MixSource(BaseModel):
+    """混合信号源"""
+    path: str = Field(..., description="原始IQ数据包路径")
+    file_type: str = Field(default="float32", description="原始数据类型 (float32/float64/int16)")
+    gain_db: float = Field(default=0.0, description="增益(dB)")
+    snr_db: Optional[float] = Field(None, description="相对参考源（第一个信号源）的功率比(dB)，设置后忽略 gain_db")
+    offset: float = Field(default=0.0, description="在混合信号中的起始时间(秒)，负值表示跳过开头")
+    freq_shift: float = Field(default=0.0, description="频移(Hz)")
+
+
+class SignalMixingRequest(BaseModel):
+    """多无人机信号混合请求"""
+    sources: List[MixSource] = Field(..., description="信号源列表，第一个为参考源", min_length=1)
+    output_path: str = Field(..., description="输出目录")
+    name: str = Field(default="mix", description="图像名前缀，保存为 name (序号).jpg")
+    sample_rate: float = Field(default=100e6, description="采样率(Hz)", gt=0)
+    duration_time: float = Field(default=0.1, description="切片时长(秒)", gt=0)
+    step_time: Optional[float] = Field(None, description="切片步进(秒)，默认等于切片时长", gt=0)
+    awgn_snr_db: Optional[float] = Field(None, description="叠加高斯白噪声，相对参考源功率的SNR(dB)")
+    seed: Optional[int] = Field(None, description="噪声随机种子")
+    stft_point: int = Field(default=1024, description="STFT点数", gt=0)
+    image_width: int = Field(default=1920, description="图像宽度", gt=0)
+    image_height: int = Field(default=1440, description="图像高度", gt=0)
+    num_workers: Optional[int] = Field(None, description="并行渲染的进程数（默认为CPU核数）", ge=1)
     task_id: Optional[str] = Field(None, description="任务ID")
     description: Optional[str] = Field(None, description="任务描述")
 
@@ -269,7 +549,7 @@ class ImageCropRequest(BaseModel):
 class PreprocessingResponse(BaseModel):
     """预处理响应"""
     task_id: str
-    task_type: str  # split/augment/crop
+    task_type: str  # split/augment/crop/snr/shard_pack/catalog_scan/catalog_export/mixing
     status: str
     message: Optional[str] = None
     progress: int = 0
@@ -2,11 +2,15 @@ from services.training_service import TrainingService
 from services.inference_service import InferenceService
 from services.task_service import TaskService
 from services.preprocessing_service import PreprocessingService
+from services.sweep_service import SweepService
+from services.benchmark_service import BenchmarkService
 
 _training_service = None
 _inference_service = None
 _task_service = None
 _preprocessing_service = None
+_sweep_service = None
+_benchmark_service = None
 
 
 def get_training_service() -> TrainingService:
@@ -38,3 +42,17 @@ def get_preprocessing_service() -> PreprocessingService:
     if _preprocessing_service is None:
         _preprocessing_service = PreprocessingService()
     return _preprocessing_service
+
+
+def get_sweep_service() -> SweepService:
+    global _sweep_service
+    if _sweep_service is None:
+        _sweep_service = SweepService()
+    return _sweep_service
+
+
+def get_benchmark_service() -> BenchmarkService:
+    global _benchmark_service
+    if _benchmark_service is None:
+        _benchmark_service = BenchmarkService()
+    return _benchmark_service
@@ -101,7 +101,7 @@ class BaseService:
                     log_entry = queue.get()
                     yield f"data: {json.dumps(log_entry, ensure_ascii=False)}\n\n"
                 
-                if status in ["completed", "failed", "cancelled"]:
+                if status in ["completed", "failed", "cancelled", "suspended"]:
                     yield f"data: {json.dumps({'status': status, 'message': '任务结束'}, ensure_ascii=False)}\n\n"
                     break
                 
@@ -0,0 +1,152 @@
+import logging
+import os
+import traceback
+import yaml
+import tempfile
+from fastapi import BackgroundTasks
+from typing import Dict, Any, List, Optional
+
+from services.base_service import BaseService
+from models.schemas import BenchmarkRequest
+from core.resource_manager import resource_manager
+from utils.benchmark import Classify_Model, PRECISIONS
+from utils.benchmark_store import BenchmarkStore
+
+logger = logging.getLogger(__name__)
+
+
+class BenchmarkService(BaseService):
+    def __init__(self):
+        super().__init__()
+
+    async def start_benchmark(
+        self,
+        request: BenchmarkRequest,
+        background_tasks: BackgroundTasks
+    ) -> str:
+        task_id = self.generate_task_id(request.task_id)
+
+        if not os.path.exists(request.cfg_path):
+            raise FileNotFoundError(f"配置文件不存在: {request.cfg_path}")
+        if not os.path.exists(request.weight_path):
+            raise FileNotFoundError(f"模型权重不存在: {request.weight_path}")
+        if not os.path.exists(request.data_path):
+            raise FileNotFoundError(f"benchmark 数据路径不存在: {request.data_path}")
+        if request.precision not in PRECISIONS:
+            raise ValueError(f"不支持的推理精度: {request.precision}，可选: {list(PRECISIONS)}")
+
+        self.update_task_status(
+            task_id,
+            "pending",
+            "等待开始",
+            0,
+            task_type="benchmark",
+            device=request.device,
+            priority=request.priority,
+            name=request.name
+        )
+
+        background_tasks.add_task(self._benchmark_worker, task_id, request)
+
+        logger.info(f"benchmark任务已创建: {task_id}")
+        return task_id
+
+    def _benchmark_worker(self, task_id: str, request: BenchmarkRequest):
+        device = request.device
+        actual_device = None
+
+        try:
+            self.create_log_queue(task_id)
+
+            self.update_task_status(task_id, "queued", "等待资源...", 0)
+            self.add_log(task_id, "INFO", f"等待{device.upper()}资源...")
+
+            import threading
+            while not resource_manager.can_allocate(device, "inference"):
+                logger.info(f"benchmark任务 {task_id} 等待 {device} 资源...")
+                threading.Event().wait(1)
+
+            actual_device = resource_manager.allocate(device, "inference", task_id)
+            self.update_task_status(task_id, "running", "benchmark中...", 0, device=actual_device)
+            self.add_log(task_id, "INFO", f"资源已分配，使用设备: {actual_device}，推理精度: {request.precision}")
+
+            with open(request.cfg_path, 'r', encoding='utf-8') as f:
+                cfg = yaml.safe_load(f)
+            cfg['device'] = actual_device  # 使用实际分配的设备
+
+            with tempfile.NamedTemporaryFile(mode='w', suffix='.yaml', delete=False, encoding='utf-8') as tmp_cfg:
+                yaml.dump(cfg, tmp_cfg, allow_unicode=True)
+                tmp_cfg_path = tmp_cfg.name
+
+            model = None
+            try:
+                self.add_log(task_id, "INFO", f"加载模型: {request.weight_path}")
+                model = Classify_Model(cfg=tmp_cfg_path, weight_path=request.weight_path)
+                self.add_log(task_id, "INFO", f"benchmark 数据: {request.data_path}")
+                report = model.benchmark(request.data_path, save_path=request.save_path,
+                                         num_workers=request.num_workers, plot=request.plot,
+                                         precision=request.precision, store=request.store_path, name=request.name)
+            finally:
+                if model is not None:
+                    model.close()
+                if os.path.exists(tmp_cfg_path):
+                    os.unlink(tmp_cfg_path)
+
+            for subset in report["subsets"]:
+                self.add_log(task_id, "INFO",
+                             f"{subset['snr']} / {subset['cm']}: 准确率 {subset['acc']:.2f}%，"
+                             f"macro_f1 {subset['macro_f1']:.4f}，mAP {subset['mAP']:.4f}")
+            latency = report["latency_ms"]
+            stats = {
+                "run_id": report.get("run_id"),
+                "store_path": request.store_path,
+                "samples": report["samples"],
+                "acc": report["acc"],
+                "throughput": report["throughput"],
+                "latency_ms": latency,
+                "duration_s": report["duration_s"],
+                "subsets": len(report["subsets"]),
+            }
+            message = (f"benchmark完成: 准确率 {report['acc']:.2f}%，吞吐 {report['throughput']} 张/秒，"
+                       f"延迟 p50 {latency['p50']} ms / p99 {latency['p99']} ms")
+            # 未指定结果库 (store_path 为空) 时不写入记录，没有记录ID
+            if report.get("run_id") is not None:
+                message += f"，记录ID {report['run_id']}"
+            self.update_task_status(task_id, "completed", message, 100, stats=stats)
+            self.add_log(task_id, "INFO", message)
+            logger.info(f"benchmark任务 {task_id} 完成")
+
+        except Exception as e:
+            error_msg = f"benchmark失败: {str(e)}"
+            logger.error(f"benchmark任务 {task_id} 失败: {error_msg}\n{traceback.format_exc()}")
+            self.update_task_status(task_id, "failed", error_msg, 0)
+            self.add_log(task_id, "ERROR", error_msg)
+        finally:
+            if actual_device is not None:
+                resource_manager.release(actual_device, "inference", task_id)
+
+    @staticmethod
+    def _store(store_path: str) -> BenchmarkStore:
+        if not os.path.exists(store_path):
+            raise FileNotFoundError(f"benchmark 结果库不存在: {store_path}")
+        return BenchmarkStore(store_path)
+
+    def list_runs(self, store_path: str, model: Optional[str] = None, weight_hash: Optional[str] = None,
+                  name: Optional[str] = None, limit: int = 100, offset: int = 0) -> List[Dict[str, Any]]:
+        """按模型/权重哈希/名称列出 benchmark 记录，最新的在前"""
+        return self._store(store_path).runs(model=model, weight_hash=weight_hash, name=name, limit=limit,
+                                            offset=offset)
+
+    def get_run(self, store_path: str, run_id: int) -> Dict[str, Any]:
+        """单条 benchmark 记录（含各子集指标与完整报告）"""
+        run = self._store(store_path).get(run_id)
+        if run is None:
+            raise KeyError(f"benchmark 记录不存在: {run_id}")
+        return run
+
+    def delete_run(self, store_path: str, run_id: int) -> bool:
+        return self._store(store_path).delete(run_id)
+
+    def compare_runs(self, store_path: str, baseline: int, candidate: int, **thresholds) -> Dict[str, Any]:
+        """对比候选记录与基线记录，标记超出阈值的精度/吞吐/延迟退化"""
+        return self._store(store_path).compare(baseline, candidate, **thresholds)
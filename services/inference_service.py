@@ -7,9 +7,9 @@ from fastapi import BackgroundTasks
 from typing import List
 
 from services.base_service import BaseService
-from models.schemas import InferenceRequest, BatchInferenceRequest
+from models.schemas import InferenceRequest, BatchInferenceRequest, TwoStageInferenceRequest
 from core.resource_manager import resource_manager
-from utils.benchmark import Classify_Model
+from utils.benchmark import Classify_Model, TwoStagePipeline
 
 logger = logging.getLogger(__name__)
 
@@ -64,6 +64,8 @@ class InferenceService(BaseService):
                 save_path=f"{request.save_base_path}/{idx}" if request.save_base_path else None,
                 device=request.device,
                 priority=request.priority,
+                energy_gate=request.energy_gate,
+                gate_threshold_db=request.gate_threshold_db,
                 task_id=None  # 自动生成
             )
             
@@ -95,14 +97,20 @@ class InferenceService(BaseService):
             with open(request.cfg_path, 'r', encoding='utf-8') as f:
                 cfg = yaml.safe_load(f)
             cfg['device'] = actual_device  # 使用实际分配的设备
+            if request.energy_gate:
+                cfg['energy_gate'] = True
+                cfg['gate_threshold_db'] = request.gate_threshold_db
+                self.add_log(task_id, "INFO", f"能量预检测已启用，门限: {request.gate_threshold_db} dB")
             
             with tempfile.NamedTemporaryFile(mode='w', suffix='.yaml', delete=False, encoding='utf-8') as tmp_cfg:
                 yaml.dump(cfg, tmp_cfg, allow_unicode=True)
                 tmp_cfg_path = tmp_cfg.name
             
+            model = None
             try:
                 self.add_log(task_id, "INFO", f"加载模型: {request.weight_path}")
-                model = Classify_Model(cfg=tmp_cfg_path, weight_path=request.weight_path)
+                model = Classify_Model(cfg=tmp_cfg_path, weight_path=request.weight_path,
+                                       annotation=request.annotation)
                 
                 self.add_log(task_id, "INFO", f"推理数据: {request.source_path}")
                 base_save = request.save_path if request.save_path else "./results/"
@@ -114,11 +122,22 @@ class InferenceService(BaseService):
                     save_path=final_save_path
                 )
                 
+                if model.gate is not None:
+                    gate_stats = model.gate.stats
+                    self.update_task_status(task_id, "running", progress=100, stats={"energy_gate": gate_stats})
+                    self.add_log(
+                        task_id, "INFO",
+                        f"能量预检测: 共{gate_stats['windows']}个窗口，跳过无信号窗口{gate_stats['gated']}个，"
+                        f"命中率 {gate_stats['hit_rate'] * 100:.1f}%"
+                    )
+
                 self.update_task_status(task_id, "completed", "推理完成", 100)
                 self.add_log(task_id, "INFO", "推理完成！")
                 logger.info(f"推理任务 {task_id} 完成")
                 
             finally:
+                if model is not None:
+                    model.close()
                 if os.path.exists(tmp_cfg_path):
                     os.unlink(tmp_cfg_path)
             
@@ -130,4 +149,99 @@ class InferenceService(BaseService):
         finally:
             actual_device = self.get_task(task_id).get("device", device)
             resource_manager.release(actual_device, "inference", task_id)
-
+    
+    async def start_two_stage(
+        self,
+        request: TwoStageInferenceRequest,
+        background_tasks: BackgroundTasks
+    ) -> str:
+        task_id = self.generate_task_id(request.task_id)
+        
+        for path in (request.detector.weight_path, request.classifier.weight_path,
+                     request.classifier.cfg, request.target_dir):
+            if not os.path.exists(path):
+                raise FileNotFoundError(f"路径不存在: {path}")
+        
+        self.update_task_status(
+            task_id,
+            "pending",
+            "等待开始",
+            0,
+            task_type="two_stage_inference",
+            device=request.device,
+            priority=request.priority
+        )
+        
+        background_tasks.add_task(self._two_stage_worker, task_id, request)
+        
+        logger.info(f"两阶段推理任务已创建: {task_id}")
+        return task_id
+    
+    def _two_stage_worker(self, task_id: str, request: TwoStageInferenceRequest):
+        device = request.device
+        
+        try:
+            self.create_log_queue(task_id)
+            
+            self.update_task_status(task_id, "queued", "等待资源...", 0)
+            self.add_log(task_id, "INFO", f"等待{device.upper()}资源...")
+            
+            import threading
+            while not resource_manager.can_allocate(device, "inference"):
+                threading.Event().wait(1)
+            
+            actual_device = resource_manager.allocate(device, "inference", task_id)
+            self.update_task_status(task_id, "running", "推理中...", 0, device=actual_device)
+            self.add_log(task_id, "INFO", f"资源已分配，使用设备: {actual_device}")
+            
+            with open(request.classifier.cfg, 'r', encoding='utf-8') as f:
+                cfg = yaml.safe_load(f)
+            cfg['device'] = actual_device
+            
+            with tempfile.NamedTemporaryFile(mode='w', suffix='.yaml', delete=False, encoding='utf-8') as tmp_cfg:
+                yaml.dump(cfg, tmp_cfg, allow_unicode=True)
+                tmp_cfg_path = tmp_cfg.name
+            
+            try:
+                self.add_log(task_id, "INFO", f"加载检测模型: {request.detector.weight_path}")
+                self.add_log(task_id, "INFO", f"加载分类模型: {request.classifier.weight_path}")
+                pipeline = TwoStagePipeline(
+                    detector_cfg=request.detector.model_dump(),
+                    classifier_cfg=tmp_cfg_path,
+                    classifier_weight=request.classifier.weight_path,
+                    device=actual_device,
+                    imgsz=request.imgsz,
+                    conf_thres=request.conf_thres,
+                    iou_thres=request.iou_thres,
+                    batch_size=request.batch_size
+                )
+                
+                self.add_log(task_id, "INFO", f"推理数据: {request.target_dir}")
+                results = pipeline.run(request.target_dir, save_dir=request.save_dir)
+                
+                class_counts = {}
+                for boxes in results.values():
+                    for box in boxes:
+                        class_counts[box['class']] = class_counts.get(box['class'], 0) + 1
+                stats = {
+                    "images": len(results),
+                    "boxes": sum(class_counts.values()),
+                    "classes": class_counts
+                }
+                
+                self.update_task_status(task_id, "completed", "推理完成", 100, stats=stats, results=results)
+                self.add_log(task_id, "INFO", f"推理完成！图像: {stats['images']}，目标: {stats['boxes']}")
+                logger.info(f"两阶段推理任务 {task_id} 完成")
+                
+            finally:
+                if os.path.exists(tmp_cfg_path):
+                    os.unlink(tmp_cfg_path)
+            
+        except Exception as e:
+            error_msg = f"推理失败: {str(e)}"
+            logger.error(f"两阶段推理任务 {task_id} 失败: {error_msg}\n{traceback.format_exc()}")
+            self.update_task_status(task_id, "failed", error_msg, 0)
+            self.add_log(task_id, "ERROR", error_msg)
+        finally:
+            actual_device = self.get_task(task_id).get("device", device)
+            resource_manager.release(actual_device, "inference", task_id)
@@ -1,19 +1,30 @@
 import logging
 import os
 import traceback
-import shutil
-import random
 from fastapi import BackgroundTasks
-from typing import List, Optional
-import albumentations as A
-import cv2
+from typing import Optional, Dict, Any
+import csv
+import json
+import time
+import numpy as np
 
 from services.base_service import BaseService
 from models.schemas import (
     DatasetSplitRequest,
     DataAugmentationRequest,
-    ImageCropRequest
+    ImageCropRequest,
+    SNREstimationRequest,
+    ShardPackRequest,
+    CatalogScanRequest,
+    CatalogExportRequest,
+    SignalMixingRequest
 )
+from SNREstimation.SNR_estimation import snr_timeline, snr_buckets
+from utils.manifest import split_dataset, SPLIT_MODES
+from utils.preprocessor import AUGMENTATION_METHODS, augment_images, crop_images, write_crop_manifest
+from utils.shards import pack_shards, pack_detection_shards
+from utils.catalog import IQCatalog, CATALOG_NAME
+from utils.mixing import MixingEngine
 
 logger = logging.getLogger(__name__)
 
@@ -32,6 +43,8 @@ class PreprocessingService(BaseService):
         
         if not os.path.exists(request.input_path):
             raise FileNotFoundError(f"输入路径不存在: {request.input_path}")
+        if request.mode not in SPLIT_MODES:
+            raise ValueError(f"不支持的分割方式: {request.mode}，可选: {list(SPLIT_MODES)}")
         
         self.update_task_status(
             task_id,
@@ -39,6 +52,7 @@ class PreprocessingService(BaseService):
             "等待开始",
             0,
             task_type="dataset_split",
+            mode=request.mode,
             input_path=request.input_path,
             output_path=request.output_path,
             train_ratio=request.train_ratio,
@@ -57,114 +71,35 @@ class PreprocessingService(BaseService):
             self.create_log_queue(task_id)
             
             self.update_task_status(task_id, "running", "正在分割数据集...", 0)
-            self.add_log(task_id, "INFO", f"开始分割数据集: {request.input_path}")
+            self.add_log(task_id, "INFO", f"开始分割数据集: {request.input_path}，分割方式: {request.mode}")
             
             if not os.path.exists(request.output_path):
                 os.makedirs(request.output_path)
                 self.add_log(task_id, "INFO", f"创建输出目录: {request.output_path}")
 
-            stats = {
-                "total_images": 0,
-                "train_images": 0,
-                "val_images": 0,
-                "test_images": 0,
-                "classes": []
-            }
-            
-            classes = [d for d in os.listdir(request.input_path) 
-                      if os.path.isdir(os.path.join(request.input_path, d))]
-            stats["classes"] = classes
-            
-            self.add_log(task_id, "INFO", f"检测到 {len(classes)} 个类别")
-            
-            for idx, drone_type in enumerate(classes):
-                train_path = os.path.join(os.path.join(request.output_path, 'train'), drone_type)
-                val_path = os.path.join(os.path.join(request.output_path, 'valid'), drone_type)
-                
-                os.makedirs(train_path, exist_ok=True)
-                os.makedirs(val_path, exist_ok=True)
-                
-                # 如果需要test集，这个接口不用但先保留
-                if request.val_ratio:
-                    test_path = os.path.join(os.path.join(request.output_path, 'test'), drone_type)
-                    os.makedirs(test_path, exist_ok=True)
-                
-                # 获取图像文件
-                class_path = os.path.join(request.input_path, drone_type)
-                image_files = [f for f in os.listdir(class_path) 
-                             if f.lower().endswith(('.png', '.jpg', '.jpeg', '.bmp'))]
-                
-                # 打乱
-                random.shuffle(image_files)
-                
-                # 计算分割点
-                total = len(image_files)
-                stats["total_images"] += total
-                
-                # 不用，但先保留
-                if request.val_ratio:
-                    num_train = int(total * request.train_ratio)
-                    num_val = int(total * request.val_ratio)
-                    
-                    train_files = image_files[:num_train]
-                    val_files = image_files[num_train:num_train+num_val]
-                    test_files = image_files[num_train+num_val:]
-                    
-                    stats["train_images"] += len(train_files)
-                    stats["val_images"] += len(val_files)
-                    stats["test_images"] += len(test_files)
-                    
-                    # 复制文件
-                    for img in train_files:
-                        shutil.copy(
-                            os.path.join(class_path, img),
-                            os.path.join(train_path, img)
-                        )
-                    
-                    for img in val_files:
-                        shutil.copy(
-                            os.path.join(class_path, img),
-                            os.path.join(val_path, img)
-                        )
-                    
-                    for img in test_files:
-                        shutil.copy(
-                            os.path.join(class_path, img),
-                            os.path.join(test_path, img)
-                        )
-                    
-                    self.add_log(
-                        task_id, "INFO",
-                        f"{drone_type}: {len(train_files)} train, {len(val_files)} val, {len(test_files)} test"
-                    )
-                else:
-                    num_train = int(total * request.train_ratio)
-                    
-                    train_files = image_files[:num_train]
-                    val_files = image_files[num_train:]
-                    
-                    stats["train_images"] += len(train_files)
-                    stats["val_images"] += len(val_files)
-                    
-                    for img in train_files:
-                        shutil.copy(
-                            os.path.join(class_path, img),
-                            os.path.join(train_path, img)
-                        )
-                    
-                    for img in val_files:
-                        shutil.copy(
-                            os.path.join(class_path, img),
-                            os.path.join(val_path, img)
-                        )
-                    
-                    self.add_log(
-                        task_id, "INFO",
-                        f"{drone_type}: {len(train_files)} train, {len(val_files)} val"
-                    )
-                
-                progress = int(((idx + 1) / len(classes)) * 100)
-                self.update_task_status(task_id, "running", f"处理中 ({idx+1}/{len(classes)})", progress)
+            def on_class_done(drone_type, counts, idx, num_classes):
+                self.add_log(task_id, "INFO", f"{drone_type}: " + ", ".join(
+                    f"{n} {'val' if subset == 'valid' else subset}" for subset, n in counts.items()))
+                progress = int(((idx + 1) / num_classes) * 100)
+                self.update_task_status(task_id, "running", f"处理中 ({idx+1}/{num_classes})", progress)
+
+            start = time.time()
+            stats = split_dataset(
+                request.input_path,
+                request.output_path,
+                train_ratio=request.train_ratio,
+                val_ratio=request.val_ratio,
+                mode=request.mode,
+                seed=request.seed,
+                callback=on_class_done
+            )
+            stats["duration_s"] = round(time.time() - start, 2)
+            self.add_log(task_id, "INFO", f"检测到 {len(stats['classes'])} 个类别")
+            if stats["manifests"]:
+                self.add_log(task_id, "INFO", f"分割清单: {stats['manifests']}（可直接作为训练集/验证集路径）")
+            if stats["fallback_copies"]:
+                self.add_log(task_id, "WARNING",
+                             f"{stats['fallback_copies']} 个文件无法以 {request.mode} 方式链接，已改为复制")
             
             self.update_task_status(task_id, "completed", "数据集分割完成", 100, stats=stats)
             self.add_log(task_id, "INFO", f"分割完成！总计 {stats['total_images']} 张图像")
@@ -228,112 +163,48 @@ class PreprocessingService(BaseService):
             # 准备增强方法
             if request.methods is None or len(request.methods) == 0:
                 # 使用默认方法
-                methods = self._get_default_augmentation_methods()
-                self.add_log(task_id, "INFO", "使用默认增强方法（6种）")
+                methods = list(AUGMENTATION_METHODS)
+                self.add_log(task_id, "INFO", f"使用默认增强方法（{len(methods)}种）")
             else:
-                methods = self._get_augmentation_methods(request.methods)
-                self.add_log(task_id, "INFO", f"使用指定增强方法: {', '.join(request.methods)}")
-            
-            # 统计信息
-            stats = {
-                "original_images": 0,
-                "augmented_images": 0,
-                "methods_used": len(methods),
-                "classes": []
-            }
-            
-            # 处理train和valid文件夹
-            total_paths = []
-            for subset in ['train', 'valid']:
-                subset_path = os.path.join(request.dataset_path, subset)
-                if os.path.exists(subset_path):
-                    total_paths.append(subset_path)
-            
-            if len(total_paths) == 0:
+                methods = [name for name in request.methods if name in AUGMENTATION_METHODS]
+                for name in set(request.methods) - set(methods):
+                    logger.warning(f"未知的增强方法: {name}")
+                    self.add_log(task_id, "WARNING", f"未知的增强方法: {name}")
+                methods = methods or list(AUGMENTATION_METHODS)
+                self.add_log(task_id, "INFO", f"使用指定增强方法: {', '.join(methods)}")
+            
+            subsets = [s for s in ['train', 'valid'] if os.path.exists(os.path.join(request.dataset_path, s))]
+            if len(subsets) == 0:
                 raise FileNotFoundError("未找到train或valid文件夹")
             
-            self.add_log(task_id, "INFO", f"找到 {len(total_paths)} 个数据子集")
+            self.add_log(task_id, "INFO", f"找到 {len(subsets)} 个数据子集")
             
-            total_progress = 0
-            for path_idx, path in enumerate(total_paths):
-                # 创建输出子目录
-                subset_name = os.path.basename(path)
-                output_subset = os.path.join(output_path, subset_name)
-                if not os.path.exists(output_subset):
-                    os.makedirs(output_subset)
-                
-                # 获取所有类别
-                classes = [d for d in os.listdir(path) 
-                          if os.path.isdir(os.path.join(path, d))]
-                
-                if path_idx == 0:
-                    stats["classes"] = classes
-                
-                self.add_log(task_id, "INFO", f"{subset_name}: {len(classes)} 个类别")
-                
-                for class_idx, _class in enumerate(classes):
-                    # 创建类别输出目录
-                    _save_path = os.path.join(output_subset, _class)
-                    if not os.path.exists(_save_path):
-                        os.makedirs(_save_path)
-                    
-                    # 获取图像
-                    class_path = os.path.join(path, _class)
-                    images = [f for f in os.listdir(class_path) 
-                             if f.lower().endswith(('.png', '.jpg', '.jpeg', '.bmp'))]
-                    
-                    stats["original_images"] += len(images)
-                    
-                    # 对每种方法进行增强
-                    for method_idx, method in enumerate(methods):
-                        for img_name in images:
-                            try:
-                                # 读取原图
-                                img_path = os.path.join(class_path, img_name)
-                                original_image = cv2.imread(img_path)
-                                
-                                if original_image is None:
-                                    self.add_log(task_id, "WARNING", f"无法读取图像: {img_name}")
-                                    continue
-                                
-                                # 应用增强
-                                transform = A.Compose([method])
-                                augmented = transform(image=original_image)
-                                
-                                # 保存增强后的图像
-                                base_name = os.path.splitext(img_name)[0]
-                                ext = os.path.splitext(img_name)[1]
-                                aug_name = f"{base_name}_AugM{method_idx}{ext}"
-                                cv2.imwrite(os.path.join(_save_path, aug_name), augmented['image'])
-                                
-                                # 同时保存原图
-                                orig_name = f"{base_name}_origin{ext}"
-                                cv2.imwrite(os.path.join(_save_path, orig_name), original_image)
-                                
-                                stats["augmented_images"] += 1
-                                
-                            except Exception as e:
-                                self.add_log(task_id, "ERROR", f"增强失败 {img_name}: {str(e)}")
-                    
-                    self.add_log(task_id, "INFO", f"完成增强: {_class} ({len(images)} 张)")
-                    
-                    # 更新进度
-                    total_classes = sum(len([d for d in os.listdir(p) 
-                                           if os.path.isdir(os.path.join(p, d))]) 
-                                       for p in total_paths)
-                    total_progress += 1
-                    progress = int((total_progress / total_classes) * 100)
-                    self.update_task_status(
-                        task_id, "running",
-                        f"处理中 ({total_progress}/{total_classes})",
-                        progress
-                    )
+            def on_chunk_done(done, total, result):
+                for error in result["errors"]:
+                    self.add_log(task_id, "WARNING", f"增强失败: {error}")
+                progress = int(done / total * 100)
+                self.update_task_status(task_id, "running", f"处理中 ({done}/{total})", min(progress, 99))
+            
+            stats = augment_images(
+                request.dataset_path,
+                output_path,
+                methods,
+                subsets=subsets,
+                workers=request.num_workers,
+                chunk_size=request.chunk_size,
+                callback=on_chunk_done
+            )
+            for worker in stats["workers"]:
+                self.add_log(task_id, "INFO",
+                             f"工作进程 {worker['pid']}: {worker['images']} 张，{worker['images_per_s']} 张/秒")
             
             # 完成
             self.update_task_status(task_id, "completed", "数据增强完成", 100, stats=stats)
             self.add_log(task_id, "INFO", f"增强完成！")
             self.add_log(task_id, "INFO", f"原始图像: {stats['original_images']}")
             self.add_log(task_id, "INFO", f"增强图像: {stats['augmented_images']}")
+            self.add_log(task_id, "INFO",
+                         f"耗时: {stats['duration_s']}s，吞吐: {stats['images_per_s']} 张/秒（{len(stats['workers'])} 个进程）")
             self.add_log(task_id, "INFO", f"输出路径: {output_path}")
             
             logger.info(f"任务 {task_id} 数据增强完成")
@@ -353,6 +224,8 @@ class PreprocessingService(BaseService):
         
         if not os.path.exists(request.input_path):
             raise FileNotFoundError(f"输入路径不存在: {request.input_path}")
+        if request.mode not in ("write", "virtual"):
+            raise ValueError(f"不支持的裁剪方式: {request.mode}，可选: write / virtual")
         
         self.update_task_status(
             task_id,
@@ -360,6 +233,7 @@ class PreprocessingService(BaseService):
             "等待开始",
             0,
             task_type="image_crop",
+            mode=request.mode,
             input_path=request.input_path,
             output_path=request.output_path,
             crop_params={"x": request.x, "y": request.y, "width": request.width, "height": request.height}
@@ -376,64 +250,43 @@ class PreprocessingService(BaseService):
             
             self.update_task_status(task_id, "running", "正在裁剪图像...", 0)
             self.add_log(task_id, "INFO", f"开始裁剪: {request.input_path}")
-            self.add_log(task_id, "INFO", f"裁剪区域: ({request.x}, {request.y}, {request.width}, {request.height})")
+            self.add_log(task_id, "INFO", f"裁剪区域: ({request.x}, {request.y}, {request.width}, {request.height})，"
+                                          f"方式: {request.mode}")
             
             if not os.path.exists(request.output_path):
                 os.makedirs(request.output_path)
             
-            stats = {"total_images": 0, "success": 0, "failed": 0}
-            
-            if os.path.isfile(request.input_path):
-                try:
-                    img = cv2.imread(request.input_path)
-                    if img is None:
-                        raise ValueError("无法读取图像")
-                    
-                    cropped = img[request.y:request.y+request.height, 
-                                 request.x:request.x+request.width]
-                    
-                    output_file = os.path.join(request.output_path, os.path.basename(request.input_path))
-                    cv2.imwrite(output_file, cropped)
-                    
-                    stats["total_images"] = 1
-                    stats["success"] = 1
-                    self.add_log(task_id, "INFO", f"裁剪完成: {os.path.basename(request.input_path)}")
-                except Exception as e:
-                    stats["failed"] = 1
-                    self.add_log(task_id, "ERROR", f"裁剪失败: {str(e)}")
-            
+            box = (request.x, request.y, request.width, request.height)
+            if request.mode == "virtual":
+                manifest = write_crop_manifest(request.input_path, request.output_path, box)
+                with open(manifest, encoding="utf-8") as f:
+                    total = len(json.load(f)["samples"])
+                stats = {"total_images": total, "success": total, "failed": 0, "manifest": manifest}
+                self.add_log(task_id, "INFO", f"虚拟裁剪清单: {manifest}（加载时裁剪，可直接作为训练集/验证集路径）")
             else:
-                for root, dirs, files in os.walk(request.input_path):
-                    for file in files:
-                        if file.lower().endswith(('.png', '.jpg', '.jpeg', '.bmp')):
-                            try:
-                                input_file = os.path.join(root, file)
-                                
-                                rel_path = os.path.relpath(root, request.input_path)
-                                output_dir = os.path.join(request.output_path, rel_path)
-                                if not os.path.exists(output_dir):
-                                    os.makedirs(output_dir)
-                                
-                                img = cv2.imread(input_file)
-                                if img is None:
-                                    stats["failed"] += 1
-                                    continue
-                                
-                                cropped = img[request.y:request.y+request.height, 
-                                            request.x:request.x+request.width]
-                                
-                                output_file = os.path.join(output_dir, file)
-                                cv2.imwrite(output_file, cropped)
-                                
-                                stats["total_images"] += 1
-                                stats["success"] += 1
-                                
-                                if stats["total_images"] % 10 == 0:
-                                    self.add_log(task_id, "INFO", f"已处理 {stats['total_images']} 张图像")
-                                
-                            except Exception as e:
-                                stats["failed"] += 1
-                                self.add_log(task_id, "ERROR", f"处理失败 {file}: {str(e)}")
+                logged = [0]
+
+                def on_chunk_done(done, total, result):
+                    for error in result["errors"]:
+                        self.add_log(task_id, "ERROR", f"处理失败 {error}")
+                    progress = int(done / total * 100)
+                    self.update_task_status(task_id, "running", f"处理中 ({done}/{total})", min(progress, 99))
+                    # 每10%记录一次日志
+                    if progress // 10 > logged[0]:
+                        logged[0] = progress // 10
+                        self.add_log(task_id, "INFO", f"已处理 {done}/{total} 张图像")
+
+                stats = crop_images(
+                    request.input_path,
+                    request.output_path,
+                    box,
+                    workers=request.num_workers,
+                    lossless=request.lossless,
+                    callback=on_chunk_done
+                )
+                if stats["lossless"]:
+                    self.add_log(task_id, "INFO", f"{stats['lossless']} 张JPEG图像以无损方式裁剪（无需解码）")
+                self.add_log(task_id, "INFO", f"耗时: {stats['duration_s']}s，吞吐: {stats['images_per_s']} 张/秒")
             
             # 完成
             self.update_task_status(task_id, "completed", "裁剪完成", 100, stats=stats)
@@ -448,59 +301,414 @@ class PreprocessingService(BaseService):
             self.update_task_status(task_id, "failed", error_msg, 0)
             self.add_log(task_id, "ERROR", error_msg)
     
-    def _get_default_augmentation_methods(self) -> List:
-        return [
-            A.AdvancedBlur(
-                blur_limit=(7, 13),
-                sigma_x_limit=(7, 13),
-                sigma_y_limit=(7, 13),
-                rotate_limit=(-90, 90),
-                beta_limit=(0.5, 8),
-                noise_limit=(2, 10),
-                p=1),
-            A.CLAHE(
-                clip_limit=3,
-                tile_grid_size=(13, 13),
-                p=1),
-            A.ColorJitter(
-                brightness=(0.5, 1.5),
-                contrast=(1, 1),
-                saturation=(1, 1),
-                hue=(-0, 0),
-                p=1),
-            A.GaussNoise(
-                var_limit=(100, 500),
-                mean=0,
-                p=1),
-            A.ISONoise(
-                intensity=(0.2, 0.5),
-                color_shift=(0.01, 0.05),
-                p=1),
-            A.Sharpen(
-                alpha=(0.2, 0.5),
-                lightness=(0.5, 1),
-                p=1)
-        ]
+    async def pack_shards(
+        self,
+        request: ShardPackRequest,
+        background_tasks: BackgroundTasks
+    ) -> str:
+        task_id = self.generate_task_id(request.task_id)
+        
+        if not os.path.exists(request.input_path):
+            raise FileNotFoundError(f"输入路径不存在: {request.input_path}")
+        if request.task not in ("classify", "detect"):
+            raise ValueError(f"不支持的数据集类型: {request.task}，可选: classify / detect")
+        
+        self.update_task_status(
+            task_id,
+            "pending",
+            "等待开始",
+            0,
+            task_type="shard_pack",
+            input_path=request.input_path,
+            output_path=request.output_path
+        )
+        
+        background_tasks.add_task(self._pack_worker, task_id, request)
+        
+        logger.info(f"分片打包任务已创建: {task_id}")
+        return task_id
+    
+    def _pack_worker(self, task_id: str, request: ShardPackRequest):
+        try:
+            self.create_log_queue(task_id)
+            
+            self.update_task_status(task_id, "running", "正在打包分片...", 0)
+            self.add_log(task_id, "INFO", f"开始打包: {request.input_path} -> {request.output_path}，"
+                                          f"分片大小: {request.shard_size_mb}MB")
+            start = time.time()
+            logged = [0]
+
+            def on_sample_done(done, total, num_shards):
+                progress = int(done / total * 100)
+                # 每10%更新一次状态与日志
+                if progress // 10 > logged[0]:
+                    logged[0] = progress // 10
+                    self.update_task_status(task_id, "running", f"打包中 ({done}/{total})", min(progress, 99))
+                    self.add_log(task_id, "INFO", f"已打包 {done}/{total} 张图像，{num_shards} 个分片")
+
+            if request.task == "detect":
+                stats = pack_detection_shards(request.input_path, request.output_path, request.shard_size_mb,
+                                              callback=on_sample_done)
+            else:
+                stats = pack_shards(request.input_path, request.output_path, request.shard_size_mb,
+                                    shuffle=request.shuffle, seed=request.seed, callback=on_sample_done)
+            stats["duration_s"] = round(time.time() - start, 2)
+            
+            self.update_task_status(task_id, "completed", "打包完成", 100, stats=stats)
+            self.add_log(task_id, "INFO", f"打包完成！{stats['samples']} 张图像写入 {stats['shards']} 个分片，"
+                                          f"共 {stats['bytes'] / (1 << 20):.1f}MB，耗时 {stats['duration_s']}s")
+            self.add_log(task_id, "INFO", f"索引: {stats['index']}（分片目录可直接作为训练集/验证集/benchmark路径）")
+            
+            logger.info(f"任务 {task_id} 分片打包完成")
+            
+        except Exception as e:
+            error_msg = f"打包失败: {str(e)}"
+            logger.error(f"任务 {task_id} 失败: {error_msg}\n{traceback.format_exc()}")
+            self.update_task_status(task_id, "failed", error_msg, 0)
+            self.add_log(task_id, "ERROR", error_msg)
+    
+    async def scan_catalog(
+        self,
+        request: CatalogScanRequest,
+        background_tasks: BackgroundTasks
+    ) -> str:
+        task_id = self.generate_task_id(request.task_id)
+        
+        if not os.path.isdir(request.data_path):
+            raise FileNotFoundError(f"原始数据目录不存在: {request.data_path}")
+        db_path = request.db_path or os.path.join(request.data_path, CATALOG_NAME)
+        
+        self.update_task_status(
+            task_id,
+            "pending",
+            "等待开始",
+            0,
+            task_type="catalog_scan",
+            input_path=request.data_path,
+            output_path=db_path
+        )
+        
+        background_tasks.add_task(self._catalog_scan_worker, task_id, request, db_path)
+        
+        logger.info(f"数据索引任务已创建: {task_id}")
+        return task_id
+    
+    def _catalog_scan_worker(self, task_id: str, request: CatalogScanRequest, db_path: str):
+        try:
+            self.create_log_queue(task_id)
+            
+            self.update_task_status(task_id, "running", "正在建立索引...", 0)
+            self.add_log(task_id, "INFO", f"开始扫描: {request.data_path}，索引: {db_path}")
+            
+            catalog = IQCatalog(db_path)
+            
+            def on_capture_done(done, total, path, num_slices):
+                if num_slices is not None:
+                    self.add_log(task_id, "INFO", f"{os.path.basename(path)}: {num_slices} 个切片")
+                progress = int(done / total * 100)
+                self.update_task_status(task_id, "running", f"处理中 ({done}/{total})", min(progress, 99))
+            
+            stats = catalog.scan(
+                request.data_path,
+                fs=request.sample_rate,
+                duration_time=request.duration_time,
+                step_time=request.step_time,
+                file_type=request.file_type,
+                nperseg=request.nperseg,
+                noise_quantile=request.noise_quantile,
+                edges=sorted(request.buckets),
+                rescan=request.rescan,
+                callback=on_capture_done
+            )
+            for error in stats["errors"]:
+                self.add_log(task_id, "ERROR", f"处理失败 {error}")
+            stats["removed"] = catalog.prune()
+            stats["db_path"] = catalog.db_path
+            stats["labels"] = catalog.count()
+            
+            self.update_task_status(task_id, "completed", "索引完成", 100, stats=stats)
+            self.add_log(task_id, "INFO", f"索引完成！扫描 {stats['scanned']} 个数据包（{stats['slices']} 个切片），"
+                                          f"未变化跳过 {stats['skipped']} 个，失败 {stats['failed']} 个，"
+                                          f"耗时 {stats['duration_s']}s")
+            
+            logger.info(f"任务 {task_id} 数据索引完成")
+            
+        except Exception as e:
+            error_msg = f"索引失败: {str(e)}"
+            logger.error(f"任务 {task_id} 失败: {error_msg}\n{traceback.format_exc()}")
+            self.update_task_status(task_id, "failed", error_msg, 0)
+            self.add_log(task_id, "ERROR", error_msg)
     
-    def _get_augmentation_methods(self, method_names: List[str]) -> List:
-        methods = []
-        method_map = {
-            "AdvancedBlur": A.AdvancedBlur(
-                blur_limit=(7, 13), sigma_x_limit=(7, 13), sigma_y_limit=(7, 13),
-                rotate_limit=(-90, 90), beta_limit=(0.5, 8), noise_limit=(2, 10), p=1),
-            "CLAHE": A.CLAHE(clip_limit=3, tile_grid_size=(13, 13), p=1),
-            "ColorJitter": A.ColorJitter(brightness=(0.5, 1.5), contrast=(1, 1), 
-                                        saturation=(1, 1), hue=(-0, 0), p=1),
-            "GaussNoise": A.GaussNoise(var_limit=(100, 500), mean=0, p=1),
-            "ISONoise": A.ISONoise(intensity=(0.2, 0.5), color_shift=(0.01, 0.05), p=1),
-            "Sharpen": A.Sharpen(alpha=(0.2, 0.5), lightness=(0.5, 1), p=1)
+    def query_catalog(self, db_path: str, limit: int = 100, offset: int = 0, **filters) -> Dict[str, Any]:
+        """按类别/SNR查询索引，不读取原始数据"""
+        if not os.path.exists(db_path):
+            raise FileNotFoundError(f"索引不存在: {db_path}")
+        catalog = IQCatalog(db_path)
+        return {
+            "counts": catalog.count(**filters),
+            "slices": catalog.query(limit=limit, offset=offset, **filters)
         }
+    
+    async def export_catalog(
+        self,
+        request: CatalogExportRequest,
+        background_tasks: BackgroundTasks
+    ) -> str:
+        task_id = self.generate_task_id(request.task_id)
         
-        for name in method_names:
-            if name in method_map:
-                methods.append(method_map[name])
-            else:
-                logger.warning(f"未知的增强方法: {name}")
+        if not os.path.exists(request.db_path):
+            raise FileNotFoundError(f"索引不存在: {request.db_path}")
+        if request.layout not in ("class", "benchmark"):
+            raise ValueError(f"不支持的目录结构: {request.layout}，可选: class / benchmark")
+        
+        self.update_task_status(
+            task_id,
+            "pending",
+            "等待开始",
+            0,
+            task_type="catalog_export",
+            input_path=request.db_path,
+            output_path=request.output_path
+        )
+        
+        background_tasks.add_task(self._catalog_export_worker, task_id, request)
+        
+        logger.info(f"索引数据集生成任务已创建: {task_id}")
+        return task_id
+    
+    def _catalog_export_worker(self, task_id: str, request: CatalogExportRequest):
+        try:
+            self.create_log_queue(task_id)
+            
+            self.update_task_status(task_id, "running", "正在生成数据集...", 0)
+            filters = dict(label=request.labels, min_snr=request.min_snr, max_snr=request.max_snr,
+                           bucket=request.buckets, min_energy=request.min_energy)
+            catalog = IQCatalog(request.db_path)
+            counts = catalog.count(**filters)
+            total = sum(n for buckets in counts.values() for n in buckets.values())
+            self.add_log(task_id, "INFO", f"选中 {total} 个切片: {counts}")
+            
+            def on_capture_done(done, total_captures):
+                progress = int(done / total_captures * 100)
+                self.update_task_status(task_id, "running", f"渲染中 ({done}/{total_captures} 个数据包)",
+                                        min(progress, 99))
+            
+            stats = catalog.export(
+                request.output_path,
+                layout=request.layout,
+                group=request.group,
+                stft_point=request.stft_point,
+                size=(request.image_width, request.image_height),
+                workers=request.num_workers,
+                callback=on_capture_done,
+                **filters
+            )
+            for error in stats["errors"]:
+                self.add_log(task_id, "ERROR", f"处理失败 {error}")
+            stats["selected"] = counts
+            
+            self.update_task_status(task_id, "completed", "数据集生成完成", 100, stats=stats)
+            self.add_log(task_id, "INFO", f"数据集生成完成！{stats['images']} 张图像，来自 {stats['captures']} 个数据包，"
+                                          f"耗时 {stats['duration_s']}s")
+            
+            logger.info(f"任务 {task_id} 索引数据集生成完成")
+            
+        except Exception as e:
+            error_msg = f"数据集生成失败: {str(e)}"
+            logger.error(f"任务 {task_id} 失败: {error_msg}\n{traceback.format_exc()}")
+            self.update_task_status(task_id, "failed", error_msg, 0)
+            self.add_log(task_id, "ERROR", error_msg)
+    
+    async def mix_signals(
+        self,
+        request: SignalMixingRequest,
+        background_tasks: BackgroundTasks
+    ) -> str:
+        task_id = self.generate_task_id(request.task_id)
+        
+        for source in request.sources:
+            if not os.path.isfile(source.path):
+                raise FileNotFoundError(f"数据包不存在: {source.path}")
+        
+        self.update_task_status(
+            task_id,
+            "pending",
+            "等待开始",
+            0,
+            task_type="mixing",
+            input_path=request.sources[0].path,
+            output_path=request.output_path
+        )
+        
+        background_tasks.add_task(self._mixing_worker, task_id, request)
+        
+        logger.info(f"信号混合任务已创建: {task_id}")
+        return task_id
+    
+    def _mixing_worker(self, task_id: str, request: SignalMixingRequest):
+        try:
+            self.create_log_queue(task_id)
+            
+            self.update_task_status(task_id, "running", "正在混合信号...", 0)
+            engine = MixingEngine(
+                [source.model_dump() for source in request.sources],
+                fs=request.sample_rate,
+                duration_time=request.duration_time,
+                step_time=request.step_time,
+                awgn_snr_db=request.awgn_snr_db,
+                seed=request.seed
+            )
+            gains = ", ".join(f"{os.path.basename(s.path)}: {20 * np.log10(max(e['gain'], 1e-12)):.1f}dB"
+                              for s, e in zip(request.sources, engine.sources))
+            self.add_log(task_id, "INFO", f"混合 {len(request.sources)} 个信号源，共 {len(engine)} 个切片，增益: {gains}")
+            logged = [0]
+            
+            def on_chunk_done(done, total):
+                progress = int(done / total * 100)
+                self.update_task_status(task_id, "running", f"渲染中 ({done}/{total})", min(progress, 99))
+                # 每10%记录一次日志
+                if progress // 10 > logged[0]:
+                    logged[0] = progress // 10
+                    self.add_log(task_id, "INFO", f"已生成 {done}/{total} 张图像")
+            
+            stats = engine.render(
+                request.output_path,
+                name=request.name,
+                stft_point=request.stft_point,
+                size=(request.image_width, request.image_height),
+                workers=request.num_workers,
+                callback=on_chunk_done
+            )
+            for error in stats["errors"]:
+                self.add_log(task_id, "ERROR", f"处理失败 {error}")
+            
+            self.update_task_status(task_id, "completed", "信号混合完成", 100, stats=stats)
+            self.add_log(task_id, "INFO", f"信号混合完成！{stats['images']} 张图像，耗时 {stats['duration_s']}s，"
+                                          f"吞吐: {stats['slices_per_s']} 切片/秒")
+            
+            logger.info(f"任务 {task_id} 信号混合完成")
+            
+        except Exception as e:
+            error_msg = f"信号混合失败: {str(e)}"
+            logger.error(f"任务 {task_id} 失败: {error_msg}\n{traceback.format_exc()}")
+            self.update_task_status(task_id, "failed", error_msg, 0)
+            self.add_log(task_id, "ERROR", error_msg)
+    
+    async def estimate_snr(
+        self,
+        request: SNREstimationRequest,
+        background_tasks: BackgroundTasks
+    ) -> str:
+        task_id = self.generate_task_id(request.task_id)
         
-        return methods if methods else self._get_default_augmentation_methods()
+        if not os.path.exists(request.input_path):
+            raise FileNotFoundError(f"输入路径不存在: {request.input_path}")
+        
+        self.update_task_status(
+            task_id,
+            "pending",
+            "等待开始",
+            0,
+            task_type="snr_estimation",
+            input_path=request.input_path,
+            output_path=request.output_path
+        )
+        
+        background_tasks.add_task(self._snr_worker, task_id, request)
+        
+        logger.info(f"SNR估计任务已创建: {task_id}")
+        return task_id
+    
+    def _snr_worker(self, task_id: str, request: SNREstimationRequest):
+        try:
+            self.create_log_queue(task_id)
+            
+            self.update_task_status(task_id, "running", "正在估计SNR...", 0)
+            self.add_log(task_id, "INFO", f"开始估计SNR: {request.input_path}")
+            
+            os.makedirs(request.output_path, exist_ok=True)
+            
+            if os.path.isfile(request.input_path):
+                captures = [request.input_path]
+            else:
+                captures = sorted(
+                    os.path.join(root, f)
+                    for root, dirs, files in os.walk(request.input_path)
+                    for f in files if f.lower().endswith(('.iq', '.dat', '.bin'))
+                )
+            
+            self.add_log(task_id, "INFO", f"检测到 {len(captures)} 个数据包")
+            
+            buckets = sorted(request.buckets)
+            stats = {"total_captures": len(captures), "total_windows": 0, "failed": 0, "buckets": {}}
+            summary = {}
+            
+            for idx, capture in enumerate(captures):
+                try:
+                    start_time = time.time()
+                    timeline = snr_timeline(
+                        capture,
+                        fs=request.sample_rate,
+                        duration_time=request.duration_time,
+                        step_time=request.step_time,
+                        nperseg=request.nperseg,
+                        noise_quantile=request.noise_quantile,
+                        file_type=np.dtype(request.file_type)
+                    )
+                    snr = timeline["snr"]
+                    names = snr_buckets(snr, buckets)
+                    
+                    rel_name = os.path.splitext(os.path.relpath(capture, os.path.dirname(request.input_path)
+                                                                if os.path.isfile(request.input_path)
+                                                                else request.input_path))[0]
+                    csv_path = os.path.join(request.output_path, rel_name.replace(os.sep, '_') + '_snr.csv')
+                    with open(csv_path, 'w', newline='') as f:
+                        writer = csv.writer(f)
+                        writer.writerow(["time", "snr_db", "bucket"])
+                        writer.writerows(zip(np.round(timeline["time"], 6), np.round(snr, 3), names))
+                    
+                    counts = {}
+                    for name in names:
+                        counts[name] = counts.get(name, 0) + 1
+                        stats["buckets"][name] = stats["buckets"].get(name, 0) + 1
+                    stats["total_windows"] += len(snr)
+                    
+                    summary[capture] = {
+                        "windows": len(snr),
+                        "mean_snr": round(float(np.mean(snr)), 3) if len(snr) else None,
+                        "median_snr": round(float(np.median(snr)), 3) if len(snr) else None,
+                        "noise_floor_db": timeline["noise_floor_db"],
+                        "buckets": counts,
+                        "timeline": csv_path
+                    }
+                    self.add_log(
+                        task_id, "INFO",
+                        f"{os.path.basename(capture)}: {len(snr)} 个窗口，"
+                        f"耗时 {time.time() - start_time:.2f}s"
+                    )
+                    
+                except Exception as e:
+                    stats["failed"] += 1
+                    self.add_log(task_id, "ERROR", f"处理失败 {capture}: {str(e)}")
+                
+                progress = int((idx + 1) / max(len(captures), 1) * 100)
+                self.update_task_status(task_id, "running", f"处理中 ({idx + 1}/{len(captures)})", progress)
+            
+            summary_path = os.path.join(request.output_path, 'snr_summary.json')
+            with open(summary_path, 'w', encoding='utf-8') as f:
+                json.dump({"buckets": buckets, "captures": summary}, f, ensure_ascii=False, indent=2)
+            
+            # 完成
+            self.update_task_status(task_id, "completed", "SNR估计完成", 100, stats=stats)
+            self.add_log(task_id, "INFO", "SNR估计完成！")
+            self.add_log(task_id, "INFO", f"窗口总数: {stats['total_windows']}, 分桶: {stats['buckets']}")
+            self.add_log(task_id, "INFO", f"汇总文件: {summary_path}")
+            
+            logger.info(f"任务 {task_id} SNR估计完成")
+            
+        except Exception as e:
+            error_msg = f"SNR估计失败: {str(e)}"
+            logger.error(f"任务 {task_id} 失败: {error_msg}\n{traceback.format_exc()}")
+            self.update_task_status(task_id, "failed", error_msg, 0)
+            self.add_log(task_id, "ERROR", error_msg)
 
@@ -0,0 +1,285 @@
+"""
+超参数搜索服务
+"""
+import os
+import json
+import time
+import logging
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, List
+from fastapi import BackgroundTasks
+
+from services.base_service import BaseService
+from services.training_service import TrainingService
+from models.schemas import SweepRequest, TrainingRequest
+from core.resource_manager import resource_manager
+from core.config import settings
+from utils.trainer import Basetrainer, TrainingCancelled, MONITOR_METRICS
+from utils.sweep import sample_trials, ASHAScheduler, compute_saved
+
+logger = logging.getLogger(__name__)
+
+# 不允许出现在搜索空间中的字段
+FIXED_FIELDS = ("task_id", "save_path", "name", "num_epochs", "resume_from", "resume_task_id")
+
+
+class SweepService(BaseService):
+    """基于ASHA的超参数搜索服务，每个试验通过资源管理器调度，在档位epoch上提前终止表现较差的试验"""
+
+    async def start_sweep(
+        self,
+        request: SweepRequest,
+        background_tasks: BackgroundTasks
+    ) -> str:
+        task_id = self.generate_task_id(request.task_id)
+
+        if request.metric not in MONITOR_METRICS:
+            raise ValueError(f"不支持的调度指标: {request.metric}，可选: {list(MONITOR_METRICS)}")
+        invalid = [k for k in request.search_space
+                   if k not in TrainingRequest.model_fields or k in FIXED_FIELDS]
+        if invalid:
+            raise ValueError(f"搜索空间包含无效字段: {invalid}")
+
+        base = request.base
+        if not os.path.exists(base.train_path):
+            raise FileNotFoundError(f"训练集路径不存在: {base.train_path}")
+        if not os.path.exists(base.val_path):
+            raise FileNotFoundError(f"验证集路径不存在: {base.val_path}")
+
+        params_list = sample_trials(request.search_space, request.num_trials, request.seed)
+        trial_requests = [TrainingRequest(**{**base.model_dump(), **params}) for params in params_list]
+        for trial_request in trial_requests:
+            if trial_request.model not in settings.SUPPORTED_MODELS:
+                raise ValueError(f"不支持的模型: {trial_request.model}")
+            if trial_request.num_devices > 1:
+                raise ValueError("超参数搜索的试验仅支持单设备训练 (num_devices=1)")
+            if trial_request.teacher_weight:
+                raise ValueError("超参数搜索暂不支持蒸馏训练")
+
+        base_save = base.save_path if base.save_path else os.path.join("models", "output")
+        sweep_dir = os.path.join(base_save, base.name) if base.name else os.path.join(base_save, f"sweep_{task_id[:8]}")
+
+        trials = [
+            {
+                "trial_id": i,
+                "params": params,
+                "status": "pending",
+                "epochs_run": 0,
+                "history": [],
+                "best_value": None,
+                "save_path": os.path.join(sweep_dir, f"trial_{i:03d}"),
+            }
+            for i, params in enumerate(params_list)
+        ]
+
+        self.update_task_status(
+            task_id,
+            "pending",
+            "等待开始",
+            0,
+            task_type="sweep",
+            device=base.device,
+            priority=base.priority,
+            total_epochs=base.num_epochs,
+            save_path=sweep_dir,
+            trials=trials
+        )
+
+        background_tasks.add_task(self._sweep_worker, task_id, request, trial_requests, sweep_dir)
+
+        logger.info(f"超参数搜索任务已创建: {task_id}，共 {len(trials)} 个试验")
+        return task_id
+
+    def _sweep_worker(self, task_id: str, request: SweepRequest, trial_requests: List[TrainingRequest], sweep_dir: str):
+        self.create_log_queue(task_id)
+        max_epochs = request.base.num_epochs
+        _, mode = MONITOR_METRICS[request.metric]
+        scheduler = ASHAScheduler(max_epochs, request.min_epochs, request.reduction_factor, mode)
+        trials = self.get_task(task_id)["trials"]
+        start = time.time()
+
+        try:
+            os.makedirs(sweep_dir, exist_ok=True)
+            self.update_task_status(task_id, "running", "超参数搜索中...", 0)
+            self.add_log(task_id, "INFO",
+                         f"开始超参数搜索: {len(trials)} 个试验，档位: {sorted(scheduler.rungs)}，"
+                         f"保留比例: 1/{request.reduction_factor}，指标: {request.metric}")
+
+            with ThreadPoolExecutor(max_workers=request.max_concurrent_trials, thread_name_prefix='sweep') as pool:
+                for trial, trial_request in zip(trials, trial_requests):
+                    pool.submit(self._run_trial, task_id, trial, trial_request, scheduler, request.metric)
+
+            stats = self._summarize(trials, scheduler, request, time.time() - start)
+            with open(os.path.join(sweep_dir, "sweep_summary.json"), "w", encoding="utf-8") as f:
+                json.dump({"stats": stats, "trials": trials}, f, ensure_ascii=False, indent=2)
+
+            if self._is_cancelled(task_id):
+                self.update_task_status(task_id, "cancelled", "超参数搜索已被用户取消",
+                                        self.get_task(task_id).get("progress", 0), stats=stats)
+                self.add_log(task_id, "INFO", "超参数搜索已被用户取消")
+                return
+
+            self.update_task_status(task_id, "completed", "超参数搜索完成", 100, stats=stats)
+            saved = stats["compute"]
+            self.add_log(task_id, "INFO",
+                         f"超参数搜索完成！实际训练 {saved['epochs_run']}/{saved['epochs_budget']} 个epoch，"
+                         f"节省 {saved['saved_ratio'] * 100:.1f}% 计算量")
+            if stats["best_trial"] is not None:
+                self.add_log(task_id, "INFO", f"最佳试验: {stats['best_trial']}")
+            logger.info(f"超参数搜索任务 {task_id} 完成")
+        except Exception as e:
+            error_msg = f"超参数搜索失败: {str(e)}"
+            logger.error(f"任务 {task_id} 失败: {error_msg}\n{traceback.format_exc()}")
+            self.update_task_status(task_id, "failed", error_msg, 0)
+            self.add_log(task_id, "ERROR", error_msg)
+
+    def _run_trial(self, task_id: str, trial: Dict[str, Any], request: TrainingRequest,
+                   scheduler: ASHAScheduler, metric: str):
+        trial_task_id = f"{task_id}-trial{trial['trial_id']:03d}"
+        get_value, mode = MONITOR_METRICS[metric]
+        better = max if mode == "max" else min
+        device = request.device
+        actual_device = None
+
+        try:
+            while not resource_manager.can_allocate(device, "training"):
+                if self._is_cancelled(task_id):
+                    trial["status"] = "cancelled"
+                    return
+                threading.Event().wait(2)
+            if self._is_cancelled(task_id):
+                trial["status"] = "cancelled"
+                return
+
+            actual_device = resource_manager.allocate(device, "training", trial_task_id)
+            trial.update(status="running", device=actual_device)
+            self.add_log(task_id, "INFO", f"试验 {trial['trial_id']} 开始，设备: {actual_device}，参数: {trial['params']}")
+            os.makedirs(trial["save_path"], exist_ok=True)
+
+            def epoch_callback(epoch, metrics):
+                value = float(get_value(metrics))
+                trial["epochs_run"] = epoch
+                trial["history"].append(value)
+                trial["best_value"] = value if trial["best_value"] is None else better(trial["best_value"], value)
+                self._update_progress(task_id, request.num_epochs)
+                if not scheduler.report(trial["trial_id"], epoch, value):
+                    self.add_log(task_id, "INFO",
+                                 f"试验 {trial['trial_id']} 在第 {epoch} 个epoch被提前终止 ({metric}={value:.4f})")
+                    trial["status"] = "stopped"
+                    return False
+                return True
+
+            trial_start = time.time()
+            try:
+                trainer = Basetrainer(
+                    model=request.model,
+                    train_path=request.train_path,
+                    val_path=request.val_path,
+                    num_class=request.num_classes,
+                    save_path=trial["save_path"],
+                    weight_path=request.weight_path,
+                    device=actual_device,
+                    batch_size=request.batch_size,
+                    shuffle=request.shuffle,
+                    image_size=request.image_size,
+                    lr=request.learning_rate,
+                    pretrained=request.pretrained,
+                    check_cancelled=lambda: self._is_cancelled(task_id),
+                    epoch_callback=epoch_callback,
+                    patience=request.patience,
+                    min_delta=request.min_delta,
+                    monitor=request.monitor,
+                    lr_scheduler=request.lr_scheduler,
+                    augmentation=TrainingService.augmentation_policy(request),
+                    augmentation_p=request.augmentation_p,
+                    num_workers=request.num_workers,
+                    synthetic=TrainingService.synthetic_options(request)
+                )
+                trainer.train(num_epochs=request.num_epochs)
+                if trial["status"] == "running" and trainer.stop_reason == "early_stopping":
+                    trial["status"] = "early_stopped"
+                    self.add_log(task_id, "INFO",
+                                 f"试验 {trial['trial_id']} 在第 {trainer.epochs_run} 个epoch触发早停，"
+                                 f"最佳 {metric}: {trial['best_value']:.4f}")
+                elif trial["status"] == "running":
+                    trial["status"] = "completed"
+                    self.add_log(task_id, "INFO",
+                                 f"试验 {trial['trial_id']} 完成全部 {request.num_epochs} 个epoch，"
+                                 f"最佳 {metric}: {trial['best_value']:.4f}")
+            finally:
+                trial["duration"] = time.time() - trial_start
+                self._detach_trial_logfile(trial["save_path"])
+        except TrainingCancelled:
+            trial["status"] = "cancelled"
+        except Exception as e:
+            trial.update(status="failed", error=str(e))
+            logger.error(f"试验 {trial_task_id} 失败: {str(e)}\n{traceback.format_exc()}")
+            self.add_log(task_id, "ERROR", f"试验 {trial['trial_id']} 失败: {str(e)}")
+        finally:
+            if actual_device is not None:
+                resource_manager.release(actual_device, "training", trial_task_id)
+            self._update_progress(task_id, request.num_epochs)
+
+    def _update_progress(self, task_id: str, max_epochs: int):
+        task = self.get_task(task_id)
+        trials = task["trials"]
+        finished = {"completed", "stopped", "early_stopped", "failed", "cancelled"}
+        # 已结束的试验按完整预算计入进度
+        done = sum(max_epochs if t["status"] in finished else t["epochs_run"] for t in trials)
+        progress = int(done / (len(trials) * max_epochs) * 100) if trials else 100
+        self.update_task_status(task_id, task["status"], progress=min(progress, 99))
+
+    def _summarize(self, trials: List[Dict[str, Any]], scheduler: ASHAScheduler, request: SweepRequest,
+                   duration: float) -> Dict[str, Any]:
+        _, mode = MONITOR_METRICS[request.metric]
+        scored = [t for t in trials if t["best_value"] is not None]
+        # 只在训练到最深档位的试验中选最佳，避免早期偶然的高指标
+        deepest = max((t["epochs_run"] for t in scored), default=0)
+        candidates = [t for t in scored if t["epochs_run"] == deepest]
+        best = (max if mode == "max" else min)(candidates, key=lambda t: t["best_value"]) if candidates else None
+        status_count: Dict[str, int] = {}
+        for t in trials:
+            status_count[t["status"]] = status_count.get(t["status"], 0) + 1
+        return {
+            "metric": request.metric,
+            "num_trials": len(trials),
+            "status": status_count,
+            "rungs": scheduler.stats,
+            "best_trial": None if best is None else {
+                "trial_id": best["trial_id"],
+                "params": best["params"],
+                "best_value": best["best_value"],
+                "epochs_run": best["epochs_run"],
+                "save_path": best["save_path"],
+            },
+            "compute": compute_saved(trials, request.base.num_epochs),
+            "wall_time_s": round(duration, 1),
+        }
+
+    @staticmethod
+    def _detach_trial_logfile(save_path: str):
+        """Basetrainer 每次实例化都会向 'Train' 日志器添加文件处理器，试验结束后移除，避免日志写入后续试验"""
+        trainer_logger = logging.getLogger('Train')
+        save_path = os.path.abspath(save_path)
+        for handler in list(trainer_logger.handlers):
+            if isinstance(handler, logging.FileHandler) and handler.baseFilename.startswith(save_path):
+                trainer_logger.removeHandler(handler)
+                handler.close()
+
+    def _is_cancelled(self, task_id: str) -> bool:
+        task = self.get_task(task_id)
+        return task is not None and task.get("status") == "cancelled"
+
+    def stop_task(self, task_id: str) -> bool:
+        task = self.get_task(task_id)
+        if not task:
+            return False
+
+        if task["status"] in ["pending", "running"]:
+            self.update_task_status(task_id, "cancelled", "任务已取消", task.get("progress", 0))
+            self.add_log(task_id, "WARNING", "任务已被用户取消")
+            return True
+
+        return False
@@ -3,17 +3,22 @@
 """
 import logging
 import os
+import json
 import traceback
 import re
 from datetime import datetime
-from typing import Dict, Any, Optional
+from typing import Dict, Any, Optional, List
 from fastapi import BackgroundTasks
 
 from services.base_service import BaseService
-from models.schemas import TrainingRequest, TrainingMetrics
+from models.schemas import TrainingRequest, PruningRequest, TrainingMetrics
 from core.resource_manager import resource_manager
 from core.config import settings
-from utils.trainer import Basetrainer
+from utils.trainer import (Basetrainer, DistillationTrainer, TrainingCancelled, MONITOR_METRICS, train_ddp,
+                           save_train_config)
+from utils.benchmark import distillation_report
+from utils.pruning import prune_classifier
+from utils.preprocessor import AUGMENTATION_METHODS
 
 logger = logging.getLogger(__name__)
 
@@ -129,6 +134,23 @@ class TrainingLogHandler(logging.Handler):
                 metrics["best_acc"] = float(match.group(1))
                 stage = "epoch_end"
         
+        elif "Early stopping at epoch [" in message:
+            match = re.search(r"Early stopping at epoch \[(\d+)/(\d+)\].*at epoch (\d+), Epochs saved: (\d+)", message)
+            if match:
+                self.current_epoch = int(match.group(1))
+                metrics["stop_reason"] = "early_stopping"
+                metrics["best_epoch"] = int(match.group(3))
+                metrics["epochs_saved"] = int(match.group(4))
+                stage = "early_stopped"
+
+        elif "Training stopped early at epoch [" in message:
+            match = re.search(r"Training stopped early at epoch \[(\d+)/(\d+)\], Epochs saved: (\d+)", message)
+            if match:
+                self.current_epoch = int(match.group(1))
+                metrics["stop_reason"] = "callback"
+                metrics["epochs_saved"] = int(match.group(3))
+                stage = "early_stopped"
+
         elif "训练完成！" in message or "Training completed" in message:
             stage = "completed"
 
@@ -167,6 +189,7 @@ class TrainingService(BaseService):
     def __init__(self):
         super().__init__()
         self.latest_metrics: Dict[str, TrainingMetrics] = {}  # 存储每个任务的最新指标
+        self.requests: Dict[str, TrainingRequest] = {}  # 存储每个任务的请求，用于挂起后恢复
     
     async def start_training(
         self,
@@ -177,11 +200,40 @@ class TrainingService(BaseService):
         
         if request.model not in settings.SUPPORTED_MODELS:
             raise ValueError(f"不支持的模型: {request.model}")
+        if request.monitor not in MONITOR_METRICS:
+            raise ValueError(f"不支持的监控指标: {request.monitor}，可选: {list(MONITOR_METRICS)}")
+        if request.lr_scheduler not in (None, "plateau", "cosine"):
+            raise ValueError(f"不支持的学习率调度: {request.lr_scheduler}")
+        unknown = [m for m in request.augmentation_methods or [] if m not in AUGMENTATION_METHODS]
+        if unknown:
+            raise ValueError(f"不支持的增强方法: {unknown}，可选: {list(AUGMENTATION_METHODS)}")
         
         if not os.path.exists(request.train_path):
             raise FileNotFoundError(f"训练集路径不存在: {request.train_path}")
         if not os.path.exists(request.val_path):
             raise FileNotFoundError(f"验证集路径不存在: {request.val_path}")
+
+        if request.teacher_weight:
+            if not os.path.exists(request.teacher_weight):
+                raise FileNotFoundError(f"教师模型权重不存在: {request.teacher_weight}")
+            if not request.teacher_cfg or not os.path.exists(request.teacher_cfg):
+                raise FileNotFoundError(f"教师模型配置文件不存在: {request.teacher_cfg}")
+            if request.synthetic is not None:
+                raise ValueError("知识蒸馏不支持在线合成数据")
+
+        if request.resume_task_id:
+            previous = self.get_task(request.resume_task_id)
+            if not previous or not previous.get("save_path"):
+                raise ValueError(f"无法从任务 {request.resume_task_id} 恢复：任务不存在或尚未开始训练")
+            request = request.model_copy(update={"resume_from": previous["save_path"]})
+        if request.resume_from:
+            checkpoint_path = self.checkpoint_path(request.resume_from)
+            if not os.path.exists(checkpoint_path):
+                raise FileNotFoundError(f"训练检查点不存在: {checkpoint_path}")
+            request = request.model_copy(update={"resume_from": checkpoint_path})
+        if request.num_devices > 1:
+            # 设备不存在或名额永远不够的请求直接拒绝，而不是在队列中无限等待
+            resource_manager.check_gang(request.device, request.num_devices, "training")
         
         self.update_task_status(
             task_id,
@@ -197,10 +249,51 @@ class TrainingService(BaseService):
         )
         
         self.latest_metrics[task_id] = TrainingMetrics(total_epochs=request.num_epochs)
+        self.requests[task_id] = request
         background_tasks.add_task(self._train_worker, task_id, request)
         
         logger.info(f"训练任务已创建: {task_id}")
         return task_id
+
+    async def resume_training(self, task_id: str, background_tasks: BackgroundTasks) -> str:
+        """从任务的最新检查点恢复被挂起、取消或失败的训练任务（沿用原任务ID）"""
+        task = self.get_task(task_id)
+        if not task:
+            raise ValueError(f"任务 {task_id} 不存在")
+        if task["status"] == "suspending":
+            raise ValueError(f"任务 {task_id} 正在挂起（等待当前epoch结束并释放设备），请在状态变为 suspended 后再恢复")
+        if task["status"] not in ["suspended", "cancelled", "failed"]:
+            raise ValueError(f"任务 {task_id} 当前状态为 {task['status']}，无法恢复")
+        if task_id not in self.requests:
+            raise ValueError(f"任务 {task_id} 的训练配置已丢失，请使用 resume_from 指定检查点重新启动")
+        checkpoint_path = self.checkpoint_path(task.get("save_path", ""))
+        if not os.path.exists(checkpoint_path):
+            raise FileNotFoundError(f"任务 {task_id} 没有可用的检查点（至少需要完成一个epoch）")
+
+        request = self.requests[task_id].model_copy(update={"resume_from": checkpoint_path, "resume_task_id": None})
+        self.requests[task_id] = request
+        self.update_task_status(task_id, "pending", "等待恢复", task.get("progress", 0))
+        background_tasks.add_task(self._train_worker, task_id, request)
+
+        logger.info(f"训练任务将从检查点恢复: {task_id}")
+        return task_id
+
+    @staticmethod
+    def augmentation_policy(request: TrainingRequest) -> Optional[List[str]]:
+        """在线增强方法列表，未启用时为 None"""
+        if not request.augmentation:
+            return None
+        return list(request.augmentation_methods or AUGMENTATION_METHODS)
+
+    @staticmethod
+    def synthetic_options(request: TrainingRequest) -> Optional[Dict[str, Any]]:
+        """SyntheticIQDataset 参数，未启用在线合成数据时为 None"""
+        return request.synthetic.model_dump() if request.synthetic is not None else None
+
+    @staticmethod
+    def checkpoint_path(path: str) -> str:
+        """训练检查点路径：目录则指向其中的 last_checkpoint.pth"""
+        return os.path.join(path, "last_checkpoint.pth") if os.path.isdir(path) else path
     
     def _train_worker(self, task_id: str, request: TrainingRequest):
         device = request.device
@@ -215,88 +308,348 @@ class TrainingService(BaseService):
         trainer_logger.addHandler(log_handler)
         trainer_logger.setLevel(logging.INFO)
         
+        devices = None
         try:
             self.create_log_queue(task_id)
+            if self._finish_interrupted(task_id):
+                return
             
             self.update_task_status(task_id, "queued", "等待资源...", 0)
             self.add_log(task_id, "INFO", f"等待{device.upper()}资源...")
             
             import threading
-            while not resource_manager.can_allocate(device, "training"):
-                logger.info(f"任务 {task_id} 等待 {device} 资源...")
-                threading.Event().wait(2)
-            
-            actual_device = resource_manager.allocate(device, "training", task_id)
-            self.update_task_status(task_id, "running", "训练中...", 0, device=actual_device)
-            self.add_log(task_id, "INFO", f"资源已分配，使用设备: {actual_device}")
-            self.add_log(task_id, "INFO", "开始训练...")
-            
+            try:
+                if request.num_devices > 1:
+                    # 分布式训练：一次性分配整组设备
+                    while True:
+                        if self._finish_interrupted(task_id):
+                            return
+                        devices = resource_manager.allocate_gang(device, request.num_devices, "training", task_id)
+                        if devices is not None:
+                            break
+                        logger.info(f"任务 {task_id} 等待 {request.num_devices} 个 {device} 设备...")
+                        threading.Event().wait(2)
+                    actual_device = ",".join(devices)
+                else:
+                    while not resource_manager.can_allocate(device, "training"):
+                        if self._finish_interrupted(task_id):
+                            return
+                        logger.info(f"任务 {task_id} 等待 {device} 资源...")
+                        threading.Event().wait(2)
+                    actual_device = resource_manager.allocate(device, "training", task_id)
+                    devices = [actual_device]
+            except Exception as e:
+                error_msg = f"资源分配失败: {str(e)}"
+                logger.error(f"任务 {task_id} 失败: {error_msg}\n{traceback.format_exc()}")
+                self.update_task_status(task_id, "failed", error_msg, 0)
+                self.add_log(task_id, "ERROR", error_msg)
+                return
+            if self._finish_interrupted(task_id):
+                return
             # 计算最终保存路径：base/save_name
             base_save = request.save_path if request.save_path else os.path.join("models", "output")
             final_save_path = os.path.join(base_save, request.name) if getattr(request, 'name', None) else base_save
             os.makedirs(final_save_path, exist_ok=True)
+            self.update_task_status(task_id, "running", "训练中...", 0, device=actual_device, save_path=final_save_path)
+            self.add_log(task_id, "INFO", f"资源已分配，使用设备: {actual_device}")
+            self.add_log(task_id, "INFO", "开始训练...")
             
             self.add_log(task_id, "INFO", f"模型: {request.model}")
             self.add_log(task_id, "INFO", f"设备: {actual_device}")
             self.add_log(task_id, "INFO", f"批次大小: {request.batch_size}")
+            if len(devices) > 1:
+                self.add_log(task_id, "INFO",
+                             f"分布式训练: {len(devices)} 个进程，全局批次大小: {request.batch_size * len(devices)}")
             self.add_log(task_id, "INFO", f"训练轮数: {request.num_epochs}")
+            if request.patience:
+                self.add_log(task_id, "INFO",
+                             f"早停: 监控 {request.monitor}，耐心值 {request.patience}，最小提升 {request.min_delta}")
+            if request.lr_scheduler:
+                self.add_log(task_id, "INFO", f"学习率调度: {request.lr_scheduler}")
+            if request.augmentation:
+                self.add_log(task_id, "INFO",
+                             f"在线数据增强: {', '.join(request.augmentation_methods or AUGMENTATION_METHODS)}，"
+                             f"概率 {request.augmentation_p}，DataLoader 进程数 {request.num_workers}")
+            if request.synthetic is not None:
+                synthetic = request.synthetic
+                self.add_log(task_id, "INFO",
+                             f"在线合成数据: 信噪比 {synthetic.snr_range[0]}~{synthetic.snr_range[1]} dB"
+                             f"（概率 {synthetic.noise_p}），干扰概率 {synthetic.interference_p}，"
+                             f"跳频干扰概率 {synthetic.hopping_p}，信干比 {synthetic.sir_range[0]}~"
+                             f"{synthetic.sir_range[1]} dB")
+            if request.resume_from:
+                self.add_log(task_id, "INFO", f"从检查点恢复: {request.resume_from}")
+            if request.teacher_weight:
+                self.add_log(task_id, "INFO",
+                             f"知识蒸馏: 教师 {request.teacher_weight}，温度 {request.distill_temperature}，"
+                             f"KL权重 {request.distill_alpha}")
             self.add_log(task_id, "INFO", f"保存目录: {final_save_path}")
             
             def check_cancelled():
-                """检查任务是否被取消"""
+                """检查任务是否被取消或挂起"""
                 task = self.get_task(task_id)
-                return task is not None and task.get("status") == "cancelled"
+                return task is not None and task.get("status") in ["cancelled", "suspending"]
             
-            trainer = Basetrainer(
+            trainer_kwargs = dict(
                 model=request.model,
                 train_path=request.train_path,
                 val_path=request.val_path,
                 num_class=request.num_classes,
                 save_path=final_save_path,
                 weight_path=request.weight_path,
-                device=actual_device,
                 batch_size=request.batch_size,
                 shuffle=request.shuffle,
                 image_size=request.image_size,
                 lr=request.learning_rate,
                 pretrained=request.pretrained,
-                check_cancelled=check_cancelled
+                patience=request.patience,
+                min_delta=request.min_delta,
+                monitor=request.monitor,
+                lr_scheduler=request.lr_scheduler,
+                resume_from=request.resume_from or "",
+                augmentation=self.augmentation_policy(request),
+                augmentation_p=request.augmentation_p,
+                num_workers=request.num_workers,
+                synthetic=self.synthetic_options(request)
             )
+            trainer_cls = Basetrainer
+            if request.teacher_weight:
+                trainer_cls = DistillationTrainer
+                trainer_kwargs.update(teacher_weight=request.teacher_weight, teacher_cfg=request.teacher_cfg,
+                                      temperature=request.distill_temperature, alpha=request.distill_alpha)
             
             try:
-                trainer.train(num_epochs=request.num_epochs)
-                if check_cancelled():
-                    self.update_task_status(task_id, "cancelled", "训练已被用户取消", 
-                                          self.get_task(task_id).get("progress", 0))
-                    self.add_log(task_id, "INFO", "训练已被用户取消")
-                    logger.info(f"任务 {task_id} 已被取消")
+                if len(devices) > 1:
+                    result = train_ddp(trainer_kwargs, request.num_epochs, devices, check_cancelled=check_cancelled,
+                                       trainer_cls=trainer_cls)
+                    cancelled = result["cancelled"]
+                    epochs_run, stop_reason, best_acc = result["epochs_run"], result["stop_reason"], result["best_acc"]
                 else:
-                    self.update_task_status(task_id, "completed", "训练完成", 100)
-                    self.add_log(task_id, "INFO", "训练完成！")
-                    logger.info(f"任务 {task_id} 训练完成")
-            except Exception as e:
-                from utils.trainer import TrainingCancelled
-                if isinstance(e, TrainingCancelled):
+                    trainer = trainer_cls(**trainer_kwargs, device=actual_device, check_cancelled=check_cancelled)
+                    try:
+                        trainer.train(num_epochs=request.num_epochs)
+                        cancelled = False
+                    except TrainingCancelled:
+                        cancelled = True
+                    epochs_run, stop_reason, best_acc = trainer.epochs_run, trainer.stop_reason, trainer.best_acc
+
+                if self.get_task(task_id).get("status") == "suspending":
+                    self._mark_suspended(task_id, epochs_run)
+                elif cancelled or check_cancelled():
                     self.update_task_status(task_id, "cancelled", "训练已被用户取消", 
                                           self.get_task(task_id).get("progress", 0))
                     self.add_log(task_id, "INFO", "训练已被用户取消")
                     logger.info(f"任务 {task_id} 已被取消")
                 else:
-                    error_msg = f"训练失败: {str(e)}"
-                    logger.error(f"任务 {task_id} 失败: {error_msg}\n{traceback.format_exc()}")
-                    self.update_task_status(task_id, "failed", error_msg, 0)
-                    self.add_log(task_id, "ERROR", error_msg)
+                    if request.teacher_weight:
+                        self._distillation_report(task_id, request, final_save_path, best_acc)
+                    if stop_reason == "early_stopping":
+                        message = (f"训练完成（第 {epochs_run} 个epoch早停，"
+                                   f"节省 {request.num_epochs - epochs_run} 个epoch）")
+                        self.update_task_status(task_id, "completed", message, 100)
+                        self.add_log(task_id, "INFO", message)
+                        logger.info(f"任务 {task_id} {message}")
+                    else:
+                        self.update_task_status(task_id, "completed", "训练完成", 100)
+                        self.add_log(task_id, "INFO", "训练完成！")
+                        logger.info(f"任务 {task_id} 训练完成")
+            except Exception as e:
+                error_msg = f"训练失败: {str(e)}"
+                logger.error(f"任务 {task_id} 失败: {error_msg}\n{traceback.format_exc()}")
+                self.update_task_status(task_id, "failed", error_msg, 0)
+                self.add_log(task_id, "ERROR", error_msg)
         finally:
-            actual_device = self.get_task(task_id).get("device", device)
-            resource_manager.release(actual_device, "training", task_id)
+            if devices is not None and len(devices) > 1:
+                resource_manager.release_gang(devices, "training", task_id)
+            elif devices is not None:
+                resource_manager.release(devices[0], "training", task_id)
             trainer_logger.removeHandler(log_handler)
     
+    async def start_pruning(
+        self,
+        request: PruningRequest,
+        background_tasks: BackgroundTasks
+    ) -> str:
+        task_id = self.generate_task_id(request.task_id)
+
+        if (request.latency_budget_ms is None) == (request.keep_ratio is None):
+            raise ValueError("latency_budget_ms 与 keep_ratio 需且仅需指定一个")
+        for path, label in [(request.cfg_path, "配置文件"), (request.weight_path, "模型权重"),
+                            (request.train_path, "训练集路径"), (request.val_path, "验证集路径")]:
+            if not os.path.exists(path):
+                raise FileNotFoundError(f"{label}不存在: {path}")
+
+        self.update_task_status(
+            task_id,
+            "pending",
+            "等待开始",
+            0,
+            task_type="pruning",
+            device=request.device,
+            priority=request.priority,
+            name=request.name,
+            total_epochs=request.finetune_epochs
+        )
+
+        self.latest_metrics[task_id] = TrainingMetrics(total_epochs=request.finetune_epochs)
+        background_tasks.add_task(self._prune_worker, task_id, request)
+
+        logger.info(f"剪枝任务已创建: {task_id}")
+        return task_id
+
+    def _prune_cancelled(self, task_id: str) -> bool:
+        """剪枝开始前检查任务是否已被取消"""
+        if self.get_task(task_id).get("status") != "cancelled":
+            return False
+        self.add_log(task_id, "INFO", "剪枝已被用户取消")
+        logger.info(f"任务 {task_id} 已被取消")
+        return True
+
+    def _prune_worker(self, task_id: str, request: PruningRequest):
+        device = request.device
+
+        trainer_logger = logging.getLogger('Train')
+        log_handler = TrainingLogHandler(task_id, self)
+        trainer_logger.addHandler(log_handler)
+        trainer_logger.setLevel(logging.INFO)
+
+        actual_device = None
+        try:
+            self.create_log_queue(task_id)
+            if self._prune_cancelled(task_id):
+                return
+
+            self.update_task_status(task_id, "queued", "等待资源...", 0)
+            self.add_log(task_id, "INFO", f"等待{device.upper()}资源...")
+
+            import threading
+            while not resource_manager.can_allocate(device, "training"):
+                # 排队期间被取消的任务不再占用设备
+                if self._prune_cancelled(task_id):
+                    return
+                logger.info(f"任务 {task_id} 等待 {device} 资源...")
+                threading.Event().wait(2)
+            if self._prune_cancelled(task_id):
+                return
+            actual_device = resource_manager.allocate(device, "training", task_id)
+
+            save_path = os.path.join(request.save_path, request.name) if request.name else request.save_path
+            os.makedirs(save_path, exist_ok=True)
+            self.update_task_status(task_id, "running", "剪枝中...", 0, device=actual_device, save_path=save_path)
+            target = (f"延迟预算 {request.latency_budget_ms}ms" if request.latency_budget_ms is not None
+                      else f"保留比例 {request.keep_ratio}")
+            self.add_log(task_id, "INFO", f"开始剪枝: {request.weight_path}，{target}，"
+                                          f"延迟测量设备: {request.latency_device}，微调 {request.finetune_epochs} 个epoch")
+
+            def check_cancelled():
+                task = self.get_task(task_id)
+                return task is not None and task.get("status") == "cancelled"
+
+            try:
+                report = prune_classifier(
+                    cfg_path=request.cfg_path,
+                    weight_path=request.weight_path,
+                    train_path=request.train_path,
+                    val_path=request.val_path,
+                    save_path=save_path,
+                    latency_budget_ms=request.latency_budget_ms,
+                    keep_ratio=request.keep_ratio,
+                    finetune_epochs=request.finetune_epochs,
+                    lr=request.learning_rate,
+                    batch_size=request.batch_size,
+                    device=actual_device,
+                    latency_device=request.latency_device,
+                    check_cancelled=check_cancelled,
+                    torchscript=request.torchscript
+                )
+            except TrainingCancelled:
+                self.update_task_status(task_id, "cancelled", "剪枝已被用户取消",
+                                        self.get_task(task_id).get("progress", 0))
+                self.add_log(task_id, "INFO", "剪枝已被用户取消")
+                return
+
+            before, after = report["before"], report["after"]
+            message = (f"剪枝完成: 保留比例 {report['keep_ratio']}，延迟 {before['latency_ms']:.2f}ms -> "
+                       f"{after['latency_ms']:.2f}ms（{report['speedup']}x），"
+                       f"准确率 {before['acc']:.2f}% -> {after['acc']:.2f}%")
+            if report["budget_met"] is False:
+                message += "，最小保留比例仍未达到延迟预算"
+            self.update_task_status(task_id, "completed", message, 100, stats={"pruning": report})
+            self.add_log(task_id, "INFO", message)
+            logger.info(f"任务 {task_id} {message}")
+        except Exception as e:
+            error_msg = f"剪枝失败: {str(e)}"
+            logger.error(f"任务 {task_id} 失败: {error_msg}\n{traceback.format_exc()}")
+            self.update_task_status(task_id, "failed", error_msg, 0)
+            self.add_log(task_id, "ERROR", error_msg)
+        finally:
+            if actual_device is not None:
+                resource_manager.release(actual_device, "training", task_id)
+            trainer_logger.removeHandler(log_handler)
+
+    def _distillation_report(self, task_id: str, request: TrainingRequest, save_path: str, best_acc: float):
+        """写出学生模型配置，并测量学生/教师在部署设备上的延迟与精度"""
+        student_cfg = save_train_config(save_path, request.model, request.num_classes, request.image_size,
+                                        request.batch_size, request.train_path, device=request.latency_device)
+        teacher_acc = None
+        meta_path = os.path.join(save_path, "teacher_logits.json")
+        if os.path.exists(meta_path):
+            with open(meta_path, encoding="utf-8") as f:
+                teacher_acc = json.load(f).get("teacher_acc")
+
+        self.add_log(task_id, "INFO", f"测量学生/教师模型在 {request.latency_device} 上的推理延迟...")
+        report = distillation_report(student_cfg, os.path.join(save_path, "best_model.pth"), best_acc,
+                                     request.teacher_cfg, request.teacher_weight, teacher_acc,
+                                     device=request.latency_device, save_path=save_path)
+        self.update_task_status(task_id, "running", stats={"distillation": report})
+        student, teacher = report["student"], report["teacher"]
+        self.add_log(task_id, "INFO",
+                     f"蒸馏结果: 学生 {student['model']} 准确率 {student['acc']:.2f}%，延迟 {student['latency_ms']:.2f}ms；"
+                     f"教师 {teacher['model']} 准确率 {teacher['acc'] if teacher['acc'] is not None else '-'}%，"
+                     f"延迟 {teacher['latency_ms']:.2f}ms；加速 {report['speedup']}x")
+
+    def _mark_suspended(self, task_id: str, epochs_run: int):
+        message = f"训练已挂起，已保存至第 {epochs_run} 个epoch，可通过恢复接口继续训练"
+        self.update_task_status(task_id, "suspended", message, self.get_task(task_id).get("progress", 0))
+        self.add_log(task_id, "INFO", message)
+        logger.info(f"任务 {task_id} 已挂起")
+
+    def _finish_interrupted(self, task_id: str) -> bool:
+        """训练开始前检查任务是否已被取消或挂起，是则直接结束（尚未训练，无需等待epoch结束）"""
+        status = self.get_task(task_id).get("status")
+        if status == "suspending":
+            self._mark_suspended(task_id, 0)
+            return True
+        if status == "cancelled":
+            self.add_log(task_id, "INFO", "训练已被用户取消")
+            logger.info(f"任务 {task_id} 已被取消")
+            return True
+        return False
+
+    def suspend_task(self, task_id: str) -> bool:
+        """
+        挂起训练任务以释放设备，当前epoch的进度会丢失，之前的epoch保存在检查点中
+
+        任务先进入 suspending 状态，训练进程在下一次取消检查时停止并释放设备后才变为 suspended，
+        此后才能恢复，避免新旧两个训练进程同时写入同一保存目录、重复占用设备
+        """
+        task = self.get_task(task_id)
+        if not task:
+            return False
+
+        if task["status"] in ["pending", "queued", "running"]:
+            self.update_task_status(task_id, "suspending", "任务挂起中", task.get("progress", 0))
+            self.add_log(task_id, "WARNING", "任务挂起中，等待当前训练进程停止")
+            return True
+
+        return False
+
     def stop_task(self, task_id: str) -> bool:
         task = self.get_task(task_id)
         if not task:
             return False
         
-        if task["status"] in ["pending", "queued", "running"]:
+        if task["status"] in ["pending", "queued", "running", "suspending"]:
             self.update_task_status(task_id, "cancelled", "任务已取消", task.get("progress", 0))
             self.add_log(task_id, "WARNING", "任务已被用户取消")
             return True
@@ -0,0 +1,28 @@
+"""measure the YOLO dataloader throughput on CPU for several worker counts
+"""
+import os
+import sys
+import argparse
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils.DetModels.yolo.dataloader import benchmark_dataloader
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--data', type=str, required=True, help='images dir / list / shard dir of the YOLO dataset')
+    parser.add_argument('--imgsz', type=int, default=640)
+    parser.add_argument('--batch-size', type=int, default=16)
+    parser.add_argument('--workers', type=int, nargs='+', default=[0, 2, 4, 8])
+    parser.add_argument('--cache', type=str, default=None, help='ram / disk')
+    parser.add_argument('--augment', action='store_true')
+    parser.add_argument('--num-batches', type=int, default=100)
+    opt = parser.parse_args()
+
+    for workers in opt.workers:
+        benchmark_dataloader(opt.data, imgsz=opt.imgsz, batch_size=opt.batch_size, workers=workers, cache=opt.cache,
+                             augment=opt.augment, num_batches=opt.num_batches)
+
+
+if __name__ == '__main__':
+    main()
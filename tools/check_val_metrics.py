@@ -0,0 +1,113 @@
+"""parity check of the vectorized YOLO validation metrics against the former per-threshold / per-class loops
+"""
+import os
+import sys
+import numpy as np
+import torch
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils.DetModels.yolo.val import process_batch
+from utils.DetModels.yolo.metrics import ap_per_class, box_iou, smooth
+
+
+def process_batch_reference(detections, labels, iouv):
+    correct = np.zeros((detections.shape[0], iouv.shape[0])).astype(bool)
+    iou = box_iou(labels[:, 1:], detections[:, :4])
+    correct_class = labels[:, 0:1] == detections[:, 5]
+    for i in range(len(iouv)):
+        x = torch.where((iou >= iouv[i]) & correct_class)  # IoU > threshold and classes match
+        if x[0].shape[0]:
+            matches = torch.cat((torch.stack(x, 1), iou[x[0], x[1]][:, None]), 1).cpu().numpy()  # [label, detect, iou]
+            if x[0].shape[0] > 1:
+                matches = matches[matches[:, 2].argsort()[::-1]]
+                matches = matches[np.unique(matches[:, 1], return_index=True)[1]]
+                matches = matches[np.unique(matches[:, 0], return_index=True)[1]]
+            correct[matches[:, 1].astype(int), i] = True
+    return torch.tensor(correct, dtype=torch.bool, device=iouv.device)
+
+
+def compute_ap_reference(recall, precision):
+    mrec = np.concatenate(([0.0], recall, [1.0]))
+    mpre = np.concatenate(([1.0], precision, [0.0]))
+    mpre = np.flip(np.maximum.accumulate(np.flip(mpre)))
+    x = np.linspace(0, 1, 101)
+    return np.trapz(np.interp(x, mrec, mpre), x)
+
+
+def ap_per_class_reference(tp, conf, pred_cls, target_cls, eps=1e-16):
+    i = np.argsort(-conf)
+    tp, conf, pred_cls = tp[i], conf[i], pred_cls[i]
+    unique_classes, nt = np.unique(target_cls, return_counts=True)
+    nc = unique_classes.shape[0]
+    px = np.linspace(0, 1, 1000)
+    ap, p, r = np.zeros((nc, tp.shape[1])), np.zeros((nc, 1000)), np.zeros((nc, 1000))
+    for ci, c in enumerate(unique_classes):
+        i = pred_cls == c
+        n_l = nt[ci]
+        n_p = i.sum()
+        if n_p == 0 or n_l == 0:
+            continue
+        fpc = (1 - tp[i]).cumsum(0)
+        tpc = tp[i].cumsum(0)
+        recall = tpc / (n_l + eps)
+        r[ci] = np.interp(-px, -conf[i], recall[:, 0], left=0)
+        precision = tpc / (tpc + fpc)
+        p[ci] = np.interp(-px, -conf[i], precision[:, 0], left=1)
+        for j in range(tp.shape[1]):
+            ap[ci, j] = compute_ap_reference(recall[:, j], precision[:, j])
+    f1 = 2 * p * r / (p + r + eps)
+    i = smooth(f1.mean(0), 0.1).argmax()  # max F1 index
+    p, r, f1 = p[:, i], r[:, i], f1[:, i]
+    tp = (r * nt).round()
+    fp = (tp / (p + eps) - tp).round()
+    return tp, fp, p, r, f1, ap
+
+
+def random_boxes(n, size=640, generator=None):
+    xy = torch.rand((n, 2), generator=generator) * size
+    wh = torch.rand((n, 2), generator=generator) * size / 4 + 4
+    return torch.cat((xy, xy + wh), 1)
+
+
+def check_process_batch(trials=200, nc=5, seed=0):
+    g = torch.Generator().manual_seed(seed)
+    iouv = torch.linspace(0.5, 0.95, 10)
+    for _ in range(trials):
+        m, n = int(torch.randint(0, 30, (1,), generator=g)), int(torch.randint(0, 60, (1,), generator=g))
+        labels = torch.cat((torch.randint(0, nc, (m, 1), generator=g).float(), random_boxes(m, generator=g)), 1)
+        # detections jittered around the labels (mostly with the right class) plus random false positives
+        random_cls = torch.randint(0, nc, (n,), generator=g).float()
+        if m:
+            k = torch.randint(0, m, (n,), generator=g)
+            boxes = labels[k, 1:] + torch.randn((n, 4), generator=g) * 6
+            cls = torch.where(torch.rand(n, generator=g) < 0.8, labels[k, 0], random_cls)
+        else:
+            boxes, cls = random_boxes(n, generator=g), random_cls
+        detections = torch.cat((boxes, torch.rand((n, 1), generator=g), cls[:, None]), 1)
+        expected = process_batch_reference(detections, labels, iouv) if m and n else torch.zeros((n, 10), dtype=torch.bool)
+        assert torch.equal(process_batch(detections, labels, iouv), expected), 'process_batch mismatch'
+    print(f'process_batch: {trials} random batches match')
+
+
+def check_ap_per_class(trials=100, nc=6, seed=0):
+    rng = np.random.default_rng(seed)
+    for _ in range(trials):
+        n = int(rng.integers(1, 500))
+        tp = rng.random((n, 10)) < np.linspace(0.8, 0.2, 10)
+        conf = rng.permutation(n) / n + rng.random(n) * 1e-6  # distinct confidences
+        pred_cls = rng.integers(0, nc + 1, n).astype(float)  # class nc has no labels
+        target_cls = rng.integers(0, nc, int(rng.integers(1, 300))).astype(float)
+        expected = ap_per_class_reference(tp, conf, pred_cls, target_cls)
+        result = ap_per_class(tp, conf, pred_cls, target_cls, names={i: str(i) for i in range(nc)})[:6]
+        for name, a, b in zip(('tp', 'fp', 'p', 'r', 'f1', 'ap'), result, expected):
+            assert np.allclose(a, b, atol=1e-9), f'ap_per_class mismatch on {name}'
+    print(f'ap_per_class: {trials} random sets match')
+
+
+def main():
+    check_process_batch()
+    check_ap_per_class()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,7 +1,10 @@
-# Merge the data of two drones
-import numpy as np
-import matplotlib.pyplot as plt
-from graphic.RawDataProcessor import STFT
+# Merge the data of two (or more) drones
+import os
+import sys
+import argparse
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils.mixing import MixingEngine
 
 
 def MergeData(UAV1: str,
@@ -10,87 +13,63 @@ def MergeData(UAV1: str,
               name: str,
               duration_time: float = 0.1,
               fs: int = 100e6,
-              stft_point: int = 1024
+              stft_point: int = 1024,
+              workers: int = None
               ):
 
     """
     Merge and process data from two UAVs, and save the processed data as images.
 
+    The two captures are summed slice by slice by `utils.mixing.MixingEngine` (memory-mapped, the shorter capture
+    is treated as zero-padded), with half-slice steps, and rendered in parallel as `<name> (<i>).jpg`.
+
     Args:
         UAV1 (str): Path to the first UAV data file.
         UAV2 (str): Path to the second UAV data file.
         targetFolderPath (str): Directory to save the processed images.
-        name (str): Name prefix for the saved images.
+        name (str): Name prefix for the saved images, they are saved under `targetFolderPath/name/`.
         duration_time (float, optional): Duration of each segment in seconds. Defaults to 0.1.
         fs (int, optional): Sampling frequency in Hz. Defaults to 100e6.
         stft_point (int, optional): Number of points for the STFT. Defaults to 1024.
+        workers (int, optional): Rendering processes, the CPU count by default.
     """
 
-    slice_point = int(fs * duration_time)
-
-    data_UAV1 = np.fromfile(UAV1, dtype=np.float32)
-    data_UAV2 =np.fromfile(UAV2, dtype=np.float32)
-
-    data_UAV1_I = data_UAV1[::2]
-    data_UAV1_Q = data_UAV1[1::2]
-
-    data_UAV2_I = data_UAV2[::2]
-    data_UAV2_Q = data_UAV2[1::2]
-
-    data_UAV1_I2_padded = np.pad(data_UAV1_I, (0,  max(len(data_UAV1_I), len(data_UAV2_I)) - len(data_UAV1_I)), 'constant', constant_values=0)
-    data_UAV1_Q2_padded = np.pad(data_UAV1_Q, (0,  max(len(data_UAV1_Q), len(data_UAV2_Q)) - len(data_UAV1_Q)), 'constant', constant_values=0)
+    engine = MixingEngine([{'path': UAV1}, {'path': UAV2}], fs=fs, duration_time=duration_time,
+                          step_time=duration_time / 2)
+    return engine.render(os.path.join(targetFolderPath, name), name=name, stft_point=stft_point, workers=workers)
 
-    data_UAV2_I1_padded = np.pad(data_UAV2_I, (0,  max(len(data_UAV1_I), len(data_UAV2_I)) - len(data_UAV2_I)), 'constant', constant_values=0)
-    data_UAV2_Q2_padded = np.pad(data_UAV2_Q, (0,  max(len(data_UAV1_Q), len(data_UAV2_Q)) - len(data_UAV2_Q)), 'constant', constant_values=0)
 
-    _data_UAV1 = data_UAV1_I2_padded + data_UAV1_Q2_padded * 1j
-    _data_UAV2 = data_UAV2_I1_padded + data_UAV2_Q2_padded * 1j
-
-    i = 0
-    data_merged = _data_UAV1 + _data_UAV2
-    while (i + 1) * slice_point <= len(data_merged):
-
-        f, t, Zxx = STFT(data_merged[int(i * slice_point): int((i + 1) * slice_point)],
-                         stft_point=stft_point,
-                         fs=fs,
-                         duration_time=duration_time,
-                         onside=False)
-        f = np.fft.fftshift(f)
-        Zxx = np.fft.fftshift(Zxx, axes=0)
-        aug = 10 * np.log10(np.abs(Zxx))
-        extent = [t.min(), t.max(), f.min(), f.max()]
-
-        plt.figure()
-        plt.imshow(aug, extent=extent, aspect='auto', origin='lower')
-        plt.axis('off')
-        plt.subplots_adjust(left=0, right=1, bottom=0, top=1, wspace=None, hspace=None)
-        plt.savefig(targetFolderPath + name + '/' + ' (' + str(i) + ').jpg', dpi=300)
-        plt.show()
-        plt.close()
-
-        i += 2 ** (-1)
+def parse_source(spec):
+    """`path[:key=value,...]`, e.g. `fpv.iq:snr_db=-3,offset=0.05,freq_shift=5e6`."""
+    path, _, options = spec.partition(':') if not os.path.exists(spec) else (spec, '', '')
+    source = {'path': path}
+    for option in filter(None, options.split(',')):
+        key, value = option.split('=')
+        source[key] = value if key == 'file_type' else float(value)
+    return source
 
 
 # Usage-----------------------------------------------------------------------------------------------------------------
 def main():
-    UAV1 = ''
-    UAV2 = ''
-    targetFolderPath = ''
-    name = 'test'
-
-    duration_time = 0.1
-    fs = 100e6
-    stft_point = 1024
-
-    MergeData(
-        UAV1=UAV1,
-        UAV2=UAV2,
-        targetFolderPath=targetFolderPath,
-        name=name,
-        duration_time=duration_time,
-        fs=fs,
-        stft_point1=stft_point)
+    parser = argparse.ArgumentParser(description='mix N captures into spectrogram images')
+    parser.add_argument('--sources', type=str, nargs='+', required=True,
+                        help='path[:gain_db=..,snr_db=..,offset=..,freq_shift=..,file_type=..], the first is the '
+                             'reference of snr_db')
+    parser.add_argument('--out', type=str, required=True)
+    parser.add_argument('--name', type=str, default='mix')
+    parser.add_argument('--fs', type=float, default=100e6)
+    parser.add_argument('--duration', type=float, default=0.1)
+    parser.add_argument('--step', type=float, default=None, help='seconds between two slices, default the duration')
+    parser.add_argument('--awgn-snr', type=float, default=None, help='white noise SNR against the reference')
+    parser.add_argument('--stft-point', type=int, default=1024)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--seed', type=int, default=None)
+    opt = parser.parse_args()
+
+    engine = MixingEngine([parse_source(s) for s in opt.sources], fs=opt.fs, duration_time=opt.duration,
+                          step_time=opt.step, awgn_snr_db=opt.awgn_snr, seed=opt.seed)
+    print(engine.render(opt.out, name=opt.name, stft_point=opt.stft_point, workers=opt.workers))
 
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
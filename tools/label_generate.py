@@ -1,9 +1,12 @@
 """generate the label for yolo
 """
-import shutil
 import os
+import sys
 import random
 
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils.manifest import link_file
+
 
 # label table
 name_table = {
@@ -54,24 +57,36 @@ def generator(pics_path, txt_path):
     print("Label complete.")
 
 
-def split_pics(source_dir, other_dir, train_dir, valid_dir, ratio):
+def split_pics(source_dir, other_dir, train_dir, valid_dir, ratio, mode='copy'):
+    """mode: 'copy', 'hardlink', 'reflink' or 'symlink' (utils.manifest.link_file), or 'manifest' to only write
+    train.txt / valid.txt image lists next to train_dir / valid_dir, which the YOLO loader reads as its train/val
+    paths."""
     drone_type = [_ for _ in os.listdir(source_dir) if _ not in other_dir]
+    lists = {'train': [], 'valid': []}
     for drone in drone_type:
         pics = [_ for _ in os.listdir(source_dir+drone + '/')]
-        os.makedirs(train_dir, exist_ok=True)
-        os.makedirs(valid_dir, exist_ok=True)
+        if mode != 'manifest':
+            os.makedirs(train_dir, exist_ok=True)
+            os.makedirs(valid_dir, exist_ok=True)
         random.shuffle(pics)
         split_point = int(len(pics) * ratio)
         valid_files = pics[:split_point]
         train_files = pics[split_point:]
 
-        for file in valid_files:
-            shutil.copy(os.path.join(source_dir+drone, file), os.path.join(train_dir, file))
-            print(file + ' copied to valid dir.')
-
-        for file in train_files:
-            shutil.copy(os.path.join(source_dir+drone, file), os.path.join(valid_dir, file))
-            print(file + ' copied to train dir.')
+        for subset, files, subset_dir in (('valid', valid_files, valid_dir), ('train', train_files, train_dir)):
+            for file in files:
+                src = os.path.join(source_dir+drone, file)
+                if mode == 'manifest':
+                    lists[subset].append(os.path.abspath(src))
+                    continue
+                link_file(src, os.path.join(subset_dir, file), mode)
+                print(file + f' {mode} to {subset} dir.')
+
+    if mode == 'manifest':
+        for subset, subset_dir in (('train', train_dir), ('valid', valid_dir)):
+            with open(os.path.normpath(subset_dir) + '.txt', 'w', encoding='utf-8') as f:
+                f.writelines(path + '\n' for path in lists[subset])
+            print(f'{len(lists[subset])} images listed in {os.path.normpath(subset_dir)}.txt')
 
 
 def main():
@@ -0,0 +1,63 @@
+"""pack an image dataset into tar shards and compare the read throughput with the original files
+
+classification: python tools/pack_shards.py --data dataset/split/train --out dataset/shards/train --compare
+YOLO detection: python tools/pack_shards.py --data dataset/det/images/train --out dataset/det/shards/train --detect
+"""
+import os
+import sys
+import time
+import argparse
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from torchvision import transforms
+from torch.utils.data import DataLoader
+from utils.manifest import build_dataset
+from utils.shards import pack_shards, pack_detection_shards
+
+
+def read_throughput(path, image_size, batch_size, workers, num_batches):
+    dataset = build_dataset(path, transform=transforms.Compose([transforms.Resize((image_size, image_size)),
+                                                                transforms.ToTensor()]),
+                            shuffle=True, batch_size=batch_size)
+    loader = DataLoader(dataset, batch_size=batch_size, num_workers=workers,
+                        shuffle=not hasattr(dataset, 'set_epoch'))
+    images, start = 0, time.time()
+    for i, (x, _) in enumerate(loader):
+        images += len(x)
+        if i + 1 == num_batches:
+            break
+    return images / (time.time() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--data', type=str, required=True, help='class folders / split manifest, or YOLO images')
+    parser.add_argument('--out', type=str, required=True, help='shard directory')
+    parser.add_argument('--shard-size', type=int, default=256, help='MB per shard')
+    parser.add_argument('--detect', action='store_true', help='YOLO dataset, labels are stored in the index')
+    parser.add_argument('--no-shuffle', action='store_true', help='keep the dataset order in the shards')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--compare', action='store_true', help='read both datasets once and print images/s')
+    parser.add_argument('--image-size', type=int, default=224)
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--num-batches', type=int, default=200)
+    opt = parser.parse_args()
+
+    start = time.time()
+    if opt.detect:
+        stats = pack_detection_shards(opt.data, opt.out, opt.shard_size)
+    else:
+        stats = pack_shards(opt.data, opt.out, opt.shard_size, shuffle=not opt.no_shuffle, seed=opt.seed)
+    print(f"{stats['samples']} images -> {stats['shards']} shards ({stats['bytes'] / (1 << 20):.1f}MB) "
+          f"in {time.time() - start:.1f}s, index: {stats['index']}")
+
+    if opt.compare and not opt.detect:
+        # run on cold caches (e.g. after dropping the page cache) to see the storage latency
+        for name, path in (('files', opt.data), ('shards', opt.out)):
+            speed = read_throughput(path, opt.image_size, opt.batch_size, opt.workers, opt.num_batches)
+            print(f'{name}: {speed:.1f} images/s')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,11 +1,15 @@
 """random crop the dataset into train set and valid set
 """
 import os
+import sys
 import random
-import shutil
 
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils.manifest import link_file
 
-def split_images(source_dir, target_dir, other_dir, open_dir, close_dir, ratio, special_dir):
+
+def split_images(source_dir, target_dir, other_dir, open_dir, close_dir, ratio, special_dir, mode='copy'):
+    """mode: 'copy', 'hardlink', 'reflink' or 'symlink', see utils.manifest.link_file"""
 
     drone_type = [_ for _ in os.listdir(source_dir) if _ not in other_dir]
 
@@ -22,10 +26,10 @@ def split_images(source_dir, target_dir, other_dir, open_dir, close_dir, ratio,
                 close_files = pics[split_point:]
 
                 for file in open_files:
-                    shutil.copy(os.path.join(source_dir+drone+'/'+target_dir+'/'+detail_type, file), os.path.join(open_dir+detail_type, file))
+                    link_file(os.path.join(source_dir+drone+'/'+target_dir+'/'+detail_type, file), os.path.join(open_dir+detail_type, file), mode)
 
                 for file in close_files:
-                    shutil.copy(os.path.join(source_dir+drone+'/'+target_dir+'/'+detail_type, file), os.path.join(close_dir+detail_type, file))
+                    link_file(os.path.join(source_dir+drone+'/'+target_dir+'/'+detail_type, file), os.path.join(close_dir+detail_type, file), mode)
 
         else:
             packs = os.listdir(os.path.join(source_dir, drone))
@@ -41,12 +45,10 @@ def split_images(source_dir, target_dir, other_dir, open_dir, close_dir, ratio,
                 val = pics[split_point:]
 
                 for file in train:
-                    shutil.copy(os.path.join(source_dir, drone, pack, file), os.path.join(target_dir, 'train', drone))
-                    os.rename(os.path.join(target_dir, 'train', drone, file), os.path.join(target_dir, 'train', drone, drone + str(i) + '.jpg'))
+                    link_file(os.path.join(source_dir, drone, pack, file), os.path.join(target_dir, 'train', drone, drone + str(i) + '.jpg'), mode)
                     i += 1
                 for file in val:
-                    shutil.copy(os.path.join(source_dir, drone, pack, file), os.path.join(target_dir, 'valid', drone))
-                    os.rename(os.path.join(target_dir, 'valid', drone, file), os.path.join(target_dir, 'valid', drone, drone + str(i) + '.jpg'))
+                    link_file(os.path.join(source_dir, drone, pack, file), os.path.join(target_dir, 'valid', drone, drone + str(i) + '.jpg'), mode)
                     i += 1
             print(f'{packs} done')
         print(f'{drone} done')
@@ -69,8 +71,9 @@ def main():
     close_dir = ''
 
     special_dir = []
+    mode = 'hardlink'
 
-    split_images(source_directory, target_dir, other_dir, open_dir, close_dir, ratio, special_dir)
+    split_images(source_directory, target_dir, other_dir, open_dir, close_dir, ratio, special_dir, mode)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,59 @@
+"""launch DDP classification training from the command line, also across nodes
+
+single node, 2 GPUs:   python tools/train_ddp.py --model resnet18 --train ... --val ... --num-classes 37 --devices cuda:0 cuda:1
+CPU smoke test (gloo): python tools/train_ddp.py ... --devices cpu cpu --epochs 1
+two nodes:             run the same command on each node with --nnodes 2 --node-rank {0,1} --master-addr <node0> --master-port 29500
+"""
+import os
+import sys
+import json
+import argparse
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils.trainer import train_ddp
+from utils.preprocessor import AUGMENTATION_METHODS
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--model', type=str, default='resnet18')
+    parser.add_argument('--train', type=str, required=True, help='training set (ImageFolder layout, split manifest or shard dir)')
+    parser.add_argument('--val', type=str, required=True, help='validation set (ImageFolder layout, split manifest or shard dir)')
+    parser.add_argument('--num-classes', type=int, required=True)
+    parser.add_argument('--save-path', type=str, default='models/output/ddp')
+    parser.add_argument('--devices', type=str, nargs='+', default=['cuda:0'], help='devices of this node, one rank each')
+    parser.add_argument('--epochs', type=int, default=100)
+    parser.add_argument('--batch-size', type=int, default=8, help='per rank')
+    parser.add_argument('--image-size', type=int, default=224)
+    parser.add_argument('--lr', type=float, default=1e-4)
+    parser.add_argument('--augment', type=str, nargs='*', default=None,
+                        help='on-the-fly augmentation methods, all of them when given without names')
+    parser.add_argument('--augment-p', type=float, default=0.5)
+    parser.add_argument('--num-workers', type=int, default=0, help='DataLoader workers per rank')
+    parser.add_argument('--synthetic', type=str, default=None,
+                        help='JSON file of utils.synthetic.SyntheticIQDataset options, raw-capture --train / --val '
+                             'directories are then synthesized on the fly')
+    parser.add_argument('--resume', type=str, default='', help='checkpoint or save dir to resume from')
+    parser.add_argument('--nnodes', type=int, default=1)
+    parser.add_argument('--node-rank', type=int, default=0)
+    parser.add_argument('--master-addr', type=str, default='127.0.0.1')
+    parser.add_argument('--master-port', type=int, default=None)
+    parser.add_argument('--backend', type=str, default=None, help='nccl / gloo')
+    opt = parser.parse_args()
+
+    os.makedirs(opt.save_path, exist_ok=True)
+    trainer_kwargs = dict(model=opt.model, train_path=opt.train, val_path=opt.val, num_class=opt.num_classes,
+                          save_path=opt.save_path, batch_size=opt.batch_size, shuffle=True,
+                          image_size=opt.image_size, lr=opt.lr, resume_from=opt.resume,
+                          augmentation=None if opt.augment is None else opt.augment or list(AUGMENTATION_METHODS),
+                          augmentation_p=opt.augment_p, num_workers=opt.num_workers)
+    if opt.synthetic:
+        with open(opt.synthetic, encoding='utf-8') as f:
+            trainer_kwargs['synthetic'] = json.load(f)
+    result = train_ddp(trainer_kwargs, opt.epochs, opt.devices, nnodes=opt.nnodes, node_rank=opt.node_rank,
+                       master_addr=opt.master_addr, master_port=opt.master_port, backend=opt.backend)
+    print(result)
+
+
+if __name__ == '__main__':
+    main()
@@ -17,6 +17,8 @@ import pkg_resources as pkg
 import platform
 import threading
 import argparse
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
 
 IMG_FORMATS = 'bmp', 'dng', 'jpeg', 'jpg', 'mpo', 'png', 'tif', 'tiff', 'webp', 'pfm'  # include image suffixes
@@ -160,6 +162,48 @@ class LoadImages:
         return self.nf  # number of files
 
 
+class LoadImagesBatched:
+    # Batched image loader, files are read and letterboxed to a common shape by a thread pool ahead of the consumer
+    def __init__(self,
+                 path,
+                 img_size=640,
+                 stride=32,
+                 batch_size=16,
+                 workers=8,
+                 prefetch=2):
+        self.files = LoadImages(path, img_size=img_size, stride=stride).files
+        self.nf = len(self.files)
+        self.img_size = (img_size, img_size) if isinstance(img_size, int) else tuple(img_size)
+        self.stride = stride
+        self.batch_size = batch_size
+        self.workers = workers
+        self.prefetch = prefetch
+
+    def _load(self, path):
+        im0 = cv2.imread(path)  # BGR
+        assert im0 is not None, f'Image Not Found {path}'
+        im = letterbox(im0, self.img_size, stride=self.stride, auto=False)[0]  # common shape for the whole batch
+        return im.transpose((2, 0, 1))[::-1], im0  # HWC to CHW, BGR to RGB
+
+    def __iter__(self):
+        """Yields (paths, im, im0s): im is a contiguous (b, 3, h, w) uint8 array, im0s the original BGR images."""
+        batches = [self.files[i:i + self.batch_size] for i in range(0, self.nf, self.batch_size)]
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            queue = deque()
+            for paths in batches[:self.prefetch]:
+                queue.append((paths, [pool.submit(self._load, p) for p in paths]))
+            for i in range(len(batches)):
+                paths, futures = queue.popleft()
+                if i + self.prefetch < len(batches):
+                    nxt = batches[i + self.prefetch]
+                    queue.append((nxt, [pool.submit(self._load, p) for p in nxt]))
+                loaded = [f.result() for f in futures]
+                yield paths, np.ascontiguousarray(np.stack([x[0] for x in loaded])), [x[1] for x in loaded]
+
+    def __len__(self):
+        return (self.nf + self.batch_size - 1) // self.batch_size  # number of batches
+
+
 def letterbox(im, new_shape=(640, 640), color=(114, 114, 114), auto=True, scaleFill=False, scaleup=True, stride=32):
     # Resize and pad image while meeting stride-multiple constraints
     shape = im.shape[:2]  # current shape [height, width]
@@ -351,6 +395,50 @@ def non_max_suppression(
     return output
 
 
+def batched_non_max_suppression(
+        prediction,
+        conf_thres=0.25,
+        iou_thres=0.45,
+        classes=None,
+        agnostic=False,
+        max_det=300,
+):
+    """Non-Maximum Suppression over a whole batch with a single torchvision.ops.batched_nms call, boxes are grouped by
+    image * nc + class (or by image only when agnostic). Best class only, same output as non_max_suppression.
+
+   Returns:
+        list of detections, on (n,6) tensor per image [xyxy, conf, cls]
+   """
+
+    assert 0 <= conf_thres <= 1, f'Invalid Confidence threshold {conf_thres}, valid values are between 0.0 and 1.0'
+    assert 0 <= iou_thres <= 1, f'Invalid IoU {iou_thres}, valid values are between 0.0 and 1.0'
+    if isinstance(prediction, (list, tuple)):
+        prediction = prediction[0]
+
+    bs = prediction.shape[0]  # batch size
+    nc = prediction.shape[2] - 5  # number of classes
+
+    img, anchor = (prediction[..., 4] > conf_thres).nonzero(as_tuple=True)  # candidates
+    x = prediction[img, anchor]
+    conf, j = (x[:, 5:] * x[:, 4:5]).max(1)  # conf = obj_conf * cls_conf
+    keep = conf > conf_thres
+    if classes is not None:
+        keep &= (j[:, None] == torch.tensor(classes, device=x.device)).any(1)
+    img, box, conf, j = img[keep], xywh2xyxy(x[keep, :4]), conf[keep], j[keep]
+
+    groups = img if agnostic else img * nc + j
+    i = torchvision.ops.batched_nms(box, conf, groups, iou_thres)  # sorted by decreasing score
+
+    # limit detections per image, keeping the score order inside each image
+    i = i[torch.sort(img[i], stable=True)[1]]
+    counts = torch.bincount(img[i], minlength=bs)
+    rank = torch.arange(len(i), device=i.device) - (torch.cumsum(counts, 0) - counts).repeat_interleave(counts)
+    i = i[rank < max_det]
+
+    det = torch.cat((box[i], conf[i, None], j[i, None].float()), 1)
+    return list(det.split(torch.bincount(img[i], minlength=bs).tolist()))
+
+
 def xywh2xyxy(x):
     # Convert nx4 boxes from [x, y, w, h] to [x1, y1, x2, y2] where xy1=top-left, xy2=bottom-right
     y = x.clone() if isinstance(x, torch.Tensor) else np.copy(x)
@@ -4,6 +4,7 @@ origin: https://github.com/ultralytics/yolov5/blob/master/utils/dataloaders.py
 
 from .torch_utils import torch_distributed_zero_first
 from .general import xywhn2xyxy, xyxy2xywhn, segments2boxes
+from utils.shards import ShardReader, is_shard_dataset
 
 import torch
 import os
@@ -22,6 +23,7 @@ import math
 import torch.nn.functional as F
 from PIL import ExifTags, Image, ImageOps
 import contextlib
+import time
 for orientation in ExifTags.TAGS.keys():
     if ExifTags.TAGS[orientation] == 'Orientation':
         break
@@ -47,7 +49,9 @@ def create_dataloader(path,
                       quad=False,
                       prefix='',
                       shuffle=False,
-                      seed=0):
+                      seed=0,
+                      persistent_workers=True,
+                      prefetch_factor=4):
     if rect and shuffle:
         print('WARNING ⚠️ --rect is incompatible with DataLoader shuffle, setting shuffle=False')
         shuffle = False
@@ -72,15 +76,17 @@ def create_dataloader(path,
     loader = InfiniteDataLoader  # only DataLoader allows for attribute updates
     generator = torch.Generator()
     generator.manual_seed(6148914691236517205 + seed + -1)
+    worker_kwargs = dict(persistent_workers=persistent_workers, prefetch_factor=prefetch_factor) if nw > 0 else {}
     return loader(dataset,
                   batch_size=batch_size,
                   shuffle=shuffle and sampler is None,
-                  num_workers=0,
+                  num_workers=nw,
                   sampler=sampler,
-                  pin_memory=True,
+                  pin_memory=torch.cuda.is_available(),
                   collate_fn=LoadImagesAndLabels.collate_fn4 if quad else LoadImagesAndLabels.collate_fn,
                   worker_init_fn=seed_worker,
-                  generator=generator), dataset
+                  generator=generator,
+                  **worker_kwargs), dataset
 
 
 class LoadImagesAndLabels(Dataset):
@@ -112,36 +118,45 @@ class LoadImagesAndLabels(Dataset):
         self.path = path
         self.albumentations = None
 
-        try:
-            f = []  # image filess
-            for p in path if isinstance(path, list) else [path]:
-                p = Path(p)  # os-agnostic
-                if p.is_dir():  # dir
-                    f += glob.glob(str(p / '**' / '*.*'), recursive=True)
-                    # f = list(p.rglob('*.*'))  # pathlib
-                elif p.is_file():  # file
-                    with open(p) as t:
-                        t = t.read().strip().splitlines()
-                        parent = str(p.parent) + os.sep
-                        f += [x.replace('./', parent, 1) if x.startswith('./') else x for x in t]  # to global path
-                        # f += [p.parent / x.lstrip(os.sep) for x in t]  # to global path (pathlib)
-                else:
-                    raise FileNotFoundError(f'{prefix}{p} does not exist')
-            self.im_files = sorted(x.replace('/', os.sep) for x in f if x.split('.')[-1].lower() in IMG_FORMATS)
-            # self.img_files = sorted([x for x in f if x.suffix[1:].lower() in IMG_FORMATS])  # pathlib
-            assert self.im_files, f'{prefix}No images found'
-        except Exception as e:
-            raise Exception(f'{prefix}Error loading data from {path}') from e
-
-        # Check cache
-        self.label_files = img2label_paths(self.im_files)  # labels
-        cache_path = (p if p.is_file() else Path(self.label_files[0]).parent).with_suffix('.cache')
-        try:
-            cache, exists = np.load(cache_path, allow_pickle=True).item(), True  # load dict
-            assert cache['version'] == self.cache_version  # matches current version
-            assert cache['hash'] == get_hash(self.label_files + self.im_files)  # identical hash
-        except Exception:
-            cache, exists = self.cache_labels(cache_path, prefix), False  # run cache ops
+        self.shards = None
+        if not isinstance(path, list) and is_shard_dataset(path):
+            # packed images with their labels and sizes (utils.shards.pack_detection_shards), images are read from
+            # the shards by offset and nothing is scanned file by file
+            self.shards = ShardReader(path)
+            self.im_files = list(self.shards.paths)
+            self.label_files = img2label_paths(self.im_files)
+            cache, exists = self.cache_shard_labels(prefix), False
+        else:
+            try:
+                f = []  # image filess
+                for p in path if isinstance(path, list) else [path]:
+                    p = Path(p)  # os-agnostic
+                    if p.is_dir():  # dir
+                        f += glob.glob(str(p / '**' / '*.*'), recursive=True)
+                        # f = list(p.rglob('*.*'))  # pathlib
+                    elif p.is_file():  # file
+                        with open(p) as t:
+                            t = t.read().strip().splitlines()
+                            parent = str(p.parent) + os.sep
+                            f += [x.replace('./', parent, 1) if x.startswith('./') else x for x in t]  # to global path
+                            # f += [p.parent / x.lstrip(os.sep) for x in t]  # to global path (pathlib)
+                    else:
+                        raise FileNotFoundError(f'{prefix}{p} does not exist')
+                self.im_files = sorted(x.replace('/', os.sep) for x in f if x.split('.')[-1].lower() in IMG_FORMATS)
+                # self.img_files = sorted([x for x in f if x.suffix[1:].lower() in IMG_FORMATS])  # pathlib
+                assert self.im_files, f'{prefix}No images found'
+            except Exception as e:
+                raise Exception(f'{prefix}Error loading data from {path}') from e
+
+            # Check cache
+            self.label_files = img2label_paths(self.im_files)  # labels
+            cache_path = (p if p.is_file() else Path(self.label_files[0]).parent).with_suffix('.cache')
+            try:
+                cache, exists = np.load(cache_path, allow_pickle=True).item(), True  # load dict
+                assert cache['version'] == self.cache_version  # matches current version
+                assert cache['hash'] == get_hash(self.label_files + self.im_files)  # identical hash
+            except Exception:
+                cache, exists = self.cache_labels(cache_path, prefix), False  # run cache ops
 
         # Display cache
         nf, nm, ne, nc, n = cache.pop('results')  # found, missing, empty, corrupt, total
@@ -219,29 +234,68 @@ class LoadImagesAndLabels(Dataset):
         # Cache images into RAM/disk for faster training
         if cache_images == 'ram' and not self.check_cache_ram(prefix=prefix):
             cache_images = False
-        self.ims = [None] * n
         self.npy_files = [Path(f).with_suffix('.npy') for f in self.im_files]
-        if cache_images:
+        self.ram_cache = None  # flat shared-memory uint8 buffer, see cache_images_to_ram()
+        if cache_images == 'ram':
+            self.cache_images_to_ram(prefix)
+        elif cache_images and self.shards is None:  # shards are read sequentially, no per image *.npy
             b, gb = 0, 1 << 30  # bytes of cached images, bytes per gigabytes
-            self.im_hw0, self.im_hw = [None] * n, [None] * n
-            fcn = self.cache_images_to_disk if cache_images == 'disk' else self.load_image
-            results = ThreadPool(NUM_THREADS).imap(fcn, range(n))
-            pbar = tqdm(enumerate(results), total=n, bar_format=TQDM_BAR_FORMAT, disable=-1> 0)
+            results = ThreadPool(NUM_THREADS).imap(self.cache_images_to_disk, range(n))
+            pbar = tqdm(enumerate(results), total=n, bar_format=TQDM_BAR_FORMAT)
             for i, x in pbar:
-                if cache_images == 'disk':
-                    b += self.npy_files[i].stat().st_size
-                else:  # 'ram'
-                    self.ims[i], self.im_hw0[i], self.im_hw[i] = x  # im, hw_orig, hw_resized = load_image(self, i)
-                    b += self.ims[i].nbytes
+                b += self.npy_files[i].stat().st_size
                 pbar.desc = f'{prefix}Caching images ({b / gb:.1f}GB {cache_images})'
             pbar.close()
 
+    def cache_images_to_ram(self, prefix=''):
+        # Caches every resized image in one shared-memory tensor so DataLoader worker processes read the same pages
+        # (a list of arrays would be copied into every worker), images are located by offset and resized hw
+        hw0 = self.shapes[:, ::-1].astype(int)  # wh to hw
+        r = self.img_size / hw0.max(1)
+        hw = np.where(r[:, None] != 1, np.ceil(hw0 * r[:, None]), hw0).astype(np.int64)
+        sizes = hw[:, 0] * hw[:, 1] * 3
+        self.ram_offsets = np.concatenate(([0], np.cumsum(sizes)))
+        self.ram_shapes = torch.from_numpy(hw).share_memory_()  # (-1, -1) once an image is found not to fit its slot
+        self.im_hw0 = hw0
+        self.ram_cache = torch.empty(int(self.ram_offsets[-1]), dtype=torch.uint8).share_memory_()
+
+        gb = 1 << 30
+        results = ThreadPool(NUM_THREADS).imap(self._read_image, range(self.n))
+        pbar = tqdm(enumerate(results), total=self.n, bar_format=TQDM_BAR_FORMAT,
+                    desc=f'{prefix}Caching images ({self.ram_offsets[-1] / gb:.1f}GB ram)')
+        missed = 0
+        for i, (im, _, (h, w)) in pbar:
+            if (h, w) != tuple(hw[i]) or im.ndim != 3 or im.shape[2] != 3:
+                self.ram_shapes[i] = -1  # e.g. EXIF-rotated or grayscale, read from disk at access time
+                missed += 1
+                continue
+            o = self.ram_offsets[i]
+            self.ram_cache[o:o + sizes[i]] = torch.from_numpy(np.ascontiguousarray(im).reshape(-1))
+        pbar.close()
+        if missed:
+            print(f'{prefix}WARNING ⚠️ {missed} images did not match their cached shape and will be read from disk')
+
+    def _read_image(self, i):
+        # Reads and resizes image 'i' from disk (or its *.npy), returns (im, original hw, resized hw)
+        f, fn = self.im_files[i], self.npy_files[i]
+        if self.shards is None and fn.exists():  # load npy
+            im = np.load(fn)
+        else:  # read image
+            im = self.imread(f)  # BGR
+            assert im is not None, f'Image Not Found {f}'
+        h0, w0 = im.shape[:2]  # orig hw
+        r = self.img_size / max(h0, w0)  # ratio
+        if r != 1:  # if sizes are not equal
+            interp = cv2.INTER_LINEAR if (self.augment or r > 1) else cv2.INTER_AREA
+            im = cv2.resize(im, (math.ceil(w0 * r), math.ceil(h0 * r)), interpolation=interp)
+        return im, (h0, w0), im.shape[:2]  # im, hw_original, hw_resized
+
     def check_cache_ram(self, safety_margin=0.1, prefix=''):
         # Check image caching requirements vs available memory
         b, gb = 0, 1 << 30  # bytes of cached images, bytes per gigabytes
         n = min(self.n, 30)  # extrapolate from 30 random images
         for _ in range(n):
-            im = cv2.imread(random.choice(self.im_files))  # sample image
+            im = self.imread(random.choice(self.im_files))  # sample image
             ratio = self.img_size / max(im.shape[0], im.shape[1])  # max(h, w)  # ratio
             b += im.nbytes * ratio ** 2
         mem_required = b * self.n / n  # GB required to cache dataset into RAM
@@ -291,6 +345,34 @@ class LoadImagesAndLabels(Dataset):
             print(f'{prefix}WARNING ⚠️ Cache directory {path.parent} is not writeable: {e}')  # not writeable
         return x
 
+    def cache_shard_labels(self, prefix=''):
+        # Labels and image shapes from a shard index, same layout as cache_labels()
+        x = {}
+        nm, nf, ne, nc, msgs = 0, 0, 0, 0, []
+        columns = self.shards.samples
+        for im_file, text, w, h in zip(self.im_files, columns['boxes'], columns['width'], columns['height']):
+            segments = []
+            if text is None:
+                nm += 1
+                lb = np.zeros((0, 5), dtype=np.float32)
+            else:
+                lb = [line.split() for line in text.strip().splitlines() if len(line)]
+                if any(len(line) > 6 for line in lb):  # is segment
+                    classes = np.array([line[0] for line in lb], dtype=np.float32)
+                    segments = [np.array(line[1:], dtype=np.float32).reshape(-1, 2) for line in lb]  # (cls, xy1...)
+                    lb = np.concatenate((classes.reshape(-1, 1), segments2boxes(segments)), 1)  # (cls, xywh)
+                lb = np.array(lb, dtype=np.float32).reshape(-1, 5)
+                nf += 1
+                ne += len(lb) == 0
+            x[im_file] = [lb, (w, h), segments]
+        if nf == 0:
+            print(f'{prefix}WARNING ⚠️ No labels found in {self.path}.')
+        x['hash'] = None
+        x['results'] = nf, nm, ne, nc, len(self.im_files)
+        x['msgs'] = msgs
+        x['version'] = self.cache_version
+        return x
+
     def __len__(self):
         return len(self.im_files)
 
@@ -333,28 +415,26 @@ class LoadImagesAndLabels(Dataset):
 
         return torch.from_numpy(img), labels_out, self.im_files[index], shapes
 
+    def imread(self, f):
+        # BGR image from disk, or from the shards of a packed dataset
+        if self.shards is not None:
+            return cv2.imdecode(np.frombuffer(self.shards.read(f), np.uint8), cv2.IMREAD_COLOR)
+        return cv2.imread(f)
+
     def load_image(self, i):
         # Loads 1 image from dataset index 'i', returns (im, original hw, resized hw)
-        im, f, fn = self.ims[i], self.im_files[i], self.npy_files[i],
-        if im is None:  # not cached in RAM
-            if fn.exists():  # load npy
-                im = np.load(fn)
-            else:  # read image
-                im = cv2.imread(f)  # BGR
-                assert im is not None, f'Image Not Found {f}'
-            h0, w0 = im.shape[:2]  # orig hw
-            r = self.img_size / max(h0, w0)  # ratio
-            if r != 1:  # if sizes are not equal
-                interp = cv2.INTER_LINEAR if (self.augment or r > 1) else cv2.INTER_AREA
-                im = cv2.resize(im, (math.ceil(w0 * r), math.ceil(h0 * r)), interpolation=interp)
-            return im, (h0, w0), im.shape[:2]  # im, hw_original, hw_resized
-        return self.ims[i], self.im_hw0[i], self.im_hw[i]  # im, hw_original, hw_resized
+        if self.ram_cache is not None and self.ram_shapes[i, 0] > 0:  # cached in shared RAM
+            h, w = self.ram_shapes[i].tolist()
+            o = self.ram_offsets[i]
+            im = self.ram_cache[o:o + h * w * 3].numpy().reshape(h, w, 3)
+            return im, tuple(self.im_hw0[i]), (h, w)  # im, hw_original, hw_resized
+        return self._read_image(i)
 
     def cache_images_to_disk(self, i):
         # Saves an image as an *.npy file for faster loading
         f = self.npy_files[i]
         if not f.exists():
-            np.save(f.as_posix(), cv2.imread(self.im_files[i]))
+            np.save(f.as_posix(), self.imread(self.im_files[i]))
 
 
     @staticmethod
@@ -410,6 +490,41 @@ class InfiniteDataLoader(dataloader.DataLoader):
             yield next(self.iterator)
 
 
+def benchmark_dataloader(path,
+                         imgsz=640,
+                         batch_size=16,
+                         workers=8,
+                         cache=False,
+                         augment=False,
+                         num_batches=100,
+                         warmup=5,
+                         **kwargs):
+    """Measures loader throughput (images/sec) on CPU only, no model or GPU involved.
+
+    Returns:
+        dict with the number of workers, images/sec and mean batch latency in ms
+    """
+    loader, dataset = create_dataloader(path, imgsz, batch_size, stride=32, augment=augment, cache=cache,
+                                        workers=workers, shuffle=True, **kwargs)
+    num_batches = min(num_batches, len(loader))
+    iterator = iter(loader)
+    for _ in range(min(warmup, num_batches)):
+        next(iterator)
+
+    images, t = 0, time.perf_counter()
+    for _ in range(num_batches):
+        im, *_ = next(iterator)
+        images += im.shape[0]
+    dt = time.perf_counter() - t
+
+    result = {'workers': loader.num_workers,
+              'images_per_sec': images / dt,
+              'batch_ms': dt / num_batches * 1E3}
+    print(f"workers={result['workers']}: {result['images_per_sec']:.1f} images/sec, "
+          f"{result['batch_ms']:.1f} ms/batch")
+    return result
+
+
 def seed_worker(worker_id):
     # Set dataloader worker seed https://pytorch.org/docs/stable/notes/randomness.html#dataloader
     worker_seed = torch.initial_seed() % 2 ** 32
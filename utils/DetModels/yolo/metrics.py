@@ -48,33 +48,46 @@ def ap_per_class(tp, conf, pred_cls, target_cls, plot=False, save_dir='.', names
     unique_classes, nt = np.unique(target_cls, return_counts=True)
     nc = unique_classes.shape[0]  # number of classes, number of detections
 
-    # Create Precision-Recall curve and compute AP for each class
+    # Create Precision-Recall curve and compute AP for all classes at once
     px, py = np.linspace(0, 1, 1000), []  # for plotting
     ap, p, r = np.zeros((nc, tp.shape[1])), np.zeros((nc, 1000)), np.zeros((nc, 1000))
-    for ci, c in enumerate(unique_classes):
-        i = pred_cls == c
-        n_l = nt[ci]  # number of labels
-        n_p = i.sum()  # number of predictions
-        if n_p == 0 or n_l == 0:
-            continue
 
-        # Accumulate FPs and TPs
-        fpc = (1 - tp[i]).cumsum(0)
-        tpc = tp[i].cumsum(0)
+    # Group the predictions by class, keeping the objectness order inside every class
+    ci = np.searchsorted(unique_classes, pred_cls)
+    known = (ci < nc) & (unique_classes[np.minimum(ci, max(nc - 1, 0))] == pred_cls) if nc else ci < 0
+    idx = np.nonzero(known)[0]
+    idx = idx[np.argsort(ci[idx], kind='stable')]
+    ci, tpk, confk = ci[idx], tp[idx].astype(float), conf[idx]
+    n_p = np.bincount(ci, minlength=nc)  # number of predictions per class
+    starts = np.cumsum(n_p) - n_p
+    has = n_p > 0
+
+    if has.any():
+        # Accumulate FPs and TPs inside each class
+        cs = tpk.cumsum(0)
+        tpc = cs - np.repeat(np.concatenate((np.zeros((1, cs.shape[1])), cs))[starts], n_p, 0)
+        pos = np.arange(len(ci)) - np.repeat(starts, n_p)  # rank inside the class
+        fpc = (pos + 1)[:, None] - tpc
 
         # Recall
-        recall = tpc / (n_l + eps)  # recall curve
-        r[ci] = np.interp(-px, -conf[i], recall[:, 0], left=0)  # negative x, xp because xp decreases
+        recall = tpc / (np.repeat(nt, n_p)[:, None] + eps)  # recall curve
+        r[has] = interp_grouped(-px, -confk, recall[:, 0], starts[has], n_p[has], left=0)
 
         # Precision
         precision = tpc / (tpc + fpc)  # precision curve
-        p[ci] = np.interp(-px, -conf[i], precision[:, 0], left=1)  # p at pr_score
-
-        # AP from recall-precision curve
-        for j in range(tp.shape[1]):
-            ap[ci, j], mpre, mrec = compute_ap(recall[:, j], precision[:, j])
-            if plot and j == 0:
-                py.append(np.interp(px, mrec, mpre))  # precision at mAP@0.5
+        p[has] = interp_grouped(-px, -confk, precision[:, 0], starts[has], n_p[has], left=1)
+
+        # AP from recall-precision curve, one padded row per (class, IoU level)
+        rows = np.cumsum(has) - 1
+        nh, nl, width = int(has.sum()), tp.shape[1], int(n_p.max()) + 2
+        mrec, mpre = np.ones((nh, nl, width)), np.zeros((nh, nl, width))
+        mrec[..., 0], mpre[..., 0] = 0.0, 1.0
+        mrec[rows[ci], :, pos + 1] = recall
+        mpre[rows[ci], :, pos + 1] = precision
+        ap[has], mpre, mrec = compute_ap_batched(mrec, mpre)
+        if plot:
+            py = list(interp_grouped(px, mrec[:, 0].reshape(-1), mpre[:, 0].reshape(-1),
+                                     np.arange(nh) * width, np.full(nh, width)))  # precision at mAP@0.5
 
     # Compute F1 (harmonic mean of precision and recall)
     f1 = 2 * p * r / (p + r + eps)
@@ -121,6 +134,56 @@ def compute_ap(recall, precision):
     return ap, mpre, mrec
 
 
+def interp_grouped(x, xp, fp, starts, lengths, left=None):
+    """ np.interp(x, xp[s:s + n], fp[s:s + n], left=left) for every group (s, n) with a single searchsorted
+    # Arguments
+        x:       Query points shared by all groups, within [-1, 1]
+        xp:      Concatenated x-coordinates, increasing inside each group, within [-1, 1]
+        fp:      Concatenated y-coordinates
+        starts:  Start of every group in xp
+        lengths: Length of every group, > 0
+    # Returns
+        Interpolated values (groups, len(x))
+    """
+    starts, lengths = np.asarray(starts), np.asarray(lengths)
+    groups = np.arange(len(starts))
+    key = xp + 4 * np.repeat(groups, lengths)  # shift every group to its own range, keeps the whole key sorted
+    j = np.searchsorted(key, x[None] + 4 * groups[:, None], side='right') - 1  # last xp <= x
+    first, last = starts[:, None], (starts + lengths - 1)[:, None]
+    j0 = np.clip(j, first, last)
+    j1 = np.minimum(j0 + 1, last)
+    x0, x1, y0, y1 = xp[j0], xp[j1], fp[j0], fp[j1]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        y = np.where(x1 > x0, y0 + (x[None] - x0) * (y1 - y0) / (x1 - x0), y0)
+    y = np.where(j >= last, fp[last], y)  # right of the curve
+    if left is not None:
+        y = np.where(j < first, left, y)
+    else:
+        y = np.where(j < first, fp[first], y)
+    return y
+
+
+def compute_ap_batched(mrec, mpre):
+    """ compute_ap for many curves at once
+    # Arguments
+        mrec:    Recall curves with sentinels (..., L), padded after the end sentinel with 1.0
+        mpre:    Precision curves with sentinels (..., L), padded after the end sentinel with 0.0
+    # Returns
+        Average precision (...), precision envelope, recall curves
+    """
+
+    # Compute the precision envelope
+    mpre = np.flip(np.maximum.accumulate(np.flip(mpre, -1), -1), -1)
+
+    # Integrate area under curve, 101-point interp (COCO)
+    shape, width = mrec.shape[:-1], mrec.shape[-1]
+    n = int(np.prod(shape))
+    x = np.linspace(0, 1, 101)
+    y = interp_grouped(x, mrec.reshape(-1), mpre.reshape(-1), np.arange(n) * width, np.full(n, width))
+    ap = np.trapz(y, x, axis=-1).reshape(shape)  # integrate
+    return ap, mpre, mrec
+
+
 class ConfusionMatrix:
     # Updated version of https://github.com/kaanakan/object_detection_confusion_matrix
     def __init__(self, nc, conf=0.25, iou_thres=0.45):
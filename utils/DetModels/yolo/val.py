@@ -71,27 +71,29 @@ def save_one_json(predn, jdict, path, class_map):
 
 def process_batch(detections, labels, iouv):
     """
-    Return correct prediction matrix
+    Return correct prediction matrix, all IoU levels are matched at once on the detections' device.
+    Each detection is assigned to its highest-IoU label of the same class, then every label keeps the first
+    (lowest index) detection assigned to it whose IoU passes the level, as the former per-level numpy matcher did.
     Arguments:
         detections (array[N, 6]), x1, y1, x2, y2, conf, class
         labels (array[M, 5]), class, x1, y1, x2, y2
     Returns:
         correct (array[N, 10]), for 10 IoU levels
     """
-    correct = np.zeros((detections.shape[0], iouv.shape[0])).astype(bool)
-    iou = box_iou(labels[:, 1:], detections[:, :4])
-    correct_class = labels[:, 0:1] == detections[:, 5]
-    for i in range(len(iouv)):
-        x = torch.where((iou >= iouv[i]) & correct_class)  # IoU > threshold and classes match
-        if x[0].shape[0]:
-            matches = torch.cat((torch.stack(x, 1), iou[x[0], x[1]][:, None]), 1).cpu().numpy()  # [label, detect, iou]
-            if x[0].shape[0] > 1:
-                matches = matches[matches[:, 2].argsort()[::-1]]
-                matches = matches[np.unique(matches[:, 1], return_index=True)[1]]
-                # matches = matches[matches[:, 2].argsort()[::-1]]
-                matches = matches[np.unique(matches[:, 0], return_index=True)[1]]
-            correct[matches[:, 1].astype(int), i] = True
-    return torch.tensor(correct, dtype=torch.bool, device=iouv.device)
+    n, m, t = detections.shape[0], labels.shape[0], iouv.shape[0]
+    if not n or not m:
+        return torch.zeros((n, t), dtype=torch.bool, device=iouv.device)
+
+    iou = box_iou(labels[:, 1:], detections[:, :4]) * (labels[:, 0:1] == detections[:, 5])  # 0 if classes differ
+    best_iou, best_label = iou.max(0)  # best label of every detection
+    valid = best_iou[:, None] >= iouv[None]  # (N, T)
+
+    det_index = torch.arange(n, device=iou.device)[:, None].expand(n, t)
+    label_index = best_label[:, None].expand(n, t)
+    first = torch.full((m, t), n, dtype=det_index.dtype, device=iou.device).scatter_reduce(
+        0, label_index, torch.where(valid, det_index, n), reduce='amin')  # first valid detection of every label
+    correct = valid & (first.gather(0, label_index) == det_index)
+    return correct.to(iouv.device)
 
 
 @smart_inference_mode()
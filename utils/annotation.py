@@ -0,0 +1,152 @@
+"""Draw inference results on images and save them without blocking the inference thread
+"""
+import os
+import json
+import threading
+from functools import lru_cache
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image, ImageDraw, ImageFont
+
+
+DEFAULT_FONT = "asset/NotoSerifCJK-VF.otf.ttc"
+
+
+@lru_cache(maxsize=16)
+def load_font(font: str = DEFAULT_FONT, font_size: int = 45):
+    """
+    Load a font once per (file, size), falls back to PIL's default font if the file is missing.
+
+    :param font: font file path.
+    :param font_size: font size.
+    :return: PIL font object.
+    """
+    try:
+        return ImageFont.truetype(font, font_size)
+    except OSError:
+        try:
+            return ImageFont.load_default(font_size)
+        except TypeError:  # Pillow < 10.1
+            return ImageFont.load_default()
+
+
+class ResultAnnotator:
+    """
+    Annotates inference results and writes them with a background pool.
+
+    Rendered texts are cached as alpha masks, so labelling an image is a single paste instead of a glyph
+    rasterization. In 'sidecar' mode nothing is drawn, results are written as JSON files next to the outputs.
+
+    Args:
+        mode (str): 'burn' to draw the label on the image, 'sidecar' to write JSON sidecars instead.
+        font (str): font file path.
+        font_size (int): font size.
+        text_color (tuple): text color.
+        position (tuple): top-left position of the text.
+        workers (int): number of writer threads.
+        cache_size (int): maximum number of cached text masks.
+    """
+
+    def __init__(self,
+                 mode: str = 'burn',
+                 font: str = DEFAULT_FONT,
+                 font_size: int = 45,
+                 text_color=(255, 0, 0),
+                 position=(40, 40),
+                 workers: int = 2,
+                 cache_size: int = 1024
+                 ):
+        if mode not in ('burn', 'sidecar'):
+            raise ValueError(f"Unsupported annotation mode: {mode}")
+        self.mode = mode
+        self.font = load_font(font, font_size)
+        self.text_color = text_color
+        self.position = position
+        self.cache_size = cache_size
+        self._masks = OrderedDict()
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='annotation')
+        self._pending = []
+
+    @staticmethod
+    def format(res, probability=None):
+        return res if probability is None else res + f" {probability:.2f}%"
+
+    def text_mask(self, text):
+        """Return the cached 'L' mask of `text`."""
+        with self._lock:
+            mask = self._masks.get(text)
+            if mask is not None:
+                self._masks.move_to_end(text)
+                return mask
+
+        left, top, right, bottom = self.font.getbbox(text)
+        mask = Image.new('L', (max(right, 1), max(bottom, 1)), 0)
+        ImageDraw.Draw(mask).text((0, 0), text, fill=255, font=self.font)
+
+        with self._lock:
+            self._masks[text] = mask
+            if len(self._masks) > self.cache_size:
+                self._masks.popitem(last=False)
+        return mask
+
+    def draw(self, image, res, probability=None, position=None, text_color=None):
+        """
+        Draw the result on `image` in place.
+
+        :param image: PIL image.
+        :param res: result label.
+        :param probability: confidence in percent, None to draw the label only.
+        :return: the annotated image.
+        """
+        mask = self.text_mask(self.format(res, probability))
+        x, y = position or self.position
+        image.paste(text_color or self.text_color, (x, y, x + mask.width, y + mask.height), mask)
+        return image
+
+    def save(self, image, path, result=None):
+        """
+        Queue the result of one image for writing.
+
+        :param image: PIL image to encode (ignored in 'sidecar' mode).
+        :param path: output image path, the sidecar uses the same name with a .json extension.
+        :param result: dict describing the result, drawn on the image in 'burn' mode (keys 'class' and
+                       'probability') or dumped as-is in 'sidecar' mode.
+        """
+        if self.mode == 'sidecar':
+            self.submit(_write_json, os.path.splitext(path)[0] + '.json', result or {})
+        else:
+            if result is not None:
+                self.draw(image, result.get('class', ''), result.get('probability'))
+            self.submit(image.save, path)
+
+    def submit(self, fn, *args, **kwargs):
+        self._pending = [f for f in self._pending if not f.done() or f.exception()]
+        self._pending.append(self._pool.submit(fn, *args, **kwargs))
+
+    def flush(self):
+        """Wait for every queued write and re-raise the first error."""
+        pending, self._pending = self._pending, []
+        for future in pending:
+            future.result()
+
+    def close(self):
+        self.flush()
+        self._pool.shutdown(wait=True)
+
+
+def _write_json(path, content):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(content, f, ensure_ascii=False, indent=2)
+
+
+# Usage-------------------------------------------------------------
+def main():
+    annotator = ResultAnnotator()
+    image = Image.new('RGB', (640, 480))
+    annotator.save(image, 'test.jpg', {'class': 'DJI MAVIC3', 'probability': 99.12})
+    annotator.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,27 +1,26 @@
 import torch
 import torch.nn as nn
 from utils.trainer import model_init_
+from utils.shards import ShardDataset, is_shard_dataset, load_index
+from utils.benchmark_store import BenchmarkStore, weights_hash, git_commit
 from utils.build import check_cfg, build_from_cfg
 import os
 import glob
 from torchvision import transforms, datasets
-from PIL import Image, ImageDraw, ImageFont
+from PIL import Image, ImageDraw
 import time
-from graphic.RawDataProcessor import generate_images
-import imageio
+from graphic.RawDataProcessor import iter_images, VideoStreamWriter
+from utils.annotation import ResultAnnotator, load_font, DEFAULT_FONT
+from SNREstimation.SNR_estimation import EnergyGate
 import sys
 import cv2
 import numpy as np
-from torch.utils.data import DataLoader
+from torch.utils.data import DataLoader, ConcatDataset
 from scipy.optimize import linear_sum_assignment
-
-try:
-    from DetModels import YOLOV5S
-    from DetModels.yolo.basic import LoadImages, Profile, Path, non_max_suppression, Annotator, scale_boxes, colorstr, \
-        Colors, letterbox
-
-except ImportError:
-    pass
+from torchvision.ops import roi_align
+import json
+import csv
+import re
 
 
 # Current directory and metric directory
@@ -32,6 +31,14 @@ sys.path.append(METRIC)
 sys.path.append(current_dir)
 sys.path.append('utils/DetModels/yolo')
 
+try:
+    from DetModels import YOLOV5S
+    from DetModels.yolo.basic import LoadImages, Profile, Path, non_max_suppression, Annotator, scale_boxes, colorstr, \
+        Colors, letterbox, LoadImagesBatched, batched_non_max_suppression
+
+except ImportError:
+    pass
+
 try:
     from .metrics.base_metric import EVAMetric
 except ImportError:
@@ -43,6 +50,8 @@ from logger import colorful_logger
 # Supported image and raw data extensions
 image_ext = ['.jpg', '.jpeg', '.png', '.gif', '.bmp', '.tiff']
 raw_data_ext = ['.iq', '.dat']
+# benchmark precision modes -> autocast dtype
+PRECISIONS = {'fp32': None, 'fp16': torch.float16, 'bf16': torch.bfloat16}
 
 class Classify_Model(nn.Module):
     """
@@ -55,12 +64,15 @@ class Classify_Model(nn.Module):
     - model (torch.nn.Module): Pre-trained model.
     - save_path (str): Path to save the results.
     - save (bool): Flag to indicate whether to save the results.
+    - annotator (ResultAnnotator): Draws the results and writes them in the background.
     """
 
     def __init__(self,
                  cfg: str = '../configs/exp1_test.yaml',
                  weight_path: str = '../default.path',
                  save: bool = True,
+                 annotation: str = None,
+                 device: str = None,
                  ):
 
         """
@@ -70,6 +82,9 @@ class Classify_Model(nn.Module):
         - cfg (str): Path to configuration dictionary.
         - weight_path (str): Path to the pre-trained model weights.
         - save (bool): Flag to indicate whether to save the results.
+        - annotation (str): 'burn' to draw the results on the outputs, 'sidecar' to write JSON files instead,
+          defaults to the `annotation` key of the config or 'burn'.
+        - device (str): overrides the `device` key of the config, e.g. 'cpu' to profile for edge deployment.
         """
 
         super().__init__()
@@ -78,11 +93,12 @@ class Classify_Model(nn.Module):
         if check_cfg(cfg):
             self.logger.log_with_color(f"Using config file: {cfg}")
             self.cfg = build_from_cfg(cfg)
+        if device is not None:
+            self.cfg['device'] = device
 
-        if self.cfg['device'] == 'cuda':
-            if torch.cuda.is_available():
-                self.logger.log_with_color("Using GPU for inference")
-                self.device = self.cfg['device']
+        if str(self.cfg['device']).startswith('cuda') and torch.cuda.is_available():
+            self.logger.log_with_color("Using GPU for inference")
+            self.device = self.cfg['device']
         else:
             self.logger.log_with_color("Using CPU for inference")
             self.device = "cpu"
@@ -99,6 +115,13 @@ class Classify_Model(nn.Module):
         self.save_path = None
 
         self.save = save
+        self.annotator = ResultAnnotator(mode=annotation or self.cfg.get('annotation', 'burn'))
+
+        # energy pre-gate, windows below the threshold are labelled "no signal" without running the classifier
+        self.gate = None
+        if self.cfg.get('energy_gate'):
+            self.gate = EnergyGate(threshold_db=self.cfg.get('gate_threshold_db', 3.0))
+            self.logger.log_with_color(f"Energy gate enabled, threshold: {self.gate.threshold_db} dB")
 
     def inference(self, source='../example/', save_path: str = '../result'):
         """
@@ -140,6 +163,18 @@ class Classify_Model(nn.Module):
         elif is_valid_file(source, raw_data_ext):
             self.RawdataProcess(source)
 
+        # wait for the background writers
+        self.annotator.flush()
+
+    def close(self):
+
+        """
+        Wait for the queued writes and shut down the background writer threads, call it once the model is no longer
+        used.
+        """
+
+        self.annotator.close()
+
     def forward(self, img):
 
         """
@@ -171,14 +206,21 @@ class Classify_Model(nn.Module):
         """
 
         self.logger.log_with_color(f"Using device: {self.device}")
-        model = model_init_(self.cfg['model'], self.cfg['num_classes'], pretrained=True)
 
         if os.path.exists(self.weight_path):
             self.logger.log_with_color(f"Loading init weights from: {self.weight_path}")
-            state_dict = torch.load(self.weight_path, map_location=self.device)
+            if self.cfg.get('pruned', False):
+                # whole module exported by `utils.pruning`, its shape differs from model_init_. Unpickling runs
+                # arbitrary code, only the configs written by the pruning export opt into it
+                model = torch.load(self.weight_path, map_location=self.device, weights_only=False)
+                self.logger.log_with_color(f"Loaded pruned model from: {self.weight_path}")
+                return model
+            state_dict = torch.load(self.weight_path, map_location=self.device, weights_only=True)
+            model = model_init_(self.cfg['model'], self.cfg['num_classes'], pretrained=False)
             model.load_state_dict(state_dict)
             self.logger.log_with_color(f"Successfully loaded pretrained weights from: {self.weight_path}")
         else:
+            model = model_init_(self.cfg['model'], self.cfg['num_classes'], pretrained=True)
             self.logger.log_with_color(f"init weights file not found at: {self.weight_path}. Skipping weight loading.")
 
         return model
@@ -195,9 +237,10 @@ class Classify_Model(nn.Module):
 
         name = os.path.basename(source)[:-4]
         origin_image = Image.open(source).convert('RGB')
-        preprocessed_image = self.preprocess(source)
+        preprocessed_image = self.preprocess(origin_image)
 
-        temp = self.model(preprocessed_image)
+        with torch.no_grad():
+            temp = self.model(preprocessed_image)
 
         probabilities = torch.softmax(temp, dim=1)
 
@@ -211,11 +254,10 @@ class Classify_Model(nn.Module):
                                    f" start saving result")
 
         if self.save:
-            res = self.add_result(res=predicted_class_name,
-                                  probability=probabilities[0][predicted_class_index].item() * 100,
-                                  image=origin_image)
-
-            res.save(os.path.join(self.save_path, name + '.jpg'))
+            self.annotator.save(origin_image, os.path.join(self.save_path, name + '.jpg'),
+                                {'source': source,
+                                 'class': predicted_class_name,
+                                 'probability': probabilities[0][predicted_class_index].item() * 100})
 
     def RawdataProcess(self, source):
         """
@@ -224,24 +266,50 @@ class Classify_Model(nn.Module):
         Parameters:
         - source (str): Path to the raw data.
         """
-        res = []
-        images = generate_images(source)
-        name = os.path.splitext(os.path.basename(source))
-
-        for image in images:
-            temp = self.model(self.preprocess(image))
-
-            probabilities = torch.softmax(temp, dim=1)
-
-            predicted_class_index = torch.argmax(probabilities, dim=1).item()
-            predicted_class_name = get_key_from_value(self.cfg['class_names'], predicted_class_index)
-
-            _ = self.add_result(res=predicted_class_name,
-                                probability=probabilities[0][predicted_class_index].item() * 100,
-                                image=image)
-            res.append(_)
-
-        imageio.mimsave(os.path.join(self.save_path, name + '.mp4'), res, fps=5)
+        gated_before = self.gate.gated if self.gate else 0
+        total_before = self.gate.total if self.gate else 0
+        name = os.path.splitext(os.path.basename(source))[0]
+        frame_size = (1920, 1440)
+        writer = VideoStreamWriter(os.path.join(self.save_path, name + '.mp4'), fps=5) if self.save else None
+        sidecar = self.annotator.mode == 'sidecar'
+        results = []
+
+        try:
+            with torch.no_grad():
+                for image in iter_images(source, gate=self.gate):
+                    if image is None:
+                        _ = Image.new('RGB', frame_size)
+                        results.append({'window': len(results), 'class': 'no signal', 'probability': None})
+                    else:
+                        frame_size = image.size
+                        temp = self.model(self.preprocess(image))
+
+                        probabilities = torch.softmax(temp, dim=1)
+
+                        predicted_class_index = torch.argmax(probabilities, dim=1).item()
+                        predicted_class_name = get_key_from_value(self.cfg['class_names'], predicted_class_index)
+
+                        _ = image.convert('RGB')
+                        results.append({'window': len(results),
+                                        'class': predicted_class_name,
+                                        'probability': probabilities[0][predicted_class_index].item() * 100})
+                    if writer:
+                        if not sidecar:
+                            self.annotator.draw(_, results[-1]['class'], results[-1]['probability'])
+                        writer.write(_)
+        finally:
+            if writer:
+                writer.close()
+
+        if self.save and sidecar:
+            self.annotator.save(None, os.path.join(self.save_path, name + '.mp4'),
+                                {'source': source, 'windows': results})
+
+        if self.gate:
+            windows = self.gate.total - total_before
+            gated = self.gate.gated - gated_before
+            self.logger.log_with_color(f"Energy gate: {gated}/{windows} windows without signal skipped"
+                                       f" ({gated / max(windows, 1) * 100:.1f}%)")
 
     def add_result(self,
                    res,
@@ -262,14 +330,16 @@ class Classify_Model(nn.Module):
         - font (str): Font file path.
         - font_size (int): Font size.
         - text_color (tuple): Text color.
-        - probability (float): Confidence probability.
+        - probability (float): Confidence probability, None to draw the result only.
 
         Returns:
         - image (PIL.Image): Image with added result.
         """
+        if font == DEFAULT_FONT and font_size == 45:
+            return self.annotator.draw(image, res, probability, position, text_color)
+
         draw = ImageDraw.Draw(image)
-        font = ImageFont.truetype(font, font_size)
-        draw.text(position, res + f" {probability:.2f}%", fill=text_color, font=font)
+        draw.text(position, ResultAnnotator.format(res, probability), fill=text_color, font=load_font(font, font_size))
 
         return image
 
@@ -291,7 +361,7 @@ class Classify_Model(nn.Module):
             transforms.ToTensor(),
         ])
 
-        image = Image.open(img).convert('RGB')
+        image = img.convert('RGB') if isinstance(img, Image.Image) else Image.open(img).convert('RGB')
         preprocessed_image = transform(image)
 
         preprocessed_image = preprocessed_image.to(self.device)
@@ -299,96 +369,282 @@ class Classify_Model(nn.Module):
 
         return preprocessed_image
 
-    def benchmark(self, data_path, save_path=None):
+    def profile(self, batch_size: int = 1, warmup: int = 10, iters: int = 50):
 
         """
-        Performs benchmarking on the given data and calculates evaluation metrics.
+        Measures the forward latency of the model on its device with random inputs.
 
         Parameters:
-        - data_path (str): Path to the benchmark data.
+        - batch_size (int): images per forward.
+        - warmup (int): untimed forwards before measuring.
+        - iters (int): timed forwards.
 
         Returns:
-        - metrics (dict): Dictionary containing evaluation metrics.
+        - dict: latency_ms (per forward), throughput (images/s) and params_m (millions of parameters).
+        """
+
+        return measure_latency(self.model, self.cfg['image_size'], self.device, batch_size, warmup, iters)
+
+    def benchmark(self, data_path, save_path=None, num_workers=None, plot=True, plot_workers=None, precision='fp32',
+                  store=None, name=None):
+
         """
-        snrs = os.listdir(data_path)
+        Performs benchmarking on the given data and calculates evaluation metrics.
+
+        Every (SNR, CM) subset is enumerated up front and evaluated in a single pass of one multi-worker loader, the
+        logits are accumulated into one tensor and sliced per subset to compute its metrics. The confusion matrices
+        are plotted afterwards in a process pool and the results are written to `benchmark_result.json` and
+        `benchmark_result.csv`, and recorded in a `utils.benchmark_store.BenchmarkStore` when `store` is given.
 
+        Parameters:
+        - data_path (str): Path to the benchmark data, `snr/CM/class` folders or a packed shard directory
+          (evaluated per SNR bucket of its index).
+        - save_path (str): Result directory, default is `<data_path>/benchmark result`.
+        - num_workers (int): DataLoader worker processes, default is min(8, CPU count).
+        - plot (bool): Plot the confusion matrix of every subset.
+        - plot_workers (int): Plotting processes, see `plot_confusion_matrices`.
+        - precision (str): 'fp32', or 'fp16' / 'bf16' to run the forwards under autocast.
+        - store (str): Benchmark store database to record the run in.
+        - name (str): Run name in the store.
+
+        Returns:
+        - report (dict): Per-subset metrics, throughput and per-batch latency percentiles, see
+          `benchmark_result.json`. `run_id` is the id of the run in `store`.
+        """
+        if precision not in PRECISIONS:
+            raise ValueError(f"precision must be one of {list(PRECISIONS)}, got {precision}")
         if not save_path:
             save_path = os.path.join(data_path, 'benchmark result')
-            if not os.path.exists(save_path): os.mkdir(save_path)
+        os.makedirs(save_path, exist_ok=True)
+        if num_workers is None:
+            num_workers = min(8, os.cpu_count() or 1)
 
-        if not os.path.exists(save_path):
-            os.mkdir(save_path)
-        #根据得到映射关系写下面的，我得到的是★ 最佳映射 pred → gt: {0: 2, 1: 1, 2: 3, 3: 4, 4: 0}
-        #MAP_P2G=torch.tensor([2,1,3,4,0],device=self.cfg['device'])
-        #INV_MAP=torch.argsort(MAP_P2G)
-        with torch.no_grad():
-            for snr in snrs:
-                CMS = os.listdir(os.path.join(data_path, snr))
-                for CM in CMS:
-                    stat_time = time.time()
-                    self.model.eval()
-                    _dataset = datasets.ImageFolder(
-                        root=os.path.join(data_path, snr, CM),
-                        transform=transforms.Compose([
-                        transforms.Resize((self.cfg['image_size'], self.cfg['image_size'])),
-                        transforms.ToTensor(),])
-                    )
-                    dataset = DataLoader(_dataset, batch_size=self.cfg['batch_size'], shuffle=self.cfg['shuffle'])
-                    print("Starting Benchmark...")
-
-                    correct = 0
-                    total = 0
-                    probabilities = []
-                    total_labels = []
-                    classes_name = tuple(self.cfg['class_names'].keys())
-                    cm_raw = np.zeros((5, 5), dtype=int)
-                    for images, labels in dataset:
-                        images, labels = images.to(self.cfg['device']), labels.to(self.cfg['device'])
-                        outputs = self.model(images)
-                        #outputs=outputs[:,INV_MAP]
-                        #probs =torch.softmax(outputs,dim=1)
-                        for output in outputs:
-                            probabilities.append(list(torch.softmax(output, dim=0)))
-                        _, predicted = outputs.max(1)
-                        for p, t in zip(predicted.cpu(), labels.cpu()):
-                            cm_raw[p,t]+=1
-                        cm_raw[p, t] += 1   # 行 = pred, 列 = gt
-                        total += labels.size(0)
-                        correct += predicted.eq(labels).sum().item()
-                        total_labels.append(labels)
-                    _total_labels = torch.concat(total_labels, dim=0)
-                    _probabilities = torch.tensor(probabilities)
-
-                    metrics = EVAMetric(preds=_probabilities.to(self.cfg['device']),
-                                        labels=_total_labels,
-                                        num_classes=self.cfg['num_classes'],
-                                        tasks=('f1', 'precision', 'CM'),
-                                        topk=(1, 3, 5),
-                                        save_path=save_path,
-                                        classes_name=classes_name,
-                                        pic_name=f'{snr}_{CM}')
-                    metrics['acc'] = 100 * correct / total
-
-                    s = (f'{snr} ' + f'CM: {CM} eva result:' + ' acc: ' + f'{metrics["acc"]}' + ' top-1: ' +
-                         f'{metrics["Top-k"]["top1"]}' + ' top-1: ' + f'{metrics["Top-k"]["top1"]}' +
-                         ' top-2 ' + f'{metrics["Top-k"]["top2"]}' + ' top-3 ' + f'{metrics["Top-k"]["top3"]}' +
-                         ' mAP: ' + f'{metrics["mAP"]["mAP"]}' + ' macro_f1: ' + f'{metrics["f1"]["macro_f1"]}' +
-                         ' micro_f1 : ' + f' {metrics["f1"]["micro_f1"]}\n')
-                    txt_path = os.path.join(save_path, 'benchmark_result.txt')
-                    colorful_logger(f'cost {(time.time()-stat_time)/60} mins')
-                    with open(txt_path, 'a') as file:
-                        file.write(s)
-
-                print(f'{CM} Done!')
-            print(f'{snr} Done!')
-        row_ind, col_ind = linear_sum_assignment(-cm_raw)   # 取负→最大化对角线
+        transform = transforms.Compose([
+            transforms.Resize((self.cfg['image_size'], self.cfg['image_size'])),
+            transforms.ToTensor(),
+        ])
+        num_classes = self.cfg['num_classes']
+        classes_name = tuple(self.cfg['class_names'].keys())
+        dataset, subsets, subset_ids = benchmark_dataset(data_path, transform, self.cfg['class_names'],
+                                                         batch_size=self.cfg['batch_size'])
+        if not len(dataset):
+            raise FileNotFoundError(f"No benchmark images found in {data_path}")
+        self.logger.log_with_color(f"Benchmarking {len(dataset)} images in {len(subsets)} subsets")
+        # the subset of a sample is known by its position, the loader keeps the dataset order
+        loader = DataLoader(dataset, batch_size=self.cfg['batch_size'], shuffle=False, num_workers=num_workers,
+                            pin_memory=str(self.device).startswith('cuda'))
+
+        device_type = 'cuda' if str(self.device).startswith('cuda') else 'cpu'
+        sync = torch.cuda.synchronize if device_type == 'cuda' else (lambda: None)
+        start_time = time.time()
+        logits, targets, latency = [], [], []
+        self.model.eval()
+        with torch.no_grad(), torch.autocast(device_type, dtype=PRECISIONS[precision],
+                                             enabled=PRECISIONS[precision] is not None):
+            for images, labels in loader:
+                images = images.to(self.device, non_blocking=True)
+                sync()
+                forward_start = time.perf_counter()
+                outputs = self.model(images)
+                sync()
+                latency.append((time.perf_counter() - forward_start) * 1000)
+                logits.append(outputs.float().cpu())
+                targets.append(labels)
+        duration = time.time() - start_time
+        latency = np.array(latency[1:] if len(latency) > 1 else latency)  # the first forward warms up
+        logits, targets = torch.cat(logits), torch.cat(targets)
+        probabilities = torch.softmax(logits, dim=1)
+        predicted = probabilities.argmax(dim=1)
+        subset_ids = torch.as_tensor(subset_ids)
+
+        results, matrices = [], {}
+        cm_total = np.zeros((num_classes, num_classes), dtype=np.int64)
+        for k, (snr, CM) in enumerate(subsets):
+            mask = subset_ids == k
+            if not mask.any():
+                continue
+            preds, labels = predicted[mask].numpy(), targets[mask].numpy()
+            cm = np.bincount(preds * num_classes + labels, minlength=num_classes ** 2).reshape(num_classes,
+                                                                                               num_classes)  # 行 = pred, 列 = gt
+            cm_total += cm
+            matrices[f'{snr}_{CM}'] = cm
+            metrics = EVAMetric(preds=probabilities[mask], labels=targets[mask], num_classes=num_classes,
+                                tasks=('f1', 'precision'), topk=(1, 3, 5), save_path=save_path,
+                                classes_name=classes_name)
+            result = {'snr': snr, 'cm': CM, 'samples': int(mask.sum()),
+                      'acc': 100 * float((preds == labels).mean()),
+                      **{name: float(value) for name, value in metrics['Top-k'].items()},
+                      'mAP': float(metrics['mAP']['mAP']),
+                      'macro_f1': float(metrics['f1']['macro_f1']),
+                      'micro_f1': float(metrics['f1']['micro_f1']),
+                      'confusion_matrix': cm.tolist()}
+            results.append(result)
+            self.logger.log_with_color(f"{snr} CM: {CM} acc: {result['acc']:.2f} mAP: {result['mAP']:.4f} "
+                                       f"macro_f1: {result['macro_f1']:.4f}")
+
+        row_ind, col_ind = linear_sum_assignment(-cm_total)   # 取负→最大化对角线
         mapping_pred2gt = {int(r): int(c) for r, c in zip(row_ind, col_ind)}
-        print("\n★ 最佳映射 pred → gt:", mapping_pred2gt)
-        
-        # 若要保存下来以后用：
-        import json
-        json.dump(mapping_pred2gt, open('class_to_idx_pred2gt.json', 'w'))
-        print("映射已保存到 class_to_idx_pred2gt.json")
+        self.logger.log_with_color(f"最佳映射 pred → gt: {mapping_pred2gt}")
+        with open(os.path.join(save_path, 'class_to_idx_pred2gt.json'), 'w') as f:
+            json.dump(mapping_pred2gt, f)
+
+        report = {
+            'model': self.cfg['model'],
+            'weight_path': os.path.abspath(self.weight_path),
+            'weight_hash': weights_hash(self.weight_path),
+            'git_commit': git_commit(),
+            'precision': precision,
+            'data_path': os.path.abspath(data_path),
+            'device': str(self.device),
+            'batch_size': self.cfg['batch_size'],
+            'image_size': self.cfg['image_size'],
+            'classes': list(classes_name),
+            'samples': len(targets),
+            'acc': 100 * float((predicted == targets).float().mean()),
+            'duration_s': round(duration, 2),
+            'throughput': round(len(targets) / max(duration, 1e-9), 2),
+            'latency_ms': {'mean': round(float(latency.mean()), 3),
+                           **{f'p{q}': round(float(np.percentile(latency, q)), 3) for q in (50, 90, 99)}},
+            'mapping_pred2gt': mapping_pred2gt,
+            'subsets': results,
+        }
+        if store:
+            report['run_id'] = BenchmarkStore(store).record(report, name=name)
+            self.logger.log_with_color(f"Benchmark run {report['run_id']} recorded in {store}")
+        with open(os.path.join(save_path, 'benchmark_result.json'), 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        columns = ['snr', 'cm', 'samples', 'acc', 'top1', 'top2', 'top3', 'mAP', 'macro_f1', 'micro_f1']
+        with open(os.path.join(save_path, 'benchmark_result.csv'), 'w', newline='', encoding='utf-8') as f:
+            writer = csv.DictWriter(f, fieldnames=columns, extrasaction='ignore')
+            writer.writeheader()
+            writer.writerows(results)
+        self.logger.log_with_color(f"Benchmark done in {duration / 60:.2f} mins ({report['throughput']} images/s), "
+                                   f"results saved to {save_path}")
+
+        if plot:
+            from utils.metrics.confusionmatrix import plot_confusion_matrices
+            plot_confusion_matrices(matrices, save_path, classes_name, workers=plot_workers)
+        return report
+
+
+def _natural_key(value):
+    return [int(t) if t.lstrip('-').isdigit() else t for t in re.split(r'(-?\d+)', str(value))]
+
+
+def benchmark_dataset(data_path, transform, class_to_idx=None, batch_size=1):
+
+    """
+    All the benchmark subsets of `data_path` as one dataset: the ImageFolders of a `snr/CM/class` tree
+    concatenated, or the whole packed shard directory with one subset per SNR bucket of its index.
+
+    Parameters:
+    - class_to_idx (dict): class indices of the model, the labels of every subset are mapped onto them (a CM folder
+      missing a class would otherwise shift the indices of the next ones). A class the model does not know raises
+      a ValueError.
+    - batch_size (int): loader batch size, keeps the order of a shard dataset read by several workers.
+
+    Returns:
+    - (dataset, subsets, subset_ids): the dataset, the (snr, CM) names of the subsets and the subset index of every
+      sample in the dataset order.
+    """
+
+    def remap(classes, where):
+        if class_to_idx is None:
+            return None
+        unknown = [c for c in classes if c not in class_to_idx]
+        if unknown:
+            raise ValueError(f"Classes {unknown} of {where} are not classes of the model, expected some of "
+                             f"{list(class_to_idx)}")
+        return [class_to_idx[c] for c in classes].__getitem__
+
+    if is_shard_dataset(data_path):
+        index = load_index(data_path)
+        dataset = ShardDataset(index, transform=transform, target_transform=remap(index['classes'], data_path),
+                               batch_size=batch_size)
+        subsets = dataset.values('snr')
+        position = {snr: k for k, snr in enumerate(subsets)}
+        column = index['samples']['snr']
+        return dataset, [(str(snr), 'shards') for snr in subsets], [position[column[i]] for i in dataset.ids]
+
+    datasets_, subsets, subset_ids = [], [], []
+    for snr in sorted(os.listdir(data_path), key=_natural_key):
+        if not os.path.isdir(os.path.join(data_path, snr)):
+            continue
+        # the result folder written into data_path has no CM folders and is skipped
+        for CM in sorted(os.listdir(os.path.join(data_path, snr))):
+            if not os.path.isdir(os.path.join(data_path, snr, CM)):
+                continue
+            root = os.path.join(data_path, snr, CM)
+            classes, _ = datasets.folder.find_classes(root)
+            folder = datasets.ImageFolder(root=root, transform=transform, target_transform=remap(classes, root))
+            subset_ids += [len(subsets)] * len(folder)
+            subsets.append((snr, CM))
+            datasets_.append(folder)
+    return ConcatDataset(datasets_), subsets, subset_ids
+
+
+def measure_latency(model, image_size, device='cpu', batch_size=1, warmup=10, iters=50):
+
+    """
+    Measures the forward latency of `model` (already on `device`) with random inputs.
+
+    Returns:
+    - dict: latency_ms (per forward), throughput (images/s) and params_m (millions of parameters).
+    """
+
+    x = torch.rand(batch_size, 3, image_size, image_size, device=device)
+    sync = torch.cuda.synchronize if str(device).startswith('cuda') else (lambda: None)
+    model.eval()
+    with torch.no_grad():
+        for _ in range(warmup):
+            model(x)
+        sync()
+        start = time.perf_counter()
+        for _ in range(iters):
+            model(x)
+        sync()
+    latency = (time.perf_counter() - start) / iters
+    return {'latency_ms': round(latency * 1000, 3),
+            'throughput': round(batch_size / latency, 2),
+            'params_m': round(sum(p.numel() for p in model.parameters()) / 1e6, 3)}
+
+
+def distillation_report(student_cfg, student_weight, student_acc, teacher_cfg, teacher_weight, teacher_acc,
+                        device='cpu', batch_size=1, save_path=None):
+
+    """
+    Compare the latency / accuracy trade-off of a distilled student against its teacher.
+
+    Parameters:
+    - student_cfg, student_weight: config.yaml and weights of the student.
+    - student_acc (float): best validation accuracy of the student (%).
+    - teacher_cfg, teacher_weight: config.yaml and weights of the teacher.
+    - teacher_acc (float): validation accuracy of the teacher (%), None if unknown.
+    - device (str): device the latency is measured on, the deployment target.
+    - batch_size (int): images per forward when measuring.
+    - save_path (str): optional directory for distillation_report.json.
+
+    Returns:
+    - dict: per-model accuracy / latency / parameters, the speedup and the accuracy drop.
+    """
+
+    report = {'device': device, 'batch_size': batch_size}
+    for name, cfg, weight, acc in (('student', student_cfg, student_weight, student_acc),
+                                   ('teacher', teacher_cfg, teacher_weight, teacher_acc)):
+        model = Classify_Model(cfg=cfg, weight_path=weight, save=False, device=device)
+        report[name] = {'model': model.cfg['model'], 'acc': acc, **model.profile(batch_size=batch_size)}
+        model.close()
+        del model
+
+    report['speedup'] = round(report['teacher']['latency_ms'] / report['student']['latency_ms'], 2)
+    if teacher_acc is not None and student_acc is not None:
+        report['acc_drop'] = round(teacher_acc - student_acc, 2)
+
+    if save_path:
+        with open(os.path.join(save_path, 'distillation_report.json'), 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    return report
+
 
 class Detection_Model:
 
@@ -404,12 +660,13 @@ class Detection_Model:
     - weight_path: The path to the pre-trained model weights.
 
     Methods:
-    - __init__(self, cfg=None, model_name=None, weight_path=None):
+    - __init__(self, cfg=None, model_name=None, weight_path=None, device=None):
         Initializes the detection model based on the provided configuration or parameters.
-        If a configuration dictionary `cfg` is provided, it will be used to set the model name and weight path.
-        Otherwise, the `model_name` and `weight_path` parameters can be specified directly.
+        If a configuration dictionary `cfg` is provided, it will be used to set the model name, weight path and device.
+        Otherwise, the `model_name`, `weight_path` and `device` parameters can be specified directly.
+        The device defaults to CUDA when available.
 
-    - yolov5_detect(self, source='../example/source/', save_dir='../res', imgsz=(640, 640), conf_thres=0.6, iou_thres=0.45, max_det=1000, line_thickness=3, hide_labels=True, hide_conf=False):
+    - yolov5_detect(self, source='../example/source/', save_dir='../res', imgsz=(640, 640), conf_thres=0.6, iou_thres=0.45, max_det=1000, line_thickness=3, hide_labels=True, hide_conf=False, batch_size=1, workers=8):
         Runs YOLOv5 object detection on the specified source.
         - source: Path to the input image or directory containing images.
         - save_dir: Directory to save the detection results.
@@ -420,34 +677,33 @@ class Detection_Model:
         - line_thickness: Thickness of the bounding box lines.
         - hide_labels: Whether to hide class labels in the output.
         - hide_conf: Whether to hide confidence scores in the output.
+        - batch_size: Images per forward pass, > 1 enables the batched mode (prefetching loader, batched NMS,
+          background writer) for directories and reports the throughput in images/sec.
+        - workers: Number of loader and writer threads in batched mode.
 
     - faster_rcnn_detect(self, source='../example/source/', save_dir='../res', weight_path='../example/detect/', imgsz=(640, 640), conf_thres=0.25, iou_thres=0.45, max_det=1000, line_thickness=3, hide_labels=False, hide_conf=False):
         Placeholder method for running Faster R-CNN object detection.
         This method is currently not implemented and should be replaced with the actual implementation.
     """
 
-    def __init__(self, cfg=None, model_name=None, weight_path=None):
+    def __init__(self, cfg=None, model_name=None, weight_path=None, device=None):
         if cfg:
             model_name = cfg['model_name']
             weight_path = cfg['weight_path']
+            device = cfg.get('device', device)
 
-            if model_name == 'yolov5':
-                self.S1model = YOLOV5S(weights=weight_path)
-                self.S1model.inference = self.yolov5_detect
+        if device is None:
+            device = 'cuda' if torch.cuda.is_available() else 'cpu'
+        self.device = torch.device(device)
 
-            # ToDo
-            elif model_name == 'faster_rcnn':
-                self.S1model = YOLOV5S(weights=weight_path)
-                self.S1model.inference = self.yolov5_detect
-        else:
-            if model_name == 'yolov5':
-                self.S1model = YOLOV5S(weights=weight_path)
-                self.S1model.inference = self.yolov5_detect
+        if model_name == 'yolov5':
+            self.S1model = YOLOV5S(weights=weight_path, device=self.device)
+            self.S1model.inference = self.yolov5_detect
 
-            # ToDo
-            elif model_name == 'faster_rcnn':
-                self.S1model = YOLOV5S(weights=weight_path)
-                self.S1model.inference = self.yolov5_detect
+        # ToDo
+        elif model_name == 'faster_rcnn':
+            self.S1model = YOLOV5S(weights=weight_path, device=self.device)
+            self.S1model.inference = self.yolov5_detect
 
     def yolov5_detect(self,
                       source='../example/source/',
@@ -459,8 +715,14 @@ class Detection_Model:
                       line_thickness=3,
                       hide_labels=True,
                       hide_conf=False,
+                      batch_size=1,
+                      workers=8,
                       ):
 
+        if batch_size > 1 and not isinstance(source, np.ndarray) and save_dir != 'buffer':
+            return self._yolov5_detect_batched(source, save_dir, imgsz, conf_thres, iou_thres, max_det,
+                                               line_thickness, hide_labels, hide_conf, batch_size, workers)
+
         color = Colors()
         detmodel = self.S1model
         stride, names = detmodel.stride, detmodel.names
@@ -525,7 +787,7 @@ class Detection_Model:
                     p, im0, frame = path, im0s.copy(), getattr(dataset, 'frame', 0)
 
                     p = Path(p)  # to Path
-                    save_path = str(save_dir + p.name)  # im.jpg
+                    save_path = os.path.join(save_dir, p.name)  # im.jpg
                     s += '%gx%g ' % im.shape[2:]  # print string
                     annotator = Annotator(im0, line_width=line_thickness, example=str(names))
                     if len(det):
@@ -555,6 +817,49 @@ class Detection_Model:
             # Print results
             print(f"Results saved to {colorstr('bold', save_dir)}")
 
+    @torch.no_grad()
+    def _yolov5_detect_batched(self, source, save_dir, imgsz, conf_thres, iou_thres, max_det,
+                               line_thickness, hide_labels, hide_conf, batch_size, workers):
+        """
+        Batched version of `yolov5_detect` for whole directories: images are decoded and letterboxed to a common shape
+        by a prefetching thread pool, each batch goes through one forward pass and one batched NMS, and drawing/writing
+        the results is done by a background writer pool.
+        """
+        color = Colors()
+        detmodel = self.S1model
+        detmodel.eval()
+        stride, names = detmodel.stride, detmodel.names
+        os.makedirs(save_dir, exist_ok=True)
+
+        dataset = LoadImagesBatched(source, img_size=imgsz, stride=stride, batch_size=batch_size, workers=workers)
+        writer = ResultAnnotator(workers=workers)
+        seen, dt = 0, (Profile(), Profile(), Profile())
+        start_time = time.time()
+
+        for paths, im, im0s in dataset:
+            with dt[0]:
+                im = torch.from_numpy(im).to(detmodel.device).float() / 255  # uint8 to fp32, 0 - 255 to 0.0 - 1.0
+            with dt[1]:
+                pred = detmodel(im)
+            with dt[2]:
+                pred = batched_non_max_suppression(pred, conf_thres, iou_thres, max_det=max_det)
+
+            for path, im0, det in zip(paths, im0s, pred):
+                seen += 1
+                if len(det):
+                    det[:, :4] = scale_boxes(im.shape[2:], det[:, :4], im0.shape).round()
+                writer.submit(_draw_and_save, os.path.join(save_dir, Path(path).name), im0, det.cpu().numpy(),
+                              names, line_thickness, hide_labels, hide_conf, color)
+
+        writer.close()
+        elapsed = time.time() - start_time
+        print(f"{seen} images in {elapsed:.2f}s ({seen / max(elapsed, 1e-9):.1f} images/sec), "
+              f"per batch: {dt[0].t / max(len(dataset), 1) * 1E3:.1f}ms pre-process, "
+              f"{dt[1].t / max(len(dataset), 1) * 1E3:.1f}ms inference, "
+              f"{dt[2].t / max(len(dataset), 1) * 1E3:.1f}ms NMS")
+        print(f"Results saved to {colorstr('bold', save_dir)}")
+        return seen / max(elapsed, 1e-9)
+
     #ToDo
     def faster_rcnn_detect(self,
                            source='../example/source/',
@@ -571,6 +876,161 @@ class Detection_Model:
         pass
 
 
+class TwoStagePipeline:
+    """
+    Fused detect-then-classify pipeline, images never go back to disk between the two stages.
+
+    A batch of images is letterboxed to a common shape and goes through one detector forward and NMS, every detected
+    region is cropped and resized in-tensor from the original images with `roi_align`, then all the crops of the batch
+    are classified in a single classifier forward.
+
+    Attributes:
+    - detector (Detection_Model): Stage 1 model.
+    - classifier (Classify_Model): Stage 2 model, its config gives the crop size and class names.
+    """
+
+    def __init__(self,
+                 detector_cfg: dict,
+                 classifier_cfg: str,
+                 classifier_weight: str,
+                 device=None,
+                 imgsz=(640, 640),
+                 conf_thres=0.6,
+                 iou_thres=0.45,
+                 max_det=1000,
+                 batch_size: int = 8,
+                 ):
+        """
+        Parameters:
+        - detector_cfg (dict): {'model_name', 'weight_path'} as in example/two_stage/sample.json.
+        - classifier_cfg (str): Path to the classifier config file.
+        - classifier_weight (str): Path to the classifier weights.
+        - device (str): Device shared by both stages, defaults to the classifier config device.
+        - imgsz (tuple): Detector input size (height, width).
+        - conf_thres (float): Detector confidence threshold.
+        - iou_thres (float): IoU threshold for NMS.
+        - max_det (int): Maximum number of detections per image.
+        - batch_size (int): Number of images per detector batch.
+        """
+        self.classifier = Classify_Model(cfg=classifier_cfg, weight_path=classifier_weight, save=False)
+        self.device = torch.device(device or self.classifier.device)
+        self.classifier.model.to(self.device)
+        self.classifier.device = self.device
+
+        self.detector = Detection_Model(model_name=detector_cfg['model_name'],
+                                        weight_path=detector_cfg['weight_path'],
+                                        device=self.device)
+        self.imgsz = (imgsz, imgsz) if isinstance(imgsz, int) else tuple(imgsz)
+        self.conf_thres = conf_thres
+        self.iou_thres = iou_thres
+        self.max_det = max_det
+        self.batch_size = batch_size
+        self.crop_size = self.classifier.cfg['image_size']
+        self.logger = self.classifier.logger
+
+    @torch.no_grad()
+    def predict(self, images, batch=None):
+        """
+        Runs both stages on a batch of images.
+
+        Parameters:
+        - images (list): BGR uint8 numpy images (as read by cv2).
+        - batch (np.ndarray): Optional (b, 3, h, w) RGB letterboxed batch of `images`, e.g. from LoadImagesBatched.
+
+        Returns:
+        - list: One list per image of dicts {'box', 'det_conf', 'det_class', 'class', 'probability'}.
+        """
+        detmodel = self.detector.S1model
+        detmodel.eval()
+        names = detmodel.names
+
+        if batch is None:
+            batch = np.stack([letterbox(im0, self.imgsz, stride=detmodel.stride, auto=False)[0] for im0 in images])
+            batch = np.ascontiguousarray(batch[..., ::-1].transpose(0, 3, 1, 2))
+        batch = torch.from_numpy(batch).to(self.device).float() / 255
+        pred = batched_non_max_suppression(detmodel(batch), self.conf_thres, self.iou_thres, max_det=self.max_det)
+
+        crops = []
+        for im0, det in zip(images, pred):
+            if not len(det):
+                continue
+            det[:, :4] = scale_boxes(batch.shape[2:], det[:, :4], im0.shape).round()
+            origin = torch.from_numpy(np.ascontiguousarray(im0[..., ::-1])).to(self.device)
+            origin = origin.permute(2, 0, 1)[None].float() / 255
+            crops.append(roi_align(origin, [det[:, :4].float()], output_size=(self.crop_size, self.crop_size),
+                                   aligned=True))
+
+        results = [[] for _ in images]
+        if not crops:
+            return results
+
+        probabilities = torch.softmax(self.classifier.model(torch.cat(crops)), dim=1)
+        confidence, predicted = probabilities.max(1)
+        confidence, predicted = confidence.tolist(), predicted.tolist()
+
+        k = 0
+        for i, det in enumerate(pred):
+            for *xyxy, conf, cls in det.tolist():
+                results[i].append({
+                    'box': [int(v) for v in xyxy],
+                    'det_conf': round(conf, 4),
+                    'det_class': names[int(cls)],
+                    'class': get_key_from_value(self.classifier.cfg['class_names'], predicted[k]),
+                    'probability': round(confidence[k] * 100, 2)
+                })
+                k += 1
+        return results
+
+    def run(self, source, save_dir=None, line_thickness=3):
+        """
+        Runs the pipeline on an image file or a directory of images.
+
+        Parameters:
+        - source (str): Image path or directory.
+        - save_dir (str): Optional directory for the annotated images and results.json.
+        - line_thickness (int): Box line thickness of the annotated images.
+
+        Returns:
+        - dict: image path -> list of per-box results.
+        """
+        dataset = LoadImagesBatched(source, img_size=self.imgsz, stride=self.detector.S1model.stride,
+                                    batch_size=self.batch_size)
+        writer = None
+        if save_dir:
+            os.makedirs(save_dir, exist_ok=True)
+            writer = ResultAnnotator()
+
+        results = {}
+        start_time = time.time()
+        for paths, im, im0s in dataset:
+            for path, im0, boxes in zip(paths, im0s, self.predict(im0s, batch=im)):
+                results[path] = boxes
+                if writer:
+                    annotator = Annotator(im0, line_width=line_thickness, example=str(self.detector.S1model.names))
+                    for box in boxes:
+                        annotator.box_label(box['box'], f"{box['class']} {box['probability']:.1f}%")
+                    writer.submit(cv2.imwrite, os.path.join(save_dir, os.path.basename(path)), annotator.result())
+
+        elapsed = time.time() - start_time
+        self.logger.log_with_color(f"Two-stage inference on {len(results)} images: "
+                                   f"{sum(len(v) for v in results.values())} boxes, "
+                                   f"{elapsed:.2f} sec ({len(results) / max(elapsed, 1e-9):.1f} images/sec)")
+        if writer:
+            with open(os.path.join(save_dir, 'results.json'), 'w', encoding='utf-8') as f:
+                json.dump(results, f, ensure_ascii=False, indent=2)
+            writer.close()
+        return results
+
+
+def _draw_and_save(save_path, im0, det, names, line_thickness, hide_labels, hide_conf, color):
+    annotator = Annotator(im0, line_width=line_thickness, example=str(names))
+    for *xyxy, conf, cls in reversed(det):
+        c = int(cls)  # integer class
+        label = None if hide_labels else (names[c] if hide_conf else f'{names[c]} {conf:.2f}')
+        annotator.box_label(xyxy, label, color=color(c + 2, True))
+    cv2.imwrite(save_path, annotator.result())
+
+
 def is_valid_file(path, total_ext):
     """
     Checks if the file has a valid extension.
@@ -0,0 +1,268 @@
+"""Benchmark result store
+
+`BenchmarkStore` records the reports of `Classify_Model.benchmark` in an SQLite database: model, weights hash,
+precision mode, device, code revision, overall and per-(SNR, CM) accuracy / F1 / mAP, throughput and latency
+percentiles. `compare` diffs two runs and flags the accuracy, F1, mAP, throughput and latency regressions beyond
+thresholds, to decide whether a pruned, quantized or exported model can replace the baseline.
+"""
+import os
+import json
+import time
+import hashlib
+import subprocess
+
+from utils.sqlite_util import connect
+
+STORE_NAME = 'benchmarks.db'
+# default regression thresholds: absolute drops for the quality metrics, relative ones for the speed metrics
+THRESHOLDS = {
+    'max_acc_drop': 1.0,            # accuracy points (%)
+    'max_f1_drop': 0.01,            # macro F1
+    'max_map_drop': 0.01,           # mAP
+    'max_throughput_drop': 0.1,     # fraction of the baseline images/s
+    'max_latency_increase': 0.1,    # fraction of the baseline p50 / p99 latency
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    created_at REAL NOT NULL,
+    name TEXT,
+    model TEXT,
+    weight_path TEXT,
+    weight_hash TEXT,
+    precision TEXT,
+    device TEXT,
+    batch_size INTEGER,
+    image_size INTEGER,
+    data_path TEXT,
+    git_commit TEXT,
+    samples INTEGER,
+    acc REAL,
+    macro_f1 REAL,
+    mAP REAL,
+    throughput REAL,
+    latency_p50 REAL,
+    latency_p90 REAL,
+    latency_p99 REAL,
+    notes TEXT,
+    report TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS subsets (
+    run_id INTEGER NOT NULL REFERENCES runs(id) ON DELETE CASCADE,
+    snr TEXT NOT NULL,
+    cm TEXT NOT NULL,
+    samples INTEGER,
+    acc REAL,
+    top1 REAL,
+    macro_f1 REAL,
+    micro_f1 REAL,
+    mAP REAL,
+    PRIMARY KEY (run_id, snr, cm)
+);
+CREATE INDEX IF NOT EXISTS runs_hash ON runs(weight_hash);
+CREATE INDEX IF NOT EXISTS runs_model ON runs(model);
+"""
+RUN_COLUMNS = ('id', 'created_at', 'name', 'model', 'weight_path', 'weight_hash', 'precision', 'device', 'batch_size',
+               'image_size', 'data_path', 'git_commit', 'samples', 'acc', 'macro_f1', 'mAP', 'throughput',
+               'latency_p50', 'latency_p90', 'latency_p99', 'notes')
+
+
+def weights_hash(path, chunk_size=1 << 20):
+    """sha256 of a weight file."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def git_commit(path=None):
+    """Current commit of the repository holding `path` (this code by default), None outside of a git checkout."""
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, timeout=5,
+                              cwd=path or os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def _mean(values):
+    values = [v for v in values if v is not None]
+    return sum(values) / len(values) if values else None
+
+
+class BenchmarkStore:
+    """
+    SQLite store of benchmark runs.
+
+    Args:
+        db_path (str): store database, created on first use. A directory means `<dir>/benchmarks.db`.
+    """
+
+    def __init__(self, db_path):
+        if os.path.isdir(db_path):
+            db_path = os.path.join(db_path, STORE_NAME)
+        self.db_path = db_path
+        if os.path.dirname(db_path):
+            os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+
+    def _connect(self):
+        return connect(self.db_path)
+
+    def record(self, report, name=None, notes=None):
+        """
+        Store a `Classify_Model.benchmark` report.
+
+        :param name: optional run name, e.g. 'resnet18-pruned-0.5'.
+        :param notes: free text.
+        :return: run id.
+        """
+        latency = report.get('latency_ms') or {}
+        subsets = report.get('subsets', [])
+        with self._connect() as conn:
+            run_id = conn.execute(
+                'INSERT INTO runs (created_at, name, model, weight_path, weight_hash, precision, device, batch_size, '
+                'image_size, data_path, git_commit, samples, acc, macro_f1, mAP, throughput, latency_p50, '
+                'latency_p90, latency_p99, notes, report) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, '
+                '?, ?, ?)',
+                (time.time(), name, report.get('model'), report.get('weight_path'), report.get('weight_hash'),
+                 report.get('precision'), report.get('device'), report.get('batch_size'), report.get('image_size'),
+                 report.get('data_path'), report.get('git_commit'), report.get('samples'), report.get('acc'),
+                 # overall F1 / mAP: mean over the subsets
+                 _mean(s.get('macro_f1') for s in subsets), _mean(s.get('mAP') for s in subsets),
+                 report.get('throughput'), latency.get('p50'), latency.get('p90'), latency.get('p99'), notes,
+                 json.dumps(report, ensure_ascii=False))).lastrowid
+            conn.executemany(
+                'INSERT INTO subsets (run_id, snr, cm, samples, acc, top1, macro_f1, micro_f1, mAP) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                [(run_id, s['snr'], s['cm'], s.get('samples'), s.get('acc'), s.get('top1'), s.get('macro_f1'),
+                  s.get('micro_f1'), s.get('mAP')) for s in subsets])
+        return run_id
+
+    def runs(self, model=None, weight_hash=None, name=None, limit=100, offset=0):
+        """Stored runs, newest first, without their full report."""
+        clauses, params = [], []
+        for column, value in (('model', model), ('weight_hash', weight_hash), ('name', name)):
+            if value is not None:
+                clauses.append(f'{column} = ?')
+                params.append(value)
+        where = (' WHERE ' + ' AND '.join(clauses)) if clauses else ''
+        with self._connect() as conn:
+            return [dict(row) for row in conn.execute(
+                f'SELECT {", ".join(RUN_COLUMNS)} FROM runs{where} ORDER BY created_at DESC, id DESC LIMIT ? OFFSET ?',
+                params + [int(limit), int(offset)])]
+
+    def get(self, run_id):
+        """A run with its per-subset metrics and full report, None when it does not exist."""
+        with self._connect() as conn:
+            row = conn.execute('SELECT * FROM runs WHERE id = ?', (run_id,)).fetchone()
+            if row is None:
+                return None
+            run = dict(row)
+            run['report'] = json.loads(run['report'])
+            run['subsets'] = [dict(s) for s in conn.execute(
+                'SELECT snr, cm, samples, acc, top1, macro_f1, micro_f1, mAP FROM subsets WHERE run_id = ? '
+                'ORDER BY rowid', (run_id,))]
+        return run
+
+    def delete(self, run_id):
+        """Delete a run, returns False when it does not exist."""
+        with self._connect() as conn:
+            return conn.execute('DELETE FROM runs WHERE id = ?', (run_id,)).rowcount > 0
+
+    def compare(self, baseline_id, candidate_id, **thresholds):
+        """
+        Diff a candidate run against a baseline run.
+
+        :param thresholds: overrides of `THRESHOLDS`. Quality drops are checked on the whole benchmark and on every
+                           (SNR, CM) subset present in both runs, speed changes on the whole benchmark.
+        :return: dict with the overall and per-subset deltas (candidate - baseline, relative changes for throughput
+                 and latency), the regressions found, warnings about differences that make the runs hard to compare,
+                 and `passed`.
+        """
+        unknown = set(thresholds) - set(THRESHOLDS)
+        if unknown:
+            raise ValueError(f"Unknown thresholds: {sorted(unknown)}, expected some of {list(THRESHOLDS)}")
+        limits = {**THRESHOLDS, **{k: v for k, v in thresholds.items() if v is not None}}
+        baseline, candidate = self.get(baseline_id), self.get(candidate_id)
+        for run_id, run in ((baseline_id, baseline), (candidate_id, candidate)):
+            if run is None:
+                raise KeyError(f"Benchmark run {run_id} does not exist")
+
+        regressions, warnings = [], []
+
+        def check_drop(scope, metric, base, cand, limit):
+            if base is None or cand is None:
+                return None
+            delta = cand - base
+            if -delta > limit:
+                regressions.append({'scope': scope, 'metric': metric, 'baseline': base, 'candidate': cand,
+                                    'delta': delta, 'threshold': limit})
+            return delta
+
+        overall = {}
+        for metric, limit in (('acc', limits['max_acc_drop']), ('macro_f1', limits['max_f1_drop']),
+                              ('mAP', limits['max_map_drop'])):
+            overall[metric] = check_drop('overall', metric, baseline[metric], candidate[metric], limit)
+
+        def check_change(metric, higher_is_better, limit):
+            # speed metrics are compared relatively to the baseline
+            base, cand = baseline[metric], candidate[metric]
+            if not base or cand is None:
+                return None
+            change = cand / base - 1
+            if (-change if higher_is_better else change) > limit:
+                regressions.append({'scope': 'overall', 'metric': metric, 'baseline': base, 'candidate': cand,
+                                    'delta': cand - base, 'change': change, 'threshold': limit})
+            return round(change, 4)
+
+        overall['throughput'] = check_change('throughput', True, limits['max_throughput_drop'])
+        for metric in ('latency_p50', 'latency_p99'):
+            overall[metric] = check_change(metric, False, limits['max_latency_increase'])
+
+        base_subsets = {(s['snr'], s['cm']): s for s in baseline['subsets']}
+        subsets = []
+        for s in candidate['subsets']:
+            key = (s['snr'], s['cm'])
+            if key not in base_subsets:
+                continue
+            b = base_subsets[key]
+            subsets.append({
+                'snr': s['snr'], 'cm': s['cm'],
+                'acc': check_drop(f'{s["snr"]}/{s["cm"]}', 'acc', b['acc'], s['acc'], limits['max_acc_drop']),
+                'macro_f1': check_drop(f'{s["snr"]}/{s["cm"]}', 'macro_f1', b['macro_f1'], s['macro_f1'],
+                                       limits['max_f1_drop']),
+                'mAP': check_drop(f'{s["snr"]}/{s["cm"]}', 'mAP', b['mAP'], s['mAP'], limits['max_map_drop']),
+            })
+        missing = sorted(set(base_subsets) - {(s['snr'], s['cm']) for s in candidate['subsets']})
+        if missing:
+            warnings.append(f"Subsets missing from the candidate: {[f'{snr}/{cm}' for snr, cm in missing]}")
+        for field in ('data_path', 'device', 'batch_size', 'image_size'):
+            if baseline[field] != candidate[field]:
+                warnings.append(f"{field} differs: {baseline[field]} vs {candidate[field]}")
+
+        return {
+            'baseline': {k: baseline[k] for k in RUN_COLUMNS},
+            'candidate': {k: candidate[k] for k in RUN_COLUMNS},
+            'thresholds': limits,
+            'overall': overall,
+            'subsets': subsets,
+            'regressions': regressions,
+            'warnings': warnings,
+            'passed': not regressions,
+        }
+
+
+# Usage-------------------------------------------------------------
+def main():
+    store = BenchmarkStore('../results/benchmarks.db')
+    with open('../dataset/benchmark/benchmark result/benchmark_result.json', encoding='utf-8') as f:
+        run_id = store.record(json.load(f), name='baseline')
+    print(store.runs(limit=5))
+    print(store.compare(run_id, run_id)['passed'])
+
+
+if __name__ == '__main__':
+    main()
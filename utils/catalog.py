@@ -0,0 +1,291 @@
+"""Indexed catalog of raw IQ captures
+
+`IQCatalog` scans a raw-data tree (`<root>/<drone>/.../<capture>.iq`) once and records in an SQLite database, for
+every capture, its drone label, sample type, sample count and slicing parameters, and for every slice its sample and
+byte offsets, energy and SNR. Queries such as "all DJI slices above 10 dB" are then answered from the database
+without opening the captures, and `export` renders exactly the selected slices into a training or benchmark tree.
+Unchanged captures are skipped when the tree is scanned again.
+"""
+import os
+import time
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+from PIL import Image
+
+from SNREstimation.SNR_estimation import load_iq, window_psd, noise_floor, window_snr, snr_buckets
+from graphic.RawDataProcessor import spectrogram_image
+from graphic.waterfull import jet_lut
+from utils.sqlite_util import connect
+
+RAW_EXTENSIONS = ('.iq', '.dat', '.bin')
+SNR_EDGES = (-20, -10, -5, 0, 5, 10, 15, 20)
+CATALOG_NAME = 'catalog.db'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    id INTEGER PRIMARY KEY,
+    path TEXT UNIQUE NOT NULL,
+    rel_path TEXT NOT NULL,
+    label TEXT,
+    dtype TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    samples INTEGER NOT NULL,
+    fs REAL NOT NULL,
+    slice_point INTEGER NOT NULL,
+    step INTEGER NOT NULL,
+    num_slices INTEGER NOT NULL,
+    noise_floor_db REAL,
+    scanned_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS slices (
+    file_id INTEGER NOT NULL REFERENCES files(id) ON DELETE CASCADE,
+    idx INTEGER NOT NULL,
+    start INTEGER NOT NULL,
+    byte_offset INTEGER NOT NULL,
+    length INTEGER NOT NULL,
+    time REAL NOT NULL,
+    energy_db REAL,
+    snr REAL,
+    bucket TEXT,
+    PRIMARY KEY (file_id, idx)
+);
+CREATE INDEX IF NOT EXISTS slices_snr ON slices(snr);
+CREATE INDEX IF NOT EXISTS files_label ON files(label);
+"""
+
+
+def _render_file(task):
+    """Render the selected slices of one capture, run in a worker process."""
+    path, file_type, fs, stft_point, size, slices = task
+    data = load_iq(path, np.dtype(file_type))
+    lut = jet_lut()
+    written, errors = 0, []
+    for start, length, dst in slices:
+        try:
+            os.makedirs(os.path.dirname(dst), exist_ok=True)
+            Image.fromarray(spectrogram_image(np.asarray(data[start:start + length]), stft_point, fs, size,
+                                              lut)).save(dst)
+            written += 1
+        except Exception as e:
+            errors.append(f'{dst}: {e}')
+    return written, errors
+
+
+class IQCatalog:
+    """
+    SQLite catalog of the captures and slices of a raw-data tree.
+
+    Args:
+        db_path (str): catalog database, created on first use. A directory means `<dir>/catalog.db`.
+    """
+
+    def __init__(self, db_path):
+        if os.path.isdir(db_path):
+            db_path = os.path.join(db_path, CATALOG_NAME)
+        self.db_path = db_path
+        if os.path.dirname(db_path):
+            os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+
+    def _connect(self):
+        # one short-lived connection per call, the catalog is used from API threads and worker threads
+        return connect(self.db_path)
+
+    def scan(self, data_path, fs=100e6, duration_time=0.1, step_time=None, file_type='float32', nperseg=1024,
+             max_segments=64, noise_quantile=0.1, edges=SNR_EDGES, extensions=RAW_EXTENSIONS, rescan=False,
+             callback=None):
+        """
+        Catalog every capture under `data_path`, the first folder below it is the drone label.
+
+        :param fs: sample rate.
+        :param duration_time: slice length in seconds, use the same value as the spectrogram generation.
+        :param step_time: hop between two slices in seconds, default is `duration_time`.
+        :param file_type: sample type of the captures.
+        :param nperseg, max_segments, noise_quantile: SNR estimation, see `SNREstimation.SNR_estimation`.
+        :param edges: SNR bucket edges (dB).
+        :param rescan: also scan the captures already cataloged with the same size, mtime and slicing.
+        :param callback: called as callback(done, total, path, num_slices) after every capture, num_slices is None
+                         for a skipped capture.
+        :return: stats dict.
+        """
+        dtype = np.dtype(file_type)
+        slice_point = int(fs * duration_time)
+        step = int(fs * step_time) if step_time else slice_point
+        captures = sorted(os.path.join(root, f) for root, _, files in os.walk(data_path)
+                          for f in files if f.lower().endswith(extensions))
+        stats = {'captures': len(captures), 'scanned': 0, 'skipped': 0, 'failed': 0, 'slices': 0, 'errors': []}
+        start_time = time.time()
+
+        for i, path in enumerate(captures):
+            path = os.path.abspath(path)
+            rel_path = os.path.relpath(path, data_path)
+            parts = rel_path.replace('\\', '/').split('/')
+            st = os.stat(path)
+            num_slices = None
+            with self._connect() as conn:
+                row = conn.execute('SELECT size, mtime, dtype, fs, slice_point, step FROM files WHERE path = ?',
+                                   (path,)).fetchone()
+            if row is not None and not rescan and tuple(row) == (st.st_size, st.st_mtime, dtype.name, fs,
+                                                                 slice_point, step):
+                stats['skipped'] += 1
+            else:
+                try:
+                    num_slices = self._scan_file(path, rel_path, parts[0] if len(parts) > 1 else None, st, dtype,
+                                                 fs, slice_point, step, nperseg, max_segments, noise_quantile, edges)
+                    stats['scanned'] += 1
+                    stats['slices'] += num_slices
+                except Exception as e:
+                    stats['failed'] += 1
+                    stats['errors'].append(f'{path}: {e}')
+            if callback is not None:
+                callback(i + 1, len(captures), path, num_slices)
+
+        stats['duration_s'] = round(time.time() - start_time, 2)
+        return stats
+
+    def _scan_file(self, path, rel_path, label, st, dtype, fs, slice_point, step, nperseg, max_segments,
+                   noise_quantile, edges):
+        data = load_iq(path, dtype)
+        psd = window_psd(data, slice_point, nperseg=nperseg, max_segments=max_segments, step=step)
+        if len(psd):
+            floor = noise_floor(psd, noise_quantile)
+            snr = window_snr(psd, floor)
+            energy = 10 * np.log10(np.maximum(np.sum(psd, axis=-1), 1e-30))
+            floor_db = float(10 * np.log10(max(np.sum(floor), 1e-30)))
+            buckets = snr_buckets(snr, edges)
+        else:
+            snr, energy, floor_db, buckets = [], [], None, []
+        sample_bytes = dtype.itemsize * 2  # interleaved I/Q
+        starts = np.arange(len(psd), dtype=np.int64) * step
+
+        with self._connect() as conn:
+            conn.execute('DELETE FROM files WHERE path = ?', (path,))
+            file_id = conn.execute(
+                'INSERT INTO files (path, rel_path, label, dtype, size, mtime, samples, fs, slice_point, step, '
+                'num_slices, noise_floor_db, scanned_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (path, rel_path, label, dtype.name, st.st_size, st.st_mtime, st.st_size // sample_bytes, fs,
+                 slice_point, step, len(psd), floor_db, time.time())).lastrowid
+            conn.executemany(
+                'INSERT INTO slices (file_id, idx, start, byte_offset, length, time, energy_db, snr, bucket) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                [(file_id, k, int(s), int(s) * sample_bytes, slice_point, float(s / fs), float(e), float(v), b)
+                 for k, (s, e, v, b) in enumerate(zip(starts, energy, snr, buckets))])
+        return len(psd)
+
+    def prune(self):
+        """Drop the captures that no longer exist on disk, returns their number."""
+        with self._connect() as conn:
+            missing = [(row['id'],) for row in conn.execute('SELECT id, path FROM files')
+                       if not os.path.exists(row['path'])]
+            conn.executemany('DELETE FROM files WHERE id = ?', missing)
+        return len(missing)
+
+    @staticmethod
+    def _where(label=None, min_snr=None, max_snr=None, bucket=None, path=None, min_energy=None):
+        clauses, params = [], []
+        for column, value in (('f.label', label), ('s.bucket', bucket), ('f.rel_path', path)):
+            if value is None:
+                continue
+            values = [value] if isinstance(value, str) else list(value)
+            clauses.append(f'{column} IN ({", ".join("?" * len(values))})')
+            params += values
+        for column, op, value in (('s.snr', '>=', min_snr), ('s.snr', '<', max_snr),
+                                  ('s.energy_db', '>=', min_energy)):
+            if value is not None:
+                clauses.append(f'{column} {op} ?')
+                params.append(value)
+        return (' WHERE ' + ' AND '.join(clauses)) if clauses else '', params
+
+    def query(self, label=None, min_snr=None, max_snr=None, bucket=None, path=None, min_energy=None, limit=None,
+              offset=0):
+        """
+        Select slices, every filter is optional and label / bucket / path also accept lists.
+
+        e.g. `catalog.query(label='DJI', min_snr=10)`: all DJI slices with SNR >= 10 dB.
+
+        :param path: capture path relative to the scanned root.
+        :return: list of slice dicts with the capture path, label, dtype and sample rate.
+        """
+        where, params = self._where(label, min_snr, max_snr, bucket, path, min_energy)
+        sql = ('SELECT f.path, f.rel_path, f.label, f.dtype, f.fs, s.idx, s.start, s.byte_offset, s.length, s.time, '
+               's.energy_db, s.snr, s.bucket FROM slices s JOIN files f ON s.file_id = f.id' + where +
+               ' ORDER BY f.path, s.idx')
+        if limit is not None:
+            sql += ' LIMIT ? OFFSET ?'
+            params += [int(limit), int(offset)]
+        with self._connect() as conn:
+            return [dict(row) for row in conn.execute(sql, params)]
+
+    def count(self, label=None, min_snr=None, max_snr=None, bucket=None, path=None, min_energy=None):
+        """Number of slices per label and SNR bucket matching the filters, as {label: {bucket: count}}."""
+        where, params = self._where(label, min_snr, max_snr, bucket, path, min_energy)
+        counts = {}
+        with self._connect() as conn:
+            for row in conn.execute('SELECT f.label, s.bucket, COUNT(*) AS n FROM slices s JOIN files f '
+                                    'ON s.file_id = f.id' + where + ' GROUP BY f.label, s.bucket', params):
+                counts.setdefault(row['label'], {})[row['bucket']] = row['n']
+        return counts
+
+    def files(self, label=None):
+        """Cataloged captures, optionally of some labels."""
+        where, params = self._where(label=label)
+        with self._connect() as conn:
+            return [dict(row) for row in conn.execute('SELECT * FROM files f' + where + ' ORDER BY f.path', params)]
+
+    def export(self, output_path, layout='class', group='catalog', stft_point=1024, size=(1920, 1440), workers=None,
+               callback=None, **filters):
+        """
+        Render the slices selected by `filters` (see `query`) as spectrogram images.
+
+        :param layout: 'class' writes `<output>/<label>/<capture> (<idx>).jpg`, a training set for
+                       `utils.manifest.split_dataset`; 'benchmark' writes `<output>/<bucket>/<group>/<label>/...`, the
+                       `snr/CM/class` tree read by `Classify_Model.benchmark`.
+        :param group: CM folder name of the benchmark layout.
+        :param stft_point: STFT points.
+        :param size: image (width, height), see `spectrogram_image`.
+        :param workers: rendering processes, one capture per task. Default is the CPU count.
+        :param callback: called as callback(done, total) after every capture.
+        :return: stats dict.
+        """
+        if layout not in ('class', 'benchmark'):
+            raise ValueError(f"Unsupported layout: {layout}, expected 'class' or 'benchmark'")
+        tasks = {}
+        for s in self.query(**filters):
+            name = f"{os.path.splitext(os.path.basename(s['path']))[0]} ({s['idx']}).jpg"
+            label = s['label'] or 'unlabeled'
+            folder = (os.path.join(output_path, label) if layout == 'class'
+                      else os.path.join(output_path, s['bucket'], group, label))
+            task = tasks.setdefault(s['path'], (s['path'], s['dtype'], s['fs'], stft_point, size, []))
+            task[5].append((s['start'], s['length'], os.path.join(folder, name)))
+
+        stats = {'captures': len(tasks), 'images': 0, 'errors': [], 'layout': layout, 'output_path': output_path}
+        start_time = time.time()
+        workers = min(workers or os.cpu_count() or 1, max(len(tasks), 1))
+        with ProcessPoolExecutor(workers, mp_context=mp.get_context('spawn')) as pool:
+            futures = [pool.submit(_render_file, task) for task in tasks.values()]
+            for done, future in enumerate(as_completed(futures), 1):
+                written, errors = future.result()
+                stats['images'] += written
+                stats['errors'] += errors
+                if callback is not None:
+                    callback(done, len(futures))
+        stats['duration_s'] = round(time.time() - start_time, 2)
+        return stats
+
+
+# Usage-------------------------------------------------------------
+def main():
+    catalog = IQCatalog('../dataset/raw/catalog.db')
+    print(catalog.scan('../dataset/raw', fs=100e6, duration_time=0.1))
+    print(catalog.count(min_snr=10))
+    slices = catalog.query(label='DJI', min_snr=10)
+    print(len(slices), slices[:1])
+    print(catalog.export('../dataset/DJI_10dB', label='DJI', min_snr=10, stft_point=1024))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,226 @@
+"""Dataset splits and crops without copying images
+
+A split is either recorded as per-subset manifests (`train.json`, `valid.json`, `test.json`, listing image paths
+relative to the source dataset with their labels) or materialized as `train/`, `valid/`, `test/` class folders made of
+hard links, reflinks or symlinks to the source images. Manifests load through `build_dataset` anywhere an ImageFolder
+path is accepted, and the `<subset>.txt` image lists written next to them are read as-is by the YOLO loader.
+A manifest may also carry a crop box, the images are then cropped at load time instead of being rewritten
+(see `utils.preprocessor.write_crop_manifest`). Packed shard datasets (`utils.shards`) load through `build_dataset` too.
+"""
+import os
+import json
+import random
+import shutil
+
+from torchvision import datasets
+from torchvision.datasets.folder import default_loader
+
+from utils.shards import ShardDataset, is_shard_dataset, load_index
+
+IMG_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp')
+SPLIT_MODES = ('copy', 'manifest', 'hardlink', 'reflink', 'symlink')
+FICLONE = 0x40049409  # linux ioctl sharing the extents of a file on btrfs/xfs
+
+
+def _reflink(src, dst):
+    import fcntl  # not available on windows, the caller falls back to a copy
+    with open(src, 'rb') as s, open(dst, 'wb') as d:
+        fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+
+
+def link_file(src, dst, mode='copy'):
+    """
+    Place `src` at `dst` without duplicating its data when `mode` allows.
+
+    Hard links and reflinks fall back to a copy when the filesystem refuses them (other device, no reflink support).
+
+    :return: True when a fallback copy was made.
+    """
+    if os.path.lexists(dst):
+        os.remove(dst)
+    if mode == 'copy':
+        shutil.copy(src, dst)
+        return False
+    try:
+        if mode == 'hardlink':
+            os.link(src, dst)
+        elif mode == 'symlink':
+            os.symlink(os.path.abspath(src), dst)
+        elif mode == 'reflink':
+            _reflink(src, dst)
+        else:
+            raise ValueError(f"Unsupported link mode: {mode}, expected one of {SPLIT_MODES}")
+        return False
+    except (OSError, ImportError):
+        if mode == 'symlink':
+            raise
+        if os.path.lexists(dst):
+            os.remove(dst)
+        shutil.copy(src, dst)
+        return True
+
+
+def split_dataset(input_path, output_path, train_ratio=0.8, val_ratio=None, mode='copy', seed=None,
+                  extensions=IMG_EXTENSIONS, callback=None):
+    """
+    Randomly split a `class/image` dataset into train / valid (/ test when `val_ratio` is given).
+
+    :param input_path: source dataset, one folder per class.
+    :param output_path: destination of the subset folders or manifests.
+    :param train_ratio: fraction of every class used for training.
+    :param val_ratio: fraction for validation, the rest goes to test. None splits train / valid only.
+    :param mode: 'copy', 'hardlink', 'reflink' or 'symlink' to build class folders, 'manifest' to only write
+                 `<subset>.json` / `<subset>.txt`.
+    :param seed: random seed, the same seed gives the same split.
+    :param extensions: image file extensions.
+    :param callback: called as callback(class_name, {subset: count}, index, num_classes) after every class.
+    :return: stats dict.
+    """
+    if mode not in SPLIT_MODES:
+        raise ValueError(f"Unsupported split mode: {mode}, expected one of {SPLIT_MODES}")
+    rng = random.Random(seed)
+    classes = sorted(d for d in os.listdir(input_path) if os.path.isdir(os.path.join(input_path, d)))
+    subsets = {'train': [], 'valid': [], 'test': []} if val_ratio else {'train': [], 'valid': []}
+    fallback = 0
+    os.makedirs(output_path, exist_ok=True)
+
+    for label, cls in enumerate(classes):
+        files = sorted(f for f in os.listdir(os.path.join(input_path, cls)) if f.lower().endswith(extensions))
+        rng.shuffle(files)
+        num_train = int(len(files) * train_ratio)
+        parts = {'train': files[:num_train]}
+        if val_ratio:
+            num_val = int(len(files) * val_ratio)
+            parts['valid'] = files[num_train:num_train + num_val]
+            parts['test'] = files[num_train + num_val:]
+        else:
+            parts['valid'] = files[num_train:]
+
+        for subset, names in parts.items():
+            subsets[subset].extend((os.path.join(cls, f), label) for f in names)
+            if mode == 'manifest':
+                continue
+            subset_dir = os.path.join(output_path, subset, cls)
+            os.makedirs(subset_dir, exist_ok=True)
+            for f in names:
+                fallback += link_file(os.path.join(input_path, cls, f), os.path.join(subset_dir, f), mode)
+        if callback is not None:
+            callback(cls, {subset: len(names) for subset, names in parts.items()}, label, len(classes))
+
+    manifests = {}
+    if mode == 'manifest':
+        manifests = {subset: write_manifest(os.path.join(output_path, f'{subset}.json'), input_path, classes, samples)
+                     for subset, samples in subsets.items()}
+    return {
+        'total_images': sum(len(samples) for samples in subsets.values()),
+        'train_images': len(subsets['train']),
+        'val_images': len(subsets['valid']),
+        'test_images': len(subsets.get('test', [])),
+        'classes': classes,
+        'mode': mode,
+        'manifests': manifests,
+        'fallback_copies': fallback,
+    }
+
+
+def write_manifest(manifest_path, root, classes, samples, crop=None):
+    """
+    Write a subset manifest and the matching image list for the YOLO loader (`<subset>.txt`).
+
+    :param samples: (path relative to `root`, label) pairs.
+    :param crop: optional (x, y, width, height) applied to every image when it is loaded. The YOLO list is not
+                 written for cropped manifests, its loader would read the full images.
+    :return: manifest_path.
+    """
+    samples = sorted(samples, key=lambda s: (s[1], s[0]))  # ImageFolder order
+    root = os.path.abspath(root)
+    manifest = {'root': root, 'classes': list(classes), 'samples': [list(s) for s in samples]}
+    if crop is not None:
+        manifest['crop'] = list(crop)
+    with open(manifest_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False)
+    if crop is None:
+        with open(os.path.splitext(manifest_path)[0] + '.txt', 'w', encoding='utf-8') as f:
+            f.writelines(os.path.join(root, path) + '\n' for path, _ in samples)
+    return manifest_path
+
+
+def is_manifest(path):
+    return str(path).lower().endswith('.json') and os.path.isfile(path)
+
+
+class ManifestDataset(datasets.VisionDataset):
+    """
+    ImageFolder-compatible dataset (classes, class_to_idx, samples, targets) read from a split manifest. Images
+    of a manifest with a `crop` box are cropped when loaded.
+
+    Args:
+        manifest_path (str): `<subset>.json` written by `split_dataset(mode='manifest')`.
+        transform, target_transform: as in torchvision.
+        loader: image loader, PIL by default.
+    """
+
+    def __init__(self, manifest_path, transform=None, target_transform=None, loader=default_loader):
+        with open(manifest_path, encoding='utf-8') as f:
+            manifest = json.load(f)
+        super().__init__(manifest['root'], transform=transform, target_transform=target_transform)
+        self.loader = loader
+        self.classes = manifest['classes']
+        self.class_to_idx = {c: i for i, c in enumerate(self.classes)}
+        self.samples = [(os.path.join(self.root, path), label) for path, label in manifest['samples']]
+        self.targets = [label for _, label in self.samples]
+        self.imgs = self.samples
+        self.crop = manifest.get('crop')
+
+    def __getitem__(self, index):
+        path, target = self.samples[index]
+        sample = self.loader(path)
+        if self.crop is not None:
+            # clamped like the array slicing of the write-mode `crop_images`, PIL would pad out-of-bounds with black
+            x, y, width, height = self.crop
+            right, bottom = min(x + width, sample.width), min(y + height, sample.height)
+            sample = sample.crop((min(x, right), min(y, bottom), right, bottom))
+        if self.transform is not None:
+            sample = self.transform(sample)
+        if self.target_transform is not None:
+            target = self.target_transform(target)
+        return sample, target
+
+    def __len__(self):
+        return len(self.samples)
+
+
+def build_dataset(path, transform=None, shuffle=False, batch_size=1):
+    """
+    ImageFolder for a directory, ManifestDataset for a `.json` split manifest, ShardDataset for a shard directory.
+    `shuffle` and `batch_size` only apply to shard datasets, which shuffle and split across loader workers themselves.
+    """
+    if is_shard_dataset(path):
+        return ShardDataset(path, transform=transform, shuffle=shuffle, batch_size=batch_size)
+    if is_manifest(path):
+        return ManifestDataset(path, transform=transform)
+    return datasets.ImageFolder(root=path, transform=transform)
+
+
+def find_classes(path):
+    """(classes, class_to_idx) of a dataset directory, split manifest or shard dataset."""
+    if is_shard_dataset(path):
+        classes = load_index(path)['classes']
+        return classes, {c: i for i, c in enumerate(classes)}
+    if is_manifest(path):
+        with open(path, encoding='utf-8') as f:
+            classes = json.load(f)['classes']
+        return classes, {c: i for i, c in enumerate(classes)}
+    return datasets.folder.find_classes(path)
+
+
+# Usage-------------------------------------------------------------
+def main():
+    stats = split_dataset('../dataset/raw', '../dataset/split', train_ratio=0.8, mode='manifest', seed=0)
+    print(stats['train_images'], stats['val_images'], stats['manifests'])
+    dataset = build_dataset(stats['manifests']['train'])
+    print(len(dataset), dataset.classes)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,4 +1,6 @@
 import warnings
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 import matplotlib.pyplot as plt
 import numpy as np
@@ -83,6 +85,39 @@ class ConfusionMatrix:
         plt.close(fig)
 
 
+def _plot_matrix(matrix, pic_name, save_dir, names):
+    cm = ConfusionMatrix(nc=len(matrix), pic_name=pic_name)
+    cm.matrix = np.asarray(matrix, dtype=float)
+    for normalize in True, False:
+        cm.plot(normalize=normalize, save_dir=save_dir, names=names)
+    return pic_name
+
+
+def plot_confusion_matrices(matrices, save_dir='', names=(), workers=None):
+    """
+    Plot already accumulated confusion matrices (normalized and raw) in a process pool.
+
+    Args:
+        matrices (dict): pic_name -> (nc, nc) matrix, rows are predictions and columns ground truths.
+        save_dir (str): Directory where the plots will be saved.
+        names (tuple): Names of classes.
+        workers (int): plotting processes, default is the CPU count. 0 plots in the calling process.
+
+    Returns:
+        (list): pic names of the plotted matrices.
+    """
+    if not matrices:
+        return []
+    if workers == 0:
+        return [_plot_matrix(matrix, pic_name, save_dir, names) for pic_name, matrix in matrices.items()]
+    workers = min(workers or mp.cpu_count(), len(matrices))
+    # spawn: seaborn / matplotlib state must not be forked from a threaded process
+    with ProcessPoolExecutor(max_workers=workers, mp_context=mp.get_context('spawn')) as pool:
+        futures = [pool.submit(_plot_matrix, np.asarray(matrix), pic_name, save_dir, tuple(names))
+                   for pic_name, matrix in matrices.items()]
+        return [future.result() for future in futures]
+
+
 # Usage-----------------------------------------------------------------------------------------------------------------
 def main():
     # probability matrix for each pred image
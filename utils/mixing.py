@@ -0,0 +1,193 @@
+"""Multi-source IQ mixing
+
+`MixingEngine` sums N memory-mapped captures slice by slice, every source with its own gain (or SNR against the
+reference source), time offset and frequency shift, and optionally adds white noise. Only the samples of the slice
+being mixed are read, nothing is padded or converted up front, and slices are rendered by the colormap-lookup
+spectrogram path in parallel worker processes. Used to build multi-drone interference datasets, see
+`tools/drone_mixing.py`.
+"""
+import os
+import time
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+from PIL import Image
+
+from SNREstimation.SNR_estimation import load_iq
+from graphic.RawDataProcessor import spectrogram_image
+from graphic.waterfull import jet_lut
+
+_engine = None  # per worker process, built once by `_mix_init`
+
+
+def mean_power(data, slice_point, num_slices=16):
+    """Mean power of a capture estimated on up to `num_slices` evenly spaced slices, reads a fraction of the file."""
+    length = min(slice_point, len(data))
+    if not length:
+        return 0.0
+    starts = np.unique(np.linspace(0, len(data) - length, num_slices).astype(np.int64))
+    return float(np.mean([np.mean(np.abs(np.asarray(data[s:s + length])) ** 2) for s in starts]))
+
+
+class MixingEngine:
+    """
+    Mix memory-mapped IQ captures slice by slice.
+
+    Every source is a dict:
+        path (str): capture path.
+        file_type (str): sample type, default float32 (interleaved I/Q).
+        gain_db (float): gain applied to the source, default 0.
+        snr_db (float): instead of `gain_db`, scale the source so that its power is `snr_db` above the power of the
+            reference source (the first one). Ignored for the reference itself.
+        offset (float): start time of the source in the mix, in seconds. Negative values skip its beginning.
+        freq_shift (float): frequency shift in Hz, phase continuous over the whole capture.
+
+    Args:
+        sources (list[dict]): sources to mix, the first one is the reference.
+        fs (float): sample rate shared by all sources.
+        duration_time (float): slice length in seconds.
+        step_time (float): hop between two slices in seconds, default is `duration_time`.
+        awgn_snr_db (float): add white noise with this SNR against the reference source power, None adds no noise.
+        seed (int): noise seed.
+    """
+
+    def __init__(self, sources, fs=100e6, duration_time=0.1, step_time=None, awgn_snr_db=None, seed=None):
+        if not sources:
+            raise ValueError("At least one source is required")
+        self._config = {'sources': [dict(source) for source in sources], 'fs': fs, 'duration_time': duration_time,
+                        'step_time': step_time, 'awgn_snr_db': awgn_snr_db, 'seed': seed}
+        self.fs = fs
+        self.slice_point = int(fs * duration_time)
+        self.step = int(fs * step_time) if step_time else self.slice_point
+        self.sources = []
+        for source in sources:
+            data = load_iq(source['path'], np.dtype(source.get('file_type', 'float32')))
+            self.sources.append({
+                'data': data,
+                'offset': int(round(source.get('offset', 0.0) * fs)),
+                'freq_shift': float(source.get('freq_shift', 0.0)),
+                'gain': 10 ** (source.get('gain_db', 0.0) / 20),
+                'snr_db': source.get('snr_db'),
+            })
+
+        reference = self.sources[0]
+        self.reference_power = mean_power(reference['data'], self.slice_point) * reference['gain'] ** 2
+        for source in self.sources[1:]:
+            if source['snr_db'] is not None:
+                power = mean_power(source['data'], self.slice_point)
+                target = self.reference_power * 10 ** (source['snr_db'] / 10)
+                source['gain'] = np.sqrt(target / power) if power > 0 else 0.0
+        self.noise_std = (np.sqrt(self.reference_power / 10 ** (awgn_snr_db / 10) / 2)
+                          if awgn_snr_db is not None else None)
+        self.seed = seed
+
+        # the mix lasts until the last source ends, like zero-padding the shorter captures
+        self.length = max(s['offset'] + len(s['data']) for s in self.sources)
+        self.num_slices = max(0, (self.length - self.slice_point) // self.step + 1)
+
+    def __len__(self):
+        return self.num_slices
+
+    def mix(self, start, length=None):
+        """Mixed complex64 samples [start, start + length) of the mix timeline."""
+        length = length or self.slice_point
+        out = np.zeros(length, dtype=np.complex64)
+        for source in self.sources:
+            a = max(start - source['offset'], 0)
+            b = min(start + length - source['offset'], len(source['data']))
+            if b <= a:
+                continue
+            segment = np.asarray(source['data'][a:b], dtype=np.complex64) * np.float32(source['gain'])
+            if source['freq_shift']:
+                n = np.arange(a, b, dtype=np.float64)
+                segment *= np.exp(2j * np.pi * source['freq_shift'] / self.fs * n).astype(np.complex64)
+            out[a + source['offset'] - start:b + source['offset'] - start] += segment
+        if self.noise_std is not None:
+            # seeded per slice, the same slice gets the same noise in any worker
+            rng = np.random.default_rng(None if self.seed is None else (self.seed, start))
+            out += (rng.standard_normal((length, 2), dtype=np.float32) * np.float32(self.noise_std)).view(
+                np.complex64)[:, 0]
+        return out
+
+    def slice(self, k):
+        """Mixed samples of slice `k`."""
+        return self.mix(k * self.step)
+
+    def __iter__(self):
+        for k in range(self.num_slices):
+            yield self.slice(k)
+
+    def slice_name(self, k):
+        """`<position>` of the slice in `generate_images` naming, in slice lengths: 0, 0.5, 1, ... for half steps."""
+        return f'{k * self.step / self.slice_point:g}'
+
+    def render(self, output_path, name='mix', stft_point=1024, size=(1920, 1440), workers=None, chunk_size=16,
+               callback=None):
+        """
+        Render every mixed slice as `<output_path>/<name> (<position>).jpg` in a process pool.
+
+        :param stft_point: STFT points.
+        :param size: image (width, height), see `spectrogram_image`.
+        :param workers: worker processes, the CPU count by default.
+        :param chunk_size: slices per task.
+        :param callback: called as callback(done_slices, total_slices) after every chunk.
+        :return: stats dict.
+        """
+        os.makedirs(output_path, exist_ok=True)
+        chunks = [list(range(k, min(k + chunk_size, self.num_slices)))
+                  for k in range(0, self.num_slices, chunk_size)]
+        stats = {'slices': self.num_slices, 'images': 0, 'errors': [], 'output_path': output_path}
+        start = time.perf_counter()
+        workers = min(workers or os.cpu_count() or 1, max(len(chunks), 1))
+        # spawn: the pool may be started from a service thread, forking a threaded process is unsafe
+        with ProcessPoolExecutor(max_workers=workers, mp_context=mp.get_context('spawn'),
+                                 initializer=_mix_init, initargs=(self.config(),)) as pool:
+            futures = [pool.submit(_render_chunk, chunk, output_path, name, stft_point, size) for chunk in chunks]
+            done = 0
+            for future in as_completed(futures):
+                written, errors, count = future.result()
+                stats['images'] += written
+                stats['errors'] += errors
+                done += count
+                if callback is not None:
+                    callback(done, self.num_slices)
+        stats['duration_s'] = round(time.perf_counter() - start, 2)
+        stats['slices_per_s'] = round(self.num_slices / max(stats['duration_s'], 1e-9), 2)
+        return stats
+
+    def config(self):
+        """Picklable description of the engine, rebuilt (memory maps included) in the worker processes."""
+        return self._config
+
+
+def _mix_init(config):
+    global _engine
+    _engine = MixingEngine(**config)
+
+
+def _render_chunk(chunk, output_path, name, stft_point, size):
+    lut = jet_lut()
+    written, errors = 0, []
+    for k in chunk:
+        path = os.path.join(output_path, f'{name} ({_engine.slice_name(k)}).jpg')
+        try:
+            Image.fromarray(spectrogram_image(_engine.slice(k), stft_point, _engine.fs, size, lut)).save(path)
+            written += 1
+        except Exception as e:
+            errors.append(f'{path}: {e}')
+    return written, errors, len(chunk)
+
+
+# Usage-------------------------------------------------------------
+def main():
+    engine = MixingEngine([
+        {'path': '../dataset/raw/DJI/pack1.iq'},
+        {'path': '../dataset/raw/FPV/pack1.iq', 'snr_db': -3, 'offset': 0.05, 'freq_shift': 5e6},
+    ], fs=100e6, duration_time=0.1, step_time=0.05, awgn_snr_db=10, seed=0)
+    print(len(engine))
+    print(engine.render('../dataset/mixed/DJI+FPV', name='DJI+FPV', stft_point=1024))
+
+
+if __name__ == '__main__':
+    main()
@@ -14,24 +14,183 @@ Args:
 """
 
 import albumentations as A
-import shutil
-import random
 import cv2
 from PIL import Image
 import numpy as np
 import os
+import time
+import shutil
+import subprocess
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from utils.manifest import split_dataset, write_manifest
+
+
+AUGMENTATION_METHODS = {
+    "AdvancedBlur": lambda: A.AdvancedBlur(
+        blur_limit=(7, 13), sigma_x_limit=(7, 13), sigma_y_limit=(7, 13),
+        rotate_limit=(-90, 90), beta_limit=(0.5, 8), noise_limit=(2, 10), p=1),
+    "CLAHE": lambda: A.CLAHE(clip_limit=3, tile_grid_size=(13, 13), p=1),
+    "ColorJitter": lambda: A.ColorJitter(brightness=(0.5, 1.5), contrast=(1, 1),
+                                         saturation=(1, 1), hue=(-0, 0), p=1),
+    "GaussNoise": lambda: A.GaussNoise(var_limit=(100, 500), mean=0, p=1),
+    "ISONoise": lambda: A.ISONoise(intensity=(0.2, 0.5), color_shift=(0.01, 0.05), p=1),
+    "Sharpen": lambda: A.Sharpen(alpha=(0.2, 0.5), lightness=(0.5, 1), p=1),
+}
+IMG_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp')
+
+_pipelines = None  # per worker process, built once by `_augment_init`
+
+
+def get_augmentation_methods(names=None):
+    """
+    Albumentations transforms by name, see `AUGMENTATION_METHODS`. All methods when `names` is empty, unknown names
+    are skipped.
+    """
+    names = names or list(AUGMENTATION_METHODS)
+    return [AUGMENTATION_METHODS[name]() for name in names if name in AUGMENTATION_METHODS]
+
+
+class RandomAugmentation:
+    """
+    Training-time augmentation for torchvision pipelines: with probability `p` one of `methods` (names of
+    `AUGMENTATION_METHODS`) is applied to the PIL image. Runs inside the DataLoader workers, so every epoch sees fresh
+    variants without augmented copies on disk.
+    """
+
+    def __init__(self, methods=None, p=0.5):
+        self.methods = list(methods or AUGMENTATION_METHODS)
+        unknown = [name for name in self.methods if name not in AUGMENTATION_METHODS]
+        if unknown:
+            raise ValueError(f"Unknown augmentation methods: {unknown}, expected {list(AUGMENTATION_METHODS)}")
+        self.p = p
+        self.transform = A.OneOf(get_augmentation_methods(self.methods), p=p)
+
+    def __call__(self, image):
+        return Image.fromarray(self.transform(image=np.asarray(image.convert('RGB')))['image'])
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}(methods={self.methods}, p={self.p})"
+
+
+def _augment_init(methods):
+    global _pipelines
+    cv2.setNumThreads(1)  # one process per core already
+    if all(isinstance(m, str) for m in methods):
+        methods = get_augmentation_methods(methods)
+    _pipelines = [A.Compose([method]) for method in methods]
+
+
+def _augment_chunk(chunk):
+    """Decode every image of the chunk once, apply all methods, and hand the encoding to a writer thread."""
+    start = time.perf_counter()
+    images, augmented, errors = 0, 0, []
+    with ThreadPoolExecutor(max_workers=2) as writer:
+        writes = []
+        for src, save_dir in chunk:
+            image = cv2.imread(src)
+            if image is None:
+                errors.append(f"cannot read {src}")
+                continue
+            base, ext = os.path.splitext(os.path.basename(src))
+            writes.append(writer.submit(shutil.copyfile, src, os.path.join(save_dir, f"{base}_origin{ext}")))
+            for i, pipeline in enumerate(_pipelines):
+                # a failing method (e.g. an image too small for a crop) skips this output, not the whole chunk
+                try:
+                    writes.append(writer.submit(cv2.imwrite, os.path.join(save_dir, f"{base}_AugM{i}{ext}"),
+                                                pipeline(image=image)['image']))
+                    augmented += 1
+                except Exception as e:
+                    errors.append(f"method {i} failed on {src}: {e}")
+            images += 1
+        for write in writes:
+            try:
+                write.result()
+            except Exception as e:
+                errors.append(str(e))
+    return {'pid': os.getpid(), 'processed': len(chunk), 'images': images, 'augmented': augmented, 'errors': errors,
+            'seconds': time.perf_counter() - start}
+
+
+def augment_images(dataset_path, output_path, methods=None, subsets=('train', 'valid'), workers=None,
+                   chunk_size=32, callback=None):
+    """
+    Augment every image of `dataset_path/<subset>/<class>` into `output_path/<subset>/<class>`.
+
+    Each image is decoded once and goes through all methods (`<name>_AugM<i><ext>`), and the original is copied once
+    (`<name>_origin<ext>`). Chunks of `chunk_size` images run on a process pool, and each worker writes its
+    outputs from a background thread while it augments the next image.
+
+    Args:
+        methods (list, optional): Method names of `AUGMENTATION_METHODS` or Albumentations transforms, all methods
+            by default.
+        workers (int, optional): Worker processes, the CPU count by default.
+        callback (callable, optional): Called as callback(done_images, total_images, chunk_result) after every chunk.
+
+    Returns:
+        dict: Image counts, classes, duration and per-worker throughput.
+    """
+    methods = methods or list(AUGMENTATION_METHODS)
+    work, classes = [], []
+    for subset in subsets:
+        path = os.path.join(dataset_path, subset)
+        if not os.path.isdir(path):
+            continue
+        subset_classes = sorted(d for d in os.listdir(path) if os.path.isdir(os.path.join(path, d)))
+        classes = classes or subset_classes
+        for _class in subset_classes:
+            save_dir = os.path.join(output_path, subset, _class)
+            os.makedirs(save_dir, exist_ok=True)
+            work += [(os.path.join(path, _class, f), save_dir) for f in sorted(os.listdir(os.path.join(path, _class)))
+                     if f.lower().endswith(IMG_EXTENSIONS)]
+    if not work:
+        raise FileNotFoundError(f"No images found under {subsets} of {dataset_path}")
+
+    chunks = [work[i:i + chunk_size] for i in range(0, len(work), chunk_size)]
+    workers = min(workers or os.cpu_count() or 1, len(chunks))
+    per_worker, errors, done = {}, [], 0
+    start = time.perf_counter()
+    # spawn: the pool may be started from a service thread, forking a threaded process is unsafe
+    with ProcessPoolExecutor(max_workers=workers, mp_context=mp.get_context('spawn'),
+                             initializer=_augment_init, initargs=(methods,)) as pool:
+        for future in as_completed([pool.submit(_augment_chunk, chunk) for chunk in chunks]):
+            result = future.result()
+            stat = per_worker.setdefault(result['pid'], {'images': 0, 'augmented': 0, 'seconds': 0.0})
+            for key in stat:
+                stat[key] += result[key]
+            errors += result['errors']
+            done += result['processed']
+            if callback is not None:
+                callback(done, len(work), result)
+    duration = time.perf_counter() - start
+
+    images = sum(stat['images'] for stat in per_worker.values())
+    return {
+        'original_images': images,
+        'augmented_images': sum(stat['augmented'] for stat in per_worker.values()),
+        'methods_used': len(methods),
+        'classes': classes,
+        'workers': [{'pid': pid, 'images': stat['images'],
+                     'images_per_s': round(stat['images'] / stat['seconds'], 2) if stat['seconds'] else None}
+                    for pid, stat in per_worker.items()],
+        'images_per_s': round(images / duration, 2) if duration else None,
+        'duration_s': round(duration, 2),
+        'errors': errors,
+    }
 
 
 def data_augmentation(dataset_path: str = None,
                       output_path: str = None,
-                      methods: list[str] = None):
+                      methods: list = None,
+                      workers: int = None):
     """
     Perform data augmentation on the given dataset using specified methods.
 
     Args:
         dataset_path (str): The file path of the dataset.
         output_path (str, optional): The path where the augmented dataset will be saved. If not specified, a new directory named `dataset_aug` will be created in the same directory as the dataset.
-        methods (list, optional): The augmentation methods to apply. Each method is an instance of an Albumentations transformation. If not specified, default methods are used.
+        methods (list, optional): The augmentation methods to apply, Albumentations transformations or names of `AUGMENTATION_METHODS`. If not specified, default methods are used.
+        workers (int, optional): Worker processes, see `augment_images`.
 
     Raises:
         FileNotFoundError: If the dataset path does not exist.
@@ -50,74 +209,12 @@ def data_augmentation(dataset_path: str = None,
     if not output_path:
         prefix = os.path.dirname(os.path.dirname(dataset_path))
         output_path = os.path.join(prefix, 'dataset_aug')
-        os.mkdir(output_path)
-
-    if methods is None:
-        methods = [
-            A.AdvancedBlur(
-                blur_limit=(7, 13),
-                sigma_x_limit=(7, 13),
-                sigma_y_limit=(7, 13),
-                rotate_limit=(-90, 90),
-                beta_limit=(0.5, 8),
-                noise_limit=(2, 10),
-                p=1),
-            A.CLAHE(
-                clip_limit=3,
-                tile_grid_size=(13, 13),
-                p=1),
-            A.ColorJitter(
-                brightness=(0.5, 1.5),
-                contrast=(1, 1),
-                saturation=(1, 1),
-                hue=(-0, 0),
-                p=1),
-            A.GaussNoise(
-                var_limit=(100, 500),
-                mean=0,
-                p=1),
-            A.ISONoise(
-                intensity=(0.2, 0.5),
-                color_shift=(0.01, 0.05),
-                p=1),
-            A.Sharpen(
-                alpha=(0.2, 0.5),
-                lightness=(0.5, 1),
-                p=1)
-            ]
-
-    total_path = [
-        os.path.join(dataset_path, 'train'),
-        os.path.join(dataset_path, 'valid'),
-    ]
-
-    for path in total_path:
-        _ = os.path.join(output_path, path.split('/')[-1])
-        if not os.path.exists(_):
-            os.mkdir(_)
-        classes = os.listdir(path)
-
-        for _class in classes:
-            _save_path = os.path.join(_, _class)
-            if not os.path.exists(_save_path):
-                os.mkdir(_save_path)
-            path_image = os.path.join(path, _class)
-            images = os.listdir(path_image)
-            i = 0
-
-            for method in methods:
-
-                for image in images:
-                    original_image = cv2.imread(os.path.join(path_image, image))
-                    # original_image = cv2.cvtColor(cv2.imread(os.path.join(path_image, image)), cv2.COLOR_BGR2RGB)
-                    # show_image(original_image)
-                    transform = A.Compose(method)
-                    augmented = transform(image=original_image)
-                    cv2.imwrite(os.path.join(_save_path, image+'_AugM'+str(i)+os.path.splitext(image)[1]), augmented['image'])
-                    cv2.imwrite(os.path.join(_save_path, image+'_origin'+os.path.splitext(image)[1]), original_image)
-                i += 1
-
-            print(f"Finished augmentation of {_class}")
+        os.makedirs(output_path, exist_ok=True)
+
+    stats = augment_images(dataset_path, output_path, methods, workers=workers,
+                           callback=lambda done, total, result: print(f"Augmented {done}/{total} images"))
+    print(f"Finished augmentation: {stats['augmented_images']} images, {stats['images_per_s']} images/s")
+    return stats
 
 
 def show_image(image):
@@ -128,42 +225,22 @@ def show_image(image):
     cv2.destroyAllWindows()
 
 
-def split_images(input_path, output_path, train_ratio=0.8):
-
-    print('starting split')
-
-    if not os.path.exists(output_path):
-        os.makedirs(output_path)
-
-
-    for drone_type in os.listdir(input_path):
+def split_images(input_path, output_path, train_ratio=0.8, mode='copy', seed=None):
 
-        train_path = os.path.join(os.path.join(output_path, 'train'), drone_type)
-        valid_path = os.path.join(os.path.join(output_path, 'valid'), drone_type)
-
-        if not os.path.exists(train_path):
-            os.makedirs(train_path)
-
-        if not os.path.exists(valid_path):
-            os.makedirs(valid_path)
-
-        image_files = [f for f in os.listdir(os.path.join(input_path, drone_type)) if f.lower().endswith(('.png', '.jpg', '.jpeg'))]
-        random.shuffle(image_files)
-
-        num_train = int(len(image_files) * train_ratio)
-
-        for image in image_files[:num_train]:
-            src = os.path.join(os.path.join(input_path, drone_type), image)
-            dst = os.path.join(train_path, image)
-            shutil.copy(src, dst)
-
-        for image in image_files[num_train:]:
-            src = os.path.join(os.path.join(input_path, drone_type), image)
-            dst = os.path.join(valid_path, image)
-            shutil.copy(src, dst)
+    """
+    Split a class-folder dataset into `train` and `valid`.
 
-        print(drone_type + ' Done')
+    Args:
+        mode (str): 'copy', 'hardlink', 'reflink' or 'symlink' for class folders, 'manifest' to only write
+            `train.json` / `valid.json`, see `utils.manifest.split_dataset`.
+        seed (int, optional): Random seed.
+    """
 
+    print('starting split')
+    stats = split_dataset(input_path, output_path, train_ratio=train_ratio, mode=mode, seed=seed,
+                          extensions=('.png', '.jpg', '.jpeg'),
+                          callback=lambda drone_type, counts, idx, num_classes: print(drone_type + ' Done'))
+    return stats
 
 
 def read_image_with_chinese_path(image_path):
@@ -207,6 +284,116 @@ def crop_and_save_image(image,
     print(f"Cropped image saved to {output_path}")
 
 
+JPEGTRAN = shutil.which('jpegtran')
+
+
+def _crop_file(src, dst, box, lossless=True):
+    """
+    Crop one image. JPEGs whose crop origin sits on an iMCU boundary (multiple of 16) are cropped losslessly in the
+    DCT domain by jpegtran, without decoding, when it is installed; other images are decoded and re-encoded.
+
+    :return: 'lossless' or 'decoded'.
+    """
+    x, y, width, height = box
+    if (lossless and JPEGTRAN and x % 16 == 0 and y % 16 == 0
+            and src.lower().endswith(('.jpg', '.jpeg'))):
+        result = subprocess.run([JPEGTRAN, '-crop', f'{width}x{height}+{x}+{y}', '-copy', 'none',
+                                 '-outfile', dst, src], capture_output=True)
+        if result.returncode == 0:
+            return 'lossless'
+    # np.fromfile / imdecode also handles non-ascii paths
+    image = cv2.imdecode(np.fromfile(src, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if image is None:
+        raise ValueError(f"cannot read {src}")
+    ok, buffer = cv2.imencode(os.path.splitext(dst)[1], image[y:y + height, x:x + width])
+    if not ok:
+        raise ValueError(f"cannot encode {dst}")
+    buffer.tofile(dst)
+    return 'decoded'
+
+
+def _crop_chunk(chunk, box, lossless):
+    result = {'success': 0, 'failed': 0, 'lossless': 0, 'errors': []}
+    for src, dst in chunk:
+        try:
+            if _crop_file(src, dst, box, lossless) == 'lossless':
+                result['lossless'] += 1
+            result['success'] += 1
+        except Exception as e:
+            result['failed'] += 1
+            result['errors'].append(f"{os.path.basename(src)}: {e}")
+    return result
+
+
+def _list_images(input_path):
+    """(path relative to `input_path`) of every image below it, or the file itself."""
+    if os.path.isfile(input_path):
+        return [os.path.basename(input_path)]
+    return sorted(os.path.relpath(os.path.join(root, f), input_path)
+                  for root, _, files in os.walk(input_path) for f in files if f.lower().endswith(IMG_EXTENSIONS))
+
+
+def crop_images(input_path, output_path, box, workers=None, chunk_size=64, lossless=True, callback=None):
+    """
+    Crop the fixed rectangle `box` = (x, y, width, height) out of an image or every image below a folder, mirroring
+    the folder tree into `output_path`. Chunks of `chunk_size` images run on a process pool.
+
+    Args:
+        lossless (bool): Use the jpegtran DCT-domain crop for aligned JPEGs, see `_crop_file`.
+        callback (callable, optional): Called as callback(done_images, total_images, chunk_result) after every chunk.
+
+    Returns:
+        dict: total_images, success, failed, lossless, duration_s, images_per_s, errors.
+    """
+    files = _list_images(input_path)
+    root = os.path.dirname(input_path) if os.path.isfile(input_path) else input_path
+    work = []
+    for rel in files:
+        dst = os.path.join(output_path, rel)
+        os.makedirs(os.path.dirname(dst), exist_ok=True)
+        work.append((os.path.join(root, rel), dst))
+
+    stats = {'total_images': len(work), 'success': 0, 'failed': 0, 'lossless': 0, 'errors': []}
+    start = time.perf_counter()
+    if work:
+        chunks = [work[i:i + chunk_size] for i in range(0, len(work), chunk_size)]
+        done = 0
+        with ProcessPoolExecutor(max_workers=min(workers or os.cpu_count() or 1, len(chunks)),
+                                 mp_context=mp.get_context('spawn')) as pool:
+            futures = {pool.submit(_crop_chunk, chunk, tuple(box), lossless): len(chunk) for chunk in chunks}
+            for future in as_completed(futures):
+                result = future.result()
+                for key in ('success', 'failed', 'lossless', 'errors'):
+                    stats[key] += result[key]
+                done += futures[future]
+                if callback is not None:
+                    callback(done, len(work), result)
+    stats['duration_s'] = round(time.perf_counter() - start, 2)
+    stats['images_per_s'] = round(len(work) / stats['duration_s'], 2) if stats['duration_s'] else None
+    return stats
+
+
+def write_crop_manifest(input_path, output_path, box):
+    """
+    Crop virtually: write `crop.json`, a manifest of every image below `input_path` with the crop box, instead of
+    cropped copies. Top-level folders are the classes, as in ImageFolder. The manifest loads through
+    `utils.manifest.build_dataset` and the crop is applied when an image is read.
+
+    :return: manifest path.
+    """
+    files = _list_images(input_path)
+    if os.path.isfile(input_path):
+        input_path = os.path.dirname(input_path)
+    classes = sorted({rel.split(os.sep)[0] for rel in files if os.sep in rel})
+    class_to_idx = {c: i for i, c in enumerate(classes)}
+    if not classes:
+        classes, class_to_idx = [os.path.basename(os.path.normpath(input_path))], {}
+    # images outside class folders get label 0
+    samples = [(rel, class_to_idx.get(rel.split(os.sep)[0], 0)) for rel in files]
+    os.makedirs(output_path, exist_ok=True)
+    return write_manifest(os.path.join(output_path, 'crop.json'), input_path, classes, samples, crop=box)
+
+
 def CropImage(
         fig_save_path: str,
         file_path: str,
@@ -216,29 +403,11 @@ def CropImage(
         height
 ):
 
-    drones = os.listdir(file_path)
-
-    for drone in drones:
-        packlist = os.listdir(file_path + drone)
-        for pack in packlist:
-
-            _ = os.path.join(file_path+drone, pack)
-
-            if os.path.isfile(_):
-                check_folder(fig_save_path + drone)
-                crop_and_save_image(read_image_with_chinese_path(_), fig_save_path + drone + '/' + pack, x=x, y=y, width=width, height=height)
-
-            else:
-                imgs = os.listdir(_)
-                for img in imgs:
-                    _save_path = os.path.join(fig_save_path + drone, pack)
-                    check_folder(_save_path)
-                    img_path = os.path.join(_, img)
-                    crop_and_save_image(read_image_with_chinese_path(img_path), _save_path + '/' + img, x=x, y=y, width=width, height=height)
-                    print(img + ' Done')
-            print(pack + ' Done')
-        print(drone + ' Done')
-    print('All Done')
+    stats = crop_images(file_path, fig_save_path, (x, y, width, height),
+                        callback=lambda done, total, result: print(f"Cropped {done}/{total} images"))
+    print(f"All Done: {stats['success']} cropped ({stats['lossless']} lossless), {stats['failed']} failed, "
+          f"{stats['images_per_s']} images/s")
+    return stats
 
 
 def check_folder(folder_path):
@@ -0,0 +1,324 @@
+"""
+Structured pruning of trained classifiers against a latency budget, followed by a short fine-tuning pass.
+"""
+import os
+import json
+from copy import deepcopy
+
+import torch
+import torch.nn as nn
+from torch.utils.data import DataLoader
+from torchvision import transforms
+from torchvision.models.mobilenetv3 import InvertedResidual
+from torchvision.models.resnet import BasicBlock, Bottleneck
+from torchvision.ops.misc import MLP, SqueezeExcitation
+
+from utils.trainer import Basetrainer, model_init_, save_train_config
+from utils.build import build_from_cfg, check_cfg
+from utils.benchmark import measure_latency
+from utils.manifest import build_dataset
+from utils.logger import colorful_logger
+
+try:
+    import thop  # for FLOPs computation
+except ImportError:
+    thop = None
+
+# keep ratios tried by the latency search, widest first
+KEEP_RATIOS = (0.9, 0.8, 0.7, 0.6, 0.5, 0.4, 0.3, 0.2, 0.1)
+
+
+def _keep_indices(importance, keep_ratio, divisor=8):
+    """Indices of the most important channels, in their original order, rounded to a multiple of `divisor`."""
+    n = importance.numel()
+    k = min(n, max(divisor, int(round(n * keep_ratio / divisor)) * divisor))
+    return importance.argsort(descending=True)[:k].sort().values
+
+
+def _prune_conv(conv, keep, dim):
+    conv.weight = nn.Parameter(conv.weight.data.index_select(dim, keep).clone())
+    if dim == 0:
+        conv.out_channels = len(keep)
+        if conv.bias is not None:
+            conv.bias = nn.Parameter(conv.bias.data[keep].clone())
+    else:
+        conv.in_channels = len(keep)
+
+
+def _prune_bn(bn, keep):
+    bn.weight = nn.Parameter(bn.weight.data[keep].clone())
+    bn.bias = nn.Parameter(bn.bias.data[keep].clone())
+    bn.running_mean = bn.running_mean[keep].clone()
+    bn.running_var = bn.running_var[keep].clone()
+    bn.num_features = len(keep)
+
+
+def _prune_linear(linear, keep, dim):
+    linear.weight = nn.Parameter(linear.weight.data.index_select(dim, keep).clone())
+    if dim == 0:
+        linear.out_features = len(keep)
+        if linear.bias is not None:
+            linear.bias = nn.Parameter(linear.bias.data[keep].clone())
+    else:
+        linear.in_features = len(keep)
+
+
+def _prune_resnet_block(block, keep_ratio):
+    # only the channels inside the block, the residual width is shared with the shortcut and stays as is
+    if isinstance(block, Bottleneck):
+        layers = [(block.conv1, block.bn1, block.conv2), (block.conv2, block.bn2, block.conv3)]
+    else:
+        layers = [(block.conv1, block.bn1, block.conv2)]
+    for conv, bn, next_conv in layers:
+        keep = _keep_indices(bn.weight.detach().abs(), keep_ratio)
+        _prune_conv(conv, keep, 0)
+        _prune_bn(bn, keep)
+        _prune_conv(next_conv, keep, 1)
+
+
+def _prune_inverted_residual(block, keep_ratio):
+    # expand 1x1 -> depthwise -> (squeeze-excitation) -> project 1x1, only the expanded width is pruned, the block
+    # input and output are shared with the residual path
+    layers = list(block.block)
+    dw = next(i for i, layer in enumerate(layers) if isinstance(layer, nn.Sequential) and layer[0].groups > 1)
+    if dw == 0:
+        return  # no expansion layer, the depthwise conv runs on the block input
+    expand, depthwise, project = layers[0], layers[dw], layers[-1]
+    keep = _keep_indices(expand[1].weight.detach().abs(), keep_ratio)
+    _prune_conv(expand[0], keep, 0)
+    _prune_bn(expand[1], keep)
+    _prune_conv(depthwise[0], keep, 0)
+    depthwise[0].in_channels = depthwise[0].groups = len(keep)
+    _prune_bn(depthwise[1], keep)
+    for layer in layers[dw + 1:-1]:
+        if isinstance(layer, SqueezeExcitation):
+            _prune_conv(layer.fc1, keep, 1)
+            _prune_conv(layer.fc2, keep, 0)
+    _prune_conv(project[0], keep, 1)
+
+
+def _prune_mlp(mlp, keep_ratio):
+    # Linear -> GELU -> Dropout -> Linear, a hidden neuron matters as much as its weights in and out
+    fc1, fc2 = mlp[0], mlp[3]
+    importance = fc1.weight.detach().norm(dim=1) * fc2.weight.detach().norm(dim=0)
+    keep = _keep_indices(importance, keep_ratio)
+    _prune_linear(fc1, keep, 0)
+    _prune_linear(fc2, keep, 1)
+
+
+def prune_model(model, keep_ratio):
+
+    """
+    Structured pruning of a `model_init_` classifier, the pruned layers are physically smaller.
+
+    ResNets keep the `keep_ratio` channels with the largest BatchNorm scale inside every residual block, MobileNetV3
+    the expanded channels of every inverted residual block ranked the same way (expansion, depthwise and
+    squeeze-excitation layers shrink together). ViT and Swin
+    keep the `keep_ratio` hidden neurons of every transformer MLP, ranked by the norm of their input and output
+    weights. The attention projections are fused in `nn.MultiheadAttention`, so heads are left untouched.
+
+    Parameters:
+    - model (torch.nn.Module): Trained classifier, not modified
+    - keep_ratio (float): Fraction of the prunable channels to keep, in (0, 1]
+
+    Returns:
+    - model (torch.nn.Module): Pruned copy
+    """
+
+    if not 0 < keep_ratio <= 1:
+        raise ValueError(f"keep_ratio must be in (0, 1], got {keep_ratio}")
+    model = deepcopy(model)
+    blocks = [m for m in model.modules() if isinstance(m, (BasicBlock, Bottleneck))]
+    inverted = [m for m in model.modules() if isinstance(m, InvertedResidual)]
+    mlps = [m for m in model.modules() if isinstance(m, MLP) and len(m) >= 4
+            and isinstance(m[0], nn.Linear) and isinstance(m[3], nn.Linear)]
+    if not blocks and not inverted and not mlps:
+        raise ValueError(f"Pruning supports ResNet, MobileNetV3, ViT and Swin models, got {model._get_name()}")
+    for block in blocks:
+        _prune_resnet_block(block, keep_ratio)
+    for block in inverted:
+        _prune_inverted_residual(block, keep_ratio)
+    for mlp in mlps:
+        _prune_mlp(mlp, keep_ratio)
+    return model
+
+
+def model_profile(model, image_size):
+
+    """
+    Returns:
+    - dict: params_m (millions of parameters) and gflops (None when thop is not installed)
+    """
+
+    params = sum(p.numel() for p in model.parameters())
+    gflops = None
+    if thop is not None:
+        x = torch.zeros(1, 3, image_size, image_size, device=next(model.parameters()).device)
+        gflops = round(thop.profile(deepcopy(model), inputs=(x,), verbose=False)[0] / 1E9 * 2, 3)
+    return {'params_m': round(params / 1e6, 3), 'gflops': gflops}
+
+
+def evaluate_accuracy(model, val_path, image_size, device='cpu', batch_size=32):
+
+    """
+    Top-1 accuracy (%) on an ImageFolder or split manifest, same preprocessing as `Basetrainer`.
+    """
+
+    loader = DataLoader(build_dataset(val_path, transform=transforms.Compose([
+        transforms.Resize((image_size, image_size)),
+        transforms.ToTensor(),
+    ])), batch_size=batch_size, shuffle=False)
+    model.to(device).eval()
+    correct, total = 0, 0
+    with torch.no_grad():
+        for images, labels in loader:
+            correct += model(images.to(device)).argmax(1).cpu().eq(labels).sum().item()
+            total += labels.size(0)
+    return 100 * correct / max(total, 1)
+
+
+def search_keep_ratio(model, image_size, latency_budget_ms, device='cpu', ratios=KEEP_RATIOS):
+
+    """
+    Largest keep ratio whose pruned model runs within `latency_budget_ms` on `device` (batch size 1).
+
+    Returns:
+    - keep_ratio (float): The selected ratio, the smallest one tried when none meets the budget
+    - trace (list): {keep_ratio, latency_ms} of every ratio tried
+    """
+
+    trace = []
+    for ratio in ratios:
+        latency = measure_latency(prune_model(model, ratio).to(device), image_size, device)['latency_ms']
+        trace.append({'keep_ratio': ratio, 'latency_ms': latency})
+        if latency <= latency_budget_ms:
+            return ratio, trace
+    return ratios[-1], trace
+
+
+class PrunedTrainer(Basetrainer):
+
+    """
+    Fine-tunes an already pruned module with the `Basetrainer` loop, `model` is only used as its name.
+
+    Parameters:
+    - pruned_model (torch.nn.Module): Output of `prune_model`
+    - **kwargs: `Basetrainer` arguments
+    """
+
+    def __init__(self, pruned_model: nn.Module, **kwargs):
+        self.pruned_model = pruned_model
+        super().__init__(**kwargs)
+
+    def build_model(self, model, pretrained, weight_path):
+        self.logger.log_with_color(f"Fine-tuning pruned {model}")
+        return self.pruned_model
+
+
+def prune_classifier(cfg_path, weight_path, train_path, val_path, save_path, latency_budget_ms=None, keep_ratio=None,
+                     finetune_epochs=3, lr=1e-4, batch_size=None, device='cuda', latency_device='cpu',
+                     check_cancelled=None, torchscript=False):
+
+    """
+    Prune a trained classifier, fine-tune it and export it next to a before/after report.
+
+    Parameters:
+    - cfg_path (str): config.yaml of the trained model
+    - weight_path (str): Its weights (`best_model.pth`)
+    - train_path (str), val_path (str): ImageFolder directories or split manifests used for fine-tuning and accuracy
+    - save_path (str): Output directory
+    - latency_budget_ms (float, optional): Target latency on `latency_device`, the keep ratio is searched
+    - keep_ratio (float, optional): Fixed keep ratio, instead of `latency_budget_ms`
+    - finetune_epochs (int, optional): Fine-tuning epochs, 0 to skip, default is 3
+    - lr (float, optional): Fine-tuning learning rate, default is 1e-4
+    - batch_size (int, optional): Defaults to the batch size in the config
+    - device (str, optional): Fine-tuning device, default is "cuda"
+    - latency_device (str, optional): Device the latency is measured on, default is "cpu"
+    - check_cancelled (callable, optional): Passed to the trainer
+    - torchscript (bool, optional): Also export a TorchScript `pruned_model.torchscript`
+
+    Returns:
+    - report (dict): Also written to `pruning_report.json`. The exported `pruned_model.pth` holds the whole module
+                     and loads with `Classify_Model` through the written config.yaml
+    """
+
+    cfg = build_from_cfg(cfg_path) if check_cfg(cfg_path) else None
+    if cfg is None:
+        raise FileNotFoundError(f"Config not found: {cfg_path}")
+    if not os.path.exists(weight_path):
+        raise FileNotFoundError(f"Weight not found: {weight_path}")
+    if (latency_budget_ms is None) == (keep_ratio is None):
+        raise ValueError("Give exactly one of latency_budget_ms and keep_ratio")
+    os.makedirs(save_path, exist_ok=True)
+    logger = colorful_logger('Train')
+    image_size, batch_size = cfg['image_size'], batch_size or cfg.get('batch_size', 8)
+
+    model = model_init_(cfg['model'], cfg['num_classes'], pretrained=False)
+    model.load_state_dict(torch.load(weight_path, map_location='cpu', weights_only=True))
+    model.to(latency_device).eval()
+    before = {**model_profile(model, image_size), **measure_latency(model, image_size, latency_device)}
+    before['acc'] = evaluate_accuracy(model, val_path, image_size, latency_device, batch_size)
+    logger.log_with_color(f"Original {cfg['model']}: Accuracy {before['acc']:.2f}%, latency {before['latency_ms']:.2f}ms "
+                          f"on {latency_device}, {before['params_m']}M params, {before['gflops']} GFLOPs")
+
+    trace = []
+    if keep_ratio is None:
+        keep_ratio, trace = search_keep_ratio(model, image_size, latency_budget_ms, latency_device)
+        logger.log_with_color(f"Keep ratio {keep_ratio} selected for a {latency_budget_ms}ms budget: {trace}")
+    pruned = prune_model(model, keep_ratio).cpu()
+    del model
+
+    if finetune_epochs > 0:
+        trainer = PrunedTrainer(pruned_model=pruned, model=cfg['model'], train_path=train_path, val_path=val_path,
+                                num_class=cfg['num_classes'], save_path=save_path, device=device,
+                                batch_size=batch_size, shuffle=True, image_size=image_size, lr=lr, pretrained=False,
+                                check_cancelled=check_cancelled)
+        trainer.train(num_epochs=finetune_epochs)
+        pruned.load_state_dict(torch.load(os.path.join(save_path, 'best_model.pth'), map_location='cpu', weights_only=True))
+    pruned.cpu().eval()
+
+    export_path = os.path.join(save_path, 'pruned_model.pth')
+    torch.save(pruned, export_path)
+    if torchscript:
+        torch.jit.trace(pruned, torch.zeros(1, 3, image_size, image_size)).save(
+            os.path.join(save_path, 'pruned_model.torchscript'))
+    cfg_out = save_train_config(save_path, cfg['model'], cfg['num_classes'], image_size, batch_size, train_path,
+                                device=latency_device, pruned=True, keep_ratio=keep_ratio)
+
+    pruned.to(latency_device)
+    after = {**model_profile(pruned, image_size), **measure_latency(pruned, image_size, latency_device)}
+    after['acc'] = evaluate_accuracy(pruned, val_path, image_size, latency_device, batch_size)
+    report = {
+        'model': cfg['model'],
+        'keep_ratio': keep_ratio,
+        'latency_budget_ms': latency_budget_ms,
+        'budget_met': None if latency_budget_ms is None else after['latency_ms'] <= latency_budget_ms,
+        'search': trace,
+        'finetune_epochs': finetune_epochs,
+        'latency_device': latency_device,
+        'before': before,
+        'after': after,
+        'speedup': round(before['latency_ms'] / after['latency_ms'], 2),
+        'acc_drop': round(before['acc'] - after['acc'], 2),
+        'weight_path': export_path,
+        'cfg_path': cfg_out,
+    }
+    with open(os.path.join(save_path, 'pruning_report.json'), 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    logger.log_with_color(f"Pruned {cfg['model']}: Accuracy {after['acc']:.2f}%, latency {after['latency_ms']:.2f}ms, "
+                          f"{after['params_m']}M params, {after['gflops']} GFLOPs, speedup {report['speedup']}x")
+    return report
+
+
+# Usage-------------------------------------------------------------
+def main():
+    report = prune_classifier(cfg_path='../models/output/resnet50/config.yaml',
+                              weight_path='../models/output/resnet50/best_model.pth',
+                              train_path='../dataset/train', val_path='../dataset/valid',
+                              save_path='../models/output/resnet50_pruned', latency_budget_ms=20,
+                              finetune_epochs=3, device='cuda', latency_device='cpu')
+    print(report['speedup'], report['acc_drop'])
+
+
+if __name__ == '__main__':
+    main()
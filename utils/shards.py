@@ -0,0 +1,356 @@
+"""Sharded packed datasets
+
+Image datasets made of tens of thousands of small files are packed into a few large uncompressed tar shards
+(`shard-00000.tar`, ...) described by `shards.json`: the class names and, for every sample, its shard, byte offset
+and length inside the shard, label, SNR bucket, source pack and slice index. The shards stay readable with any tar
+tool, training reads them through `ShardDataset` as long sequential reads instead of one open/stat per image.
+
+A shard directory (or its `shards.json`) is accepted by `utils.manifest.build_dataset`, `Basetrainer`,
+`Classify_Model.benchmark` and, for detection shards written by `pack_detection_shards`, the YOLO loader.
+"""
+import io
+import os
+import re
+import json
+import glob
+import random
+import tarfile
+import threading
+
+from PIL import Image
+from torch import distributed as dist
+from torch.utils.data import IterableDataset, get_worker_info
+
+SHARD_INDEX = 'shards.json'
+SHARD_PATTERN = 'shard-{:05d}.tar'
+READ_BUFFER = 8 << 20  # bytes read ahead from a shard
+SNR_DIR = re.compile(r'^<?-?\d+(?:\.\d+)?\s*db$', re.IGNORECASE)  # SNR bucket folders, e.g. "5dB", "<-20dB"
+SLICE_NAME = re.compile(r'^(.*) \((\d+(?:\.\d+)?)\)$')  # RawDataProcessor image names, "<pack> (<slice>).jpg"
+
+
+def shard_index_path(path):
+    """`shards.json` of a shard directory or index path, None when `path` is not a shard dataset."""
+    path = str(path)
+    if os.path.isdir(path):
+        path = os.path.join(path, SHARD_INDEX)
+    return path if os.path.basename(path) == SHARD_INDEX and os.path.isfile(path) else None
+
+
+def is_shard_dataset(path):
+    return shard_index_path(path) is not None
+
+
+def parse_sample_meta(rel_path):
+    """
+    SNR bucket, source pack and slice index of an image from its path, e.g. `5dB/CM/DJI/pack1 (3).jpg`
+    gives ('5dB', 'pack1', 3). Overlapping windows are numbered `pack1 (0.5).jpg`. Missing fields are None.
+    """
+    parts = rel_path.replace('\\', '/').split('/')
+    snr = next((p for p in parts[:-1] if SNR_DIR.match(p)), None)
+    stem = os.path.splitext(parts[-1])[0]
+    match = SLICE_NAME.match(stem)
+    if match:
+        slice_idx = match.group(2)
+        return snr, match.group(1), float(slice_idx) if '.' in slice_idx else int(slice_idx)
+    return snr, stem, None
+
+
+def load_index(path):
+    """Read a shard index, shard file names are resolved to absolute paths."""
+    index_path = shard_index_path(path)
+    if index_path is None:
+        raise FileNotFoundError(f"No {SHARD_INDEX} found at {path}")
+    with open(index_path, encoding='utf-8') as f:
+        index = json.load(f)
+    index['path'] = index_path
+    index['shards'] = [os.path.join(os.path.dirname(index_path), shard) for shard in index['shards']]
+    return index
+
+
+def _write_shards(samples, output_path, root, classes, shard_size_mb=256, columns=None, callback=None):
+    """
+    Append `samples` ((path relative to `root`, label) pairs) to tar shards of about `shard_size_mb` and write the
+    index. `columns` are extra per-sample index fields, as {name: values}.
+    """
+    os.makedirs(output_path, exist_ok=True)
+    shard_bytes = shard_size_mb << 20
+    shards = []
+    index = {'shard': [], 'offset': [], 'length': [], 'label': [], 'snr': [], 'pack': [], 'slice': [], 'name': []}
+    tar = None
+    try:
+        for i, (rel_path, label) in enumerate(samples):
+            if tar is None or tar.offset >= shard_bytes:
+                if tar is not None:
+                    tar.close()
+                shards.append(SHARD_PATTERN.format(len(shards)))
+                tar = tarfile.open(os.path.join(output_path, shards[-1]), 'w', format=tarfile.USTAR_FORMAT)
+            src = os.path.join(root, rel_path)
+            info = tarfile.TarInfo(f'{i:08d}{os.path.splitext(rel_path)[1].lower()}')
+            info.size = os.path.getsize(src)
+            with open(src, 'rb') as f:
+                tar.addfile(info, f)
+            snr, pack, slice_idx = parse_sample_meta(rel_path)
+            index['shard'].append(len(shards) - 1)
+            # the member data ends on the 512 byte block boundary the tar offset now points at
+            index['offset'].append(tar.offset - -(-info.size // tarfile.BLOCKSIZE) * tarfile.BLOCKSIZE)
+            index['length'].append(info.size)
+            index['label'].append(label)
+            index['snr'].append(snr)
+            index['pack'].append(pack)
+            index['slice'].append(slice_idx)
+            index['name'].append(rel_path.replace('\\', '/'))
+            if callback is not None:
+                callback(i + 1, len(samples), len(shards))
+    finally:
+        if tar is not None:
+            tar.close()
+
+    index.update(columns or {})
+    index_path = os.path.join(output_path, SHARD_INDEX)
+    with open(index_path, 'w', encoding='utf-8') as f:
+        json.dump({'version': 1, 'root': os.path.abspath(root), 'classes': list(classes), 'shards': shards,
+                   'samples': index}, f, ensure_ascii=False)
+    return {
+        'index': index_path,
+        'shards': len(shards),
+        'samples': len(samples),
+        'classes': list(classes),
+        'bytes': sum(os.path.getsize(os.path.join(output_path, shard)) for shard in shards),
+    }
+
+
+def pack_shards(input_path, output_path, shard_size_mb=256, shuffle=True, seed=0, callback=None):
+    """
+    Pack a classification dataset (class folders or a split manifest) into tar shards.
+
+    :param input_path: ImageFolder directory or `<subset>.json` manifest.
+    :param output_path: directory receiving the shards and `shards.json`.
+    :param shard_size_mb: approximate size of a shard.
+    :param shuffle: store the samples in random order, so that every shard mixes all classes and SNRs. Streaming
+                    shuffles shards and a window of samples, not the whole dataset.
+    :param seed: packing order seed.
+    :param callback: called as callback(done, total, num_shards).
+    :return: stats dict.
+    """
+    from utils.manifest import build_dataset
+    dataset = build_dataset(input_path)
+    root = os.path.abspath(dataset.root)
+    samples = [(os.path.relpath(path, root), label) for path, label in dataset.samples]
+    if shuffle:
+        random.Random(seed).shuffle(samples)
+    return _write_shards(samples, output_path, root, dataset.classes, shard_size_mb, callback=callback)
+
+
+def pack_detection_shards(input_path, output_path, shard_size_mb=256, callback=None):
+    """
+    Pack a YOLO detection dataset into tar shards. The label file text and the size of every image are stored in
+    the index, so the YOLO loader neither opens the label files nor verifies the images one by one.
+
+    :param input_path: images directory (`.../images/...` with the `.../labels/...` next to it) or image list `.txt`.
+    :return: stats dict.
+    """
+    from utils.DetModels.yolo.dataloader import IMG_FORMATS, img2label_paths
+    if os.path.isdir(input_path):
+        files = glob.glob(os.path.join(input_path, '**', '*.*'), recursive=True)
+    else:
+        root = os.path.dirname(os.path.abspath(input_path))
+        with open(input_path, encoding='utf-8') as f:
+            files = [os.path.join(root, x[2:]) if x.startswith('./') else x for x in f.read().strip().splitlines()]
+    files = sorted(os.path.abspath(x) for x in files if x.split('.')[-1].lower() in IMG_FORMATS)
+    if not files:
+        raise FileNotFoundError(f"No images found in {input_path}")
+    root = os.path.commonpath(files) if len(files) > 1 else os.path.dirname(files[0])
+
+    boxes, width, height = [], [], []
+    for im_file, lb_file in zip(files, img2label_paths(files)):
+        with Image.open(im_file) as im:
+            width.append(im.size[0])
+            height.append(im.size[1])
+        if os.path.isfile(lb_file):
+            with open(lb_file, encoding='utf-8') as f:
+                boxes.append(f.read())
+        else:
+            boxes.append(None)
+    samples = [(os.path.relpath(x, root), -1) for x in files]
+    return _write_shards(samples, output_path, root, [], shard_size_mb, callback=callback,
+                         columns={'boxes': boxes, 'width': width, 'height': height})
+
+
+class ShardReader:
+    """
+    Random access to the samples of a shard dataset by index or original path. Every process keeps one descriptor
+    per shard and reads with `pread`, so DataLoader workers and reader threads do not share file offsets.
+    """
+
+    def __init__(self, index):
+        self.index = index if isinstance(index, dict) else load_index(index)
+        self.samples = self.index['samples']
+        self.paths = [os.path.join(self.index['root'], name) for name in self.samples['name']]
+        self._position = {os.path.normpath(p): i for i, p in enumerate(self.paths)}
+        self._pid, self._fds, self._lock = None, {}, None
+
+    def __len__(self):
+        return len(self.paths)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.update(_pid=None, _fds={}, _lock=None)
+        return state
+
+    def _fd(self, shard):
+        if self._pid != os.getpid():  # new process, descriptors inherited from the parent share their offsets
+            self._pid, self._fds, self._lock = os.getpid(), {}, threading.Lock()
+        fd = self._fds.get(shard)
+        if fd is None:
+            fd = self._fds.setdefault(shard, os.open(self.index['shards'][shard], os.O_RDONLY | getattr(os, 'O_BINARY', 0)))
+        return fd
+
+    def read(self, key):
+        """Encoded bytes of sample `key`, an index or the original image path."""
+        i = key if isinstance(key, int) else self._position[os.path.normpath(str(key))]
+        fd = self._fd(self.samples['shard'][i])
+        offset, length = self.samples['offset'][i], self.samples['length'][i]
+        if hasattr(os, 'pread'):
+            return os.pread(fd, length, offset)
+        with self._lock:
+            os.lseek(fd, offset, os.SEEK_SET)
+            return os.read(fd, length)
+
+
+class ShardDataset(IterableDataset):
+    """
+    Stream a shard dataset. With `shuffle`, every epoch visits the shards in a new random order and reads each one
+    sequentially, samples are mixed through a shuffle buffer. Without it samples come in index order.
+
+    The samples are split across DDP ranks (padded to the same count per rank, like `DistributedSampler`) and
+    DataLoader workers by the dataset itself, do not pass a sampler. Unshuffled, rank r gets samples r, r + world_size,
+    ... and its workers take turns by blocks of `batch_size`, so the loader yields exactly the `DistributedSampler`
+    order and `Basetrainer.gather` can restore the dataset order.
+
+    Args:
+        index: shard directory, `shards.json` path or an index loaded by `load_index`.
+        transform, target_transform: as in torchvision.
+        shuffle (bool): shuffled-shard reads.
+        seed (int): shuffling seed, the shard order of an epoch is seed + epoch on every rank.
+        buffer_size (int): encoded samples held by the shuffle buffer of every worker.
+        batch_size (int): DataLoader batch size, keeps the unshuffled order with several workers.
+        where (dict): keep only the samples whose index fields have these values, e.g. {'snr': '5dB'}.
+    """
+
+    def __init__(self, index, transform=None, target_transform=None, shuffle=False, seed=0, buffer_size=512,
+                 batch_size=1, where=None):
+        self.index = index if isinstance(index, dict) else load_index(index)
+        self.root = os.path.dirname(self.index['path'])
+        self.transform = transform
+        self.target_transform = target_transform
+        self.shuffle = shuffle
+        self.seed = seed
+        self.buffer_size = buffer_size
+        self.batch_size = batch_size
+        self.classes = self.index['classes']
+        self.class_to_idx = {c: i for i, c in enumerate(self.classes)}
+
+        columns = self.index['samples']
+        self.ids = [i for i in range(len(columns['label']))
+                    if not where or all(columns[k][i] == v for k, v in where.items())]
+        self.targets = [columns['label'][i] for i in self.ids]
+        self.samples = [(os.path.join(self.index['root'], columns['name'][i]), columns['label'][i]) for i in self.ids]
+        self.by_shard = {}
+        for i in self.ids:
+            self.by_shard.setdefault(columns['shard'][i], []).append(i)
+
+        distributed = dist.is_available() and dist.is_initialized()
+        self.rank = dist.get_rank() if distributed else 0
+        self.world_size = dist.get_world_size() if distributed else 1
+        self.epoch = 0
+        self._iterations = 0
+
+    def __len__(self):
+        return len(self.ids)
+
+    def set_epoch(self, epoch):
+        # persistent workers keep their own copy, which advances one epoch per pass (`_iterations`)
+        self.epoch = epoch
+        self._iterations = 0
+
+    def partition(self, epoch, worker_id=0, num_workers=1):
+        """Sample ids read by this rank and worker for `epoch`."""
+        if self.shuffle:
+            order = sorted(self.by_shard)
+            random.Random(self.seed + epoch).shuffle(order)
+            ids = [i for shard in order for i in self.by_shard[shard]]
+        else:
+            ids = list(self.ids)
+        total = -(-len(ids) // self.world_size) * self.world_size
+        ids = (ids * -(-total // max(len(ids), 1)))[:total]
+        if self.shuffle:
+            # contiguous ranges keep the reads of a rank / worker sequential
+            per = total // self.world_size
+            ids = ids[self.rank * per:(self.rank + 1) * per]
+            return ids[len(ids) * worker_id // num_workers:len(ids) * (worker_id + 1) // num_workers]
+        ids = ids[self.rank::self.world_size]
+        step = self.batch_size * num_workers
+        return [i for start in range(worker_id * self.batch_size, len(ids), step)
+                for i in ids[start:start + self.batch_size]]
+
+    def _read(self, ids):
+        columns = self.index['samples']
+        current, handle = None, None
+        try:
+            for i in ids:
+                if columns['shard'][i] != current:
+                    if handle is not None:
+                        handle.close()
+                    current = columns['shard'][i]
+                    handle = open(self.index['shards'][current], 'rb', buffering=READ_BUFFER)
+                handle.seek(columns['offset'][i])
+                yield handle.read(columns['length'][i]), columns['label'][i]
+        finally:
+            if handle is not None:
+                handle.close()
+
+    def _shuffle_buffer(self, samples, rng):
+        buffer = []
+        for sample in samples:
+            if len(buffer) < self.buffer_size:
+                buffer.append(sample)
+                continue
+            j = rng.randrange(len(buffer))
+            yield buffer[j]
+            buffer[j] = sample
+        rng.shuffle(buffer)
+        yield from buffer
+
+    def __iter__(self):
+        epoch = self.epoch + self._iterations
+        self._iterations += 1
+        worker = get_worker_info()
+        worker_id, num_workers = (worker.id, worker.num_workers) if worker is not None else (0, 1)
+        samples = self._read(self.partition(epoch, worker_id, num_workers))
+        if self.shuffle:
+            samples = self._shuffle_buffer(samples, random.Random(f'{self.seed}-{epoch}-{self.rank}-{worker_id}'))
+        for data, target in samples:
+            sample = Image.open(io.BytesIO(data)).convert('RGB')
+            if self.transform is not None:
+                sample = self.transform(sample)
+            if self.target_transform is not None:
+                target = self.target_transform(target)
+            yield sample, target
+
+    def values(self, field):
+        """Distinct values of an index field among the selected samples, e.g. the SNR buckets."""
+        column = self.index['samples'][field]
+        return sorted({column[i] for i in self.ids}, key=lambda v: (v is None, [
+            int(t) if t.lstrip('-').isdigit() else t for t in re.split(r'(-?\d+)', str(v))]))
+
+
+# Usage-------------------------------------------------------------
+def main():
+    stats = pack_shards('../dataset/split/train', '../dataset/shards/train', shard_size_mb=256)
+    print(stats)
+    dataset = ShardDataset('../dataset/shards/train', shuffle=True)
+    print(len(dataset), dataset.classes, dataset.values('snr'))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,52 @@
+"""SQLite connection helper shared by the databases of `utils` (`utils.catalog`, `utils.benchmark_store`)."""
+import sqlite3
+
+
+class Connection:
+    """
+    Context manager around an sqlite3 connection: commit on success, roll back on error, close in both cases.
+
+    Args:
+        conn (sqlite3.Connection): the wrapped connection, returned by `__enter__`.
+    """
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        return self.conn
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        try:
+            if exc_type is None:
+                self.conn.commit()
+            else:
+                self.conn.rollback()
+        finally:
+            self.conn.close()
+
+
+def connect(db_path, timeout=30):
+    """
+    Open a short-lived connection, one per call so that the stores can be used from API threads and worker threads.
+
+    Rows are returned as `sqlite3.Row` and foreign keys are enforced.
+
+    :return: a `Connection`, use it as `with connect(path) as conn: ...`.
+    """
+    conn = sqlite3.connect(db_path, timeout=timeout)
+    conn.row_factory = sqlite3.Row
+    conn.execute('PRAGMA foreign_keys = ON')
+    return Connection(conn)
+
+
+# Usage-------------------------------------------------------------
+def main():
+    with connect(':memory:') as conn:
+        conn.execute('CREATE TABLE t (x INTEGER)')
+        conn.execute('INSERT INTO t VALUES (1)')
+        print([dict(row) for row in conn.execute('SELECT x FROM t')])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,157 @@
+"""Trial sampling and asynchronous successive halving (ASHA) for hyperparameter sweeps
+"""
+import math
+import random
+import itertools
+import threading
+
+
+def sample_trials(search_space: dict, num_trials: int = None, seed: int = None):
+    """
+    Build the parameter sets of a sweep.
+
+    Each value of `search_space` is either a list of choices or a dict `{"low": a, "high": b, "log": bool}`
+    describing a continuous range (`"int": true` rounds the sample). A space made only of lists is expanded to its
+    full grid, and `num_trials` then randomly keeps that many grid points. Continuous ranges are sampled randomly,
+    so `num_trials` is required for them.
+
+    :param search_space: {field: choices or range}.
+    :param num_trials: number of trials, None for the full grid.
+    :param seed: random seed.
+    :return: list of {field: value} dicts.
+    """
+    rng = random.Random(seed)
+    choices = {k: v for k, v in search_space.items() if isinstance(v, (list, tuple))}
+    ranges = {k: v for k, v in search_space.items() if isinstance(v, dict)}
+    unknown = set(search_space) - set(choices) - set(ranges)
+    if unknown:
+        raise ValueError(f"Search space values must be a list or a {{low, high}} range: {sorted(unknown)}")
+    if any(len(v) == 0 for v in choices.values()):
+        raise ValueError("Search space choices must not be empty")
+
+    if not ranges:
+        keys = list(choices)
+        grid = [dict(zip(keys, values)) for values in itertools.product(*(choices[k] for k in keys))]
+        if num_trials is None or num_trials >= len(grid):
+            return grid
+        return rng.sample(grid, num_trials)
+
+    if num_trials is None:
+        raise ValueError("num_trials is required when the search space has continuous ranges")
+    trials = []
+    for _ in range(num_trials):
+        params = {k: rng.choice(list(v)) for k, v in choices.items()}
+        for k, r in ranges.items():
+            low, high = r["low"], r["high"]
+            if r.get("log", False):
+                value = math.exp(rng.uniform(math.log(low), math.log(high)))
+            else:
+                value = rng.uniform(low, high)
+            params[k] = int(round(value)) if r.get("int", False) else value
+        trials.append(params)
+    return trials
+
+
+def rung_epochs(max_epochs: int, min_epochs: int = 1, reduction_factor: int = 3):
+    """Epochs at which trials are compared: min_epochs * reduction_factor ** k, below max_epochs."""
+    rungs, epoch = [], min_epochs
+    while epoch < max_epochs:
+        rungs.append(epoch)
+        epoch *= reduction_factor
+    return rungs
+
+
+class ASHAScheduler:
+    """
+    Asynchronous successive halving, stopping variant (Li et al., "A System for Massively Parallel Hyperparameter
+    Tuning").
+
+    Trials report their validation metric after every epoch. When a trial reaches a rung epoch its value is compared
+    with every value recorded at that rung so far, and the trial only continues if it is in the top
+    1 / reduction_factor. Decisions never wait for other trials, so the devices stay busy.
+
+    Args:
+        max_epochs (int): full training budget of a trial.
+        min_epochs (int): first rung.
+        reduction_factor (int): keep the top 1 / reduction_factor at each rung.
+        mode (str): 'max' or 'min', direction of the metric.
+    """
+
+    def __init__(self, max_epochs: int, min_epochs: int = 1, reduction_factor: int = 3, mode: str = 'max'):
+        if mode not in ('max', 'min'):
+            raise ValueError(f"Unsupported mode: {mode}")
+        if reduction_factor < 2:
+            raise ValueError("reduction_factor must be >= 2")
+        self.max_epochs = max_epochs
+        self.reduction_factor = reduction_factor
+        self.mode = mode
+        self.rungs = {epoch: {} for epoch in rung_epochs(max_epochs, min_epochs, reduction_factor)}
+        self._lock = threading.Lock()
+
+    def report(self, trial_id, epoch: int, value: float) -> bool:
+        """
+        Record the metric of `trial_id` after `epoch` and decide whether it keeps training.
+
+        :return: True to continue, False to stop the trial.
+        """
+        if epoch not in self.rungs:
+            return True
+        with self._lock:
+            recorded = self.rungs[epoch]
+            recorded[trial_id] = value
+            values = sorted(recorded.values(), reverse=self.mode == 'max')
+            cutoff = values[max(1, len(values) // self.reduction_factor) - 1]
+        return value >= cutoff if self.mode == 'max' else value <= cutoff
+
+    @property
+    def stats(self):
+        with self._lock:
+            return {str(epoch): len(recorded) for epoch, recorded in self.rungs.items()}
+
+
+def compute_saved(trials, max_epochs: int):
+    """
+    Summarize the compute spent by a sweep against training every trial for `max_epochs`.
+
+    :param trials: list of dicts with 'epochs_run' and optional 'duration' (seconds).
+    :param max_epochs: full training budget of a trial.
+    :return: dict of the epoch and time budgets.
+    """
+    budget = len(trials) * max_epochs
+    used = sum(t.get('epochs_run', 0) for t in trials)
+    duration = sum(t.get('duration', 0.0) for t in trials)
+    # extrapolate each trial's measured epoch time to the full budget
+    full_duration = sum(t['duration'] / t['epochs_run'] * max_epochs
+                        for t in trials if t.get('epochs_run') and t.get('duration'))
+    return {
+        'epochs_budget': budget,
+        'epochs_run': used,
+        'epochs_saved': budget - used,
+        'saved_ratio': round(1 - used / budget, 4) if budget else 0.0,
+        'speedup': round(budget / used, 2) if used else None,
+        'duration_s': round(duration, 1),
+        'full_duration_s': round(full_duration, 1),
+    }
+
+
+# Usage-------------------------------------------------------------
+def main():
+    trials = sample_trials({'model': ['resnet18', 'resnet50', 'vit_b_16'],
+                            'learning_rate': {'low': 1e-5, 'high': 1e-3, 'log': True}}, num_trials=9, seed=0)
+    scheduler = ASHAScheduler(max_epochs=27, min_epochs=1, reduction_factor=3)
+    rng = random.Random(0)
+    results = []
+    for i, params in enumerate(trials):
+        skill = rng.random()
+        epochs = 0
+        for epoch in range(1, 28):
+            epochs = epoch
+            if not scheduler.report(i, epoch, skill * (1 - 1 / (epoch + 1))):
+                break
+        results.append({'epochs_run': epochs})
+        print(i, params, epochs)
+    print(compute_saved(results, 27))
+
+
+if __name__ == '__main__':
+    main()
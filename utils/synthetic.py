@@ -0,0 +1,247 @@
+"""On-the-fly synthetic IQ training data
+
+`SyntheticIQDataset` draws slices from memory-mapped raw captures (`<root>/<drone>/.../<capture>.iq`, the layout
+scanned by `utils.catalog`), adds white noise at a randomly drawn SNR, optionally mixes in another drone or a
+frequency-hopping tone as interference, and renders the spectrogram in the DataLoader workers. Robustness training
+over an SNR range then needs no rendered image per (slice, SNR) level on disk. `Basetrainer` uses it when given the
+`synthetic` options, see `utils.trainer`.
+"""
+import os
+
+import numpy as np
+import torch.distributed as dist
+from PIL import Image
+from torch.utils.data import IterableDataset, get_worker_info
+
+from SNREstimation.SNR_estimation import add_awgn_noise, generate_frequency_hopping_signal
+from graphic.RawDataProcessor import spectrogram_image
+from graphic.waterfull import jet_lut
+from utils.catalog import IQCatalog, RAW_EXTENSIONS
+from utils.manifest import IMG_EXTENSIONS
+
+
+def is_iq_dataset(path, extensions=RAW_EXTENSIONS):
+    """True for a directory holding raw captures rather than images, only walks until the first one of either."""
+    if not os.path.isdir(path):
+        return False
+    for _, _, files in os.walk(path):
+        for f in files:
+            if f.lower().endswith(extensions):
+                return True
+            if f.lower().endswith(IMG_EXTENSIONS):
+                return False
+    return False
+
+
+class SyntheticIQDataset(IterableDataset):
+    """
+    Stream noisy, optionally interfered spectrograms synthesized from raw captures.
+
+    Sample `i` of an epoch is fully determined by (seed, epoch, i), or (seed, i) without `shuffle` so that a
+    validation set is the same every epoch. The samples are split across DDP ranks and DataLoader workers like an
+    unshuffled `utils.shards.ShardDataset`: rank r gets samples r, r + world_size, ... and its workers take turns by
+    blocks of `batch_size`, do not pass a sampler.
+
+    Args:
+        data_path (str): raw-data tree, the first folder below it is the class.
+        transform, target_transform: as in torchvision, applied to the rendered PIL image.
+        fs (float): sample rate of the captures.
+        duration_time (float): slice length in seconds, use the same value as the spectrogram generation.
+        file_type (str): sample type of the captures.
+        snr_range (tuple): (low, high) dB, the added white noise SNR is drawn uniformly in it, relative to the power
+            of the (interfered) slice.
+        noise_p (float): probability of adding white noise to a sample.
+        interference_p (float): probability of mixing a slice of another class into a sample.
+        sir_range (tuple): (low, high) dB, signal to interference ratio of the mixed slice.
+        hopping_p (float): probability of adding a frequency-hopping tone, at a SIR drawn in `sir_range`.
+        max_freq_shift (float): the interference is shifted by a frequency drawn in [-max_freq_shift, max_freq_shift].
+        stft_point (int): STFT points.
+        size (tuple): rendered image (width, height) before `transform`, see `spectrogram_image`.
+        samples_per_epoch (int): samples of an epoch, the number of slices of the captures by default.
+        balance (bool): draw the class uniformly first instead of drawing slices uniformly.
+        catalog (str): optional `utils.catalog` database, slices are then only drawn among its cataloged slices of
+            the captures under `data_path` that match `min_snr`, at their cataloged offsets.
+        min_snr (float): with `catalog`, minimum cataloged SNR of a drawn slice (e.g. skip slices without signal).
+        shuffle (bool): new samples every epoch.
+        seed (int): random seed.
+        batch_size (int): DataLoader batch size, keeps the sample order with several workers.
+    """
+
+    def __init__(self, data_path, transform=None, target_transform=None, fs=100e6, duration_time=0.1,
+                 file_type='float32', snr_range=(-10, 20), noise_p=1.0, interference_p=0.0, sir_range=(0, 20),
+                 hopping_p=0.0, max_freq_shift=0.0, stft_point=1024, size=(640, 480), samples_per_epoch=None,
+                 balance=False, catalog=None, min_snr=None, shuffle=False, seed=0, batch_size=1):
+        self.root = data_path
+        self.transform = transform
+        self.target_transform = target_transform
+        self.fs = fs
+        self.slice_point = int(fs * duration_time)
+        self.dtype = np.dtype(file_type)
+        self.snr_range = tuple(snr_range)
+        self.noise_p = noise_p
+        self.interference_p = interference_p
+        self.sir_range = tuple(sir_range)
+        self.hopping_p = hopping_p
+        self.max_freq_shift = max_freq_shift
+        self.stft_point = stft_point
+        self.size = tuple(size) if size else None
+        self.balance = balance
+        self.shuffle = shuffle
+        self.seed = seed
+        self.batch_size = batch_size
+
+        self.classes = sorted(d for d in os.listdir(data_path) if os.path.isdir(os.path.join(data_path, d)))
+        if not self.classes:
+            raise FileNotFoundError(f"No class folder found in {data_path}")
+        self.class_to_idx = {c: i for i, c in enumerate(self.classes)}
+        sample_bytes = self.dtype.itemsize * 2  # interleaved I/Q
+        self.captures = []  # (path, label, samples)
+        for cls in self.classes:
+            for root, _, files in sorted(os.walk(os.path.join(data_path, cls))):
+                for f in sorted(files):
+                    if f.lower().endswith(RAW_EXTENSIONS):
+                        path = os.path.abspath(os.path.join(root, f))
+                        samples = os.path.getsize(path) // sample_bytes
+                        if samples >= self.slice_point:
+                            self.captures.append((path, self.class_to_idx[cls], samples))
+        if not self.captures:
+            raise FileNotFoundError(f"No capture of at least {self.slice_point} samples found in {data_path}")
+
+        # allowed slice starts per capture, None draws any offset
+        self.starts = [None] * len(self.captures)
+        if catalog is not None:
+            index = {path: k for k, (path, _, _) in enumerate(self.captures)}
+            starts = {}
+            for s in IQCatalog(catalog).query(min_snr=min_snr):
+                if s['path'] in index and s['length'] == self.slice_point:
+                    starts.setdefault(index[s['path']], []).append(s['start'])
+            self.starts = [np.asarray(starts.get(k, []), dtype=np.int64) for k in range(len(self.captures))]
+        self.weights = np.array([len(s) if s is not None else n // self.slice_point
+                                 for (_, _, n), s in zip(self.captures, self.starts)], dtype=np.float64)
+        if not self.weights.sum():
+            raise ValueError(f"No slice of {data_path} matches the catalog filters")
+        self.labels = np.array([label for _, label, _ in self.captures])
+        self.num_samples = samples_per_epoch or int(self.weights.sum())
+
+        distributed = dist.is_available() and dist.is_initialized()
+        self.rank = dist.get_rank() if distributed else 0
+        self.world_size = dist.get_world_size() if distributed else 1
+        self.epoch = 0
+        self._iterations = 0
+        self._data = {}  # memory maps of this process, opened on first use (a np.memmap pickles its data)
+        self._lut = None
+
+    def __len__(self):
+        return self.num_samples
+
+    def set_epoch(self, epoch):
+        # persistent workers keep their own copy, which advances one epoch per pass (`_iterations`)
+        self.epoch = epoch
+        self._iterations = 0
+
+    def partition(self, worker_id=0, num_workers=1):
+        """Sample indices generated by this rank and worker."""
+        total = -(-self.num_samples // self.world_size) * self.world_size
+        ids = [i % self.num_samples for i in range(self.rank, total, self.world_size)]
+        step = self.batch_size * num_workers
+        return [i for start in range(worker_id * self.batch_size, len(ids), step)
+                for i in ids[start:start + self.batch_size]]
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_data'] = {}
+        return state
+
+    def _read(self, k, start):
+        """complex64 samples of the slice of capture `k` starting at `start`, only these samples are read."""
+        if k not in self._data:
+            self._data[k] = np.memmap(self.captures[k][0], dtype=self.dtype, mode='r')
+        raw = np.asarray(self._data[k][2 * start:2 * (start + self.slice_point)], dtype=np.float32)
+        return raw.view(np.complex64)
+
+    def _draw_slice(self, rng, exclude=None):
+        """(samples, label) of a random slice, `exclude` skips the captures of a label when others exist."""
+        weights = self.weights
+        if exclude is not None and np.any(weights[self.labels != exclude]):
+            weights = np.where(self.labels != exclude, weights, 0)
+        if self.balance:
+            present = np.unique(self.labels[weights > 0])
+            label = rng.choice(present)
+            weights = np.where(self.labels == label, weights, 0)
+        k = rng.choice(len(weights), p=weights / weights.sum())
+        _, label, samples = self.captures[k]
+        starts = self.starts[k]
+        start = int(starts[rng.integers(len(starts))]) if starts is not None else int(
+            rng.integers(samples - self.slice_point + 1))
+        return self._read(k, start), label
+
+    def _scaled(self, interference, power, rng):
+        """Interference scaled to a SIR drawn in `sir_range` against `power`, randomly frequency shifted."""
+        sir = rng.uniform(*self.sir_range)
+        interference_power = np.mean(np.abs(interference) ** 2)
+        if interference_power <= 0:
+            return 0
+        interference = interference * np.float32(np.sqrt(power / interference_power / 10 ** (sir / 10)))
+        if self.max_freq_shift:
+            shift = rng.uniform(-self.max_freq_shift, self.max_freq_shift)
+            n = np.arange(len(interference), dtype=np.float64)
+            interference = interference * np.exp(2j * np.pi * shift / self.fs * n).astype(np.complex64)
+        return interference
+
+    def generate(self, i, epoch=0):
+        """
+        Samples and label of sample `i`.
+
+        :return: (complex64 samples, label).
+        """
+        rng = np.random.default_rng((self.seed, epoch, i) if self.shuffle else (self.seed, i))
+        data, label = self._draw_slice(rng)
+        power = np.mean(np.abs(data) ** 2)
+        if rng.random() < self.interference_p:
+            data = data + self._scaled(self._draw_slice(rng, exclude=label)[0], power, rng)
+        if rng.random() < self.hopping_p:
+            frequencies = rng.uniform(-0.45 * self.fs, 0.45 * self.fs, size=8)
+            _, tone = generate_frequency_hopping_signal(frequencies, self.slice_point / self.fs / 10, self.fs,
+                                                       self.slice_point / self.fs, iq=True, rng=rng)
+            tone = np.resize(tone, self.slice_point)
+            data = data + self._scaled(tone, power, rng)
+        if rng.random() < self.noise_p:
+            data = add_awgn_noise(data, rng.uniform(*self.snr_range), rng=rng)
+        return data.astype(np.complex64), label
+
+    def render(self, data):
+        """Spectrogram PIL image of IQ samples, same picture as the dataset generation."""
+        if self._lut is None:
+            self._lut = jet_lut()
+        return Image.fromarray(spectrogram_image(data, self.stft_point, self.fs, self.size, self._lut))
+
+    def __iter__(self):
+        epoch = self.epoch + self._iterations
+        self._iterations += 1
+        worker = get_worker_info()
+        worker_id, num_workers = (worker.id, worker.num_workers) if worker is not None else (0, 1)
+        for i in self.partition(worker_id, num_workers):
+            data, target = self.generate(i, epoch)
+            sample = self.render(data)
+            if self.transform is not None:
+                sample = self.transform(sample)
+            if self.target_transform is not None:
+                target = self.target_transform(target)
+            yield sample, target
+
+
+# Usage-------------------------------------------------------------
+def main():
+    from torch.utils.data import DataLoader
+    from torchvision import transforms
+
+    dataset = SyntheticIQDataset('../dataset/raw', transform=transforms.Compose([
+        transforms.Resize((224, 224)), transforms.ToTensor()]), snr_range=(-10, 20), interference_p=0.3,
+        sir_range=(0, 20), max_freq_shift=20e6, samples_per_epoch=1000, shuffle=True, batch_size=32)
+    print(len(dataset), dataset.classes)
+    images, labels = next(iter(DataLoader(dataset, batch_size=32, num_workers=4)))
+    print(images.shape, labels)
+
+
+if __name__ == '__main__':
+    main()
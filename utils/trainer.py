@@ -1,16 +1,29 @@
 """
 The base trainer class `Basetrainer` and a custom trainer class `CustomTrainer` for training and validating image classification models.
 """
-from torch.utils.data import DataLoader
-from torchvision import transforms, datasets
+from torch.utils.data import DataLoader, IterableDataset
+from torch.utils.data.distributed import DistributedSampler
+from torchvision import transforms
 import torch
 import torch.nn as nn
+import torch.nn.functional as F
 from torchvision import models
 import torch.optim as optim
+import torch.distributed as dist
+import torch.multiprocessing as mp
+from torch.nn.parallel import DistributedDataParallel as DDP
 import os
+import json
+import socket
+import logging
+import threading
+from logging.handlers import QueueHandler, QueueListener
 import yaml
 from utils.build import build_from_cfg, check_cfg
 from utils.logger import colorful_logger
+from utils.manifest import build_dataset, find_classes
+from utils.synthetic import SyntheticIQDataset, is_iq_dataset
+from utils.preprocessor import RandomAugmentation
 import cv2
 from abc import abstractmethod
 from .metrics.base_metric import EVAMetric
@@ -50,6 +63,14 @@ class TrainingCancelled(Exception):
     pass
 
 
+# Monitored validation metrics: name -> (getter on the `val` result, direction)
+MONITOR_METRICS = {
+    "val_acc": (lambda m: m["acc"], "max"),
+    "val_loss": (lambda m: m["total_loss"], "min"),
+    "macro_f1": (lambda m: m["f1"]["macro_f1"], "max"),
+}
+
+
 class Basetrainer:
 
     """
@@ -59,8 +80,10 @@ class Basetrainer:
     - model (str): Model name, supported models include "resnet18", "resnet34", "resnet50", "resnet101", "resnet152",
                   "vit_b_16", "vit_b_32", "vit_l_16", "vit_l_32", "vit_h_14",
                   "swin_v2_t", "swin_v2_s", "swin_v2_b", "mobilenet_v3_small", "mobilenet_v3_large"
-    - train_path (str): Path to the training dataset
-    - val_path (str): Path to the validation dataset
+    - train_path (str): Path to the training dataset, an ImageFolder directory, a split manifest (`train.json`,
+                  see `utils.manifest`), a packed shard directory (see `utils.shards`) or, with `synthetic`, a
+                  raw-capture directory
+    - val_path (str): Path to the validation dataset, same formats as `train_path`
     - num_class (int): Number of classes
     - save_path (str): Path to save the model
     - weight_path (str, optional): Path to pre-trained weights, default is None
@@ -69,9 +92,30 @@ class Basetrainer:
     - criterion (torch.nn.Module, optional): Loss function, default is `nn.CrossEntropyLoss()`
     - pretrained (bool, optional): Whether to use pre-trained model, default is `True`
     - batch_size (int, optional): Batch size, default is 8
-    - shuffle (bool, optional): Whether to shuffle the data, default is `False`
+    - shuffle (bool, optional): Whether to shuffle the data (shuffled-shard reads for shard datasets), default is `False`
     - image_size (int, optional): Image size, default is 224
     - lr (float, optional): Learning rate, default is 0.0001
+    - check_cancelled (callable, optional): Returns True when the task has been cancelled
+    - epoch_callback (callable, optional): Called as `epoch_callback(epoch, metrics)` after each validation,
+                  returning False stops the training early (used by the sweep scheduler)
+    - patience (int, optional): Epochs without improvement of `monitor` before stopping, 0 disables early stopping
+    - min_delta (float, optional): Minimum change of `monitor` counted as an improvement, default is 0
+    - monitor (str, optional): Metric watched by early stopping and the plateau scheduler, one of `MONITOR_METRICS`
+    - lr_scheduler (str, optional): None, "plateau" (ReduceLROnPlateau on `monitor`) or "cosine" (cosine annealing
+                  over the epoch budget)
+    - resume_from (str, optional): Training checkpoint (or the directory holding `last_checkpoint.pth`) to resume
+                  from, training continues at the next epoch with the saved optimizer, scheduler and RNG state
+    - augmentation (list, optional): Names of `utils.preprocessor.AUGMENTATION_METHODS` applied on the fly to the
+                  training images, one random method per image with probability `augmentation_p`; None disables
+    - augmentation_p (float, optional): Probability of augmenting a training image, default is 0.5
+    - num_workers (int, optional): DataLoader worker processes, where the decoding and augmentation run, default 0
+    - synthetic (dict, optional): Options of `utils.synthetic.SyntheticIQDataset`. When given, a `train_path` (and
+                  `val_path`) holding raw IQ captures is read as a synthetic dataset: slices are drawn from the
+                  captures, noised / interfered and rendered in the loader workers, without rendering images to disk
+    - rank (int, optional): Global rank in a distributed run, -1 (default) for single-device training
+    - world_size (int, optional): Number of ranks; above 1 the model is wrapped in DistributedDataParallel, each rank
+                  reads its own `DistributedSampler` shard with `batch_size` images per step, and only rank 0 logs
+                  and saves. The process group must already be initialized, see `train_ddp`
     """
 
     def __init__(self,
@@ -89,9 +133,30 @@ class Basetrainer:
                  shuffle: bool = False,
                  image_size: int = 224,
                  lr: float = 0.0001,
-                 check_cancelled: callable = None
+                 check_cancelled: callable = None,
+                 epoch_callback: callable = None,
+                 patience: int = 0,
+                 min_delta: float = 0.0,
+                 monitor: str = "val_acc",
+                 lr_scheduler: str = None,
+                 resume_from: str = "",
+                 augmentation: list = None,
+                 augmentation_p: float = 0.5,
+                 num_workers: int = 0,
+                 synthetic: dict = None,
+                 rank: int = -1,
+                 world_size: int = 1
                  ):
 
+        if monitor not in MONITOR_METRICS:
+            raise ValueError(f"monitor must be one of {list(MONITOR_METRICS)}, got {monitor}")
+        if lr_scheduler not in (None, "plateau", "cosine"):
+            raise ValueError(f"lr_scheduler must be None, 'plateau' or 'cosine', got {lr_scheduler}")
+
+        self.rank = rank
+        self.world_size = world_size
+        self.distributed = world_size > 1
+        self.is_main = rank in (-1, 0)
         self.batch_size = batch_size
         self.image_size = image_size
         self.shuffle = shuffle
@@ -106,6 +171,20 @@ class Basetrainer:
         self.logger = self.set_logger(os.path.join(save_path, log_file))
         self.criterion = criterion  # initializing the loss function
         self.check_cancelled = check_cancelled  # 检查取消状态的函数
+        self.epoch_callback = epoch_callback  # 每个epoch验证后的回调，返回False时提前结束训练
+        self.epochs_run = 0
+        self.patience = patience
+        self.min_delta = min_delta
+        self.monitor = monitor
+        self.lr_scheduler = lr_scheduler
+        self.scheduler = None
+        self.stop_reason = None
+        self.resume_from = resume_from
+        self.augmentation = augmentation
+        self.augmentation_p = augmentation_p
+        self.num_workers = num_workers
+        self.synthetic = synthetic
+        self.start_epoch = 0
         self.set_up(model=model, train_path=train_path, val_path=val_path,
                     pretrained=pretrained, weight_path=weight_path)
 
@@ -122,6 +201,70 @@ class Basetrainer:
         - model (str): Model name, default is "resnet18"
         """
 
+        self.model = self.build_model(model, pretrained, weight_path)
+        self.model.to(self.device)
+        if self.distributed:
+            self.model = DDP(self.model, device_ids=[self.device.index] if self.device.type == 'cuda' else None)
+            self.logger.log_with_color(f"{model} wrapped for DDP training on {self.world_size} ranks")
+        self.logger.log_with_color(f"{model} loaded onto device: {self.device}")
+
+        # initializing the dataset
+        self.logger.log_with_color(f"Loading dataset from: {train_path} and {val_path}")
+        train_transforms = [transforms.Resize((self.image_size, self.image_size)), transforms.ToTensor()]
+        if self.augmentation:
+            train_transforms.insert(0, RandomAugmentation(self.augmentation, self.augmentation_p))
+            self.logger.log_with_color(f"On-the-fly augmentation: {train_transforms[0]}")
+        _train_set = self.load_dataset(train_path, transforms.Compose(train_transforms), shuffle=self.shuffle)
+        # packed shard and synthetic datasets stream and split themselves across ranks and workers, no sampler
+        streaming = isinstance(_train_set, IterableDataset)
+
+        self.train_sampler = DistributedSampler(_train_set, num_replicas=self.world_size, rank=self.rank,
+                                                shuffle=self.shuffle) if self.distributed and not streaming else None
+        self.train_set = DataLoader(_train_set, batch_size=self.batch_size, sampler=self.train_sampler,
+                                    shuffle=self.shuffle and self.train_sampler is None and not streaming,
+                                    **self.loader_kwargs())
+
+        _val_set = self.load_dataset(val_path, transforms.Compose([
+            transforms.Resize((self.image_size, self.image_size)),
+            transforms.ToTensor(),
+        ]))
+        streaming = isinstance(_val_set, IterableDataset)
+        # ranks read interleaved validation shards, `gather` restores the dataset order
+        val_sampler = DistributedSampler(_val_set, num_replicas=self.world_size, rank=self.rank,
+                                         shuffle=False) if self.distributed and not streaming else None
+        self.val_set = DataLoader(_val_set, batch_size=self.batch_size, sampler=val_sampler,
+                                  shuffle=self.shuffle and val_sampler is None and not streaming,
+                                  **self.loader_kwargs())
+
+        # initializing optimizer
+        self.optimizer = optim.Adam(self.model.parameters(), lr=self.lr)
+
+    def load_dataset(self, path, transform, shuffle=False):
+        """`build_dataset`, or a `SyntheticIQDataset` for a raw-capture directory when `synthetic` is set."""
+        if self.synthetic is not None and is_iq_dataset(path):
+            dataset = SyntheticIQDataset(path, transform=transform, shuffle=shuffle, batch_size=self.batch_size,
+                                         **self.synthetic)
+            self.logger.log_with_color(f"Synthesizing {len(dataset)} samples per epoch from "
+                                       f"{len(dataset.captures)} captures in {path}")
+            return dataset
+        return build_dataset(path, transform=transform, shuffle=shuffle, batch_size=self.batch_size)
+
+    def loader_kwargs(self):
+        """DataLoader worker settings shared by the training and validation loaders."""
+        if not self.num_workers:
+            return {}
+        return {'num_workers': self.num_workers, 'persistent_workers': True,
+                'pin_memory': self.device.type == 'cuda'}
+
+    def build_model(self, model, pretrained, weight_path):
+
+        """
+        Create the model to train, `model_init_` with optional initial weights.
+
+        Returns:
+        - model (torch.nn.Module): Model on the CPU
+        """
+
         self.logger.log_with_color(f"Loading model: {model}")
 
         if os.path.exists(weight_path):
@@ -136,81 +279,245 @@ class Basetrainer:
         if os.path.exists(weight_path):
             self.load_pretrained_weights(weight_path)
             self.logger.log_with_color(f"Loading pretrained weights from: {weight_path}")
+        return self.model
 
-        self.model.to(self.device)
-        self.logger.log_with_color(f"{model} loaded onto device: {self.device}")
+    def set_up_schedule(self, num_epochs):
 
-        # initializing the dataset
-        self.logger.log_with_color(f"Loading dataset from: {train_path} and {val_path}")
-        _train_set = datasets.ImageFolder(root=train_path, transform=transforms.Compose([
-            transforms.Resize((self.image_size, self.image_size)),
-            transforms.ToTensor(),
-        ]))
+        """
+        Create the early stopper and the learning rate scheduler for a run of `num_epochs` epochs.
+        """
 
-        self.train_set = DataLoader(_train_set, batch_size=self.batch_size, shuffle=self.shuffle)
+        _, mode = MONITOR_METRICS[self.monitor]
+        self.stopper = EarlyStopping(patience=self.patience, min_delta=self.min_delta, mode=mode, verbose=False)
+        if self.lr_scheduler == "plateau":
+            # reduce the lr well before early stopping would trigger
+            self.scheduler = lr_scheduler.ReduceLROnPlateau(self.optimizer, mode=mode, factor=0.1,
+                                                            patience=max(1, self.patience // 3) if self.patience else 5,
+                                                            threshold=self.min_delta, threshold_mode='abs')
+        elif self.lr_scheduler == "cosine":
+            self.scheduler = lr_scheduler.CosineAnnealingLR(self.optimizer, T_max=num_epochs)
 
-        _val_set = datasets.ImageFolder(root=val_path, transform=transforms.Compose([
-            transforms.Resize((self.image_size, self.image_size)),
-            transforms.ToTensor(),
-        ]))
-        self.val_set = DataLoader(_val_set, batch_size=self.batch_size, shuffle=self.shuffle)
+    def end_of_epoch(self, epoch, num_epochs, metrics):
 
-        # initializing optimizer
-        self.optimizer = optim.Adam(self.model.parameters(), lr=self.lr)
+        """
+        Step the lr scheduler and the early stopper after validation.
+
+        Returns:
+        - bool: True when training should stop
+        """
+
+        self.epochs_run = epoch + 1
+        get_value, _ = MONITOR_METRICS[self.monitor]
+        value = float(get_value(metrics))
+        if isinstance(self.scheduler, lr_scheduler.ReduceLROnPlateau):
+            self.scheduler.step(value)
+        elif self.scheduler is not None:
+            self.scheduler.step()
+        if self.scheduler is not None:
+            self.logger.log_with_color(f"Learning Rate: {self.optimizer.param_groups[0]['lr']:.8f}")
+
+        if self.epoch_callback and self.epoch_callback(epoch + 1, metrics) is False:
+            self.stop_reason = "callback"
+            self.logger.log_with_color(f"Training stopped early at epoch [{epoch + 1}/{num_epochs}], "
+                                       f"Epochs saved: {num_epochs - epoch - 1}")
+            return True
+
+        if self.stopper(epoch=epoch + 1, fitness=value):
+            self.stop_reason = "early_stopping"
+            self.logger.log_with_color(
+                f"Early stopping at epoch [{epoch + 1}/{num_epochs}]: no {self.monitor} improvement above "
+                f"{self.min_delta} in {self.patience} epochs, best {self.monitor}: {self.stopper.best_fitness:.4f} "
+                f"at epoch {self.stopper.best_epoch}, Epochs saved: {num_epochs - epoch - 1}")
+            return True
+        return False
+
+    def save_checkpoint(self, epoch, num_epochs):
+
+        """
+        Save the full training state after `epoch` to `last_checkpoint.pth`, so that `resume` continues
+        exactly where this epoch ended.
+        """
+
+        if not self.is_main:
+            return
+        checkpoint = {
+            'epoch': epoch + 1,
+            'num_epochs': num_epochs,
+            'model': de_parallel(self.model).state_dict(),
+            'optimizer': self.optimizer.state_dict(),
+            'scheduler': self.scheduler.state_dict() if self.scheduler is not None else None,
+            'best_acc': self.best_acc,
+            'stopper': {'best_fitness': self.stopper.best_fitness, 'best_epoch': self.stopper.best_epoch},
+            'rng': {
+                'torch': torch.get_rng_state(),
+                'cuda': torch.cuda.get_rng_state_all() if torch.cuda.is_available() else None,
+                'numpy': np.random.get_state(),
+                'python': random.getstate(),
+            },
+        }
+        checkpoint_path = os.path.join(self.save_path, 'last_checkpoint.pth')
+        # write then rename, a crash while saving must not corrupt the previous checkpoint
+        torch.save(checkpoint, checkpoint_path + '.tmp')
+        os.replace(checkpoint_path + '.tmp', checkpoint_path)
+
+    def resume(self, checkpoint_path):
+
+        """
+        Restore the state saved by `save_checkpoint`. Must run after `set_up_schedule`.
+
+        Parameters:
+        - checkpoint_path (str): Checkpoint file, or a directory containing `last_checkpoint.pth`
+        """
+
+        if os.path.isdir(checkpoint_path):
+            checkpoint_path = os.path.join(checkpoint_path, 'last_checkpoint.pth')
+        if not os.path.exists(checkpoint_path):
+            raise FileNotFoundError(f"Checkpoint not found: {checkpoint_path}")
+
+        checkpoint = torch.load(checkpoint_path, map_location=self.device, weights_only=False)
+        de_parallel(self.model).load_state_dict(checkpoint['model'])
+        self.optimizer.load_state_dict(checkpoint['optimizer'])
+        if self.scheduler is not None and checkpoint['scheduler'] is not None:
+            self.scheduler.load_state_dict(checkpoint['scheduler'])
+        self.best_acc = checkpoint['best_acc']
+        self.stopper.best_fitness = checkpoint['stopper']['best_fitness']
+        self.stopper.best_epoch = checkpoint['stopper']['best_epoch']
+
+        rng = checkpoint['rng']
+        torch.set_rng_state(rng['torch'].cpu())
+        if rng['cuda'] is not None and torch.cuda.is_available() and len(rng['cuda']) == torch.cuda.device_count():
+            torch.cuda.set_rng_state_all([state.cpu() for state in rng['cuda']])
+        np.random.set_state(rng['numpy'])
+        random.setstate(rng['python'])
+
+        self.start_epoch = self.epochs_run = checkpoint['epoch']
+        self.logger.log_with_color(f"Resumed from {checkpoint_path} at epoch {self.start_epoch} "
+                                   f"(best accuracy: {self.best_acc:.2f}%)")
+
+    def cancelled(self):
+
+        """
+        Poll `check_cancelled`. In a distributed run the decision is all-reduced, so every rank leaves at the same
+        step instead of leaving the others blocked in a collective.
+        """
+
+        flag = bool(self.check_cancelled and self.check_cancelled())
+        if self.distributed:
+            flag = self.all_reduce([float(flag)])[0] > 0
+        return flag
+
+    def all_reduce(self, values):
+
+        """
+        Sum a list of numbers over all ranks, returns the list unchanged in single-device training.
+        """
+
+        if not self.distributed:
+            return values
+        tensor = torch.tensor(values, dtype=torch.float64, device=self.device)
+        dist.all_reduce(tensor, op=dist.ReduceOp.SUM)
+        return tensor.tolist()
+
+    def gather(self, tensor, size):
+
+        """
+        Gather per-rank validation outputs into dataset order and drop the `DistributedSampler` padding.
+
+        Parameters:
+        - tensor (torch.Tensor): Outputs of this rank, in sampler order
+        - size (int): Length of the dataset
+        """
+
+        if not self.distributed:
+            return tensor
+        chunks = [torch.empty_like(tensor) for _ in range(self.world_size)]
+        dist.all_gather(chunks, tensor.contiguous())
+        # rank r holds samples r, r + world_size, r + 2 * world_size, ...
+        return torch.stack(chunks, 1).flatten(0, 1)[:size]
+
+    def train_step(self, batch):
+
+        """
+        One optimization step on a batch of the training loader.
+
+        Returns:
+        - (loss, outputs, labels): loss tensor, logits and labels on the device
+        """
+
+        images, labels = batch
+        images, labels = images.to(self.device), labels.to(self.device)
+        self.optimizer.zero_grad()
+
+        # forward
+        outputs = self.model(images)
+        loss = self.criterion(outputs, labels)
+
+        # backward
+        loss.backward()
+        self.optimizer.step()
+        return loss, outputs, labels
 
     @abstractmethod
     def train(self, num_epochs):
-        for epoch in range(num_epochs):
+        self.set_up_schedule(num_epochs)
+        if self.resume_from:
+            self.resume(self.resume_from)
+        for epoch in range(self.start_epoch, num_epochs):
             # 检查是否被取消
-            if self.check_cancelled and self.check_cancelled():
+            if self.cancelled():
                 self.logger.log_with_color("训练已被取消")
                 raise TrainingCancelled("训练任务已被用户取消")
             
             self.logger.log_with_color(f"Epoch [{epoch + 1}/{num_epochs}] started.")
+            if self.train_sampler is not None:
+                self.train_sampler.set_epoch(epoch)
+            elif isinstance(self.train_set.dataset, IterableDataset):
+                self.train_set.dataset.set_epoch(epoch)
             self.model.train()
             running_loss = 0.0
             correct = 0
             total = 0
+            batches = 0
             
             # 在批次循环中也可以定期检查
-            batch_check_interval = max(1, len(self.train_set) // 10)  # 每10%的批次检查一次
+            rank_batches = len(self.train_set)
+            if self.train_sampler is None and isinstance(self.train_set.dataset, IterableDataset):
+                # streaming datasets report the batches of the whole dataset, every rank iterates its share
+                rank_batches = -(-rank_batches // self.world_size)
+            batch_check_interval = max(1, rank_batches // 10)  # 每10%的批次检查一次
             
-            for batch_idx, (images, labels) in enumerate(self.train_set):
+            for batch_idx, batch in enumerate(self.train_set):
                 # 定期检查取消状态
-                if self.check_cancelled and batch_idx % batch_check_interval == 0:
-                    if self.check_cancelled():
-                        self.logger.log_with_color("训练已被取消")
-                        raise TrainingCancelled("训练任务已被用户取消")
-                
-                images, labels = images.to(self.device), labels.to(self.device)
-                self.optimizer.zero_grad()
+                if batch_idx % batch_check_interval == 0 and self.cancelled():
+                    self.logger.log_with_color("训练已被取消")
+                    raise TrainingCancelled("训练任务已被用户取消")
 
-                # forward
-                outputs = self.model(images)
-                loss = self.criterion(outputs, labels)
-
-                # backward
-                loss.backward()
-                self.optimizer.step()
+                loss, outputs, labels = self.train_step(batch)
 
                 # acc & loss
                 running_loss += loss.item()
                 _, predicted = outputs.max(1)
                 total += labels.size(0)
                 correct += predicted.eq(labels).sum().item()
+                batches += 1
             
             # Epoch结束时再次检查
-            if self.check_cancelled and self.check_cancelled():
+            if self.cancelled():
                 self.logger.log_with_color("训练已被取消")
                 raise TrainingCancelled("训练任务已被用户取消")
             
-            train_loss = running_loss / len(self.train_set)
+            running_loss, correct, total, batches = self.all_reduce([running_loss, correct, total, batches])
+            train_loss = running_loss / batches
             train_acc = 100 * correct / total
             self.logger.log_with_color(
                 f'Epoch [{epoch + 1}/{num_epochs}], Train Loss: {train_loss:.4f}, Train Accuracy: {train_acc:.2f}%')
             metrics = self.val
             self.logger.log_with_color(f'Validation Loss: {metrics["total_loss"]:.4f}, Validation Accuracy: {metrics["acc"]:.2f}%')
             self.save_model(metrics, epoch)
+            stop = self.end_of_epoch(epoch, num_epochs, metrics)
+            self.save_checkpoint(epoch, num_epochs)
+            if stop:
+                break
 
     @property
     def val(self):
@@ -221,29 +528,38 @@ class Basetrainer:
         val_total = 0
         val_probabilities = []
         val_total_labels = []
+        batches = 0
         with torch.no_grad():
             for val_images, val_labels in self.val_set:
+                batches += 1
                 val_images, val_labels = val_images.to(self.device), val_labels.to(self.device)
                 val_outputs = self.model(val_images)
-                for val_output in val_outputs:
-                    val_probabilities.append(list(torch.softmax(val_output, dim=0)))
+                val_probabilities.append(torch.softmax(val_outputs, dim=1))
                 val_loss += self.criterion(val_outputs, val_labels).item()
-                _, val_predicted = val_outputs.max(1)
-                val_total += val_labels.size(0)
-                val_correct += val_predicted.eq(val_labels).sum().item()
                 val_total_labels.append(val_labels)
-        _val_total_labels = torch.concat(val_total_labels, dim=0)
-        _val_probabilities = torch.tensor(val_probabilities)
-        metrics = EVAMetric(preds=_val_probabilities.to(self.device),
-                            labels=_val_total_labels,
-                            num_classes=self.num_class,
-                            tasks=('f1', 'precision'),
-                            topk=(1, 3, 5),
-                            save_path=self.save_path,
-                            classes_name=self.train_set.dataset.classes)
+        size = len(self.val_set.dataset)
+        _val_total_labels = self.gather(torch.concat(val_total_labels, dim=0), size)
+        _val_probabilities = self.gather(torch.concat(val_probabilities, dim=0), size)
+        val_loss, batches = self.all_reduce([val_loss, batches])
+        val_correct = _val_probabilities.argmax(1).eq(_val_total_labels).sum().item()
+        val_total = _val_total_labels.numel()
+
+        # every rank needs the metrics for the early stopping decision, only rank 0 computes them
+        metrics = [None]
+        if self.is_main:
+            metrics[0] = EVAMetric(preds=_val_probabilities,
+                                   labels=_val_total_labels,
+                                   num_classes=self.num_class,
+                                   tasks=('f1', 'precision'),
+                                   topk=(1, 3, 5),
+                                   save_path=self.save_path,
+                                   classes_name=self.train_set.dataset.classes)
+        if self.distributed:
+            dist.broadcast_object_list(metrics, src=0)
+        metrics = metrics[0]
 
         metrics['acc'] = 100 * val_correct / val_total
-        metrics['total_loss'] = val_loss / len(self.val_set)
+        metrics['total_loss'] = val_loss / batches
         return metrics
 
     def save_model(self, val_acc, epoch):
@@ -252,14 +568,20 @@ class Basetrainer:
         Save the model after each epoch and track the best model based on validation accuracy.
         """
 
-        checkpoint_path = os.path.join(self.save_path, f'{self.model._get_name()}_epoch_{epoch + 1}.pth')
+        model = de_parallel(self.model)
+        improved = val_acc["acc"] > self.best_acc
+        if improved:
+            self.best_acc = val_acc["acc"]  # tracked on every rank, only rank 0 writes
+        if not self.is_main:
+            return
+
+        checkpoint_path = os.path.join(self.save_path, f'{model._get_name()}_epoch_{epoch + 1}.pth')
         self.logger.log_with_color(f'Model saved at {checkpoint_path} (Validation Accuracy: {val_acc["acc"]:.2f}%)')
-        torch.save(self.model.state_dict(), checkpoint_path)
+        torch.save(model.state_dict(), checkpoint_path)
 
         # Save the best model if current validation accuracy is higher than the best recorded one
-        if val_acc["acc"] > self.best_acc:
-            self.best_acc = val_acc["acc"]
-            self.best_model = self.model.state_dict()
+        if improved:
+            self.best_model = model.state_dict()
             best_model_path = os.path.join(self.save_path, 'best_model.pth')
             torch.save(self.best_model, best_model_path)
             self.logger.log_with_color(f'New best model saved with Accuracy: {val_acc["acc"]:.2f}%')
@@ -276,6 +598,11 @@ class Basetrainer:
         - logger (colorful_logger): Logger object
         """
 
+        if not self.is_main:
+            # ranks other than 0 stay silent, rank 0 speaks for the whole run
+            logger = colorful_logger(name=f'TrainRank{self.rank}')
+            logger.logger.setLevel(logging.WARNING)
+            return logger
         logger = colorful_logger(name='Train', logfile=log_file)
         return logger
 
@@ -372,6 +699,293 @@ def model_init_(model_name, num_class, pretrained=True):
     return model
 
 
+def ddp_worker(local_rank, trainer_kwargs, num_epochs, devices, node_rank, nnodes, init_method, backend,
+               log_queue, result_queue, cancel_event, trainer_cls=None):
+
+    """
+    Entry point of one DDP rank, started by `train_ddp` through `torch.multiprocessing.spawn`.
+
+    Rank 0 forwards its 'Train' log records to `log_queue` and puts the outcome of the run on `result_queue`.
+    """
+
+    world_size = nnodes * len(devices)
+    rank = node_rank * len(devices) + local_rank
+    device = devices[local_rank]
+    if device.startswith('cuda'):
+        torch.cuda.set_device(torch.device(device))
+    dist.init_process_group(backend, init_method=init_method, rank=rank, world_size=world_size)
+    if rank == 0 and log_queue is not None:
+        logging.getLogger('Train').addHandler(QueueHandler(log_queue))
+
+    trainer = None
+    try:
+        trainer = (trainer_cls or Basetrainer)(**trainer_kwargs, device=device, rank=rank, world_size=world_size,
+                                               check_cancelled=cancel_event.is_set)
+        trainer.train(num_epochs=num_epochs)
+        cancelled = False
+    except TrainingCancelled:
+        cancelled = True
+    finally:
+        dist.destroy_process_group()
+    if rank == 0:
+        result_queue.put({'cancelled': cancelled,
+                          'epochs_run': trainer.epochs_run if trainer else 0,
+                          'stop_reason': trainer.stop_reason if trainer else None,
+                          'best_acc': trainer.best_acc if trainer else 0})
+
+
+def train_ddp(trainer_kwargs, num_epochs, devices, nnodes=1, node_rank=0, master_addr='127.0.0.1', master_port=None,
+              backend=None, check_cancelled=None, trainer_cls=None):
+
+    """
+    Train a `Basetrainer` with one process per device and DistributedDataParallel.
+
+    Parameters:
+    - trainer_kwargs (dict): `Basetrainer` arguments except device, rank, world_size and the callbacks
+    - num_epochs (int): Number of epochs
+    - devices (list): Devices of this node, one rank each, e.g. ["cuda:0", "cuda:1"] or ["cpu", "cpu"]
+    - nnodes (int, optional): Number of nodes, each running `train_ddp` with the same devices count
+    - node_rank (int, optional): Rank of this node
+    - master_addr (str, optional): Address of node 0
+    - master_port (int, optional): Port of node 0, a free port is picked on single-node runs
+    - backend (str, optional): "nccl" or "gloo", default is nccl on GPUs and gloo on CPU
+    - check_cancelled (callable, optional): Polled in this process, cancels every rank when it returns True
+    - trainer_cls (type, optional): `Basetrainer` subclass to run, e.g. `DistillationTrainer`
+
+    Returns:
+    - dict: cancelled, epochs_run, stop_reason and best_acc reported by rank 0 (empty on other nodes)
+    """
+
+    if backend is None:
+        backend = 'nccl' if devices[0].startswith('cuda') and torch.cuda.is_available() else 'gloo'
+    if master_port is None:
+        if nnodes > 1:
+            raise ValueError("master_port is required for multi-node training")
+        with socket.socket() as sock:
+            sock.bind(('', 0))
+            master_port = sock.getsockname()[1]
+    init_method = f'tcp://{master_addr}:{master_port}'
+
+    ctx = mp.get_context('spawn')
+    log_queue, result_queue, cancel_event = ctx.Queue(), ctx.Queue(), ctx.Event()
+    # relay rank 0 records to the in-process handlers (e.g. the service metric parser), rank 0 writes train.log itself
+    handlers = [h for h in logging.getLogger('Train').handlers if not isinstance(h, logging.FileHandler)]
+    listener = QueueListener(log_queue, *handlers)
+    listener.start()
+
+    finished = threading.Event()
+
+    def watch_cancel():
+        while not finished.wait(1):
+            if check_cancelled and check_cancelled():
+                cancel_event.set()
+
+    watcher = threading.Thread(target=watch_cancel, daemon=True)
+    watcher.start()
+    try:
+        mp.spawn(ddp_worker,
+                 args=(trainer_kwargs, num_epochs, devices, node_rank, nnodes, init_method, backend,
+                       log_queue, result_queue, cancel_event, trainer_cls),
+                 nprocs=len(devices), join=True)
+    finally:
+        finished.set()
+        watcher.join()
+        listener.stop()
+    return result_queue.get(timeout=5) if node_rank == 0 else {}
+
+
+def save_train_config(save_path, model, num_classes, image_size, batch_size, train_path, device='cuda', **extra):
+
+    """
+    Write the config.yaml that `Classify_Model` needs to load the trained weights, same layout as
+    `CustomTrainer.save_yaml`.
+    """
+
+    _, class_to_idx = find_classes(train_path)
+    parameters = {'model': model, 'num_classes': num_classes, 'image_size': image_size, 'batch_size': batch_size,
+                  'device': device, 'shuffle': False, 'train': train_path, 'save_path': save_path,
+                  'class_names': class_to_idx, **extra}
+    cfg_path = os.path.join(save_path, 'config.yaml')
+    with open(cfg_path, 'w', encoding='utf-8') as file:
+        yaml.dump(parameters, file, allow_unicode=True)
+    return cfg_path
+
+
+class IndexedDataset(torch.utils.data.Dataset):
+    """Wraps a dataset so that samples also return their index, used to look up cached teacher logits."""
+
+    def __init__(self, dataset):
+        self.dataset = dataset
+
+    def __len__(self):
+        return len(self.dataset)
+
+    def __getitem__(self, index):
+        image, label = self.dataset[index]
+        return image, label, index
+
+    def __getattr__(self, name):
+        # classes, class_to_idx, samples, ... of the wrapped dataset
+        if name == 'dataset':
+            raise AttributeError(name)
+        return getattr(self.dataset, name)
+
+
+def distillation_loss(student_logits, teacher_logits, labels, temperature=4.0, alpha=0.5):
+
+    """
+    Hinton et al. knowledge distillation loss: alpha * T^2 * KL(teacher_T || student_T) + (1 - alpha) * CE.
+
+    Parameters:
+    - student_logits (torch.Tensor): (b, c) student logits
+    - teacher_logits (torch.Tensor): (b, c) teacher logits
+    - labels (torch.Tensor): (b,) ground truth labels
+    - temperature (float): Softening temperature T
+    - alpha (float): Weight of the distillation term
+    """
+
+    kd = F.kl_div(F.log_softmax(student_logits / temperature, dim=1),
+                  F.log_softmax(teacher_logits / temperature, dim=1),
+                  reduction='batchmean', log_target=True) * temperature ** 2
+    ce = F.cross_entropy(student_logits, labels)
+    return alpha * kd + (1 - alpha) * ce
+
+
+class DistillationTrainer(Basetrainer):
+
+    """
+    Trains a student from `model_init_` against a trained teacher.
+
+    The teacher runs once over the training set before the first epoch, its logits are stored in a memory-mapped
+    `teacher_logits.npy` next to the student weights and looked up by sample index afterwards, so every epoch costs
+    a student forward/backward only and the teacher is released before training starts. The cache is reused as
+    long as the teacher weights and the training set are unchanged.
+
+    Parameters:
+    - teacher_weight (str): Teacher weights (`best_model.pth`)
+    - teacher_cfg (str): Teacher config.yaml, gives the teacher model name and image size
+    - temperature (float, optional): Softening temperature, default is 4.0
+    - alpha (float, optional): Weight of the distillation term against the cross entropy, default is 0.5
+    - **kwargs: `Basetrainer` arguments for the student
+    """
+
+    def __init__(self, teacher_weight: str, teacher_cfg: str, temperature: float = 4.0, alpha: float = 0.5, **kwargs):
+        if not os.path.exists(teacher_weight):
+            raise FileNotFoundError(f"Teacher weight not found: {teacher_weight}")
+        self.teacher_weight = teacher_weight
+        self.teacher_cfg = build_from_cfg(teacher_cfg) if check_cfg(teacher_cfg) else None
+        if self.teacher_cfg is None:
+            raise FileNotFoundError(f"Teacher config not found: {teacher_cfg}")
+        self.temperature = temperature
+        self.alpha = alpha
+        self.teacher_acc = None
+        super().__init__(**kwargs)
+
+    def set_up(self, train_path, val_path, pretrained, weight_path, model='resnet18'):
+        super().set_up(train_path, val_path, pretrained, weight_path, model)
+        if isinstance(self.train_set.dataset, IterableDataset):
+            raise ValueError("Distillation looks teacher logits up by sample index, shard and synthetic datasets are "
+                             "not supported")
+        if self.teacher_cfg['num_classes'] != self.num_class:
+            raise ValueError(f"Teacher has {self.teacher_cfg['num_classes']} classes, student has {self.num_class}")
+        self.teacher_logits = self.build_teacher_cache(train_path, val_path)
+        self.train_set = DataLoader(IndexedDataset(self.train_set.dataset), batch_size=self.batch_size,
+                                    sampler=self.train_sampler, shuffle=self.shuffle and self.train_sampler is None,
+                                    **self.loader_kwargs())
+
+    def build_teacher_cache(self, train_path, val_path):
+
+        """
+        Compute (or reuse) the memory-mapped teacher logits of the training set, in ImageFolder order.
+
+        Returns:
+        - np.memmap: (num_samples, num_class) float32 logits
+        """
+
+        cache_path = os.path.join(self.save_path, 'teacher_logits.npy')
+        meta_path = os.path.join(self.save_path, 'teacher_logits.json')
+        train_dataset = self.train_set.dataset
+        stat = os.stat(self.teacher_weight)
+        key = {'teacher_weight': os.path.abspath(self.teacher_weight), 'mtime': stat.st_mtime, 'size': stat.st_size,
+               'train_path': os.path.abspath(train_path), 'samples': len(train_dataset),
+               'num_class': self.num_class, 'image_size': self.teacher_cfg['image_size']}
+
+        meta = None
+        if os.path.exists(cache_path) and os.path.exists(meta_path):
+            with open(meta_path, encoding='utf-8') as f:
+                meta = json.load(f)
+            if meta.get('key') != key:
+                meta = None
+
+        if meta is not None:
+            self.logger.log_with_color(f"Using cached teacher logits: {cache_path}")
+        elif self.is_main:
+            meta = self._compute_teacher_cache(cache_path, meta_path, key, train_path, val_path)
+        if self.distributed:
+            dist.barrier()  # the other ranks wait for rank 0 to write the cache
+            if meta is None:
+                with open(meta_path, encoding='utf-8') as f:
+                    meta = json.load(f)
+
+        self.teacher_acc = meta.get('teacher_acc')
+        return np.load(cache_path, mmap_mode='r')
+
+    def _compute_teacher_cache(self, cache_path, meta_path, key, train_path, val_path):
+        self.logger.log_with_color(f"Computing teacher logits ({self.teacher_cfg['model']}) for {key['samples']} "
+                                   f"training images into {cache_path}")
+        teacher = model_init_(self.teacher_cfg['model'], self.num_class, pretrained=False)
+        teacher.load_state_dict(torch.load(self.teacher_weight, map_location=self.device, weights_only=True))
+        teacher.to(self.device).eval()
+        transform = transforms.Compose([
+            transforms.Resize((self.teacher_cfg['image_size'], self.teacher_cfg['image_size'])),
+            transforms.ToTensor(),
+        ])
+
+        logits = np.lib.format.open_memmap(cache_path + '.tmp.npy', mode='w+', dtype=np.float32,
+                                           shape=(key['samples'], self.num_class))
+        with torch.no_grad():
+            start = 0
+            loader = DataLoader(build_dataset(train_path, transform=transform),
+                                batch_size=self.batch_size, shuffle=False)
+            for images, _ in loader:
+                out = teacher(images.to(self.device)).float().cpu().numpy()
+                logits[start:start + len(out)] = out
+                start += len(out)
+            logits.flush()
+
+            # teacher accuracy on the validation set, reported next to the student's
+            correct, total = 0, 0
+            loader = DataLoader(build_dataset(val_path, transform=transform),
+                                batch_size=self.batch_size, shuffle=False)
+            for images, labels in loader:
+                predicted = teacher(images.to(self.device)).argmax(1).cpu()
+                correct += predicted.eq(labels).sum().item()
+                total += labels.size(0)
+        del logits, teacher
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+        os.replace(cache_path + '.tmp.npy', cache_path)
+
+        meta = {'key': key, 'teacher_acc': 100 * correct / max(total, 1)}
+        with open(meta_path, 'w', encoding='utf-8') as f:
+            json.dump(meta, f, indent=2)
+        self.logger.log_with_color(f"Teacher logits cached, teacher Validation Accuracy: {meta['teacher_acc']:.2f}%")
+        return meta
+
+    def train_step(self, batch):
+        images, labels, index = batch
+        images, labels = images.to(self.device), labels.to(self.device)
+        teacher_logits = torch.from_numpy(self.teacher_logits[index.numpy()]).to(self.device)
+        self.optimizer.zero_grad()
+
+        outputs = self.model(images)
+        loss = distillation_loss(outputs, teacher_logits, labels, self.temperature, self.alpha)
+
+        loss.backward()
+        self.optimizer.step()
+        return loss, outputs, labels
+
+
 class CustomTrainer(Basetrainer):
 
     """